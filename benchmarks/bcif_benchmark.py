@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+"""
+Compares BinaryCIF (.bcif) with text CIF(s): the bytes on disk, the time to write them, and the
+time to read the _atom_site columns of every structure, as strings and as NumPy arrays:
+
+    python benchmarks/bcif_benchmark.py --structures 200 --output bcif.json
+
+Each BinaryCIF is also checked to round-trip: every tag must have the same values as in the
+text CIF, and simplify_cif must write the same values from both. Needs the msgpack package.
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+from PDBClean import bcifutils
+from PDBClean import cleanutils
+from PDBClean import pdbclean_io
+from PDBClean.mmcifutils import MMCIFFile
+from synthetic_ensemble import make_ensemble
+
+FORMATS = ['cif', 'cif.gz', 'bcif']
+ATOM_SITE_TAGS = ['_atom_site.group_PDB', '_atom_site.id', '_atom_site.type_symbol', '_atom_site.label_atom_id',
+                  '_atom_site.label_comp_id', '_atom_site.label_asym_id', '_atom_site.label_seq_id',
+                  '_atom_site.Cartn_x', '_atom_site.Cartn_y', '_atom_site.Cartn_z', '_atom_site.occupancy',
+                  '_atom_site.B_iso_or_equiv']
+NUMERIC_TAGS = ['_atom_site.Cartn_x', '_atom_site.Cartn_y', '_atom_site.Cartn_z', '_atom_site.B_iso_or_equiv']
+
+def write_copies(filelist, target_dir, extension):
+    """
+    Writes a copy of each CIF with an extension, and returns the paths and the seconds spent.
+    """
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+    copies = []
+    start = time.perf_counter()
+    for path in filelist:
+        copy = target_dir+'/'+pdbclean_io.cif_basename(path)+extension
+        with open(path, 'rb') as source, pdbclean_io.open_file(copy, 'wb') as target:
+            target.write(source.read())
+        copies.append(copy)
+    return copies, time.perf_counter() - start
+
+def time_columns(filelist):
+    """
+    Reads the _atom_site columns of every CIF as strings, and returns the seconds spent.
+    """
+    start = time.perf_counter()
+    for path in filelist:
+        MMCIFFile(path).columns(ATOM_SITE_TAGS)
+    return time.perf_counter() - start
+
+def time_arrays(filelist):
+    """
+    Reads the coordinates and B-factors of every CIF as NumPy arrays, and returns the seconds spent.
+    """
+    start = time.perf_counter()
+    for path in filelist:
+        mmcif_dict = MMCIFFile(path)
+        for tag in NUMERIC_TAGS:
+            mmcif_dict.numeric_array(tag)
+    return time.perf_counter() - start
+
+def same_values(path, other):
+    """
+    Returns True if two CIF(s) have the same tags, with the same values (the data block name aside).
+    """
+    mmcif_dict = MMCIFFile(path)
+    other_dict = MMCIFFile(other)
+    if mmcif_dict.tags() != other_dict.tags():
+        return False
+    return all(mmcif_dict[tag] == other_dict[tag] for tag in mmcif_dict.tags() if not tag.startswith('data_'))
+
+def check_round_trip(plain_files, copies, workdir):
+    """
+    Returns the names of the BinaryCIF(s) whose values, or simplify_cif outputs, differ from those
+    of the text CIF.
+    """
+    failures = []
+    for plain, copy in zip(plain_files, copies):
+        if not same_values(plain, copy):
+            failures.append(os.path.basename(copy))
+            continue
+        # simplify_cif names its outputs after newfile, so both are written at the same path
+        name = pdbclean_io.cif_basename(copy)
+        outputs = {}
+        for source, extension in [(plain, '.cif'), (copy, '.bcif')]:
+            cleanutils.simplify_cif(source, workdir+'/'+name+extension, extension)
+            outputs[extension] = [output for output in pdbclean_io.list_cif_files(workdir, name+'+*')
+                                  if pdbclean_io.cif_extension(output) == extension]
+        if len(outputs['.cif']) != len(outputs['.bcif']) or \
+                not all(same_values(x, y) for x, y in zip(outputs['.cif'], outputs['.bcif'])):
+            failures.append(os.path.basename(copy)+' (simplify_cif)')
+        for output in outputs['.cif'] + outputs['.bcif']:
+            if os.path.isfile(output):
+                os.remove(output)
+    return failures
+
+def run(workdir, repeats=3, **ensemble_options):
+    """
+    Runs the BinaryCIF benchmark on a synthetic ensemble.
+
+    Parameters:
+    -----------
+    workdir : str
+        Directory where the ensemble and its copies are written.
+    repeats : int, optional
+        Number of times the reads are timed (the fastest is kept). Default is 3.
+    **ensemble_options
+        Passed to make_ensemble.
+
+    Returns:
+    --------
+    results : dict
+    """
+    filelist, n_atoms = make_ensemble(workdir+'/plain', **ensemble_options)
+    results = {'structures': len(filelist), 'atoms': n_atoms, 'formats': {}}
+    for fmt in FORMATS:
+        if fmt == 'cif':
+            copies, write_seconds = filelist, None
+        else:
+            copies, write_seconds = write_copies(filelist, workdir+'/'+fmt, '.'+fmt)
+        result = {'bytes': sum(os.path.getsize(path) for path in copies),
+                  'write_seconds': write_seconds,
+                  'columns_seconds': min(time_columns(copies) for repeat in range(repeats)),
+                  'arrays_seconds': min(time_arrays(copies) for repeat in range(repeats))}
+        if fmt == 'bcif':
+            result['round_trip_failures'] = check_round_trip(filelist, copies, workdir)
+        results['formats'][fmt] = result
+    return results
+
+def print_results(results):
+    plain = results['formats']['cif']
+    print('{0:<7} {1:>9} {2:>7} {3:>9} {4:>11} {5:>10}'.format('', 'MB', 'ratio', 'write s', 'columns s',
+                                                               'arrays s'))
+    for fmt, result in results['formats'].items():
+        write_seconds = result['write_seconds']
+        print('{0:<7} {1:>9.2f} {2:>7.2f} {3:>9} {4:>11.3f} {5:>10.3f}'.format(
+            fmt, result['bytes']/1e6, plain['bytes']/result['bytes'],
+            '-' if write_seconds is None else '{0:.3f}'.format(write_seconds),
+            result['columns_seconds'], result['arrays_seconds']))
+        if result.get('round_trip_failures'):
+            print('    round trip FAILED: '+', '.join(result['round_trip_failures']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare BinaryCIF with text CIF(s) on a synthetic ensemble.')
+    parser.add_argument('--output', help='JSON file where the results are written')
+    parser.add_argument('--workdir', help='directory for the ensemble (default: a temporary directory)')
+    parser.add_argument('--repeats', type=int, default=3, help='times each read is timed (default: 3)')
+    parser.add_argument('--structures', type=int, default=50, help='number of structures (default: 50)')
+    parser.add_argument('--chains', type=int, default=4, help='protein chains per structure (default: 4)')
+    parser.add_argument('--residues', type=int, default=300, help='residues per chain (default: 300)')
+    parser.add_argument('--waters', type=int, default=200, help='water molecules per structure (default: 200)')
+    args = parser.parse_args()
+
+    bcifutils.require_msgpack()
+    ensemble_options = dict(n_structures=args.structures, n_chains=args.chains, n_residues=args.residues,
+                            n_waters=args.waters)
+    if args.workdir is not None:
+        results = run(args.workdir, repeats=args.repeats, **ensemble_options)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run(workdir, repeats=args.repeats, **ensemble_options)
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if results['formats']['bcif']['round_trip_failures']:
+        sys.exit(1)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+"""
+Checks that BinaryCIF (.bcif) columns and files round-trip: every value written is read back
+exactly as it was, for integers and decimals with '.' and '?', numbers that are only kept exact
+as strings (leading zeros, '-0', '-0.000'), and strings that have to be quoted in a CIF
+(quotes, whitespace, multi-line values). Runs with pytest or on its own:
+
+    python benchmarks/bcif_roundtrip_test.py
+
+Needs the msgpack package.
+"""
+from __future__ import print_function
+import os
+import sys
+import tempfile
+import numpy as np
+import msgpack
+from PDBClean import bcifutils
+from PDBClean import pdbclean_io
+from PDBClean.mmcifutils import MMCIFFile
+
+# Values of each column, and the first encoding expected to hold them (None for plain integers)
+COLUMNS = [
+    ('integers', ['1', '2', '3', '10', '-5', '100000', '70000'], None),
+    ('masked_integers', ['1', '.', '3', '?', '?', '-5', '.'], None),
+    ('all_masked', ['.', '?', '.'], 'StringArray'),
+    ('leading_zeros', ['007', '8', '10'], 'StringArray'),
+    ('negative_zero', ['-0', '1', '2'], 'StringArray'),
+    ('large_integers', ['1', '4294967296', '-3'], 'StringArray'),
+    ('fixed_point', ['1.000', '-2.500', '12.345', '0.001', '-0.010'], 'FixedPoint'),
+    ('masked_fixed_point', ['1.50', '.', '?', '-2.25', '100.00'], 'FixedPoint'),
+    ('negative_zero_decimal', ['1.000', '-0.000', '2.000'], 'StringArray'),
+    ('leading_zero_decimal', ['01.500', '2.500'], 'StringArray'),
+    ('mixed_digits', ['1.5', '2.25', '3.125'], 'StringArray'),
+    ('strings', ['ATOM', 'HETATM', '.', 'ATOM', '?'], 'StringArray'),
+    ('quoted', ["O5'", 'a "b" c', "it's a", 'x\' y" z', "'start", '"start', 'two words', "C1'", "end'"],
+     'StringArray'),
+    ('reserved', ['_tag', '#hash', 'data_block', 'loop_', 'save_x', '[bracket', ';semicolon', '$dollar'],
+     'StringArray'),
+    ('multi_line', ['first line\nsecond line', "it's\n\"quoted\" on two lines", 'single'], 'StringArray'),
+]
+
+# A CIF with a single-row category, a loop with the columns above and an _atom_site loop
+ATOM_SITE = [
+    ['ATOM', '1', 'N', 'N', 'GLY', 'A', '1', '?', '10.123', '-0.000', '5.600', '1.00', '20.00', '1'],
+    ['ATOM', '2', 'C', 'CA', 'GLY', 'A', '1', '?', '11.000', '1.250', '-5.600', '1.00', '21.50', '1'],
+    ['HETATM', '3', 'O', "O5'", 'HOH', 'B', '.', '?', '0.001', '002.500', '3.000', '0.50', '.', '1'],
+    ['ATOM', '4', 'N', 'N', 'ALA', 'A', '2', 'A', '-12.345', '7.000', '8.125', '1.00', '?', '2'],
+]
+ATOM_SITE_NAMES = ['group_PDB', 'id', 'type_symbol', 'label_atom_id', 'label_comp_id', 'label_asym_id',
+                   'label_seq_id', 'pdbx_PDB_ins_code', 'Cartn_x', 'Cartn_y', 'Cartn_z', 'occupancy',
+                   'B_iso_or_equiv', 'pdbx_PDB_model_num']
+
+def write_text_cif(path):
+    """
+    Writes the test CIF as text, with the values quoted as bcifutils.quote does.
+    """
+    lines = ['data_roundtrip\n', '#\n',
+             '_struct.entry_id   roundtrip\n',
+             '_struct.title\n;A title\nover two lines\n;\n',
+             "_struct.pdbx_descriptor   \"it's quoted\"\n", '#\n', 'loop_\n']
+    rows = max(len(values) for _, values, _ in COLUMNS)
+    lines.extend('_test.' + name + '\n' for name, _, _ in COLUMNS)
+    for i in range(rows):
+        line = ' '.join(bcifutils.quote(values[i % len(values)]) for _, values, _ in COLUMNS)
+        lines.append(line + ('' if line.endswith('\n') else '\n'))
+    lines.extend(['#\n', 'loop_\n'])
+    lines.extend('_atom_site.' + name + '\n' for name in ATOM_SITE_NAMES)
+    lines.extend(' '.join(bcifutils.quote(value) for value in row) + '\n' for row in ATOM_SITE)
+    lines.append('#\n')
+    with open(path, 'w') as ciffile:
+        ciffile.write(''.join(lines).replace('\n\n;', '\n;'))
+
+def read_all(mmcif_dict):
+    """
+    Returns the values of every tag of a CIF, in order.
+    """
+    tags = mmcif_dict.tags()
+    return list(zip(tags, mmcif_dict.columns(tags)))
+
+def test_columns_round_trip():
+    for name, values, kind in COLUMNS:
+        column = bcifutils.encode_column(name, values)
+        first = column['data']['encoding'][0]['kind']
+        assert first == kind or kind is None and first not in ('FixedPoint', 'StringArray'), (name, first)
+        # Through MessagePack, as in a file
+        column = msgpack.unpackb(msgpack.packb(column, use_bin_type=True), raw=False)
+        assert bcifutils.decode_column(column) == values, name
+        assert (column['mask'] is not None) == ('.' in values or '?' in values), name
+
+def test_numbers_round_trip():
+    for name in ('integers', 'masked_integers', 'fixed_point', 'masked_fixed_point'):
+        values = dict((column[0], column[1]) for column in COLUMNS)[name]
+        numbers = bcifutils.decode_numbers(bcifutils.encode_column(name, values))
+        expected = np.array([float(value) if value not in ('.', '?') else np.nan for value in values])
+        assert np.array_equal(numbers, expected, equal_nan=True), name
+
+def test_open_file_round_trip():
+    with tempfile.TemporaryDirectory() as workdir:
+        text_path = os.path.join(workdir, 'roundtrip.cif')
+        write_text_cif(text_path)
+        with MMCIFFile(text_path) as mmcif_dict:
+            expected = read_all(mmcif_dict)
+        rows = max(len(values) for _, values, _ in COLUMNS)
+        for name, values, _ in COLUMNS:
+            assert dict(expected)['_test.' + name] == [values[i % len(values)] for i in range(rows)], name
+        # Text and binary modes, written through open_file as the curation steps do
+        for mode in ('w', 'wb'):
+            bcif_path = os.path.join(workdir, 'roundtrip_' + mode + '.bcif')
+            with open(text_path, 'r' + mode[1:]) as source, pdbclean_io.open_file(bcif_path, mode) as target:
+                target.write(source.read())
+            assert not os.path.exists(bcif_path + '.tmp')
+            with MMCIFFile(bcif_path) as mmcif_dict:
+                assert read_all(mmcif_dict) == expected, mode
+                assert mmcif_dict['data_'] == 'roundtrip'
+                for tag in ('_atom_site.Cartn_x', '_atom_site.Cartn_y', '_atom_site.occupancy'):
+                    assert np.array_equal(mmcif_dict.numeric_array(tag), np.array(mmcif_dict[tag], dtype=float))
+            # Reading the BinaryCIF back as text gives the same values
+            with pdbclean_io.open_file(bcif_path, 'r') as bcif_file:
+                text = bcif_file.read()
+            with MMCIFFile(bcif_path, data=text.encode()) as mmcif_dict:
+                assert read_all(mmcif_dict) == expected, mode
+
+def test_empty_file():
+    with tempfile.TemporaryDirectory() as workdir:
+        bcif_path = os.path.join(workdir, 'empty.bcif')
+        with open(bcif_path, 'wb') as bcif_file:
+            bcif_file.write(msgpack.packb({'version': bcifutils.BCIF_VERSION, 'dataBlocks': []}))
+        try:
+            MMCIFFile(bcif_path)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('An empty BinaryCIF was read')
+
+if __name__ == '__main__':
+    failed = 0
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_') and callable(test):
+            try:
+                test()
+                print('ok      ' + name)
+            except AssertionError as error:
+                failed += 1
+                print('FAILED  ' + name + ': ' + str(error))
+    sys.exit(1 if failed else 0)
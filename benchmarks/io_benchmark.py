@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+"""
+Measures what compressed CIF(s) save in I/O: the bytes on disk, the time to read and decompress
+them, and the time a step would spend reading them from a spinning disk or a network file system,
+modelled from the measured decompression time and an assumed throughput of each kind of disk:
+
+    python benchmarks/io_benchmark.py --structures 200 --output io.json
+    python benchmarks/io_benchmark.py --disk spinning=150 --disk nfs=50 --disk ssd=2000
+
+Each compression is also checked to round-trip: the decompressed CIF(s), and the output of
+clean_cif on them, must be identical to those of the plain CIF(s). zstd is skipped if the
+zstandard package is not installed.
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+from PDBClean import cleanutils
+from PDBClean import pdbclean_io
+from synthetic_ensemble import make_ensemble
+
+COMPRESSIONS = ['none', 'gzip', 'zstd']
+# Assumed sequential read throughput of each kind of disk, in MB/s
+DISKS = {'spinning': 150.0, 'network': 50.0}
+
+def drop_cache(path):
+    """
+    Asks the kernel to drop a file from the page cache, so the next read comes from the disk.
+    Returns False where this is not supported.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+def write_copies(filelist, target_dir, compression):
+    """
+    Writes a copy of each CIF with a compression, and returns the paths and the seconds spent.
+    """
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+    extension = pdbclean_io.cif_file_extension(compression)
+    copies = []
+    start = time.perf_counter()
+    for path in filelist:
+        copy = target_dir+'/'+pdbclean_io.cif_basename(path)+extension
+        with open(path, 'rb') as source, pdbclean_io.open_file(copy, 'wb') as target:
+            target.write(source.read())
+        copies.append(copy)
+    return copies, time.perf_counter() - start
+
+def time_reads(filelist, cold):
+    """
+    Reads (and decompresses) every file, and returns the seconds spent. If cold is True, the
+    files are dropped from the page cache first.
+    """
+    if cold:
+        for path in filelist:
+            drop_cache(path)
+    start = time.perf_counter()
+    for path in filelist:
+        pdbclean_io.read_bytes(path)
+    return time.perf_counter() - start
+
+def check_round_trip(plain_files, copies, workdir):
+    """
+    Returns the names of the CIF(s) whose decompressed content, or clean_cif output, differs
+    from that of the plain CIF.
+    """
+    failures = []
+    for plain, copy in zip(plain_files, copies):
+        if pdbclean_io.read_bytes(copy) != pdbclean_io.read_bytes(plain):
+            failures.append(os.path.basename(copy))
+            continue
+        name = pdbclean_io.cif_basename(copy)
+        plain_clean = workdir+'/'+name+'.plain.cif'
+        copy_clean = workdir+'/'+name+'.copy'+pdbclean_io.cif_extension(copy)
+        cleanutils.clean_cif(plain, plain_clean)
+        cleanutils.clean_cif(copy, copy_clean)
+        if pdbclean_io.read_bytes(copy_clean) != pdbclean_io.read_bytes(plain_clean):
+            failures.append(os.path.basename(copy)+' (clean_cif)')
+        os.remove(plain_clean)
+        os.remove(copy_clean)
+    return failures
+
+def run(workdir, disks, repeats=3, **ensemble_options):
+    """
+    Runs the I/O benchmark on a synthetic ensemble.
+
+    Parameters:
+    -----------
+    workdir : str
+        Directory where the ensemble and its compressed copies are written.
+    disks : dict
+        Maps a kind of disk to its assumed read throughput, in MB/s.
+    repeats : int, optional
+        Number of times the reads are timed (the fastest is kept). Default is 3.
+    **ensemble_options
+        Passed to make_ensemble.
+
+    Returns:
+    --------
+    results : dict
+    """
+    plain_dir = workdir+'/plain'
+    filelist, n_atoms = make_ensemble(plain_dir, **ensemble_options)
+    results = {'structures': len(filelist), 'atoms': n_atoms, 'disks_MB_per_s': disks, 'compressions': {}}
+    for compression in COMPRESSIONS:
+        if compression == 'zstd' and pdbclean_io.zstandard is None:
+            print('zstd: skipped (zstandard is not installed)')
+            continue
+        if compression == 'none':
+            copies, write_seconds = filelist, None
+        else:
+            copies, write_seconds = write_copies(filelist, workdir+'/'+compression, compression)
+        size = sum(os.path.getsize(path) for path in copies)
+        warm = min(time_reads(copies, cold=False) for repeat in range(repeats))
+        cold = min(time_reads(copies, cold=True) for repeat in range(repeats))
+        result = {'bytes': size,
+                  'write_seconds': write_seconds,
+                  'read_seconds_cached': warm,
+                  'read_seconds_local_disk': cold,
+                  'modelled_read_seconds': {}}
+        # The file is read from the disk, then decompressed from memory (the cached read time)
+        for disk, throughput in disks.items():
+            result['modelled_read_seconds'][disk] = size / (throughput * 1e6) + warm
+        if compression != 'none':
+            result['round_trip_failures'] = check_round_trip(filelist, copies, workdir)
+        results['compressions'][compression] = result
+    return results
+
+def print_results(results):
+    plain = results['compressions']['none']
+    disks = sorted(results['disks_MB_per_s'])
+    header = '{0:<6} {1:>10} {2:>7} {3:>10} {4:>10}'.format('', 'MB', 'ratio', 'cached s', 'local s')
+    for disk in disks:
+        header += ' {0:>14}'.format(disk+' s')
+    print(header)
+    for compression, result in results['compressions'].items():
+        line = '{0:<6} {1:>10.2f} {2:>7.2f} {3:>10.3f} {4:>10.3f}'.format(
+            compression, result['bytes']/1e6, plain['bytes']/result['bytes'],
+            result['read_seconds_cached'], result['read_seconds_local_disk'])
+        for disk in disks:
+            seconds = result['modelled_read_seconds'][disk]
+            line += ' {0:>7.3f} ({1:>4.2f}x)'.format(seconds, plain['modelled_read_seconds'][disk]/seconds)
+        print(line)
+        if result.get('round_trip_failures'):
+            print('    round trip FAILED: '+', '.join(result['round_trip_failures']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the I/O saved by compressed CIF(s) on a synthetic ensemble.')
+    parser.add_argument('--output', help='JSON file where the results are written')
+    parser.add_argument('--workdir', help='directory for the ensemble (default: a temporary directory). '
+                                          'Put it on the disk to be measured')
+    parser.add_argument('--disk', action='append', metavar='NAME=MB/s',
+                        help='kind of disk and its read throughput, e.g. spinning=150 (default: '
+                             + ', '.join('{0}={1:g}'.format(disk, mb) for disk, mb in sorted(DISKS.items())) + ')')
+    parser.add_argument('--repeats', type=int, default=3, help='times each read is timed (default: 3)')
+    parser.add_argument('--structures', type=int, default=50, help='number of structures (default: 50)')
+    parser.add_argument('--chains', type=int, default=4, help='protein chains per structure (default: 4)')
+    parser.add_argument('--residues', type=int, default=300, help='residues per chain (default: 300)')
+    parser.add_argument('--waters', type=int, default=200, help='water molecules per structure (default: 200)')
+    args = parser.parse_args()
+
+    disks = DISKS
+    if args.disk:
+        disks = {}
+        for disk in args.disk:
+            name, throughput = disk.split('=')
+            disks[name] = float(throughput)
+    ensemble_options = dict(n_structures=args.structures, n_chains=args.chains, n_residues=args.residues,
+                            n_waters=args.waters)
+    if args.workdir is not None:
+        results = run(args.workdir, disks, repeats=args.repeats, **ensemble_options)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run(workdir, disks, repeats=args.repeats, **ensemble_options)
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if any(result.get('round_trip_failures') for result in results['compressions'].values()):
+        sys.exit(1)
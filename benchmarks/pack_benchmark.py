@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+"""
+Compares a bank kept as a directory with the same bank packed into a single file (see
+PDBClean.packutils): the files (inodes) on disk, and the time to list the CIF(s) of the bank and
+read all of them, from the page cache and from the local disk:
+
+    python benchmarks/pack_benchmark.py --structures 2000 --output pack.json
+
+Every CIF read from the packed bank is checked to be identical to the file of the directory.
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+from PDBClean import packutils
+from PDBClean import pdbclean_io
+from io_benchmark import drop_cache
+from synthetic_ensemble import make_ensemble
+
+def time_bank(bank, cold):
+    """
+    Lists and reads every CIF of a bank, and returns the seconds spent. If cold is True, the
+    files are dropped from the page cache first.
+    """
+    if cold:
+        for path in ([bank] if os.path.isfile(bank) else pdbclean_io.list_cif_files(bank)):
+            drop_cache(path)
+        # The index of the packed bank is read again as well
+        packutils.close_packs()
+    start = time.perf_counter()
+    for path in pdbclean_io.list_cif_files(bank):
+        pdbclean_io.read_bytes(path)
+    return time.perf_counter() - start
+
+def run(workdir, repeats=3, **ensemble_options):
+    """
+    Runs the packed bank benchmark on a synthetic ensemble.
+
+    Parameters:
+    -----------
+    workdir : str
+        Directory where the ensemble and its packed copy are written.
+    repeats : int, optional
+        Number of times the reads are timed (the fastest is kept). Default is 3.
+    **ensemble_options
+        Passed to make_ensemble.
+
+    Returns:
+    --------
+    results : dict
+    """
+    directory = workdir+'/directory_bank'
+    filelist, n_atoms = make_ensemble(directory, **ensemble_options)
+    packed = workdir+'/packed_bank'
+    shutil.copytree(directory, packed)
+    start = time.perf_counter()
+    packutils.pack_bank(packed, verbose=False)
+    pack_seconds = time.perf_counter() - start
+    results = {'structures': len(filelist), 'atoms': n_atoms, 'pack_seconds': pack_seconds, 'banks': {}}
+    files = [path for path, name in packutils.bank_files(directory)]
+    for kind, bank, paths in [('directory', directory, files), ('packed', packed, [packed])]:
+        results['banks'][kind] = {
+            'files': len(paths),
+            'bytes': sum(os.path.getsize(path) for path in paths),
+            'read_seconds_cached': min(time_bank(bank, cold=False) for repeat in range(repeats)),
+            'read_seconds_local_disk': min(time_bank(bank, cold=True) for repeat in range(repeats))}
+    results['mismatches'] = [os.path.basename(path) for path in pdbclean_io.list_cif_files(directory)
+                             if pdbclean_io.read_bytes(path) !=
+                             pdbclean_io.read_bytes(packed+'/'+os.path.basename(path))]
+    return results
+
+def print_results(results):
+    print('Packed {0} structures in {1:.2f} s'.format(results['structures'], results['pack_seconds']))
+    print('{0:<10} {1:>7} {2:>9} {3:>10} {4:>10}'.format('', 'files', 'MB', 'cached s', 'local s'))
+    for kind, result in results['banks'].items():
+        print('{0:<10} {1:>7} {2:>9.2f} {3:>10.3f} {4:>10.3f}'.format(
+            kind, result['files'], result['bytes']/1e6, result['read_seconds_cached'],
+            result['read_seconds_local_disk']))
+    if results['mismatches']:
+        print('    packed bank differs: '+', '.join(results['mismatches']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare a directory bank with a packed bank on a synthetic ensemble.')
+    parser.add_argument('--output', help='JSON file where the results are written')
+    parser.add_argument('--workdir', help='directory for the ensemble (default: a temporary directory). '
+                                          'Put it on the disk to be measured')
+    parser.add_argument('--repeats', type=int, default=3, help='times each read is timed (default: 3)')
+    parser.add_argument('--structures', type=int, default=500, help='number of structures (default: 500)')
+    parser.add_argument('--chains', type=int, default=1, help='protein chains per structure (default: 1)')
+    parser.add_argument('--residues', type=int, default=100, help='residues per chain (default: 100)')
+    parser.add_argument('--waters', type=int, default=20, help='water molecules per structure (default: 20)')
+    args = parser.parse_args()
+
+    ensemble_options = dict(n_structures=args.structures, n_chains=args.chains, n_residues=args.residues,
+                            n_waters=args.waters)
+    if args.workdir is not None:
+        results = run(args.workdir, repeats=args.repeats, **ensemble_options)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run(workdir, repeats=args.repeats, **ensemble_options)
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if results['mismatches']:
+        sys.exit(1)
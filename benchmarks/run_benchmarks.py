@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+"""
+Times the steps of the curation on a synthetic ensemble (see synthetic_ensemble.py), and writes
+the results as JSON, so they can be compared between commits:
+
+    python benchmarks/run_benchmarks.py --output before.json
+    (change the code)
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+
+Each step is run on the output of the previous one. The MUSCLE steps (chain standardization,
+multiple alignment, and the renumbering that depends on it) are skipped if muscle is not installed.
+"""
+from __future__ import print_function
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import datetime
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from PDBClean import cleanutils
+from PDBClean import pdbcleanmolidcifutils as molidutils
+from PDBClean import pdbcleanchainstandardizationutils as chainstd
+from PDBClean import pdbcleanresiduestandardizationutils as resstd
+from synthetic_ensemble import make_ensemble, CONVERSION_FILE
+
+BENCHMARKS = ['clean_cif', 'simplify_cif', 'clean_and_simplify_cif', 'pdb_to_masterlist', 'masterlist_to_pdb', 'chain_standardization',
+              'perform_multiple_alignment', 'conversiontemplate_to_pdb_FAPA']
+MUSCLE_BENCHMARKS = ['chain_standardization', 'perform_multiple_alignment', 'conversiontemplate_to_pdb_FAPA']
+
+def empty_dir(path):
+    """
+    Creates a directory, or removes whatever it has (the directory itself is kept, as it
+    may be the working directory).
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+        return
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+
+def cif_files(path):
+    return sorted(glob.glob(path+'/*.cif'))
+
+class EnsembleBenchmarks(object):
+    """
+    The steps of the curation, run one after the other on a synthetic ensemble. Each step has
+    a reset method (not timed) that removes the output of the previous run, and a run method.
+
+    Attributes:
+    -----------
+    workdir : str
+        Directory with one subdirectory per step, as in a PDBClean project.
+    max_workers : int
+        Number of files processed at the same time by the steps that run in parallel.
+    """
+    def __init__(self, workdir, raw_dir, max_workers=1):
+        self.workdir = workdir
+        self.raw_dir = raw_dir
+        self.max_workers = max_workers
+        self.state = {}
+
+    def bank(self, name):
+        return self.workdir+'/'+name
+
+    def reset_clean_cif(self):
+        empty_dir(self.bank('clean_bank'))
+
+    def run_clean_cif(self):
+        for path in cif_files(self.raw_dir):
+            cleanutils.clean_cif(path, self.bank('clean_bank')+'/'+os.path.basename(path))
+
+    def reset_simplify_cif(self):
+        empty_dir(self.bank('simple_bank'))
+
+    def run_simplify_cif(self):
+        for path in cif_files(self.bank('clean_bank')):
+            cleanutils.simplify_cif(path, self.bank('simple_bank')+'/'+os.path.basename(path), '.cif')
+
+    def reset_clean_and_simplify_cif(self):
+        # Writes the same simple_bank as clean_cif followed by simplify_cif
+        empty_dir(self.bank('simple_bank'))
+
+    def run_clean_and_simplify_cif(self):
+        for path in cif_files(self.raw_dir):
+            cleanutils.clean_and_simplify_cif(path, self.bank('simple_bank')+'/'+os.path.basename(path), '.cif')
+
+    def reset_pdb_to_masterlist(self):
+        pass
+
+    def run_pdb_to_masterlist(self):
+        self.state['masterlist'] = molidutils.pdb_to_masterlist(cif_files(self.bank('simple_bank')))
+
+    def reset_masterlist_to_pdb(self):
+        # The chain IDs of the conversion file (and concatenations) are assigned before the step is timed
+        empty_dir(self.bank('standard_MolID_bank'))
+        masterlist = molidutils.pdb_to_masterlist(cif_files(self.bank('simple_bank')))
+        unique_map = molidutils.CreateMasterUniqueMolIDMap(masterlist)
+        conversion_list = molidutils.uniquelist_to_conversionlist(unique_map)
+        conversion_list = molidutils.add_user_conversion(conversion_list, self.raw_dir+'/'+CONVERSION_FILE)
+        masterlist = molidutils.update_masterlist(masterlist, conversion_list)
+        for newchain in molidutils.return_unassigned_conversion(masterlist, step='concatenation'):
+            masterlist = molidutils.list_accept_concatenations_auto(masterlist, newchain, new_order=None,
+                                                                     action='accept')[0]
+        self.state['masterlist'] = masterlist
+
+    def run_masterlist_to_pdb(self):
+        molidutils.masterlist_to_pdb(cif_files(self.bank('simple_bank')), self.state['masterlist'],
+                                     target_dir=self.bank('standard_MolID_bank'))
+
+    def reset_chain_standardization(self):
+        empty_dir(self.bank('standard_ChainID_bank'))
+        empty_dir(self.bank('alignments'))
+
+    def run_chain_standardization(self):
+        # Standard sequences from the consensus of all structures, then options 4 of the ChainID step
+        filelist = cif_files(self.bank('standard_MolID_bank'))
+        Structure_Sequences, structid_list, chid_list = chainstd.pdb_to_structurelists(filelist)
+        Standard_Sequences = {}
+        for chid in chid_list:
+            Standard_Sequences = chainstd.assign_standard_from_consensus(Structure_Sequences, Standard_Sequences, chid)
+        score_cache = {}
+        for I in range(len(filelist)):
+            output, output_scores = chainstd.standardize_structure_chains(Structure_Sequences[I], Standard_Sequences,
+                                                                          score_cache=score_cache)
+            chainstd.reassignedmaps_to_pdb([filelist[I]], [output], [filelist[I]],
+                                           target_dir=self.bank('standard_ChainID_bank'))
+
+    def reset_perform_multiple_alignment(self):
+        empty_dir(self.bank('alignments'))
+
+    def run_perform_multiple_alignment(self):
+        # Option 4 of the multiple alignment menu of the ResidueID step
+        filelist = cif_files(self.bank('standard_ChainID_bank'))
+        Structure_Sequences, ChID_ResiNum_Vector, structid_list, chid_list = resstd.pdb_to_structurelists(filelist)
+        Structure_Sequences_Aligned, Structure_Sequences_GAPS = resstd.align_chains(Structure_Sequences,
+                                                                                    structid_list, chid_list,
+                                                                                    max_workers=self.max_workers)
+        self.state['conversion_templates'] = resstd.build_conversion_templates(Structure_Sequences_Aligned,
+                                                                               Structure_Sequences_GAPS,
+                                                                               ChID_ResiNum_Vector,
+                                                                               structid_list)
+
+    def reset_conversiontemplate_to_pdb_FAPA(self):
+        empty_dir(self.bank('standard_ResidueID_bank'))
+
+    def run_conversiontemplate_to_pdb_FAPA(self):
+        resstd.conversiontemplate_to_pdb_FAPA(cif_files(self.bank('standard_ChainID_bank')),
+                                              self.state['conversion_templates'],
+                                              target_dir=self.bank('standard_ResidueID_bank'),
+                                              max_workers=self.max_workers)
+
+def measure(reset, run, repeat=3, quiet=True):
+    """
+    Times a step, and measures the peak of the memory allocated by Python during one more run.
+
+    Parameters:
+    -----------
+    reset : function
+        Called before each run, not timed.
+    run : function
+        The step.
+    repeat : int, optional
+        Number of timed runs. Default is 3.
+    quiet : bool, optional
+        If True, the output of the step is not printed. Default is True.
+
+    Returns:
+    --------
+    result : dict
+        Wall and CPU seconds of each run, best and median wall seconds, and peak memory in bytes.
+    """
+    wall = []
+    cpu = []
+    with open(os.devnull, 'w') as devnull:
+        stdout = devnull if quiet else sys.stdout
+        for i in range(repeat):
+            with redirect_stdout(stdout):
+                reset()
+                start_wall = time.perf_counter()
+                start_cpu = time.process_time()
+                run()
+                cpu.append(time.process_time() - start_cpu)
+                wall.append(time.perf_counter() - start_wall)
+        # Memory is measured on a separate run, as tracing allocations slows the step down
+        with redirect_stdout(stdout):
+            reset()
+        tracemalloc.start()
+        try:
+            with redirect_stdout(stdout):
+                run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    ordered = sorted(wall)
+    return {'seconds': wall,
+            'cpu_seconds': cpu,
+            'best_seconds': ordered[0],
+            'median_seconds': ordered[len(ordered)//2],
+            'peak_memory_bytes': peak}
+
+def git_commit():
+    """
+    Returns the commit of the working copy of PDBClean, or None if it is not a git repository.
+    """
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                      stderr=subprocess.DEVNULL)
+        return out.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(old, new):
+    """
+    Prints the median time and peak memory of each step in two result files, and their ratio.
+    """
+    print('Benchmark | Old seconds | New seconds | Ratio | Old MB | New MB')
+    for name in BENCHMARKS:
+        old_result = old['benchmarks'].get(name, {})
+        new_result = new['benchmarks'].get(name, {})
+        if 'median_seconds' not in old_result or 'median_seconds' not in new_result:
+            continue
+        ratio = new_result['median_seconds'] / old_result['median_seconds'] if old_result['median_seconds'] else 0
+        print('{0} | {1:.3f} | {2:.3f} | {3:.2f} | {4:.1f} | {5:.1f}'.format(
+            name, old_result['median_seconds'], new_result['median_seconds'], ratio,
+            old_result['peak_memory_bytes']/1e6, new_result['peak_memory_bytes']/1e6))
+
+def run_benchmarks(parameters, workdir, only=None, repeat=3, max_workers=1, quiet=True):
+    """
+    Generates the ensemble and runs the benchmarks.
+
+    Parameters:
+    -----------
+    parameters : dict
+        Keyword arguments of make_ensemble.
+    workdir : str
+        Directory where the ensemble and the output of each step are written.
+    only : list of str, optional
+        Benchmarks to run. The steps they depend on are run once, untimed. Default is all.
+    repeat : int, optional
+        Number of timed runs of each step. Default is 3.
+    max_workers : int, optional
+        Number of files processed at the same time by the parallel steps. Default is 1.
+    quiet : bool, optional
+        If True, the output of the steps is not printed. Default is True.
+
+    Returns:
+    --------
+    results : dict
+    """
+    raw_dir = workdir+'/raw_bank'
+    empty_dir(raw_dir)
+    filelist, n_atoms = make_ensemble(raw_dir, **parameters)
+    results = {'commit': git_commit(),
+               'date': str(datetime.datetime.now()),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpu_count': os.cpu_count(),
+               'max_workers': max_workers,
+               'repeat': repeat,
+               'ensemble': dict(parameters, n_atoms=n_atoms),
+               'benchmarks': {}}
+    have_muscle = shutil.which('muscle') is not None
+    suite = EnsembleBenchmarks(workdir, raw_dir, max_workers=max_workers)
+    # MUSCLE writes its files to the working directory
+    cwd = os.getcwd()
+    empty_dir(suite.bank('alignments'))
+    os.chdir(suite.bank('alignments'))
+    try:
+        for name in BENCHMARKS:
+            reset = getattr(suite, 'reset_'+name)
+            run = getattr(suite, 'run_'+name)
+            if name in MUSCLE_BENCHMARKS and not have_muscle:
+                print('{0}: skipped (muscle not found)'.format(name))
+                results['benchmarks'][name] = {'skipped': 'muscle not found'}
+                continue
+            if only is not None and name not in only:
+                # Needed by the next steps
+                with open(os.devnull, 'w') as devnull, redirect_stdout(devnull if quiet else sys.stdout):
+                    reset()
+                    run()
+                continue
+            result = measure(reset, run, repeat=repeat, quiet=quiet)
+            results['benchmarks'][name] = result
+            print('{0}: {1:.3f} s (median of {2}), {3:.1f} MB peak'.format(
+                name, result['median_seconds'], repeat, result['peak_memory_bytes']/1e6))
+    finally:
+        os.chdir(cwd)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the curation steps on a synthetic ensemble.')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file with the results')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare with')
+    parser.add_argument('--workdir', help='directory for the ensemble and the output of each step '
+                                          '(default: a temporary directory, removed at the end)')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='benchmarks to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each step (default: 3)')
+    parser.add_argument('--max-workers', type=int, default=1,
+                        help='files processed at the same time by the parallel steps (default: 1)')
+    parser.add_argument('--verbose', action='store_true', help='print the output of the steps')
+    parser.add_argument('--structures', type=int, default=20, help='number of structures (default: 20)')
+    parser.add_argument('--chains', type=int, default=2, help='protein chains per structure (default: 2)')
+    parser.add_argument('--residues', type=int, default=150, help='residues per chain (default: 150)')
+    parser.add_argument('--assemblies', type=int, default=1, help='biological assemblies per structure (default: 1)')
+    parser.add_argument('--mutation-rate', type=float, default=0.01,
+                        help='probability that a residue differs from the base sequence (default: 0.01)')
+    parser.add_argument('--ligands', type=int, default=1, help='ligand molecules per structure (default: 1)')
+    parser.add_argument('--waters', type=int, default=50, help='water molecules per structure (default: 50)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    args = parser.parse_args()
+
+    parameters = {'n_structures': args.structures, 'n_chains': args.chains, 'n_residues': args.residues,
+                  'n_assemblies': args.assemblies, 'mutation_rate': args.mutation_rate,
+                  'n_ligands': args.ligands, 'n_waters': args.waters, 'seed': args.seed}
+    workdir = args.workdir
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='pdbclean_benchmark_')
+    try:
+        results = run_benchmarks(parameters, os.path.abspath(workdir), only=args.only, repeat=args.repeat,
+                                 max_workers=args.max_workers, quiet=not args.verbose)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print('Results written to '+args.output)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare_results(json.load(f), results)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+"""
+Runs the per-structure stages (download, clean, simplify) of several projects with the same PDB
+entries, with and without a shared store (see PDBClean.storeutils), and compares the downloads,
+the time spent, and the bytes on disk (each hard-linked file is counted once):
+
+    python benchmarks/store_benchmark.py --structures 200 --projects 4 --output store.json
+
+The entries are "downloaded" from a synthetic ensemble through file:// URLs, so the time saved on
+the network is not measured. The CIF(s) of each project are checked to be the same with and
+without the store (the data block names of the simplify outputs aside).
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+from PDBClean import pdbutils
+from PDBClean import pipelineutils
+from PDBClean import pdbclean_io
+from PDBClean.storeutils import Store
+from synthetic_ensemble import make_ensemble
+
+BANKS = ['raw_bank', 'clean_bank', 'simple_bank']
+
+def count_downloads():
+    """
+    Counts the calls to pdbutils.download_from_url, and returns the counter (a list of one int).
+    """
+    counter = [0]
+    download_from_url = pdbutils.download_from_url
+    def counted_download_from_url(source, target):
+        counter[0] += 1
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                download_from_url(source, target)
+            finally:
+                sys.stdout = stdout
+    pdbutils.download_from_url = counted_download_from_url
+    return counter
+
+def disk_bytes(directories):
+    """
+    Returns the bytes of the files under directories, counting each inode once.
+    """
+    inodes = {}
+    for directory in directories:
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                stat = os.stat(os.path.join(dirpath, filename))
+                inodes[(stat.st_dev, stat.st_ino)] = stat.st_size
+    return sum(inodes.values())
+
+def bank_contents(projdir):
+    """
+    Returns the content of the CIF(s) of the per-structure banks of a project, without the data
+    block names of the simplify outputs (they are named after the project directory).
+    """
+    contents = {}
+    for bank in BANKS:
+        for path in pdbclean_io.list_cif_files(projdir+'/'+bank):
+            content = pdbclean_io.read_bytes(path)
+            if bank == 'simple_bank':
+                content = content.split(b'\n', 1)[1]
+            contents[bank+'/'+os.path.basename(path)] = content
+    return contents
+
+def run(workdir, n_projects=3, **ensemble_options):
+    """
+    Runs the store benchmark on a synthetic ensemble.
+
+    Parameters:
+    -----------
+    workdir : str
+        Directory where the ensemble, the projects and the store are written.
+    n_projects : int, optional
+        Number of projects with the same PDB entries. Default is 3.
+    **ensemble_options
+        Passed to make_ensemble.
+
+    Returns:
+    --------
+    results : dict
+    """
+    filelist, n_atoms = make_ensemble(workdir+'/entries', **ensemble_options)
+    pdbids = [pdbclean_io.cif_basename(path) for path in filelist]
+    pdbutils.PDB_DOWNLOAD_URL = 'file://'+os.path.abspath(workdir)+'/entries/'
+    downloads = count_downloads()
+    results = {'structures': len(filelist), 'atoms': n_atoms, 'projects': n_projects, 'runs': {}}
+    contents = {}
+    for kind in ['without_store', 'with_store']:
+        store = Store(workdir+'/store') if kind == 'with_store' else None
+        projdirs = [workdir+'/'+kind+'/project'+str(i) for i in range(n_projects)]
+        os.makedirs(workdir+'/'+kind)
+        downloads[0] = 0
+        seconds = []
+        for projdir in projdirs:
+            start = time.perf_counter()
+            pipelineutils.run_pipeline(projdir, pdbids=pdbids, stop_after='simplify', store=store, verbose=False)
+            seconds.append(time.perf_counter() - start)
+        results['runs'][kind] = {
+            'downloads': downloads[0],
+            'seconds_first_project': seconds[0],
+            'seconds_other_projects': sum(seconds[1:]) / max(1, len(seconds) - 1),
+            'bytes': disk_bytes([projdir+'/'+bank for projdir in projdirs for bank in BANKS] +
+                                ([store.root+'/objects'] if store is not None else []))}
+        contents[kind] = [bank_contents(projdir) for projdir in projdirs]
+        if store is not None:
+            store.close()
+    results['mismatches'] = sorted(set(name for without_store, with_store in zip(contents['without_store'],
+                                                                                  contents['with_store'])
+                                       for name in set(without_store) | set(with_store)
+                                       if without_store.get(name) != with_store.get(name)))
+    return results
+
+def print_results(results):
+    print('{0} structures, {1} projects'.format(results['structures'], results['projects']))
+    print('{0:<14} {1:>10} {2:>10} {3:>10} {4:>9}'.format('', 'downloads', 'first s', 'others s', 'MB'))
+    for kind, result in results['runs'].items():
+        print('{0:<14} {1:>10} {2:>10.2f} {3:>10.2f} {4:>9.2f}'.format(
+            kind, result['downloads'], result['seconds_first_project'], result['seconds_other_projects'],
+            result['bytes']/1e6))
+    if results['mismatches']:
+        print('    projects differ: '+', '.join(results['mismatches']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare projects with and without a shared store on a '
+                                                 'synthetic ensemble.')
+    parser.add_argument('--output', help='JSON file where the results are written')
+    parser.add_argument('--workdir', help='directory for the ensemble, projects and store (default: a temporary '
+                                          'directory)')
+    parser.add_argument('--projects', type=int, default=3, help='number of projects (default: 3)')
+    parser.add_argument('--structures', type=int, default=100, help='number of structures (default: 100)')
+    parser.add_argument('--chains', type=int, default=2, help='protein chains per structure (default: 2)')
+    parser.add_argument('--residues', type=int, default=200, help='residues per chain (default: 200)')
+    parser.add_argument('--waters', type=int, default=50, help='water molecules per structure (default: 50)')
+    args = parser.parse_args()
+
+    ensemble_options = dict(n_structures=args.structures, n_chains=args.chains, n_residues=args.residues,
+                            n_waters=args.waters)
+    if args.workdir is not None:
+        results = run(args.workdir, n_projects=args.projects, **ensemble_options)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run(workdir, n_projects=args.projects, **ensemble_options)
+    print_results(results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if results['mismatches']:
+        sys.exit(1)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+"""
+Generates synthetic structural ensembles: CIF(s) in the format downloaded from the RCSB PDB,
+with the categories read by PDBClean (entry, citation, resolution, entities, biological
+assemblies and coordinates), so every step of the curation can be run on them.
+"""
+from __future__ import print_function
+import os
+import random
+import argparse
+
+AMINO_ACIDS = ['ALA', 'ARG', 'ASN', 'ASP', 'CYS', 'GLN', 'GLU', 'GLY', 'HIS', 'ILE',
+               'LEU', 'LYS', 'MET', 'PHE', 'PRO', 'SER', 'THR', 'TRP', 'TYR', 'VAL']
+LIGAND_ATOMS = ['C1', 'C2', 'C3', 'C4', 'C5', 'C6', 'N1', 'O1', 'O2', 'S1']
+ATOM_SITE_ITEMS = ['group_PDB', 'id', 'type_symbol', 'label_atom_id', 'label_alt_id', 'label_comp_id',
+                   'label_asym_id', 'label_entity_id', 'label_seq_id', 'pdbx_PDB_ins_code', 'Cartn_x',
+                   'Cartn_y', 'Cartn_z', 'occupancy', 'B_iso_or_equiv', 'pdbx_formal_charge', 'auth_seq_id',
+                   'auth_comp_id', 'auth_asym_id', 'auth_atom_id', 'pdbx_PDB_model_num']
+CONVERSION_FILE = 'conversion.txt'
+
+def asym_ids(n):
+    """
+    Returns n distinct chain IDs: A-Z, then AA, AB, ...
+
+    Parameters:
+    -----------
+    n : int
+        Number of chain IDs.
+
+    Returns:
+    --------
+    ids : list of str
+    """
+    letters = [chr(ord('A')+i) for i in range(26)]
+    ids = []
+    size = 1
+    while len(ids) < n:
+        if size == 1:
+            ids.extend(letters)
+        else:
+            ids.extend(first+second for first in letters for second in letters)
+        size += 1
+    return ids[:n]
+
+def residue_atoms(resname):
+    """
+    Returns the atom names written for a residue: the backbone, and CB for all residues but glycine.
+    """
+    if resname == 'GLY':
+        return ['N', 'CA', 'C', 'O']
+    return ['N', 'CA', 'C', 'O', 'CB']
+
+def make_structure(path, pdbid, base_sequences, n_assemblies=1, mutation_rate=0.0, n_ligands=0, n_waters=0,
+                   rng=None):
+    """
+    Writes one synthetic CIF.
+
+    Each sequence in base_sequences is a protein entity with one chain. Chains, ligands and waters
+    are distributed among the biological assemblies (each assembly has at least one chain).
+
+    Parameters:
+    -----------
+    path : str
+        Path of the new CIF.
+    pdbid : str
+        Entry ID written in the CIF.
+    base_sequences : list of list of str
+        Residue names of each protein entity.
+    n_assemblies : int, optional
+        Number of biological assemblies. Default is 1.
+    mutation_rate : float, optional
+        Probability that each residue is replaced by another amino acid. Default is 0.
+    n_ligands : int, optional
+        Number of ligand molecules. Default is 0.
+    n_waters : int, optional
+        Number of water molecules. Default is 0.
+    rng : random.Random, optional
+        Random number generator.
+
+    Returns:
+    --------
+    n_atoms : int
+        Number of atoms written.
+    """
+    if rng is None:
+        rng = random.Random(0)
+    n_chains = len(base_sequences)
+    n_assemblies = max(1, min(n_assemblies, n_chains))
+    ligand_entity = str(n_chains+1)
+    water_entity = str(n_chains+2)
+    ids = asym_ids(n_chains + n_ligands + n_assemblies)
+    protein_asym = ids[:n_chains]
+    ligand_asym = ids[n_chains:n_chains+n_ligands]
+    water_asym = ids[n_chains+n_ligands:]
+
+    lines = ["data_{0}\n#\n_entry.id   {0}\n#\n".format(pdbid)]
+    lines.append("loop_\n_citation_author.name\n'Doe, J.'\n'Roe, R.'\n#\n")
+    lines.append("loop_\n_citation.id\n_citation.title\n_citation.year\n_citation.pdbx_database_id_DOI\n"
+                 "primary 'Synthetic structure {0}' 2024 10.0000/{0}\n#\n".format(pdbid))
+    lines.append("_exptl.entry_id {0}\n_exptl.method 'X-RAY DIFFRACTION'\n#\n".format(pdbid))
+    lines.append("_refine.entry_id {0}\n_refine.pdbx_refine_id 'X-RAY DIFFRACTION'\n_refine.ls_d_res_high 2.00\n#\n"
+                 .format(pdbid))
+    lines.append("loop_\n_entity.id\n_entity.type\n_entity.pdbx_description\n")
+    for i in range(n_chains):
+        lines.append("{0} polymer 'Synthetic protein {0}'\n".format(i+1))
+    lines.append("{0} non-polymer 'Synthetic ligand'\n{1} water water\n#\n".format(ligand_entity, water_entity))
+
+    assembly_asym = [[] for assembly in range(n_assemblies)]
+    for i, asym in enumerate(protein_asym):
+        assembly_asym[i % n_assemblies].append(asym)
+    for i, asym in enumerate(ligand_asym):
+        assembly_asym[i % n_assemblies].append(asym)
+    for assembly, asym in enumerate(water_asym):
+        assembly_asym[assembly].append(asym)
+    lines.append("loop_\n_pdbx_struct_assembly_gen.assembly_id\n_pdbx_struct_assembly_gen.oper_expression\n"
+                 "_pdbx_struct_assembly_gen.asym_id_list\n")
+    for assembly in range(n_assemblies):
+        lines.append("{0} 1 {1}\n".format(assembly+1, ','.join(assembly_asym[assembly])))
+    lines.append("#\nloop_\n")
+    lines.extend("_atom_site.{0}\n".format(item) for item in ATOM_SITE_ITEMS)
+
+    n_atoms = 0
+    row = "{0} {1} {2} {3} . {4} {5} {6} {7} ? {8:.3f} {9:.3f} {10:.3f} 1.00 {11:.2f} ? {12} {4} {13} {3} 1\n"
+    for i, sequence in enumerate(base_sequences):
+        x0, y0, z0 = rng.uniform(-50, 50), rng.uniform(-50, 50), rng.uniform(-50, 50)
+        for resnum, resname in enumerate(sequence):
+            if mutation_rate and rng.random() < mutation_rate:
+                resname = rng.choice([aa for aa in AMINO_ACIDS if aa != resname])
+            for atom in residue_atoms(resname):
+                n_atoms += 1
+                lines.append(row.format('ATOM', n_atoms, atom[0], atom, resname, protein_asym[i], i+1, resnum+1,
+                                        x0 + 3.8*resnum + rng.uniform(-1, 1), y0 + rng.uniform(-1, 1),
+                                        z0 + rng.uniform(-1, 1), rng.uniform(10, 60), resnum+1, protein_asym[i]))
+    for i, asym in enumerate(ligand_asym):
+        x0, y0, z0 = rng.uniform(-50, 50), rng.uniform(-50, 50), rng.uniform(-50, 50)
+        for atom in LIGAND_ATOMS:
+            n_atoms += 1
+            lines.append(row.format('HETATM', n_atoms, atom[0], atom, 'LIG', asym, ligand_entity, '.',
+                                    x0 + rng.uniform(-3, 3), y0 + rng.uniform(-3, 3), z0 + rng.uniform(-3, 3),
+                                    rng.uniform(10, 60), 1001+i, asym))
+    for i in range(n_waters):
+        asym = water_asym[i % len(water_asym)]
+        n_atoms += 1
+        lines.append(row.format('HETATM', n_atoms, 'O', 'O', 'HOH', asym, water_entity, '.',
+                                rng.uniform(-60, 60), rng.uniform(-60, 60), rng.uniform(-60, 60),
+                                rng.uniform(20, 80), 2001+i, asym))
+    lines.append("#\n")
+    with open(path, 'w') as ciffile:
+        ciffile.write(''.join(lines))
+    return n_atoms
+
+def make_ensemble(target_dir, n_structures=10, n_chains=2, n_residues=100, n_assemblies=1, mutation_rate=0.0,
+                  n_ligands=1, n_waters=20, seed=0):
+    """
+    Writes a synthetic ensemble: structures of the same proteins, that differ by point mutations,
+    coordinates and the number of biological assemblies, ligands and waters given.
+
+    A MolID conversion file (CONVERSION_FILE) with enough chain IDs for every entity is written
+    next to the CIF(s), so the MolID step can be run without user interaction.
+
+    Parameters:
+    -----------
+    target_dir : str
+        Directory where the CIF(s) are written.
+    n_structures : int, optional
+        Number of structures. Default is 10.
+    n_chains : int, optional
+        Number of protein chains (entities) per structure. Default is 2.
+    n_residues : int, optional
+        Number of residues per chain. Default is 100.
+    n_assemblies : int, optional
+        Number of biological assemblies per structure. Default is 1.
+    mutation_rate : float, optional
+        Probability that each residue of a structure differs from the base sequence. Default is 0.
+    n_ligands : int, optional
+        Number of ligand molecules per structure. Default is 1.
+    n_waters : int, optional
+        Number of water molecules per structure. Default is 20.
+    seed : int, optional
+        Seed of the random number generator. The same seed gives the same ensemble. Default is 0.
+
+    Returns:
+    --------
+    filelist : list of str
+        Paths of the CIF(s).
+    n_atoms : int
+        Total number of atoms.
+    """
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+    rng = random.Random(seed)
+    base_sequences = [[rng.choice(AMINO_ACIDS) for resnum in range(n_residues)] for chain in range(n_chains)]
+    filelist = []
+    n_atoms = 0
+    for i in range(n_structures):
+        pdbid = 'S{0:03d}'.format(i)
+        path = os.path.join(target_dir, pdbid+'.cif')
+        n_atoms += make_structure(path, pdbid, base_sequences, n_assemblies=n_assemblies,
+                                  mutation_rate=mutation_rate, n_ligands=n_ligands, n_waters=n_waters, rng=rng)
+        filelist.append(path)
+
+    # Each assembly file has at most one chain of each protein, one water chain, and up to all ligands
+    ids = asym_ids(n_chains + max(n_ligands, 1) + 1)
+    with open(os.path.join(target_dir, CONVERSION_FILE), 'w') as conversion:
+        for i in range(n_chains):
+            conversion.write('SYNTHETIC PROTEIN {0}:{1}\n'.format(i+1, ids[i]))
+        if n_ligands:
+            conversion.write('SYNTHETIC LIGAND:{0}\n'.format(','.join(ids[n_chains:n_chains+n_ligands])))
+        conversion.write('WATER:{0}\n'.format(ids[-1]))
+    return filelist, n_atoms
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic structural ensemble of CIF(s).')
+    parser.add_argument('target_dir', help='directory where the CIF(s) are written')
+    parser.add_argument('--structures', type=int, default=10, help='number of structures (default: 10)')
+    parser.add_argument('--chains', type=int, default=2, help='protein chains per structure (default: 2)')
+    parser.add_argument('--residues', type=int, default=100, help='residues per chain (default: 100)')
+    parser.add_argument('--assemblies', type=int, default=1, help='biological assemblies per structure (default: 1)')
+    parser.add_argument('--mutation-rate', type=float, default=0.0,
+                        help='probability that a residue differs from the base sequence (default: 0)')
+    parser.add_argument('--ligands', type=int, default=1, help='ligand molecules per structure (default: 1)')
+    parser.add_argument('--waters', type=int, default=20, help='water molecules per structure (default: 20)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    args = parser.parse_args()
+    filelist, n_atoms = make_ensemble(args.target_dir, n_structures=args.structures, n_chains=args.chains,
+                                      n_residues=args.residues, n_assemblies=args.assemblies,
+                                      mutation_rate=args.mutation_rate, n_ligands=args.ligands,
+                                      n_waters=args.waters, seed=args.seed)
+    print('Wrote {0} structures ({1} atoms) to {2}'.format(len(filelist), n_atoms, args.target_dir))
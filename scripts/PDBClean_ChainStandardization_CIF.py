@@ -3,27 +3,91 @@
 #
 from __future__ import print_function
 from __future__ import division
-import sys, glob
+import sys
+import argparse
+import json
+import socket
+from PDBClean import pdbclean_io, sessionutils
 from PDBClean import pdbcleanchainstandardizationutils as chainstd
 
 ########################
 # READ INPUT ARGUMENTS #
 ########################
-n_arg = len(sys.argv)
-if(n_arg<3):
-    print('Usage error: {0} <source directory> <target directory>'.format(sys.argv[0]))
+parser = argparse.ArgumentParser(description='Standardize chain IDs. Without options, an interactive menu is shown. '
+                                             'Batch options run without interaction against frozen standard sequences.')
+parser.add_argument('source_dir', help='source directory')
+parser.add_argument('target_dir', help='target directory (shared by all shards or workers)')
+batch = parser.add_mutually_exclusive_group()
+batch.add_argument('--shard', help='process the i-th of N slices of the sorted file list, counting from 0 (e.g. 0/4)')
+batch.add_argument('--queue', metavar='CLAIMS_DIR',
+                   help='take structures from a work queue shared through CLAIMS_DIR, until none are left')
+batch.add_argument('--merge', action='store_true',
+                   help='merge the records of all shards or workers and check that every structure was standardized')
+parser.add_argument('--standard-sequences', help='JSON file with the standard sequences (required by --shard and --queue)')
+parser.add_argument('--ignore-chains', help='file with chain IDs to ignore when aligning, one per line')
+parser.add_argument('--worker', default=socket.gethostname(),
+                    help='name of this worker in the work queue (default: host name)')
+parser.add_argument('--resume', action='store_true',
+                    help='replay the answers of an interactive session that did not finish')
+args = parser.parse_args()
+source_dir=args.source_dir
+target_dir=args.target_dir
+
+
+#########################
+# BATCH STANDARDIZATION #
+#########################
+
+if args.merge:
+    filelist=pdbclean_io.list_cif_files(source_dir)
+    sys.exit(0 if chainstd.merge_batch_records(filelist, target_dir) else 1)
+
+if args.shard is not None or args.queue is not None:
+    if args.standard_sequences is None:
+        parser.error('--shard and --queue need --standard-sequences')
+    if args.shard is not None:
+        try:
+            shard_index, n_shards = chainstd.parse_shard(args.shard)
+        except ValueError as error:
+            parser.error(str(error))
+    with open(args.standard_sequences) as f:
+        Standard_Sequences = json.loads(f.read())
+    ignore_chid = []
+    if args.ignore_chains is not None:
+        with open(args.ignore_chains) as f:
+            ignore_chid = [line.strip() for line in f if line.strip()]
+    filelist=pdbclean_io.list_cif_files(source_dir)
+    if args.shard is not None:
+        filelist = chainstd.shard_filelist(filelist, shard_index, n_shards)
+        journal = chainstd.BATCH_JOURNAL.format('shard-{0}-of-{1}'.format(shard_index, n_shards))
+        n_standardized = chainstd.standardize_batch(filelist, Standard_Sequences, target_dir, journal,
+                                                    ignore_chid=ignore_chid)
+    else:
+        journal = chainstd.BATCH_JOURNAL.format('worker-'+args.worker)
+        n_standardized = chainstd.standardize_batch(filelist, Standard_Sequences, target_dir, journal,
+                                                    ignore_chid=ignore_chid, claims_dir=args.queue,
+                                                    worker=args.worker)
+    print("Standardized {0} structures. Run with --merge when all shards are done.".format(n_standardized))
     sys.exit()
-source_dir=sys.argv[1]
-target_dir=sys.argv[2]
 
 
 #############################################
 # READ PDB FILES AND DEFINE STRUCTURE LISTS #
 #############################################
 
-filelist=glob.glob(source_dir+'/*.cif')
-Structure_Sequences, structid_list, chid_list = chainstd.pdb_to_structurelists(filelist)
+filelist=pdbclean_io.list_cif_files(source_dir)
+session = sessionutils.Session(target_dir, 'chainid', filelist)
+state = session.load_state()
+if state is None:
+    Structure_Sequences, structid_list, chid_list = chainstd.pdb_to_structurelists(filelist)
+    session.save_state({'Structure_Sequences': Structure_Sequences, 'structid_list': structid_list,
+                        'chid_list': chid_list})
+else:
+    Structure_Sequences = state['Structure_Sequences']
+    structid_list = state['structid_list']
+    chid_list = state['chid_list']
 Standard_Sequences = {}
+session.start(args.resume)
 
 
 ############################################
@@ -44,15 +108,16 @@ while(input_menu != "QUIT"):
               sep="\n")
     input_menu = input('Option Number: ')
     if (input_menu == "1"):
-        Standard_Sequences, input_menu_check_1 = chainstd.select_standard_seq_from_reference(Structure_Sequences,
-                                                                                             Standard_Sequences,
-                                                                                             structid_list,
-                                                                                             input_menu_check_1)
+        # The standard sequences are journaled, so a resumed session does not compute them again
+        Standard_Sequences, input_menu_check_1 = session.call('standard_sequences',
+                                                              chainstd.select_standard_seq_from_reference,
+                                                              Structure_Sequences, Standard_Sequences,
+                                                              structid_list, input_menu_check_1)
     elif (input_menu == "2"):
-        Standard_Sequences, input_menu_check_1 = chainstd.create_standard_seq_from_consensus(Structure_Sequences,
-                                                                                             Standard_Sequences,
-                                                                                             chid_list,
-                                                                                             input_menu_check_1)
+        Standard_Sequences, input_menu_check_1 = session.call('standard_sequences',
+                                                              chainstd.create_standard_seq_from_consensus,
+                                                              Structure_Sequences, Standard_Sequences,
+                                                              chid_list, input_menu_check_1)
         print("These are the standard sequences:")
         print(Standard_Sequences)
     elif (input_menu == "3" and input_menu_check_1 == "1"):
@@ -66,3 +131,5 @@ while(input_menu != "QUIT"):
                                                    target_dir=target_dir)
         print("Done!")
         input_menu = "QUIT"
+
+session.close()
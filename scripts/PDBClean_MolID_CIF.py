@@ -9,29 +9,42 @@
 # Create list of MolIDConversion objects using unique_molID_occur_map
 
 from __future__ import print_function
-import sys, glob
+import sys
+from PDBClean import pdbclean_io, sessionutils
 from PDBClean import pdbcleanmolidcifutils as molidutils
 
 
 ########################
 # READ INPUT ARGUMENTS #
 ########################
-n_arg = len(sys.argv)
+# --resume replays the answers of a session that did not finish (see sessionutils)
+argv = [arg for arg in sys.argv if arg != '--resume']
+resume = len(argv) != len(sys.argv)
+n_arg = len(argv)
 if(n_arg<3):
-    print('Usage error: {0} <source directory> <target directory>'.format(sys.argv[0]))
+    print('Usage error: {0} <source directory> <target directory> [--resume]'.format(sys.argv[0]))
     sys.exit()
-source_dir = sys.argv[1]
-target_dir = sys.argv[2]
+source_dir = argv[1]
+target_dir = argv[2]
 
 
 #########################################
 # READ PDB FILES AND DEFINE MolID LISTS #
 #########################################
 
-filelist=glob.glob(source_dir+'/*.cif')
-master_molID_class_list = molidutils.pdb_to_masterlist(filelist)
-unique_molID_occur_map  = molidutils.CreateMasterUniqueMolIDMap(master_molID_class_list)
-molIDConversion_list    = molidutils.uniquelist_to_conversionlist(unique_molID_occur_map)
+filelist=pdbclean_io.list_cif_files(source_dir)
+session = sessionutils.Session(target_dir, 'molid', filelist)
+state = session.load_state()
+if state is None:
+    master_molID_class_list = molidutils.pdb_to_masterlist(filelist)
+    unique_molID_occur_map  = molidutils.CreateMasterUniqueMolIDMap(master_molID_class_list)
+    molIDConversion_list    = molidutils.uniquelist_to_conversionlist(unique_molID_occur_map)
+    session.save_state({'master_molID_class_list': master_molID_class_list,
+                        'molIDConversion_list': molIDConversion_list})
+else:
+    master_molID_class_list = state['master_molID_class_list']
+    molIDConversion_list = state['molIDConversion_list']
+session.start(resume)
 #FAPA MARCH 2024
 MolID_to_files_map = molidutils.CreateMasterUniqueMolIDMapWithFileName(master_molID_class_list)
 MolID_occur_dict_of_lists = molidutils.CreateMasterUniqueMolIDOccursLIST(master_molID_class_list)
@@ -169,8 +182,8 @@ if (concat_menu == "START"):
                  Before you do anything, we suggest to choose option 2, so you know which concatenations have not
                  been accepted. It will also give you the proper format of the input for option 3.
 
-                 If you are sure that all the concatenations are correct. Option 5 will accept all of them. They 
-                 will be printed to screen as they are being accepted. 
+                 If you are sure that all the concatenations are correct. Option 5 will accept all of them. They
+                 will be listed in AcceptedConcatenations.txt, in the target directory.
 
                  Select one of the following options to proceed:
                  1) Show all conversions
@@ -198,13 +211,14 @@ if (concat_menu == "START"):
             master_molID_class_list = molidutils.list_accept_concatenations(master_molID_class_list, unassigned_MolID, new_order=new_order, action='accept')[0]
             # Note for tomorrow: here we need to create a new function in molidutils, so we can go over all concatenations!
         elif (concat_menu == "5"):
-            allnewchains=molidutils.return_unassigned_conversion(master_molID_class_list, step='concatenation')
-            for newchain in allnewchains:
-                new_order=None
-                master_molID_class_list = molidutils.list_accept_concatenations_auto(master_molID_class_list, newchain, new_order=new_order, action='accept')[0]
+            summary_file = target_dir+'/AcceptedConcatenations.txt'
+            master_molID_class_list, accepted = molidutils.accept_all_concatenations(master_molID_class_list, summary_file=summary_file)
+            print("Accepted %s concatenations, listed in %s" % (len(accepted), summary_file))
             count_problems = molidutils.problem_counter(master_molID_class_list)
             print(count_problems)
         elif (concat_menu == "6"):
             print("Finalizing Curation ...")
             molidutils.masterlist_to_pdb(filelist, master_molID_class_list, target_dir=target_dir)
             concat_menu = "QUIT"
+
+session.close()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+from __future__ import print_function
+import argparse
+from PDBClean import packutils
+
+########################
+# READ INPUT ARGUMENTS #
+########################
+parser = argparse.ArgumentParser(description='Pack the directory of a bank into a single file at the same path, '
+                                             'which every step reads in place of the directory (see '
+                                             'PDBClean.packutils). Packed banks are read-only.')
+subparsers = parser.add_subparsers(dest='command')
+subparsers.required = True
+pack_parser = subparsers.add_parser('pack', help='replace the directories of banks by packed banks')
+pack_parser.add_argument('banks', nargs='+', help='directories of the banks, such as my_project/simple_bank')
+unpack_parser = subparsers.add_parser('unpack', help='replace packed banks by directories with their files')
+unpack_parser.add_argument('banks', nargs='+', help='packed banks')
+add_parser = subparsers.add_parser('add', help='append files to a packed bank (creating it if needed)')
+add_parser.add_argument('bank', help='packed bank')
+add_parser.add_argument('files', nargs='+', help='files to add, replacing the files of the same name')
+list_parser = subparsers.add_parser('list', help='list the files of a packed bank')
+list_parser.add_argument('bank', help='packed bank')
+compact_parser = subparsers.add_parser('compact', help='remove the content of replaced files from packed banks')
+compact_parser.add_argument('banks', nargs='+', help='packed banks')
+args = parser.parse_args()
+
+###################
+# RUN THE COMMAND #
+###################
+if args.command == 'pack':
+    for bank in args.banks:
+        packutils.pack_bank(bank)
+elif args.command == 'unpack':
+    for bank in args.banks:
+        packutils.unpack_bank(bank)
+elif args.command == 'add':
+    packutils.add_files(args.bank, args.files)
+elif args.command == 'list':
+    with packutils.PackFile(args.bank) as pack:
+        for name in pack.names():
+            print('{0:>12} {1}'.format(pack.stat(name).st_size, name))
+elif args.command == 'compact':
+    for bank in args.banks:
+        packutils.compact_pack(bank)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+from __future__ import print_function
+import os
+import sys
+import argparse
+from PDBClean import pipelineutils, storeutils
+
+########################
+# READ INPUT ARGUMENTS #
+########################
+parser = argparse.ArgumentParser(description='Run the PDBClean curation from download to residue standardization, '
+                                             'without the interactive menus.')
+parser.add_argument('projdir', help='project directory')
+parser.add_argument('--pdbids', help='file with the PDB IDs to download, one per line. '
+                                     'If not given, the CIF(s) already in <projdir>/raw_bank are used')
+parser.add_argument('--stop-after', default='residueid', choices=pipelineutils.STAGES,
+                    help='last stage to run (default: residueid)')
+parser.add_argument('--conversion-file', help='MolID conversion file (chain IDs of each entity)')
+parser.add_argument('--accept-concatenations', action='store_true',
+                    help='accept ALL concatenations proposed by the MolID step')
+parser.add_argument('--standard-sequences', help='JSON file with the standard sequences of the ChainID step. '
+                                                 'If not given, the consensus of all structures is used')
+parser.add_argument('--ignore-chains', help='file with the chain IDs to leave out of the ChainID and '
+                                            'ResidueID steps, one per line')
+parser.add_argument('--queue-size', type=int, default=4,
+                    help='maximum number of structures waiting between two per-structure stages (default: 4)')
+parser.add_argument('--max-workers', type=int, help='number of alignments and files processed at the same time')
+parser.add_argument('--compress', choices=['gzip', 'zstd', 'none', 'bcif'],
+                    help='compression of the CIF(s) written, or bcif to write them as BinaryCIF (zstd needs the '
+                         'zstandard package, and bcif the msgpack package). '
+                         'If not given, the CIF(s) keep the compression of the files in raw_bank')
+parser.add_argument('--store', default=os.environ.get(storeutils.STORE_ENVIRONMENT),
+                    help='directory of a store shared by several projects: the PDB entries and the clean and '
+                         'simplify outputs already in it are linked into the project instead of being downloaded '
+                         'or computed again (default: the ${0} environment variable)'.format(
+                             storeutils.STORE_ENVIRONMENT))
+args = parser.parse_args()
+
+pdbids = None
+if args.pdbids is not None:
+    with open(args.pdbids) as f:
+        pdbids = [line.strip() for line in f if line.strip()]
+ignore_chid = None
+if args.ignore_chains is not None:
+    with open(args.ignore_chains) as f:
+        ignore_chid = [line.strip() for line in f if line.strip()]
+
+################
+# RUN PIPELINE #
+################
+failed = pipelineutils.run_pipeline(args.projdir, pdbids=pdbids, stop_after=args.stop_after,
+                                    conversion_file=args.conversion_file,
+                                    accept_concatenations=args.accept_concatenations,
+                                    standard_sequences_file=args.standard_sequences,
+                                    ignore_chid=ignore_chid, queue_size=args.queue_size,
+                                    max_workers=args.max_workers, compression=args.compress, store=args.store)
+if failed:
+    sys.exit(1)
@@ -3,7 +3,8 @@
 
 from __future__ import print_function
 from __future__ import division
-import sys, glob
+import sys
+from PDBClean import pdbclean_io
 from PDBClean import pdbcleanresiduestandardizationutils as resstd
 
 ########################
@@ -20,7 +21,7 @@ target_dir=sys.argv[2]
 #############################################
 # READ PDB FILES AND DEFINE STRUCTURE LISTS #
 #############################################
-filelist=glob.glob(source_dir+'/*.cif')
+filelist=pdbclean_io.list_cif_files(source_dir)
 Structure_Sequences, ChID_ResiNum_Vector, structid_list, chid_list = resstd.pdb_to_structurelists(filelist)
 
 
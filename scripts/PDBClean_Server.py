@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+from __future__ import print_function
+import argparse
+from PDBClean import serverutils
+
+########################
+# READ INPUT ARGUMENTS #
+########################
+parser = argparse.ArgumentParser(description='Run a local curation server, which keeps the MolID and ChainID '
+                                             'steps in memory and edits them through a JSON API '
+                                             '(see PDBClean.serverutils.CurationClient).')
+parser.add_argument('--socket', default=serverutils.DEFAULT_SOCKET,
+                    help='path of the Unix socket to listen on (default: {0})'.format(serverutils.DEFAULT_SOCKET))
+parser.add_argument('--tcp', action='store_true',
+                    help='listen on --host and --port instead of a Unix socket')
+parser.add_argument('--host', default=serverutils.DEFAULT_HOST,
+                    help='address to listen on with --tcp (default: {0})'.format(serverutils.DEFAULT_HOST))
+parser.add_argument('--port', type=int, default=serverutils.DEFAULT_PORT,
+                    help='port to listen on with --tcp (default: {0})'.format(serverutils.DEFAULT_PORT))
+parser.add_argument('--token-file', help='file where the token that clients must send is written (default: '
+                                         '<socket>.token, or ~/.pdbclean/curation-<port>.token with --tcp)')
+parser.add_argument('--molid', nargs=2, metavar=('SOURCE_DIR', 'TARGET_DIR'),
+                    help='open the MolID step on these directories before serving')
+parser.add_argument('--chainid', nargs=2, metavar=('SOURCE_DIR', 'TARGET_DIR'),
+                    help='open the ChainID step on these directories before serving')
+args = parser.parse_args()
+
+##############
+# RUN SERVER #
+##############
+state = serverutils.CurationState()
+if args.molid is not None:
+    state.open_molid(*args.molid)
+if args.chainid is not None:
+    state.open_chainid(*args.chainid)
+serverutils.serve(state, socket_path=None if args.tcp else args.socket, host=args.host, port=args.port,
+                  token_file=args.token_file)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# coding: utf-8
+#
+from __future__ import print_function
+import os
+import argparse
+from PDBClean import pdbclean_io, storeutils
+
+########################
+# READ INPUT ARGUMENTS #
+########################
+parser = argparse.ArgumentParser(description='Manage a store of PDB entries and derived CIF(s) shared by several '
+                                             'projects (see PDBClean.storeutils).')
+parser.add_argument('--store', default=os.environ.get(storeutils.STORE_ENVIRONMENT),
+                    help='store directory (default: the ${0} environment variable)'.format(
+                        storeutils.STORE_ENVIRONMENT))
+subparsers = parser.add_subparsers(dest='command')
+subparsers.required = True
+subparsers.add_parser('status', help='print the number and size of the objects of the store')
+fetch_parser = subparsers.add_parser('fetch', help='add PDB entries to the store, downloading them if needed')
+fetch_parser.add_argument('pdbids', nargs='+', help='PDB IDs')
+fetch_parser.add_argument('--format', default='.cif', choices=['.cif', '.cif.gz'],
+                          help='format of the files (default: .cif)')
+fetch_parser.add_argument('--refresh', action='store_true',
+                          help='download the entries again, and keep them as new revisions if they changed')
+import_parser = subparsers.add_parser('import', help='add the CIF(s) of the raw_bank of projects to the store, '
+                                                     'and link them back in their place')
+import_parser.add_argument('projdirs', nargs='+', help='project directories')
+gc_parser = subparsers.add_parser('gc', help='remove the objects that no project file references anymore')
+gc_parser.add_argument('--dry-run', action='store_true', help='only count the objects that would be removed')
+args = parser.parse_args()
+
+if args.store is None:
+    parser.error('give the store directory with --store, or the ${0} environment variable'.format(
+        storeutils.STORE_ENVIRONMENT))
+
+###################
+# RUN THE COMMAND #
+###################
+with storeutils.Store(args.store) as store:
+    if args.command == 'status':
+        status = store.status()
+        print('{0} objects ({1:.1f} MB)'.format(status['objects'], status['bytes']/1e6))
+        print('{0} PDB entries, {1} revisions'.format(status['entries'], status['revisions']))
+        print('{0} derived outputs'.format(status['derived']))
+        print('{0} project files linked'.format(status['references']))
+    elif args.command == 'fetch':
+        for pdbid in args.pdbids:
+            print('{0} {1}'.format(pdbid, store.fetch(pdbid, args.format, refresh=args.refresh)))
+    elif args.command == 'import':
+        for projdir in args.projdirs:
+            for path in pdbclean_io.list_cif_files(projdir+'/raw_bank'):
+                pdbformat = pdbclean_io.cif_extension(path)
+                store.add_revision(pdbclean_io.cif_basename(path), pdbformat, path)
+                print('imported {0}'.format(path))
+    elif args.command == 'gc':
+        store.collect_garbage(dry_run=args.dry_run)
@@ -1,9 +1,18 @@
 from __future__ import print_function
 from __future__ import division
 import os
-import time
+import subprocess
+import tempfile
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from Bio import SeqIO
+from Bio.Align import PairwiseAligner
 import numpy as np
+from PDBClean import instrumentutils
+from PDBClean import progressutils
+from PDBClean.pdbclean_io import file_sha256
+from PDBClean.progressutils import message, NORMAL
 
 # AA Map from 3 letter amino acid id to 1 letter id
 # it also includes nucleic acids, including post-tranlational modifications,
@@ -85,6 +94,10 @@ def AlignSequences(sequence_vec):
     Takes a list of sequence strings and performs a MUSCLE alignment,
     outputting a vector of aligned sequence strings.
 
+    The input and output of MUSCLE are written to a temporary directory of each call,
+    so alignments running at the same time (threads, shards or queue workers started
+    from the same directory) never read each other's files.
+
     Parameters:
     -----------
     sequence_vec : list of str
@@ -96,41 +109,34 @@ def AlignSequences(sequence_vec):
         A list containing the aligned sequences
     """
 
-    with open("Seq.fa", 'w') as newfafile:
-        for seq in sequence_vec:
-            newfafile.write("> Seq" + "\n")
-            newfafile.write(seq + "\n")
-
-    process=os.popen('muscle -align Seq.fa -output Seq.afa')
-
-    process
-
-    time.sleep(1) #FAPA
-
-    #FAPA START
-    while not os.path.exists("Seq.afa"):
-        time.sleep(1) #FAPA, WAITING LESS TIME
-        print("waiting...")
-
-    while not os.path.getsize("Seq.afa") >= os.path.getsize("Seq.fa"):
-        time.sleep(1) #FAPA, WAITING LESS TIME
-        print("waiting even more...")
-
-    #FAPA ENDS
+    with tempfile.TemporaryDirectory(prefix='pdbclean-align-') as tmpdir:
+        fa_file = os.path.join(tmpdir, "Seq.fa")
+        afa_file = os.path.join(tmpdir, "Seq.afa")
+        with open(fa_file, 'w') as newfafile:
+            for seq in sequence_vec:
+                newfafile.write("> Seq" + "\n")
+                newfafile.write(seq + "\n")
 
-    aligned_seq = []
-    with open("Seq.afa") as seqfile:
-        seq = ""
-        for line in seqfile:
-            if (line[0] == ">"):
-                if (seq != ""):
-                    aligned_seq.append(seq)
-                    seq = ""
-            else:
-                seq += line.strip()
-        aligned_seq.append(seq)
+        # Wait for MUSCLE to exit instead of polling the size of its output
+        try:
+            subprocess.run(["muscle", "-align", fa_file, "-output", afa_file], stdout=subprocess.DEVNULL,
+                           stderr=subprocess.PIPE, check=True)
+        except subprocess.CalledProcessError as error:
+            raise RuntimeError("MUSCLE failed to align " + str(len(sequence_vec)) + " sequences: "
+                               + error.stderr.decode(errors='replace').strip())
+
+        aligned_seq = []
+        with open(afa_file) as seqfile:
+            seq = ""
+            for line in seqfile:
+                if (line[0] == ">"):
+                    if (seq != ""):
+                        aligned_seq.append(seq)
+                        seq = ""
+                else:
+                    seq += line.strip()
+            aligned_seq.append(seq)
 
-    process.close()
     return (aligned_seq)
 # END AlignSequences
 
@@ -170,12 +176,12 @@ def AlignSequences_v2(sequence_vec, file_name, this_chainsseq_list_ids):
 
     #FAPA START
     while not os.path.exists(file_name+".fasta"):
-        time.sleep(10)
-        print("waiting...")
+        instrumentutils.sleep(10)
+        message("waiting...")
 
     while not os.path.getsize(file_name+".fasta") > 0:
-        time.sleep(10)
-        print("waiting even more...")
+        instrumentutils.sleep(10)
+        message("waiting even more...")
 
     aligned_seq_map = {}
     aligned_seq = []
@@ -213,7 +219,7 @@ def AlignSequences_v3(sequence_vec, file_name, this_chainsseq_list_ids):
     Takes a list of sequence strings and performs a MUSCLE alignment,
     outputting a vector of aligned sequence strings. This version checks
     if an alignment has already been provided, before running muscle, and
-    in that case, just reads the existing alignment.
+    in that case, just reads the existing alignment (see load_or_run_alignment).
 
     Parameters:
     -----------
@@ -231,67 +237,27 @@ def AlignSequences_v3(sequence_vec, file_name, this_chainsseq_list_ids):
         A dictionary where the keys are sequence identifiers from `this_chainsseq_list_ids` and
         the values are the corresponding aligned sequence strings.
     """
-    if os.path.exists(file_name+".fasta") == False:
-
-        with open(file_name+".fa", 'w') as newfafile:
-            i = 0
-            for seq in sequence_vec:
-                newfafile.write("> Seq " + str(this_chainsseq_list_ids[i]) + "\n")
-                newfafile.write(seq + "\n")
-                i += 1
-
-        command = "muscle -align "+file_name+".fa -output "+file_name+".fasta"
-        process = os.popen(command)
-        process
-
-        while not os.path.exists(file_name+".fasta"):
-            time.sleep(10)
-            print("waiting...")
-
-        while not os.path.getsize(file_name+".fasta") > 0:
-            time.sleep(10)
-            print("waiting even more...")
-        process.close()
-
-    else:
-        print("Alignment already exists, so I will use that one!")
-
-    aligned_seq_map = {}
-    aligned_seq = []
-    seq = ""
-    with open(file_name + ".fasta") as seqfile:
-        for line in seqfile:
-            if (line[0] == ">"):
-                # Very first line
-                if (seq == ""):
-                    line = line.strip()
-                    line = line.split()
-                    key = line[2]
-                else:
-                    aligned_seq_map[key] = seq
-                    seq = ""
-                    line = line.strip()
-                    line = line.split()
-                    key = line[2]
-            else:
-                seq += line.strip()
-        aligned_seq_map[key] = seq
-
-    for item in (aligned_seq_map.keys()):
-        aligned_seq.append(aligned_seq_map[item])
-
+    aligned_seq_map = load_or_run_alignment(sequence_vec, file_name, this_chainsseq_list_ids)
 
     return (aligned_seq_map)
 
 
 # FAPA JULY TEST STARTS HERE
 
-def AlignSequences_v4(sequence_vec, file_name, this_chainsseq_list_ids):
+def AlignSequences_v4(sequence_vec, file_name, this_chainsseq_list_ids, threads=None, incremental=True):
     """
     Takes a list of sequence strings and performs a MUSCLE alignment, outputting
     a vector of aligned sequence strings. This version checks if an alignment has
     already been provided, before running muscle, and in that case just reads the
-    existing alignment.
+    existing alignment, as long as it still matches the input sequences
+    (see load_or_run_alignment).
+
+    Identical sequences are aligned only once: MUSCLE aligns the unique sequences
+    (see unique_sequence_groups), and every structure gets the aligned sequence of
+    its unique sequence. Gap percentages still count every structure. The alignment
+    of the unique sequences is kept in <file_name>.unique.fasta, and <file_name>.fasta
+    has one sequence per structure, so it can be inspected or edited (for example in
+    Jalview). An edited <file_name>.fasta is used as it is (see is_user_alignment).
 
     Parameters:
     -----------
@@ -302,6 +268,11 @@ def AlignSequences_v4(sequence_vec, file_name, this_chainsseq_list_ids):
     this_chainsseq_list_ids : list of str
         List of identifiers for each sequence which are also used as headers in the
         FASTA file.
+    threads : int, optional
+        Number of threads given to MUSCLE. If None, MUSCLE uses its own default.
+    incremental : bool, optional
+        If True, new sequences are added to an existing alignment instead of running
+        MUSCLE again. Default is True.
 
     Returns:
     --------
@@ -312,36 +283,292 @@ def AlignSequences_v4(sequence_vec, file_name, this_chainsseq_list_ids):
         An array where each element represents the percentage of gaps at that position
         across all sequences.
     """
-    if os.path.exists(file_name+".fasta") == False:
+    message(file_name)
+
+    if is_user_alignment(file_name):
+        # Alignment provided (or edited) by the user, with one sequence per structure
+        with instrumentutils.timer('align', file_name):
+            aligned_seq_map = load_or_run_alignment(sequence_vec, file_name, this_chainsseq_list_ids,
+                                                    threads=threads, incremental=incremental, user_supplied=True)
+            instrumentutils.count('alignments')
+            instrumentutils.count('sequences', len(sequence_vec))
+        sequences = read_fasta_files( file_name + ".fasta")
+        gap_percentages = calculate_gap_percentages(sequences)
+    else:
+        unique_sequences, unique_ids, members = unique_sequence_groups(sequence_vec, this_chainsseq_list_ids)
+        message(str(len(sequence_vec)) + " sequences, " + str(len(unique_sequences)) + " unique")
+        with instrumentutils.timer('align', file_name):
+            unique_aligned_seq_map = load_or_run_alignment(unique_sequences, file_name + ".unique", unique_ids,
+                                                           threads=threads, incremental=incremental)
+            instrumentutils.count('alignments')
+            instrumentutils.count('sequences', len(unique_sequences))
+        with open(file_name + ".members.json", 'w') as membersfile:
+            json.dump(members, membersfile, indent=1)
+        unique_id_of = {}
+        for unique_id in unique_ids:
+            for seqid in members[unique_id]:
+                unique_id_of[seqid] = unique_id
+        aligned_seq_map = {}
+        for seqid in this_chainsseq_list_ids:
+            aligned_seq_map[str(seqid)] = unique_aligned_seq_map[unique_id_of[str(seqid)]]
+        write_expanded_alignment(file_name, aligned_seq_map)
+        gap_percentages = calculate_gap_percentages([unique_aligned_seq_map[unique_id] for unique_id in unique_ids],
+                                                    weights=[len(members[unique_id]) for unique_id in unique_ids])
 
-        with open(file_name+".fa", 'w') as newfafile:
-            i = 0
-            for seq in sequence_vec:
-                newfafile.write("> Seq " + str(this_chainsseq_list_ids[i]) + "\n")
-                newfafile.write(seq + "\n")
-                i += 1
+    #print(aligned_seq_map)
+    message("Gap percentages per position:")
+    message(gap_percentages)
 
-        command = "muscle -align "+file_name+".fa -output "+file_name+".fasta"
-        process = os.popen(command)
-        process
+    return (aligned_seq_map,gap_percentages)
 
-        #FAPA START
-        while not os.path.exists(file_name+".fasta"):
-            time.sleep(10)
-            print("waiting...")
+def is_user_alignment(file_name):
+    """
+    Returns True if <file_name>.fasta was provided or edited by the user, and False if
+    there is no such file or it is the alignment last written by AlignSequences_v4
+    (see write_expanded_alignment).
 
-        while not os.path.getsize(file_name+".fasta") > 0:
-            time.sleep(10)
-            print("waiting even more...")
+    Parameters:
+    -----------
+    file_name : str
+        Name given to FASTA file
 
-        #FAPA ENDS
-        process.close()
+    Returns:
+    --------
+    user_alignment : bool
+    """
+    if not os.path.exists(file_name + ".fasta"):
+        return False
+    manifest = read_alignment_manifest(file_name + ".unique")
+    if manifest is not None and manifest.get("expanded_sha256") == file_sha256(file_name + ".fasta"):
+        return False
+    # Alignments of the unique sequences used to be written to <file_name>.fasta itself
+    return not all(seqid.startswith("seq_") for seqid in read_alignment(file_name))
+
+def write_expanded_alignment(file_name, aligned_seq_map):
+    """
+    Writes the alignment with one sequence per structure to <file_name>.fasta, and records
+    its hash in the manifest of the alignment of the unique sequences, so a later edit of
+    the file by the user can be told apart (see is_user_alignment).
 
-    else:
-        print("Alignment already exists, so I will use that one!")
+    Parameters:
+    -----------
+    file_name : str
+        Name given to FASTA file
+    aligned_seq_map : dict
+        A dictionary where the keys are the sequence identifiers and the values are the
+        corresponding aligned sequence strings.
+
+    Returns:
+    --------
+    None
+    """
+    write_alignment(file_name, aligned_seq_map)
+    manifest = read_alignment_manifest(file_name + ".unique")
+    manifest["expanded_sha256"] = file_sha256(file_name + ".fasta")
+    write_alignment_manifest(file_name + ".unique", manifest)
+    # Manifest of <file_name>.fasta from before the unique sequences had their own alignment
+    if os.path.exists(file_name + ".manifest.json"):
+        os.remove(file_name + ".manifest.json")
+
+def unique_sequence_groups(sequence_vec, this_chainsseq_list_ids):
+    """
+    Groups identical sequences. Each unique sequence is identified by a hash of the sequence,
+    so its identifier does not depend on which structures have it, and a saved alignment of
+    the unique sequences stays valid when structures are added.
+
+    Parameters:
+    -----------
+    sequence_vec : list of str
+        list of sequences
+    this_chainsseq_list_ids : list of str
+        List of identifiers for each sequence
+
+    Returns:
+    --------
+    unique_sequences : list of str
+        The unique sequences, in order of first appearance.
+    unique_ids : list of str
+        Identifier of each unique sequence.
+    members : dict
+        Maps the identifier of each unique sequence to the identifiers of the sequences equal to it.
+    """
+    unique_sequences = []
+    unique_ids = []
+    members = {}
+    for seq, seqid in zip(sequence_vec, this_chainsseq_list_ids):
+        unique_id = "seq_" + hashlib.sha256(seq.encode()).hexdigest()[:16]
+        if unique_id not in members:
+            members[unique_id] = []
+            unique_sequences.append(seq)
+            unique_ids.append(unique_id)
+        members[unique_id].append(str(seqid))
+    return unique_sequences, unique_ids, members
+
+def AlignSequences_v4_parallel(alignment_jobs, max_workers=None, incremental=True):
+    """
+    Runs AlignSequences_v4 on several independent sets of sequences at once. Each
+    alignment is dispatched to a worker pool and results are gathered as they complete,
+    so the total run time is close to the time of the slowest alignment.
+
+    Parameters:
+    -----------
+    alignment_jobs : dict
+        A dictionary where each key is the name given to the FASTA file (the chain ID) and
+        the value is a tuple (sequence_vec, this_chainsseq_list_ids) as taken by AlignSequences_v4.
+    max_workers : int, optional
+        Number of alignments running at the same time. If None, one per CPU core
+        (and never more than the number of alignments).
+    incremental : bool, optional
+        If True, new sequences are added to existing alignments instead of running
+        MUSCLE again. Default is True.
 
+    Returns:
+    --------
+    alignment_results : dict
+        A dictionary where each key is a key of `alignment_jobs` and the value is the tuple
+        (aligned_seq_map, gap_percentages) returned by AlignSequences_v4.
+    """
+    alignment_results = {}
+    if len(alignment_jobs) == 0:
+        return alignment_results
+    n_cpu = os.cpu_count() or 1
+    if max_workers is None:
+        max_workers = n_cpu
+    max_workers = max(1, min(max_workers, len(alignment_jobs)))
+    # Share the cores between the MUSCLE runs that are going at the same time
+    threads = max(1, n_cpu // max_workers)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for file_name in alignment_jobs:
+            sequence_vec, this_chainsseq_list_ids = alignment_jobs[file_name]
+            future = executor.submit(AlignSequences_v4, sequence_vec, file_name, this_chainsseq_list_ids,
+                                     threads, incremental)
+            futures[future] = file_name
+        for future in progressutils.progress(as_completed(futures), total=len(futures), desc='Aligning chains',
+                                             unit='alignments'):
+            file_name = futures[future]
+            alignment_results[file_name] = future.result()
+            message("Finished alignment " + file_name + "  (" + str(len(alignment_results)) + " of " + str(len(futures)) + ")")
+    return alignment_results
+
+# The functions below manage the alignments saved to disk (<file_name>.fasta).
+# Each alignment is stored next to a manifest (<file_name>.manifest.json) that
+# records a hash of every member sequence, so an existing alignment is only reused
+# when it matches the input sequences, and new sequences can be added to it.
+# Alignments provided by the user get no manifest, and are never replaced.
+def load_or_run_alignment(sequence_vec, file_name, this_chainsseq_list_ids, threads=None, incremental=True,
+                          user_supplied=False):
+    """
+    Returns the alignment of the input sequences, reusing the alignment saved in
+    <file_name>.fasta when possible.
+
+    - If the saved alignment has exactly the input sequences, it is read from disk.
+    - If the input only adds sequences to the saved alignment and `incremental` is True,
+      the new sequences are aligned onto the saved alignment (see profile_align_sequences),
+      so that the columns of the existing alignment stay the same.
+    - Otherwise (no saved alignment, or sequences changed or removed), MUSCLE is run
+      on all the sequences.
+
+    An alignment provided by the user (`user_supplied`) is always used: new sequences are
+    added to it, sequences that differ from it are reported, and MUSCLE is never run on it.
+
+    Parameters:
+    -----------
+    sequence_vec : list of str
+        list of sequences to be aligned
+    file_name : str
+        Name given to FASTA file
+    this_chainsseq_list_ids : list of str
+        List of identifiers for each sequence which are also used as headers in the
+        FASTA file.
+    threads : int, optional
+        Number of threads given to MUSCLE. If None, MUSCLE uses its own default.
+    incremental : bool, optional
+        If True, new sequences are added to an existing alignment. Default is True.
+    user_supplied : bool, optional
+        If True, <file_name>.fasta was provided by the user. Default is False.
+
+    Returns:
+    --------
+    aligned_seq_map : dict
+        A dictionary where the keys are the sequence identifiers from `this_chainsseq_list_ids`
+        and the values are the corresponding aligned sequence strings.
+    """
+    requested_manifest = alignment_manifest(sequence_vec, this_chainsseq_list_ids)
+
+    if os.path.exists(file_name+".fasta"):
+        aligned_seq_map = read_alignment(file_name)
+        cached_manifest = None if user_supplied else read_alignment_manifest(file_name)
+        if cached_manifest is None:
+            # Alignment provided by the user, or written before manifests existed
+            cached_manifest = manifest_from_alignment(aligned_seq_map)
+
+        if cached_manifest["digest"] == requested_manifest["digest"]:
+            message("Alignment already exists, so I will use that one!", level=NORMAL)
+            if not user_supplied:
+                write_alignment_manifest(file_name, cached_manifest)
+            return aligned_seq_map
+
+        requested_members = requested_manifest["members"]
+        cached_members = cached_manifest["members"]
+        stale = [seqid for seqid in cached_members
+                 if seqid in requested_members and requested_members[seqid] != cached_members[seqid]]
+        removed = [seqid for seqid in cached_members if seqid not in requested_members]
+        if user_supplied and stale:
+            message("The sequences of " + ", ".join(stale) + " differ from the alignment provided in " + file_name
+                    + ".fasta, which is used as it is", level=NORMAL)
+        if user_supplied or (incremental and not stale and not removed):
+            new_seq_map = {}
+            for seq, seqid in zip(sequence_vec, this_chainsseq_list_ids):
+                if str(seqid) not in cached_members:
+                    new_seq_map[str(seqid)] = seq
+            message("Alignment already exists, adding " + str(len(new_seq_map)) + " new sequences to it", level=NORMAL)
+            if new_seq_map:
+                aligned_seq_map = profile_align_sequences(aligned_seq_map, new_seq_map)
+                write_alignment(file_name, aligned_seq_map)
+            if not user_supplied:
+                write_alignment_manifest(file_name, requested_manifest)
+            return aligned_seq_map
+
+        message("Alignment already exists but does not match the input sequences, so I will run MUSCLE again", level=NORMAL)
+
+    with open(file_name+".fa", 'w') as newfafile:
+        i = 0
+        for seq in sequence_vec:
+            newfafile.write("> Seq " + str(this_chainsseq_list_ids[i]) + "\n")
+            newfafile.write(seq + "\n")
+            i += 1
+
+    command = ["muscle", "-align", file_name+".fa", "-output", file_name+".fasta"]
+    if threads is not None:
+        command += ["-threads", str(threads)]
+    # Wait for MUSCLE to exit instead of polling for the output file, so
+    # several alignments can run side by side without sleeping
+    process = subprocess.run(command, stdout=subprocess.DEVNULL)
+    if (process.returncode != 0) or not os.path.exists(file_name+".fasta"):
+        raise RuntimeError("MUSCLE failed to align " + file_name + ".fa")
+
+    aligned_seq_map = read_alignment(file_name)
+    write_alignment_manifest(file_name, requested_manifest)
+    return aligned_seq_map
+
+def read_alignment(file_name):
+    """
+    Reads an alignment in FASTA format, where headers have the format '> Seq <identifier>'.
+
+    Parameters:
+    -----------
+    file_name : str
+        Name given to FASTA file, the alignment is read from <file_name>.fasta
+
+    Returns:
+    --------
+    aligned_seq_map : dict
+        A dictionary where the keys are the sequence identifiers and the values are the
+        corresponding aligned sequence strings.
+    """
     aligned_seq_map = {}
-    aligned_seq = []
     seq = ""
     with open(file_name + ".fasta") as seqfile:
         for line in seqfile:
@@ -360,20 +587,208 @@ def AlignSequences_v4(sequence_vec, file_name, this_chainsseq_list_ids):
             else:
                 seq += line.strip()
         aligned_seq_map[key] = seq
+    return aligned_seq_map
 
-    for item in (aligned_seq_map.keys()):
-        aligned_seq.append(aligned_seq_map[item])
+def write_alignment(file_name, aligned_seq_map):
+    """
+    Writes an alignment in FASTA format to <file_name>.fasta, using the same headers as
+    the input of MUSCLE ('> Seq <identifier>').
 
-    print(file_name)
+    Parameters:
+    -----------
+    file_name : str
+        Name given to FASTA file
+    aligned_seq_map : dict
+        A dictionary where the keys are the sequence identifiers and the values are the
+        corresponding aligned sequence strings.
 
-    sequences = read_fasta_files( file_name + ".fasta")
-    gap_percentages = calculate_gap_percentages(sequences)
+    Returns:
+    --------
+    None
+    """
+    with open(file_name + ".fasta", 'w') as seqfile:
+        for key in aligned_seq_map:
+            seqfile.write("> Seq " + str(key) + "\n")
+            seqfile.write(aligned_seq_map[key] + "\n")
 
-    #print(aligned_seq_map)
-    print("Gap percentages per position:")
-    print(gap_percentages)
+def alignment_manifest(sequence_vec, this_chainsseq_list_ids):
+    """
+    Creates the manifest of a set of sequences: a hash for each member sequence and
+    a digest of the whole set.
 
-    return (aligned_seq_map,gap_percentages)
+    Parameters:
+    -----------
+    sequence_vec : list of str
+        list of (unaligned) sequences
+    this_chainsseq_list_ids : list of str
+        List of identifiers for each sequence
+
+    Returns:
+    --------
+    manifest : dict
+        A dictionary with the manifest 'version', the 'digest' of the set of sequences,
+        and the 'members', which maps each identifier to the hash of its sequence.
+    """
+    members = {}
+    for seq, seqid in zip(sequence_vec, this_chainsseq_list_ids):
+        members[str(seqid)] = hashlib.sha256(seq.encode()).hexdigest()
+    digest = hashlib.sha256()
+    for seqid in sorted(members):
+        digest.update((seqid + ":" + members[seqid] + "\n").encode())
+    manifest = {"version": 1, "digest": digest.hexdigest(), "members": members}
+    return manifest
+
+def manifest_from_alignment(aligned_seq_map):
+    """
+    Creates the manifest of the sequences contained in an alignment (gaps removed).
+
+    Parameters:
+    -----------
+    aligned_seq_map : dict
+        A dictionary where the keys are the sequence identifiers and the values are the
+        corresponding aligned sequence strings.
+
+    Returns:
+    --------
+    manifest : dict
+        The manifest of the sequences in the alignment, see alignment_manifest.
+    """
+    seqids = list(aligned_seq_map.keys())
+    sequence_vec = [aligned_seq_map[seqid].replace("-", "") for seqid in seqids]
+    return alignment_manifest(sequence_vec, seqids)
+
+def read_alignment_manifest(file_name):
+    """
+    Reads the manifest saved next to an alignment.
+
+    Parameters:
+    -----------
+    file_name : str
+        Name given to FASTA file, the manifest is read from <file_name>.manifest.json
+
+    Returns:
+    --------
+    manifest : dict or None
+        The manifest, or None if there is no (valid) manifest.
+    """
+    if not os.path.exists(file_name + ".manifest.json"):
+        return None
+    with open(file_name + ".manifest.json") as manifestfile:
+        try:
+            manifest = json.load(manifestfile)
+        except ValueError:
+            return None
+    if manifest.get("version") != 1:
+        return None
+    return manifest
+
+def write_alignment_manifest(file_name, manifest):
+    """
+    Saves the manifest of an alignment to <file_name>.manifest.json
+
+    Parameters:
+    -----------
+    file_name : str
+        Name given to FASTA file
+    manifest : dict
+        The manifest, see alignment_manifest.
+
+    Returns:
+    --------
+    None
+    """
+    with open(file_name + ".manifest.json", 'w') as manifestfile:
+        json.dump(manifest, manifestfile)
+
+def profile_align_sequences(aligned_seq_map, new_seq_map):
+    """
+    Adds new sequences to an existing alignment without changing the existing columns.
+
+    Each new sequence is aligned (global alignment, free end gaps) to the consensus of the
+    existing alignment. Residues aligned to a consensus position go into that column.
+    Residues that fall between two columns are placed in new columns, inserted at that
+    point of the alignment, where all the existing sequences have gaps. Since these new
+    columns are mostly gaps, the residue numbering derived from the existing columns stays
+    the same.
+
+    Parameters:
+    -----------
+    aligned_seq_map : dict
+        A dictionary where the keys are the sequence identifiers and the values are the
+        corresponding aligned sequence strings.
+    new_seq_map : dict
+        A dictionary where the keys are the identifiers and the values are the (unaligned)
+        sequences to add to the alignment.
+
+    Returns:
+    --------
+    aligned_seq_map : dict
+        The alignment, including the new sequences.
+    """
+    if len(new_seq_map) == 0:
+        return aligned_seq_map
+
+    seqids = list(aligned_seq_map.keys())
+    alignment = np.array([np.frombuffer(aligned_seq_map[seqid].encode(), dtype=np.uint8) for seqid in seqids])
+    n_col = alignment.shape[1]
+
+    # Consensus: most frequent residue in each column, ignoring gaps
+    residues = np.unique(alignment)
+    residues = residues[residues != ord('-')]
+    counts = np.array([(alignment == residue).sum(axis=0) for residue in residues])
+    consensus = residues[np.argmax(counts, axis=0)].tobytes().decode()
+
+    aligner = PairwiseAligner()
+    aligner.mode = 'global'
+    aligner.match_score = 2
+    aligner.mismatch_score = -1
+    aligner.open_gap_score = -5
+    aligner.extend_gap_score = -0.5
+    aligner.end_gap_score = 0
+
+    # For each new sequence, find the column of each residue. Residues between
+    # column j-1 and column j are inserted in slot j (slot 0 is before the first column)
+    new_placement = {}
+    slot_width = np.zeros(n_col + 1, dtype=int)
+    for seqid in new_seq_map:
+        seq = new_seq_map[seqid]
+        column_of_residue = np.full(len(seq), -1, dtype=int)
+        if len(seq) > 0:
+            pairwise = aligner.align(consensus, seq)[0]
+            for (t_start, t_end), (q_start, q_end) in zip(*pairwise.aligned):
+                column_of_residue[q_start:q_end] = np.arange(t_start, t_end)
+        insertions = {}
+        last_column = -1
+        for i in range(len(seq)):
+            if column_of_residue[i] >= 0:
+                last_column = column_of_residue[i]
+            else:
+                insertions.setdefault(last_column + 1, []).append(i)
+        for slot in insertions:
+            slot_width[slot] = max(slot_width[slot], len(insertions[slot]))
+        new_placement[seqid] = (column_of_residue, insertions)
+
+    # Position of every existing column, and of every slot, in the new alignment
+    offset = np.concatenate(([0], np.cumsum(slot_width[:n_col])))
+    new_column = np.arange(n_col) + offset[1:]
+    slot_start = np.arange(n_col + 1) + offset
+    new_n_col = n_col + slot_width.sum()
+
+    new_aligned_seq_map = {}
+    for I in range(len(seqids)):
+        row = np.full(new_n_col, ord('-'), dtype=np.uint8)
+        row[new_column] = alignment[I]
+        new_aligned_seq_map[seqids[I]] = row.tobytes().decode()
+    for seqid in new_seq_map:
+        seq = np.frombuffer(new_seq_map[seqid].encode(), dtype=np.uint8)
+        column_of_residue, insertions = new_placement[seqid]
+        row = np.full(new_n_col, ord('-'), dtype=np.uint8)
+        aligned = column_of_residue >= 0
+        row[new_column[column_of_residue[aligned]]] = seq[aligned]
+        for slot in insertions:
+            row[slot_start[slot]:slot_start[slot] + len(insertions[slot])] = seq[insertions[slot]]
+        new_aligned_seq_map[seqid] = row.tobytes().decode()
+    return new_aligned_seq_map
 
 # The functions below are used to calculate the percentage of gaps per position
 def read_fasta_files(fasta_file):
@@ -395,7 +810,7 @@ def read_fasta_files(fasta_file):
         sequences.append(str(record.seq))
     return sequences
 
-def calculate_gap_percentages(sequences):
+def calculate_gap_percentages(sequences, weights=None):
     """
     Calculates the percentage of gaps at each position in a list of sequences.
 
@@ -403,6 +818,9 @@ def calculate_gap_percentages(sequences):
     -----------
     sequences : list of str
         list of sequences extracted from a FASTA file
+    weights : list of int, optional
+        Number of times each sequence is counted (for example, the number of structures
+        sharing a unique sequence). If None, each sequence is counted once.
 
     Returns:
     --------
@@ -410,20 +828,53 @@ def calculate_gap_percentages(sequences):
         An array where each element represents the percentage of gaps at that position
         across all sequences.
     """
+    if weights is None:
+        weights = [1] * len(sequences)
     sequence_length = len(sequences[0])
     gap_counts = np.zeros(sequence_length)
 
-    for sequence in sequences:
+    for sequence, weight in zip(sequences, weights):
         for i, char in enumerate(sequence):
             if char == '-':
-                gap_counts[i] += 1
+                gap_counts[i] += weight
 
-    total_sequences = len(sequences)
+    total_sequences = sum(weights)
     gap_percentages = (gap_counts / total_sequences) * 100
     return gap_percentages
 
 # FAPA JULY TEST ENDS
 
+def pairwise_alignment_score(seq1, seq2, score_cache=None):
+    """
+    Aligns two sequences with MUSCLE (see AlignSequences) and scores the alignment
+    (see ScoreSequenceAlignment). The score of a pair of sequences is computed only once
+    when a cache is given.
+
+    Parameters:
+    -----------
+    seq1 : str
+        The reference sequence
+    seq2 : str
+        The sequence being compared
+    score_cache : dict, optional
+        Scores already computed, by pair of sequences. Updated with the new score.
+
+    Returns:
+    --------
+    score : float
+        The similarity score between the reference sequence and the sequence being compared.
+    """
+    if score_cache is not None and (seq1, seq2) in score_cache:
+        instrumentutils.count('cached_alignments')
+        return score_cache[(seq1, seq2)]
+    with instrumentutils.timer('align'):
+        aligned_seq = AlignSequences([seq1, seq2])
+        score = ScoreSequenceAlignment(aligned_seq[0], aligned_seq[1])
+        instrumentutils.count('alignments')
+    if score_cache is not None:
+        score_cache[(seq1, seq2)] = score
+    return score
+
 def ScoreSequenceAlignment(seq1, seq2):
     """
     Compares the reference sequence to another sequence and counts for similarity based on
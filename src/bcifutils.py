@@ -0,0 +1,458 @@
+from __future__ import print_function
+import io
+import re
+import numpy as np
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# BinaryCIF (https://github.com/molstar/BinaryCIF): a MessagePack map of data blocks, categories
+# and columns, where each column is an array of numbers or strings stored with a chain of encodings
+# (applied in order when writing, and in reverse order when reading).
+BCIF_VERSION = '0.3.0'
+BCIF_ENCODER = 'PDBClean'
+# Type codes of ByteArray
+INT8, INT16, INT32, UINT8, UINT16, UINT32, FLOAT32, FLOAT64 = 1, 2, 3, 4, 5, 6, 32, 33
+BYTE_ARRAY_TYPES = {INT8: '<i1', INT16: '<i2', INT32: '<i4', UINT8: '<u1', UINT16: '<u2', UINT32: '<u4',
+                    FLOAT32: '<f4', FLOAT64: '<f8'}
+# Values of the mask of a column: present, '.' (not applicable) and '?' (unknown)
+PRESENT, NOT_APPLICABLE, UNKNOWN = 0, 1, 2
+# Categories written as a loop even when they have a single row (the *_to_pdb writers read
+# atom records line by line)
+LOOP_CATEGORIES = ['_atom_site']
+INTEGER = re.compile(r'-?[0-9]+\Z')
+DECIMAL = re.compile(r'-?[0-9]+\.([0-9]+)\Z')
+# Values that have to be quoted in a CIF
+NEEDS_QUOTES = re.compile(r"""^(?:[_#$'"\[\];]|(?:data|save)_|(?:loop|stop|global)_\Z)|\s""", re.I)
+
+def require_msgpack():
+    if msgpack is None:
+        raise ImportError("Reading or writing BinaryCIF (.bcif) files requires the msgpack package (pip install msgpack)")
+
+#############
+# ENCODINGS #
+#############
+
+def byte_array(values, type_code):
+    return values.astype(BYTE_ARRAY_TYPES[type_code]).tobytes(), {'kind': 'ByteArray', 'type': type_code}
+
+def integer_type(values):
+    """
+    Returns the smallest ByteArray type code holding integer values.
+    """
+    if len(values) == 0:
+        return INT32
+    low, high = int(values.min()), int(values.max())
+    if low >= 0:
+        for type_code, limit in ((UINT8, 1 << 8), (UINT16, 1 << 16)):
+            if high < limit:
+                return type_code
+        return UINT32
+    for type_code, limit in ((INT8, 1 << 7), (INT16, 1 << 15)):
+        if -limit <= low and high < limit:
+            return type_code
+    return INT32
+
+def packed_size(values, byte_count, unsigned):
+    """
+    Returns the number of elements of integers packed into 1- or 2-byte integers (see integer_packing).
+    """
+    upper = (1 << (8*byte_count)) - 1 if unsigned else (1 << (8*byte_count - 1)) - 1
+    if unsigned:
+        return int((values // upper).sum()) + len(values)
+    return int(np.where(values >= 0, values // upper, values // (-upper - 1)).sum()) + len(values)
+
+def integer_packing(values, byte_count, unsigned):
+    """
+    Packs integers into 1- or 2-byte integers: values out of range are written as a sum of
+    elements, all but the last of which are the limit of the range.
+    """
+    upper = (1 << (8*byte_count)) - 1 if unsigned else (1 << (8*byte_count - 1)) - 1
+    lower = 0 if unsigned else -upper - 1
+    values = values.astype(np.int64)
+    counts = np.where(values >= 0, values // upper, values // lower if lower else 0) + 1
+    packed = np.repeat(np.where(values >= 0, upper, lower), counts)
+    packed[np.cumsum(counts) - 1] = values - (counts - 1) * np.where(values >= 0, upper, lower)
+    return packed
+
+def encode_integers(values, delta=False, run_length=False):
+    """
+    Encodes an array of integers with Delta, RunLength, IntegerPacking and ByteArray (the first
+    two if asked for), and returns the data and the list of encodings.
+    """
+    encodings = []
+    data = values.astype(np.int64)
+    if delta:
+        origin = int(data[0]) if len(data) else 0
+        data = np.diff(data, prepend=origin)
+        encodings.append({'kind': 'Delta', 'origin': origin, 'srcType': INT32})
+    if run_length:
+        size = len(data)
+        if size:
+            starts = np.concatenate([[0], np.flatnonzero(data[1:] != data[:-1]) + 1])
+            lengths = np.diff(np.append(starts, size))
+            data = np.stack([data[starts], lengths], axis=1).ravel()
+        encodings.append({'kind': 'RunLength', 'srcType': INT32, 'srcSize': size})
+    type_code = integer_type(data)
+    if type_code not in (INT8, UINT8) and len(data):
+        # Packing into 1 or 2 bytes per element, if it makes the column smaller
+        unsigned = bool(data.min() >= 0)
+        size, byte_count = min((packed_size(data, byte_count, unsigned) * byte_count, byte_count)
+                               for byte_count in (1, 2))
+        if size < len(data) * np.dtype(BYTE_ARRAY_TYPES[type_code]).itemsize:
+            encodings.append({'kind': 'IntegerPacking', 'byteCount': byte_count, 'isUnsigned': unsigned,
+                              'srcSize': len(data)})
+            data = integer_packing(data, byte_count, unsigned)
+            type_code = {(1, True): UINT8, (1, False): INT8, (2, True): UINT16, (2, False): INT16}[(byte_count,
+                                                                                                   unsigned)]
+    data, encoding = byte_array(data, type_code)
+    encodings.append(encoding)
+    return data, encodings
+
+def smallest_integer_encoding(values):
+    """
+    Encodes integers with the smallest of: packing alone, run-length, delta, or delta and
+    run-length (such as atom numbers, residue numbers, or chain indices).
+    """
+    best = None
+    for delta in (False, True):
+        for run_length in (False, True):
+            data, encodings = encode_integers(values, delta=delta, run_length=run_length)
+            if best is None or len(data) < len(best[0]):
+                best = (data, encodings)
+    return best
+
+def decode(data, encodings):
+    """
+    Decodes the data of a column (or mask) of a BinaryCIF file.
+
+    Parameters:
+    -----------
+    data : bytes
+        The encoded data.
+    encodings : list of dict
+        The encodings applied to the data, in the order they were applied.
+
+    Returns:
+    --------
+    values : np.ndarray or list of str
+        Numbers, or strings for StringArray.
+    """
+    for encoding in reversed(encodings):
+        kind = encoding['kind']
+        if kind == 'ByteArray':
+            data = np.frombuffer(data, dtype=BYTE_ARRAY_TYPES[encoding['type']])
+        elif kind == 'FixedPoint':
+            data = data.astype(np.float32 if encoding['srcType'] == FLOAT32 else np.float64) / encoding['factor']
+        elif kind == 'IntervalQuantization':
+            data = (encoding['min'] + (encoding['max'] - encoding['min']) / (encoding['numSteps'] - 1)
+                    * data.astype(np.float64))
+        elif kind == 'RunLength':
+            data = np.repeat(data[0::2], data[1::2].astype(np.int64))
+        elif kind == 'Delta':
+            data = data.astype(np.int64)
+            if len(data):
+                data[0] += encoding['origin']
+            data = np.cumsum(data)
+        elif kind == 'IntegerPacking':
+            data = data.astype(np.int64)
+            if encoding['isUnsigned']:
+                limits = (data != (1 << (8*encoding['byteCount'])) - 1)
+            else:
+                upper = (1 << (8*encoding['byteCount'] - 1)) - 1
+                limits = (data != upper) & (data != -upper - 1)
+            ends = np.flatnonzero(limits)
+            sums = np.cumsum(data)[ends]
+            data = np.diff(sums, prepend=0)
+        elif kind == 'StringArray':
+            offsets = decode(encoding['offsets'], encoding['offsetEncoding'])
+            strings = [encoding['stringData'][start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+            indices = decode(data, encoding['dataEncoding'])
+            data = [strings[index] if index >= 0 else '' for index in indices.tolist()]
+        else:
+            raise ValueError('Unknown BinaryCIF encoding: ' + str(kind))
+    return data
+
+###########
+# COLUMNS #
+###########
+
+def format_fixed_point(numbers, digits):
+    """
+    Formats integers as decimals with a number of digits after the point (1234, 3 -> '1.234').
+    """
+    if digits == 0:
+        return [str(number) for number in numbers]
+    # Doubles are precise enough for the 32-bit integers of BinaryCIF to be rounded back exactly
+    decimal = '%.{0}f'.format(digits)
+    return [decimal % number for number in (np.asarray(numbers, dtype=np.int64) / 10 ** digits).tolist()]
+
+def unmask(numbers, mask):
+    """
+    Returns the numbers of the values present in a column as an array of all its rows (0 for '.' and '?').
+    """
+    values = np.zeros(len(mask), dtype=np.int64)
+    values[mask == PRESENT] = numbers
+    return values
+
+def encode_column(name, values):
+    """
+    Encodes the values of a column, as integers, fixed-point decimals or strings (whichever
+    gives back exactly the same values), with a mask for '.' and '?'.
+
+    Parameters:
+    -----------
+    name : str
+        Name of the column, without its category (such as 'Cartn_x').
+    values : list of str
+        The values, as read by MMCIFFile.
+
+    Returns:
+    --------
+    column : dict
+    """
+    mask = np.zeros(len(values), dtype=np.uint8)
+    present = values
+    if '.' in values or '?' in values:
+        present = []
+        for i, value in enumerate(values):
+            if value == '.':
+                mask[i] = NOT_APPLICABLE
+            elif value == '?':
+                mask[i] = UNKNOWN
+            else:
+                present.append(value)
+    filled = values if not mask.any() else [value if code == PRESENT else None for value, code in zip(values, mask)]
+    column = None
+    # Numbers are only encoded as such if they are written back exactly as they were read
+    # (no leading zeros, '+' signs or '-0')
+    if present and all(map(INTEGER.match, present)):
+        numbers = [int(value) for value in present]
+        if [str(number) for number in numbers] == present and -(1 << 31) <= min(numbers) and max(numbers) < (1 << 31):
+            data, encodings = smallest_integer_encoding(unmask(numbers, mask))
+            column = {'data': data, 'encoding': encodings}
+    if column is None and present:
+        match = DECIMAL.match(present[0])
+        digits = len(match.group(1)) if match else 0
+        if 0 < digits <= 6 and all(map(re.compile(r'-?[0-9]+\.[0-9]{%d}\Z' % digits).match, present)):
+            numbers = [int(value.replace('.', '')) for value in present]
+            if -(1 << 31) <= min(numbers) and max(numbers) < (1 << 31) and \
+                    format_fixed_point(numbers, digits) == present:
+                data, encodings = smallest_integer_encoding(unmask(numbers, mask))
+                column = {'data': data,
+                          'encoding': [{'kind': 'FixedPoint', 'factor': 10 ** digits, 'srcType': FLOAT64}] + encodings}
+    if column is None:
+        strings = {}
+        indices = np.array([strings.setdefault(value, len(strings)) if value is not None else -1 for value in filled],
+                           dtype=np.int64)
+        string_data = ''.join(strings)
+        offsets = np.cumsum([0] + [len(string) for string in strings])
+        offset_data, offset_encodings = encode_integers(offsets, delta=True)
+        data, index_encodings = smallest_integer_encoding(indices)
+        column = {'data': data,
+                  'encoding': [{'kind': 'StringArray', 'dataEncoding': index_encodings, 'stringData': string_data,
+                                'offsetEncoding': offset_encodings, 'offsets': offset_data}]}
+    column['name'] = name
+    column['data'] = {'data': column['data'], 'encoding': column.pop('encoding')}
+    if mask.any():
+        mask_data, mask_encodings = encode_integers(mask, run_length=True)
+        column['mask'] = {'data': mask_data, 'encoding': mask_encodings}
+    else:
+        column['mask'] = None
+    return column
+
+def decode_column(column):
+    """
+    Decodes a column of a BinaryCIF file into strings, as MMCIFFile reads them from a CIF.
+
+    Parameters:
+    -----------
+    column : dict
+        The column (name, data and mask).
+
+    Returns:
+    --------
+    values : list of str
+    """
+    encodings = column['data']['encoding']
+    values = decode(column['data']['data'], encodings)
+    if not isinstance(values, list):
+        if encodings[0]['kind'] == 'FixedPoint' and round(np.log10(encodings[0]['factor']), 6).is_integer():
+            digits = int(round(np.log10(encodings[0]['factor'])))
+            values = format_fixed_point(np.rint(values * encodings[0]['factor']).astype(np.int64), digits)
+        elif values.dtype.kind in 'iu':
+            values = [str(value) for value in values.tolist()]
+        else:
+            values = [repr(value) for value in values.tolist()]
+    mask = column.get('mask')
+    if mask:
+        codes = decode(mask['data'], mask['encoding'])
+        for i in np.flatnonzero(codes).tolist():
+            values[i] = '.' if codes[i] == NOT_APPLICABLE else '?'
+    return values
+
+def decode_numbers(column, dtype=float):
+    """
+    Decodes a column of a BinaryCIF file into a NumPy array of numbers, without going through
+    strings. Values '.' and '?' are NaN (or 0 for integers).
+
+    Parameters:
+    -----------
+    column : dict
+        The column (name, data and mask).
+    dtype : type, optional
+        Type of the array. Default is float.
+
+    Returns:
+    --------
+    values : np.ndarray
+    """
+    values = decode(column['data']['data'], column['data']['encoding'])
+    if isinstance(values, list):
+        values = [value if value not in ('', '.', '?') else 'nan' for value in values]
+    values = np.array(values, dtype=np.float64 if np.dtype(dtype).kind == 'f' else None).astype(dtype)
+    mask = column.get('mask')
+    if mask and np.dtype(dtype).kind == 'f':
+        values[decode(mask['data'], mask['encoding']) != PRESENT] = np.nan
+    return values
+
+#########
+# FILES #
+#########
+
+def encode_cif(mmcif_dict):
+    """
+    Encodes a CIF as BinaryCIF.
+
+    Parameters:
+    -----------
+    mmcif_dict : MMCIFFile
+        The CIF (a single data block).
+
+    Returns:
+    --------
+    data : bytes
+        The BinaryCIF file.
+    """
+    require_msgpack()
+    categories = []
+    tags = mmcif_dict.tags()
+    values = dict(zip(tags, mmcif_dict.columns(tags)))
+    for tag in tags:
+        category, _, name = tag.partition('.')
+        if not categories or categories[-1]['name'] != category:
+            categories.append({'name': category, 'columns': [], 'rowCount': len(values[tag])})
+        categories[-1]['columns'].append(encode_column(name, values[tag]))
+    block = {'header': mmcif_dict['data_'], 'categories': categories}
+    return msgpack.packb({'version': BCIF_VERSION, 'encoder': BCIF_ENCODER, 'dataBlocks': [block]},
+                         use_bin_type=True)
+
+def read_bcif(data):
+    """
+    Reads the first data block of a BinaryCIF file.
+
+    Parameters:
+    -----------
+    data : bytes
+        The BinaryCIF file.
+
+    Returns:
+    --------
+    block : dict
+        'header' (name of the data block) and 'categories'.
+    """
+    require_msgpack()
+    content = msgpack.unpackb(data, raw=False)
+    if not content.get('dataBlocks'):
+        raise ValueError("Empty file.")
+    return content['dataBlocks'][0]
+
+def quote(value):
+    """
+    Quotes a value of a CIF if needed.
+    """
+    if value and not NEEDS_QUOTES.search(value):
+        return value
+    if '\n' in value or ("' " in value and '" ' in value) or (value.endswith("'") and '" ' in value):
+        return '\n;' + value + '\n;\n'
+    if "'" in value and ("' " in value or value.endswith("'") or '"' not in value):
+        return '"' + value + '"'
+    return "'" + value + "'"
+
+def bcif_to_text(data):
+    """
+    Writes a BinaryCIF file as a CIF, laid out as the CIF(s) written by simplify_cif (categories
+    separated by '#', one line per row).
+
+    Parameters:
+    -----------
+    data : bytes
+        The BinaryCIF file.
+
+    Returns:
+    --------
+    text : str
+    """
+    block = read_bcif(data)
+    lines = ['data_' + block['header'] + '\n']
+    for category in block['categories']:
+        lines.append('#\n')
+        columns = [[quote(value) for value in decode_column(column)] for column in category['columns']]
+        names = [category['name'] + '.' + column['name'] for column in category['columns']]
+        if category['rowCount'] == 1 and category['name'] not in LOOP_CATEGORIES:
+            width = max(len(name) for name in names) + 3
+            for name, column in zip(names, columns):
+                separator = '' if column[0].startswith('\n;') else ' ' * (width - len(name))
+                lines.append(name + separator + column[0] + ('' if column[0].endswith('\n') else '\n'))
+        else:
+            lines.append('loop_\n')
+            lines.extend(name + '\n' for name in names)
+            for row in zip(*columns):
+                line = ' '.join(row)
+                lines.append(line + ('' if line.endswith('\n') else '\n'))
+    lines.append('#\n')
+    return ''.join(lines).replace('\n\n;', '\n;')
+
+class BinaryCIFWriter(object):
+    """
+    File object that takes the text of a CIF and writes it as BinaryCIF when it is closed
+    (see pdbclean_io.open_file). Text and bytes can both be written.
+    """
+    def __init__(self, path, open_function):
+        require_msgpack()
+        self.name = path
+        self._buffer = io.BytesIO()
+        self._open_function = open_function
+        self.closed = False
+
+    def write(self, text):
+        if isinstance(text, str):
+            text = text.encode()
+        return self._buffer.write(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.closed = True
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        from PDBClean.mmcifutils import MMCIFFile
+        with MMCIFFile(self.name, data=self._buffer.getvalue()) as mmcif_dict:
+            data = encode_cif(mmcif_dict)
+        with self._open_function(self.name, 'wb') as bcif_file:
+            bcif_file.write(data)
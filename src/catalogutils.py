@@ -0,0 +1,318 @@
+from __future__ import print_function
+import os
+import re
+import sqlite3
+import threading
+import datetime
+from PDBClean.pdbclean_io import file_sha256, cif_extension
+from PDBClean import packutils
+from PDBClean.mmcifutils import MMCIFFile, read_first_model_residues
+from PDBClean.alignmentutils import ResnConvert
+
+CATALOG_FILE = 'pdbclean_catalog.db'
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    bank TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    sha256 TEXT,
+    indexed TEXT,
+    UNIQUE (bank, name)
+);
+CREATE TABLE IF NOT EXISTS entities (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    entity_id TEXT,
+    description TEXT,
+    chain_ids TEXT
+);
+CREATE TABLE IF NOT EXISTS chains (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    chain_order INTEGER,
+    chain_id TEXT,
+    sequence TEXT,
+    n_residues INTEGER
+);
+CREATE TABLE IF NOT EXISTS steps (
+    step TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT,
+    finished TEXT,
+    seconds REAL,
+    PRIMARY KEY (step, name)
+);
+CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+CREATE INDEX IF NOT EXISTS entities_file ON entities (file_id);
+CREATE INDEX IF NOT EXISTS entities_description ON entities (description);
+CREATE INDEX IF NOT EXISTS chains_file ON chains (file_id);
+CREATE INDEX IF NOT EXISTS chains_chain_id ON chains (chain_id);
+CREATE INDEX IF NOT EXISTS chains_sequence ON chains (sequence);
+CREATE INDEX IF NOT EXISTS steps_status ON steps (step, status);
+"""
+
+class ProjectCatalog(object):
+    """
+    SQLite database of a project: the CIF(s) of each bank with their checksum, entities, chains
+    and sequences, and the status and timing of each step on each structure.
+
+    The database is kept in the project directory, in WAL mode, so one process can write to it
+    while others read it. Files are only parsed again when their size or modification time changes.
+
+    Attributes:
+    -----------
+    projdir : str
+        The project directory.
+    filename : str
+        Path of the database.
+
+    Methods:
+    --------
+    update_bank(bank):
+        Adds the new and modified CIF(s) of a bank to the catalog, and removes the deleted ones.
+
+    files(bank):
+        Returns the paths of the CIF(s) of a bank.
+
+    structure_sequences(bank):
+        Returns the chain sequences of the CIF(s) of a bank.
+
+    record_step(step, name, status, seconds):
+        Records the status and duration of a step on a structure.
+
+    summary():
+        Returns the number of files, chains and sequences of each bank, and the status of each step.
+
+    close():
+        Closes the database.
+    """
+    def __init__(self, projdir):
+        """
+        Initializes the ProjectCatalog class, creating the database if needed.
+
+        Parameters:
+        -----------
+        projdir : str
+            The project directory.
+        """
+        self.projdir = projdir
+        self.filename = projdir+'/'+CATALOG_FILE
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.filename, timeout=60, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('PRAGMA foreign_keys=ON')
+        with self._db:
+            self._db.executescript(CATALOG_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def update_bank(self, bank, verbose=True):
+        """
+        Adds the new and modified CIF(s) of a bank to the catalog, and removes the deleted ones.
+
+        Parameters:
+        -----------
+        bank : str
+            Subdirectory of the project directory, such as 'simple_bank'.
+        verbose : bool, optional
+            If True, the number of files indexed is printed. Default is True.
+
+        Returns:
+        --------
+        n_indexed : int
+            Number of files parsed (new or modified).
+        """
+        bankdir = self.projdir+'/'+bank
+        on_disk = {}
+        if os.path.isdir(bankdir):
+            for entry in os.scandir(bankdir):
+                if cif_extension(entry.name) is not None and entry.is_file():
+                    stat = entry.stat()
+                    on_disk[entry.name] = (stat.st_size, stat.st_mtime)
+        elif packutils.is_pack(bankdir):
+            pack = packutils.get_pack(bankdir)
+            for name in pack.names():
+                if cif_extension(name) is not None and '/' not in name:
+                    stat = pack.stat(name)
+                    on_disk[name] = (stat.st_size, stat.st_mtime)
+        with self._lock:
+            known = dict((name, (file_id, size, mtime)) for file_id, name, size, mtime in
+                         self._db.execute('SELECT id, name, size, mtime FROM files WHERE bank = ?', (bank,)))
+            with self._db:
+                for name in set(known) - set(on_disk):
+                    self._db.execute('DELETE FROM files WHERE id = ?', (known[name][0],))
+        n_indexed = 0
+        for name in sorted(on_disk):
+            if name in known and known[name][1:] == on_disk[name]:
+                continue
+            self._index_file(bank, name, on_disk[name])
+            n_indexed += 1
+        if verbose and n_indexed:
+            print('Indexed {0} files of {1}'.format(n_indexed, bank))
+        return n_indexed
+
+    def _index_file(self, bank, name, size_mtime):
+        """
+        Parses one CIF and replaces its rows in the catalog.
+        """
+        path = self.projdir+'/'+bank+'/'+name
+        checksum = file_sha256(path)
+        entities = []
+        chains = []
+        try:
+            with MMCIFFile(path) as mmcif_dict:
+                if '_entity.id' in mmcif_dict and '_entity.pdbx_description' in mmcif_dict:
+                    entity_chains = {}
+                    if '_atom_site.label_entity_id' in mmcif_dict:
+                        entity_list, chid_list = mmcif_dict.columns(['_atom_site.label_entity_id',
+                                                                     '_atom_site.auth_asym_id'])
+                        for entity_id, chid in set(zip(entity_list, chid_list)):
+                            entity_chains.setdefault(entity_id, set()).add(chid)
+                    for entity_id, description in zip(*mmcif_dict.columns(['_entity.id', '_entity.pdbx_description'])):
+                        entities.append((entity_id, description, ','.join(sorted(entity_chains.get(entity_id, [])))))
+                has_atoms = '_atom_site.label_comp_id' in mmcif_dict
+            if has_atoms:
+                for chain_order, (chid, residues) in enumerate(read_first_model_residues(path)):
+                    sequence = ''.join(ResnConvert(resname) for residue_id, resname in residues)
+                    chains.append((chain_order, chid, sequence, len(residues)))
+        except (ValueError, KeyError) as error:
+            print('Could not index {0}: {1}'.format(path, error))
+        with self._lock:
+            with self._db:
+                self._db.execute('DELETE FROM files WHERE bank = ? AND name = ?', (bank, name))
+                file_id = self._db.execute('INSERT INTO files (bank, name, size, mtime, sha256, indexed) '
+                                           'VALUES (?, ?, ?, ?, ?, ?)',
+                                           (bank, name, size_mtime[0], size_mtime[1], checksum,
+                                            str(datetime.datetime.now()))).lastrowid
+                self._db.executemany('INSERT INTO entities VALUES (?, ?, ?, ?)',
+                                     [(file_id,) + entity for entity in entities])
+                self._db.executemany('INSERT INTO chains VALUES (?, ?, ?, ?, ?)',
+                                     [(file_id,) + chain for chain in chains])
+
+    def files(self, bank):
+        """
+        Returns the paths of the CIF(s) of a bank, as recorded in the catalog.
+
+        Parameters:
+        -----------
+        bank : str
+            Subdirectory of the project directory, such as 'simple_bank'.
+
+        Returns:
+        --------
+        filelist : list of str
+            Paths of the CIF(s), sorted by name.
+        """
+        with self._lock:
+            rows = self._db.execute('SELECT name FROM files WHERE bank = ? ORDER BY name', (bank,)).fetchall()
+        return [self.projdir+'/'+bank+'/'+name for name, in rows]
+
+    def structure_sequences(self, bank, min_length=5):
+        """
+        Returns the chain sequences of the CIF(s) of a bank, as pdb_to_structurelists of the ChainID
+        step reads them: residues that are not amino acids (X) are removed, and short chains are left out.
+
+        Parameters:
+        -----------
+        bank : str
+            Subdirectory of the project directory, such as 'standard_MolID_bank'.
+        min_length : int, optional
+            Minimum length of the sequence of a chain. Default is 5.
+
+        Returns:
+        --------
+        Structure_Sequences : list of dict
+            Contains dictionaries where each dictionary maps chain IDs to their
+            sequences for each structure.
+        structid_list : list of str
+        	List of unique structure identifiers for each CIF. Format is 'input directory / CIF'
+        chid_list : list of str
+        	Contains all the chain IDs from CIF(s)
+        """
+        filelist = self.files(bank)
+        Structure_Sequences = dict((path, {}) for path in filelist)
+        chid_set = set()
+        with self._lock:
+            rows = self._db.execute('SELECT files.name, chains.chain_id, chains.sequence FROM chains '
+                                    'JOIN files ON files.id = chains.file_id WHERE files.bank = ? '
+                                    'ORDER BY files.name, chains.chain_order', (bank,)).fetchall()
+        for name, chid, sequence in rows:
+            sequence = re.sub('X', '', sequence)
+            if len(sequence) >= min_length:
+                Structure_Sequences[self.projdir+'/'+bank+'/'+name][chid] = sequence
+                chid_set.add(chid)
+        return [Structure_Sequences[path] for path in filelist], filelist, sorted(chid_set)
+
+    def record_step(self, step, name, status, seconds=None):
+        """
+        Records the status and duration of a step on a structure (or on all of them).
+
+        Parameters:
+        -----------
+        step : str
+            Name of the step, such as 'clean'.
+        name : str
+            Name of the structure.
+        status : str
+            Status, such as 'done' or 'failed'.
+        seconds : float, optional
+            Duration of the step.
+
+        Returns:
+        --------
+        None
+        """
+        with self._lock:
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?, ?)',
+                                 (step, name, status, str(datetime.datetime.now()), seconds))
+
+    def summary(self):
+        """
+        Returns the number of files, chains and unique sequences of each bank, and the number of
+        structures and total time of each step and status.
+
+        Returns:
+        --------
+        banks : list of tuple
+            (bank, files, chains, unique sequences) for each bank.
+        steps : list of tuple
+            (step, status, structures, seconds) for each step and status.
+        """
+        with self._lock:
+            banks = self._db.execute('SELECT files.bank, COUNT(DISTINCT files.id), COUNT(chains.chain_id), '
+                                     'COUNT(DISTINCT chains.sequence) FROM files '
+                                     'LEFT JOIN chains ON chains.file_id = files.id '
+                                     'GROUP BY files.bank ORDER BY files.bank').fetchall()
+            steps = self._db.execute('SELECT step, status, COUNT(*), SUM(seconds) FROM steps '
+                                     'GROUP BY step, status ORDER BY step, status').fetchall()
+        return banks, steps
+
+def show_catalog_summary(catalog):
+    """
+    Prints the summary of a project catalog.
+
+    Parameters:
+    -----------
+    catalog : ProjectCatalog
+
+    Returns:
+    --------
+    None
+    """
+    banks, steps = catalog.summary()
+    print('Bank | Files | Chains | Unique sequences')
+    for bank, n_files, n_chains, n_sequences in banks:
+        print('{0} | {1} | {2} | {3}'.format(bank, n_files, n_chains, n_sequences))
+    if steps:
+        print('Step | Status | Structures | Seconds')
+        for step, status, n_structures, seconds in steps:
+            print('{0} | {1} | {2} | {3:.1f}'.format(step, status, n_structures, seconds or 0))
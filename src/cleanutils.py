@@ -1,11 +1,30 @@
-import os, glob
+import os
+import io
 import re
-from Bio.PDB.MMCIF2Dict import MMCIF2Dict
-
-def process(projdir=None, step='clean', source='raw_bank', target='clean_bank', pdbformat='.cif', verbose=True):
+import time
+import locale
+import itertools
+import numpy as np
+from PDBClean.mmcifutils import MMCIFFile
+from PDBClean.pdbclean_io import open_file, glob_bank, COMPRESSION_EXTENSIONS, BINARY_CIF_EXTENSION
+from PDBClean.progressutils import message, NORMAL
+
+# Filters of the atoms written by simplify_cif, in the order they are applied:
+#   first_model   : keep only the first model (NMR ensembles)
+#   single_altloc : keep only the alternate location with the highest occupancy in each residue
+#   hydrogens     : remove hydrogen and deuterium atoms
+#   waters        : remove water molecules (WATER_COMP_IDS)
+#   residues      : list of residue names (label_comp_id) to remove
+ATOM_FILTERS = ['first_model', 'single_altloc', 'hydrogens', 'waters', 'residues']
+WATER_COMP_IDS = ['HOH', 'DOD']
+HYDROGEN_SYMBOLS = ['H', 'D']
+
+def process(projdir=None, step='clean', source='raw_bank', target='clean_bank', pdbformat='.cif', verbose=True,
+            compression=None, filters=None):
     """
     Processes all CIF files in the source directory through one of the processing steps,
-    and then saves the results to the target directory. The specified steps include, 'clean' and 'simplify'
+    and then saves the results to the target directory. The specified steps include, 'clean', 'simplify'
+    and 'clean+simplify', which does both without writing the cleaned CIF(s) to disk
 
     Parameters:
     -----------
@@ -15,15 +34,23 @@ def process(projdir=None, step='clean', source='raw_bank', target='clean_bank',
         The processing step to apply to each CIF(s). If none, the current step is 'clean', which rewrites the CIF(s)
         including only a limited set of data blocks.
     source : str, optional
-        The subdirectory within the project directory where the raw CIF(s) are in. The default is the
-        subdirectory titled 'raw_bank'
+        The subdirectory within the project directory where the raw CIF(s) are in (or a packed bank,
+        see packutils). The default is the subdirectory titled 'raw_bank'
     target : str, optional
         The subdirectory within the project directory where processed CIF(s) will be saved. The default is the
         subdirectory titled 'clean_bank'
     pdbformat : str, optional
-        The file extension format for CIF(s). Thr default is '.cif'.
+        The file extension format for CIF(s). Thr default is '.cif'. Compressed CIF(s)
+        (pdbformat followed by .gz or .zst) and BinaryCIF(s) (.bcif) are also read.
     verbose : bool, optional
         If True, progress is printed to the console. Default is true.
+    compression : str, optional
+        Compression of the CIF(s) written: 'gzip', 'zstd', 'none' or 'bcif' (BinaryCIF). If None,
+        each CIF is written with the compression of its input.
+    filters : dict, optional
+        Atoms removed by the 'simplify' and 'clean+simplify' steps (see ATOM_FILTERS), such as
+        {'first_model': True, 'hydrogens': True, 'residues': ['SO4', 'GOL']}. If verbose, the atoms
+        and bytes saved in each CIF are reported. Default is None (every atom is kept).
 
     Returns:
     -----------
@@ -32,8 +59,13 @@ def process(projdir=None, step='clean', source='raw_bank', target='clean_bank',
     if projdir is not None:
         source_dir = projdir+'/'+source
         target_dir = projdir+'/'+target
-        input_list = glob.glob(source_dir+'/*'+pdbformat)
+        input_list = []
+        for extension in [''] + sorted(COMPRESSION_EXTENSIONS.values()):
+            input_list += glob_bank(source_dir, '*'+pdbformat+extension)
+        input_list += glob_bank(source_dir, '*'+BINARY_CIF_EXTENSION)
+        input_list = sorted(input_list)
         i=0
+        reports = []
 
         for input_cif in input_list:
             cif_name=os.path.basename(input_cif)
@@ -42,7 +74,19 @@ def process(projdir=None, step='clean', source='raw_bank', target='clean_bank',
                 i+=1
                 print('[{0}/{1}]: {2}'.format(i,len(input_list),cif_name))
 
-            output_cif=target_dir+'/'+cif_name
+            input_format = pdbformat
+            for extension in COMPRESSION_EXTENSIONS.values():
+                if cif_name.endswith(pdbformat+extension):
+                    input_format = pdbformat+extension
+            if cif_name.endswith(BINARY_CIF_EXTENSION):
+                input_format = BINARY_CIF_EXTENSION
+            if compression is None:
+                output_format = input_format
+            elif compression == 'bcif':
+                output_format = BINARY_CIF_EXTENSION
+            else:
+                output_format = pdbformat+COMPRESSION_EXTENSIONS.get(compression, '')
+            output_cif=target_dir+'/'+cif_name[:-len(input_format)]+output_format
 
             if(step=='clean'):
                 if os.path.isfile(output_cif):
@@ -51,27 +95,45 @@ def process(projdir=None, step='clean', source='raw_bank', target='clean_bank',
 
             elif(step=='simplify'):
                 # missing line: remove all assembly cif already created
-                simplify_cif(input_cif, output_cif, pdbformat)
+                reports.append(simplify_cif(input_cif, output_cif, output_format, filters=filters))
+
+            elif(step=='clean+simplify'):
+                reports.append(clean_and_simplify_cif(input_cif, output_cif, output_format, filters=filters))
+
+            if verbose and filters and reports:
+                print('    ' + format_filter_report(reports[-1]))
 
-def simplify_cif(oldfile, newfile, pdbformat):
+        if verbose and filters and reports:
+            print('Total: ' + format_filter_report(sum_filter_reports(reports)))
+
+def simplify_cif(oldfile, newfile, pdbformat, filters=None):
     """
     Separate all biological assemblies in a CIF into separate files.
 
     Parameters:
     -----------
-    oldfile : str
-        Path to the original CIF(s) needed to be simplified.
+    oldfile : str or MMCIFFile
+        Path to the original CIF(s) needed to be simplified, or the CIF already opened.
     newfile: str
         Path where the new, simplified CIF(s) will be saved. The function creates multiple files if there are
         more than one biological assemblies.
     pdbformat : str
         The file format extension used when saving the new CIF.
+    filters : dict, optional
+        Atoms to remove (see ATOM_FILTERS). Default is None (every atom is kept).
 
     Returns:
     -----------
-    None
+    report : dict or None
+        If filters are given, the atoms removed by each filter and the time spent (see filter_atom_site).
     """
-    mmcif_dict = MMCIF2Dict(oldfile)
+    if not isinstance(oldfile, MMCIFFile):
+        # A CIF opened here is closed once written, a CIF given already opened is left open
+        with MMCIFFile(oldfile) as mmcif_dict:
+            return simplify_cif(mmcif_dict, newfile, pdbformat, filters=filters)
+    start = time.perf_counter()
+    mmcif_dict = oldfile
+    report = None
 
     # Create map from asym_id to assembly_id
     # Convert assembly_id to a list, as it can be either a string or a list
@@ -98,148 +160,453 @@ def simplify_cif(oldfile, newfile, pdbformat):
         for ident in asym_id:
             asym_assembly_map[ident] = assembly_id_list[i]
 
-    for assembly in assembly_id_list:
+    # Assemblies built with symmetry operators other than the identity have one copy of
+    # their chains per operator, the others are written as they are
+    assembly_operators = read_assembly_operators(mmcif_dict)
+
+    newfile_stem = newfile[:-len(pdbformat)] if newfile.endswith(pdbformat) else newfile
+    # An assembly split over several rows is written once
+    for assembly in sorted(set(assembly_id_list), key=assembly_id_list.index):
 
         if (len(assembly_id_list)==1):
-            newciffilename = str(re.sub(pdbformat, '', newfile))+"+00"
+            newciffilename = newfile_stem+"+00"
         else:
-            newciffilename = str(re.sub(pdbformat, '', newfile))+"+0"+str(assembly)
+            newciffilename = newfile_stem+"+0"+str(assembly)
+
+        with open_file(newciffilename+pdbformat, 'w') as newciffile:
+            newciffile.write("data_"+newciffilename+"\n")
+
+            # Writes entry.id
+            newciffile.write("#\n")
+
+            # Changes the list format to str
+            L = str(mmcif_dict['_entry.id'])
+            entryid = '_entry.id   ' + L
+            newciffile.write(entryid + "\n")
+
+            # Write Audit category
+            newciffile.write("#\n")
+            newciffile.write("loop_\n")
+            newciffile.write("_citation_author.name\n")
+
+            if '_citation_author.name' in mmcif_dict:
+                L = mmcif_dict['_citation_author.name']
+            else:
+                L = "???"
+
+
+            if isinstance(L, list):
+                for i in L:
+                    newciffile.write("'" + re.sub("'", "", i) + "'" + "\n")
+            else:
+                newciffile.write("'" + re.sub("'", "", L) + "'" + "\n")
+
+            # Writes Citation category
+            newciffile.write("#" + "\n")
+            newciffile.write("loop_" + "\n")
+            newciffile.write("_citation.title" + "\n")
+            newciffile.write("_citation.year" + "\n")
+            newciffile.write("_citation.pdbx_database_id_DOI" + "\n")
+            L1 = mmcif_dict['_citation.title']
+            L2 = mmcif_dict['_citation.year']
+            L3 = mmcif_dict['_citation.pdbx_database_id_DOI']
+            if isinstance(L1, list):
+                for i in range(len(L1)):
+                    newciffile.write("'" + re.sub("\n"," ",re.sub("'", "", L1[i])) + "' " + L2[i] + " " + L3[i] + "\n") #FAPA
+            else:
+                newciffile.write("'" + re.sub("\n"," ",re.sub("'", "", L1[i])) + "' " + L2[i] + " " + L3[i] + "\n") #FAPA
 
-        newciffile = open(newciffilename+pdbformat, 'w')
-        newciffile.write("data_"+newciffilename+"\n")
+            # Writes Resolution category
+            newciffile.write("#" + "\n")
+            newciffile.write("loop_" + "\n")
+            newciffile.write("_exptl.method" + "\n")
+            newciffile.write("_exptl.resolution" + "\n")
+            if '_exptl.method' in mmcif_dict:
+                L1 = mmcif_dict['_exptl.method']
+            elif '_refine_hist.pdbx_refine_id' in mmcif_dict:
+                L1 = mmcif_dict['_refine_hist.pdbx_refine_id']
+            else:
+                L1 = mmcif_dict['_refine.pdbx_refine_id']
+            if '_refine.ls_d_res_high' in mmcif_dict:
+                L2 = mmcif_dict['_refine.ls_d_res_high']
+            elif '_em_3d_reconstruction.resolution' in mmcif_dict:
+                L2 = mmcif_dict['_em_3d_reconstruction.resolution']
+            elif '_refine_hist.d_res_high' in mmcif_dict:
+                L2 = mmcif_dict['_refine_hist.d_res_high']
+            else:
+                L2 = '????'
+            if isinstance(L1, list) and isinstance(L2, list):
+                for i in range(len(L1)):
+                    newciffile.write("'" + L1[i] + "' " + L2[i] + " " + "\n")
+            elif isinstance(L1, list) and not isinstance(L2,list):
+                newciffile.write("'" + L1[0] + "' " + L2 + " " + "\n")
+            elif not isinstance(L1,list) and isinstance(L2,list):
+                newciffile.write("'" + L1 + "' " + L2[0] + " " + "\n")
+            else:
+                newciffile.write("'" + L1 + "' " + L2 + " " + "\n")
+
+            # Writes Entity category
+            newciffile.write("#" + "\n")
+            newciffile.write("loop_" + "\n")
+            newciffile.write("_entity.id" + "\n")
+            newciffile.write("_entity.pdbx_description" + "\n")
+            L1 = mmcif_dict['_entity.id']
+            L2 = mmcif_dict['_entity.pdbx_description']
+            for i in range(len(L1)):
+                L2[i] = L2[i].upper()
+                L2[i] = L2[i].replace(":", "")
+                newciffile.write(L1[i] + " '" + L2[i].replace("'", "") + "'\n")
+
+            # Writes the coordinate portion of the file
+            newciffile.write("#" + "\n")
+            newciffile.write("loop_" + "\n")
+            newciffile.write("_atom_site.group_PDB" + "\n")
+            newciffile.write("_atom_site.id" + "\n")
+            newciffile.write("_atom_site.type_symbol" + "\n")
+            newciffile.write("_atom_site.label_atom_id" + "\n")
+            newciffile.write("_atom_site.label_alt_id" + "\n")
+            newciffile.write("_atom_site.label_comp_id" + "\n")
+            newciffile.write("_atom_site.label_asym_id" + "\n")
+            newciffile.write("_atom_site.label_entity_id" + "\n")
+            newciffile.write("_atom_site.label_seq_id" + "\n")
+            newciffile.write("_atom_site.pdbx_PDB_ins_code" + "\n")
+            newciffile.write("_atom_site.Cartn_x" + "\n")
+            newciffile.write("_atom_site.Cartn_y" + "\n")
+            newciffile.write("_atom_site.Cartn_z" + "\n")
+            newciffile.write("_atom_site.occupancy" + "\n")
+            newciffile.write("_atom_site.B_iso_or_equiv" + "\n")
+            newciffile.write("_atom_site.auth_seq_id" + "\n")
+            newciffile.write("_atom_site.auth_comp_id" + "\n")
+            newciffile.write("_atom_site.auth_asym_id" + "\n")
+            newciffile.write("_atom_site.auth_atom_id" + "\n")
+            newciffile.write("_atom_site.pdbx_PDB_model_num" + "\n")
+            L1, L2, L3, L4, L5, L6, L7, L8, L9, L10, L11, L12, L13, L14, L15, L16, L17, L18, L19, L20 = \
+                mmcif_dict.columns(['_atom_site.group_PDB',
+                                    '_atom_site.id',
+                                    '_atom_site.type_symbol',
+                                    '_atom_site.label_atom_id',
+                                    '_atom_site.label_alt_id',
+                                    '_atom_site.label_comp_id',
+                                    '_atom_site.label_asym_id',
+                                    '_atom_site.label_entity_id',
+                                    '_atom_site.label_seq_id',
+                                    '_atom_site.pdbx_PDB_ins_code',
+                                    '_atom_site.Cartn_x',
+                                    '_atom_site.Cartn_y',
+                                    '_atom_site.Cartn_z',
+                                    '_atom_site.occupancy',
+                                    '_atom_site.B_iso_or_equiv',
+                                    '_atom_site.auth_seq_id',
+                                    '_atom_site.auth_comp_id',
+                                    '_atom_site.auth_asym_id',
+                                    '_atom_site.auth_atom_id',
+                                    '_atom_site.pdbx_PDB_model_num'])
+            if filters:
+                # The atoms are filtered once, for all the assemblies
+                if report is None:
+                    atom_site, report = filter_atom_site([L1, L2, L3, L4, L5, L6, L7, L8, L9, L10, L11, L12, L13, L14,
+                                                          L15, L16, L17, L18, L19, L20], filters)
+                L1, L2, L3, L4, L5, L6, L7, L8, L9, L10, L11, L12, L13, L14, L15, L16, L17, L18, L19, L20 = atom_site
+
+            if assembly_operators is not None and assembly in assembly_operators:
+                write_assembly_copies(newciffile, [L1, L2, L3, L4, L5, L6, L7, L8, L9, L10, L11, L12, L13, L14, L15, L16,
+                                                   L17, L18, L19, L20], assembly_operators[assembly])
+            else:
+                # This section is necessary to print the biological assemblies on separate files
+                BioAssembly = mmcif_dict['_pdbx_struct_assembly_gen.asym_id_list']
+
+                for i in range(len(L1)):
+                    if (L7[i] in BioAssembly[int(assembly)-1].split(',')):
+                        newciffile.write(L1[i] + " " + L2[i] + " " + L3[i] + ' "' + L4[i] + '" ' + L5[i] + " " + L6[i] + " " + L7[i] + " " + L8[i] + " " + L9[i] + " " + L10[i] + " " + L11[i] + " " + L12[i] + " " + L13[i] + " " + L14[i] + " " + L15[i] + " " + L16[i] + " " + L17[i] + " " + L18[i] + ' "' + L19[i] + '" ' + L20[i] + "\n")
+            newciffile.write("#" + "\n")
+    if report is not None:
+        report['file'] = oldfile.filename
+        report['seconds'] = time.perf_counter() - start
+    return report
+
+def filter_atom_site(atom_site, filters):
+    """
+    Removes atoms from the _atom_site columns written by simplify_cif. Each filter is a
+    vectorized mask over the columns.
 
-        # Writes entry.id
-        newciffile.write("#\n")
+    Parameters:
+    -----------
+    atom_site : list of list of str
+        The 20 columns of _atom_site written by simplify_cif.
+    filters : dict
+        Atoms to remove (see ATOM_FILTERS).
 
-        # Changes the list format to str
-        L = str(mmcif_dict['_entry.id'])
-        entryid = '_entry.id   ' + L
-        newciffile.write(entryid + "\n")
+    Returns:
+    --------
+    atom_site : list of list of str
+        The columns, without the atoms removed.
+    report : dict
+        'atoms' (number of atoms read), 'atoms_kept', 'removed' (atoms removed by each filter,
+        in the order of ATOM_FILTERS), 'bytes_removed' (bytes of the atom records removed, once
+        per atom) and 'filter_seconds'.
+    """
+    for name in filters:
+        if name not in ATOM_FILTERS:
+            raise ValueError('Unknown atom filter: ' + name)
+    start = time.perf_counter()
+    (group, serial, type_symbol, atom_id, alt_id, comp_id, asym_id, entity_id, seq_id, ins_code, x, y, z, occupancy,
+     b_factor, auth_seq_id, auth_comp_id, auth_asym_id, auth_atom_id, model) = atom_site
+    n_atoms = len(group)
+    keep = np.ones(n_atoms, dtype=bool)
+    removed = {}
+    if n_atoms and filters.get('first_model'):
+        models = np.array(model)
+        removed['first_model'] = np.count_nonzero(keep & (models != models[0]))
+        keep &= models == models[0]
+    if n_atoms and filters.get('single_altloc'):
+        alt_ids = np.array(alt_id)
+        alternate = keep & ~np.isin(alt_ids, ['.', '?'])
+        if alternate.any():
+            indices = np.flatnonzero(alternate)
+            residues = np.array([asym_id[i] + ' ' + auth_seq_id[i] + ' ' + ins_code[i] + ' ' + model[i] for i in indices])
+            residue_index = np.unique(residues, return_inverse=True)[1]
+            alt_index = np.unique(alt_ids[indices], return_inverse=True)[1]
+            # Mean occupancy of each (residue, altloc)
+            pairs, pair_index = np.unique(np.stack([residue_index, alt_index], axis=1), axis=0, return_inverse=True)
+            pair_index = pair_index.ravel()
+            occupancies = np.array([occupancy[i] for i in indices], dtype=float)
+            mean_occupancy = np.bincount(pair_index, occupancies) / np.bincount(pair_index)
+            # Highest occupancy first; ties go to the first altloc in alphabetical order
+            order = np.lexsort((pairs[:, 1], -mean_occupancy, pairs[:, 0]))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = pairs[order[1:], 0] != pairs[order[:-1], 0]
+            chosen = np.zeros(len(pairs), dtype=bool)
+            chosen[order[first]] = True
+            drop = indices[~chosen[pair_index]]
+            removed['single_altloc'] = len(drop)
+            keep[drop] = False
+        else:
+            removed['single_altloc'] = 0
+    if n_atoms and filters.get('hydrogens'):
+        hydrogens = np.isin(np.array(type_symbol), HYDROGEN_SYMBOLS)
+        removed['hydrogens'] = np.count_nonzero(keep & hydrogens)
+        keep &= ~hydrogens
+    if n_atoms and (filters.get('waters') or filters.get('residues')):
+        comp_ids = np.array(comp_id)
+        if filters.get('waters'):
+            waters = np.isin(comp_ids, WATER_COMP_IDS)
+            removed['waters'] = np.count_nonzero(keep & waters)
+            keep &= ~waters
+        if filters.get('residues'):
+            residues = np.isin(comp_ids, list(filters['residues']))
+            removed['residues'] = np.count_nonzero(keep & residues)
+            keep &= ~residues
+
+    kept = np.flatnonzero(keep)
+    bytes_removed = 0
+    if len(kept) < n_atoms:
+        # Each record is its 20 values, 19 spaces, 4 quotes and a newline
+        dropped = np.flatnonzero(~keep)
+        bytes_removed = sum(sum(len(column[i]) for i in dropped) for column in atom_site) + 24*len(dropped)
+        atom_site = [[column[i] for i in kept] for column in atom_site]
+    report = {'atoms': n_atoms,
+              'atoms_kept': len(kept),
+              'removed': dict((name, int(removed[name])) for name in ATOM_FILTERS if name in removed),
+              'bytes_removed': int(bytes_removed),
+              'filter_seconds': time.perf_counter() - start}
+    return atom_site, report
+
+def sum_filter_reports(reports):
+    """
+    Adds the reports of filter_atom_site (or simplify_cif) of several CIF(s).
+    """
+    total = {'atoms': 0, 'atoms_kept': 0, 'removed': {}, 'bytes_removed': 0, 'filter_seconds': 0.0,
+             'seconds': 0.0, 'file': '{0} CIF(s)'.format(len([report for report in reports if report]))}
+    for report in reports:
+        if not report:
+            continue
+        for key in ['atoms', 'atoms_kept', 'bytes_removed', 'filter_seconds', 'seconds']:
+            total[key] += report.get(key, 0)
+        for name, count in report['removed'].items():
+            total['removed'][name] = total['removed'].get(name, 0) + count
+    return total
+
+def format_filter_report(report):
+    """
+    Formats a report of filter_atom_site (or simplify_cif) in one line.
+    """
+    if not report:
+        return 'no atoms filtered'
+    atoms = max(report['atoms'], 1)
+    text = '{0} of {1} atoms kept ({2:.1%} removed'.format(report['atoms_kept'], report['atoms'],
+                                                             1 - report['atoms_kept']/atoms)
+    details = ['{0} {1}'.format(count, name) for name, count in report['removed'].items() if count]
+    if details:
+        text += ': ' + ', '.join(details)
+    if report['bytes_removed'] >= 1e6:
+        size = '{0:.2f} MB'.format(report['bytes_removed']/1e6)
+    else:
+        size = '{0:.1f} kB'.format(report['bytes_removed']/1e3)
+    text += '), {0} less per copy, filtered in {1:.3f} s'.format(size, report['filter_seconds'])
+    if 'seconds' in report:
+        text += ' (simplified in {0:.3f} s)'.format(report['seconds'])
+    return text
 
-        # Write Audit category
-        newciffile.write("#\n")
-        newciffile.write("loop_\n")
-        newciffile.write("_citation_author.name\n")
+def parse_oper_expression(expression):
+    """
+    Lists the operators of an oper_expression of _pdbx_struct_assembly_gen, such as '1',
+    '1,2,5', '(1-60)' or '(X0)(1-60)'. A product of groups gives one operator per combination,
+    applied from right to left (in '(X0)(1-60)', each of 1 to 60 is followed by X0).
 
-        if '_citation_author.name' in mmcif_dict:
-            L = mmcif_dict['_citation_author.name']
-        else:
-            L = "???"
+    Parameters:
+    -----------
+    expression : str
+        The oper_expression.
 
+    Returns:
+    --------
+    operators : list of tuple of str
+        The operator IDs of each combination, in the order they are multiplied (left to right).
+    """
+    expression = re.sub(r'\s', '', expression)
+    groups = re.findall(r'\(([^)]*)\)', expression)
+    if not groups:
+        groups = [expression]
+    group_ids = []
+    for group in groups:
+        ids = []
+        for item in group.split(','):
+            first, dash, last = item.partition('-')
+            if dash and first.isdigit() and last.isdigit():
+                ids += [str(number) for number in range(int(first), int(last)+1)]
+            elif item:
+                ids.append(item)
+        group_ids.append(ids)
+    return list(itertools.product(*group_ids))
+
+def read_assembly_operators(mmcif_dict):
+    """
+    Reads the symmetry operators that build each biological assembly, from _pdbx_struct_oper_list
+    and the oper_expression of _pdbx_struct_assembly_gen.
 
-        if isinstance(L, list):
-            for i in L:
-                newciffile.write("'" + re.sub("'", "", i) + "'" + "\n")
-        else:
-            newciffile.write("'" + re.sub("'", "", L) + "'" + "\n")
-
-        # Writes Citation category
-        newciffile.write("#" + "\n")
-        newciffile.write("loop_" + "\n")
-        newciffile.write("_citation.title" + "\n")
-        newciffile.write("_citation.year" + "\n")
-        newciffile.write("_citation.pdbx_database_id_DOI" + "\n")
-        L1 = mmcif_dict['_citation.title']
-        L2 = mmcif_dict['_citation.year']
-        L3 = mmcif_dict['_citation.pdbx_database_id_DOI']
-        if isinstance(L1, list):
-            for i in range(len(L1)):
-                newciffile.write("'" + re.sub("\n"," ",re.sub("'", "", L1[i])) + "' " + L2[i] + " " + L3[i] + "\n") #FAPA
-        else:
-            newciffile.write("'" + re.sub("\n"," ",re.sub("'", "", L1[i])) + "' " + L2[i] + " " + L3[i] + "\n") #FAPA
-
-        # Writes Resolution category
-        newciffile.write("#" + "\n")
-        newciffile.write("loop_" + "\n")
-        newciffile.write("_exptl.method" + "\n")
-        newciffile.write("_exptl.resolution" + "\n")
-        if '_exptl.method' in mmcif_dict:
-            L1 = mmcif_dict['_exptl.method']
-        elif '_refine_hist.pdbx_refine_id' in mmcif_dict:
-            L1 = mmcif_dict['_refine_hist.pdbx_refine_id']
-        else:
-            L1 = mmcif_dict['_refine.pdbx_refine_id']
-        if '_refine.ls_d_res_high' in mmcif_dict:
-            L2 = mmcif_dict['_refine.ls_d_res_high']
-        elif '_em_3d_reconstruction.resolution' in mmcif_dict:
-            L2 = mmcif_dict['_em_3d_reconstruction.resolution']
-        elif '_refine_hist.d_res_high' in mmcif_dict:
-            L2 = mmcif_dict['_refine_hist.d_res_high']
-        else:
-            L2 = '????'
-        if isinstance(L1, list) and isinstance(L2, list):
-            for i in range(len(L1)):
-                newciffile.write("'" + L1[i] + "' " + L2[i] + " " + "\n")
-        elif isinstance(L1, list) and not isinstance(L2,list):
-            newciffile.write("'" + L1[0] + "' " + L2 + " " + "\n")
-        elif not isinstance(L1,list) and isinstance(L2,list):
-            newciffile.write("'" + L1 + "' " + L2[0] + " " + "\n")
-        else:
-            newciffile.write("'" + L1 + "' " + L2 + " " + "\n")
-
-        # Writes Entity category
-        newciffile.write("#" + "\n")
-        newciffile.write("loop_" + "\n")
-        newciffile.write("_entity.id" + "\n")
-        newciffile.write("_entity.pdbx_description" + "\n")
-        L1 = mmcif_dict['_entity.id']
-        L2 = mmcif_dict['_entity.pdbx_description']
-        for i in range(len(L1)):
-            L2[i] = L2[i].upper()
-            L2[i] = L2[i].replace(":", "")
-            newciffile.write(L1[i] + " '" + L2[i].replace("'", "") + "'\n")
-
-        # Writes the coordinate portion of the file
-        newciffile.write("#" + "\n")
-        newciffile.write("loop_" + "\n")
-        newciffile.write("_atom_site.group_PDB" + "\n")
-        newciffile.write("_atom_site.id" + "\n")
-        newciffile.write("_atom_site.type_symbol" + "\n")
-        newciffile.write("_atom_site.label_atom_id" + "\n")
-        newciffile.write("_atom_site.label_alt_id" + "\n")
-        newciffile.write("_atom_site.label_comp_id" + "\n")
-        newciffile.write("_atom_site.label_asym_id" + "\n")
-        newciffile.write("_atom_site.label_entity_id" + "\n")
-        newciffile.write("_atom_site.label_seq_id" + "\n")
-        newciffile.write("_atom_site.pdbx_PDB_ins_code" + "\n")
-        newciffile.write("_atom_site.Cartn_x" + "\n")
-        newciffile.write("_atom_site.Cartn_y" + "\n")
-        newciffile.write("_atom_site.Cartn_z" + "\n")
-        newciffile.write("_atom_site.occupancy" + "\n")
-        newciffile.write("_atom_site.B_iso_or_equiv" + "\n")
-        newciffile.write("_atom_site.auth_seq_id" + "\n")
-        newciffile.write("_atom_site.auth_comp_id" + "\n")
-        newciffile.write("_atom_site.auth_asym_id" + "\n")
-        newciffile.write("_atom_site.auth_atom_id" + "\n")
-        newciffile.write("_atom_site.pdbx_PDB_model_num" + "\n")
-        L1 = mmcif_dict['_atom_site.group_PDB']
-        L2 = mmcif_dict['_atom_site.id']
-        L3 = mmcif_dict['_atom_site.type_symbol']
-        L4 = mmcif_dict['_atom_site.label_atom_id']
-        L5 = mmcif_dict['_atom_site.label_alt_id']
-        L6 = mmcif_dict['_atom_site.label_comp_id']
-        L7 = mmcif_dict['_atom_site.label_asym_id']
-        L8 = mmcif_dict['_atom_site.label_entity_id']
-        L9 = mmcif_dict['_atom_site.label_seq_id']
-        L10 = mmcif_dict['_atom_site.pdbx_PDB_ins_code']
-        L11 = mmcif_dict['_atom_site.Cartn_x']
-        L12 = mmcif_dict['_atom_site.Cartn_y']
-        L13 = mmcif_dict['_atom_site.Cartn_z']
-        L14 = mmcif_dict['_atom_site.occupancy']
-        L15 = mmcif_dict['_atom_site.B_iso_or_equiv']
-        L16 = mmcif_dict['_atom_site.auth_seq_id']
-        L17 = mmcif_dict['_atom_site.auth_comp_id']
-        L18 = mmcif_dict['_atom_site.auth_asym_id']
-        L19 = mmcif_dict['_atom_site.auth_atom_id']
-        L20 = mmcif_dict['_atom_site.pdbx_PDB_model_num']
-
-        # This section is necessary to print the biological assemblies on separate files
-        BioAssembly = mmcif_dict['_pdbx_struct_assembly_gen.asym_id_list']
-
-        for i in range(len(L1)):
-            if (L7[i] in BioAssembly[int(assembly)-1].split(',')):
-                newciffile.write(L1[i] + " " + L2[i] + " " + L3[i] + ' "' + L4[i] + '" ' + L5[i] + " " + L6[i] + " " + L7[i] + " " + L8[i] + " " + L9[i] + " " + L10[i] + " " + L11[i] + " " + L12[i] + " " + L13[i] + " " + L14[i] + " " + L15[i] + " " + L16[i] + " " + L17[i] + " " + L18[i] + ' "' + L19[i] + '" ' + L20[i] + "\n")
-        newciffile.write("#" + "\n")
+    Parameters:
+    -----------
+    mmcif_dict : MMCIFFile
+        The CIF.
+
+    Returns:
+    --------
+    assembly_operators : dict or None
+        Maps the ID of each assembly built with an operator other than the identity (in the
+        order of the CIF) to a list of (asym IDs, operators), one per row of
+        _pdbx_struct_assembly_gen, where operators is a list of (name, rotation, translation).
+        The other assemblies are left out: they are made of their chains as they are. None if
+        no assembly has such an operator, or the CIF has no operators.
+    """
+    if '_pdbx_struct_oper_list.id' not in mmcif_dict or '_pdbx_struct_assembly_gen.oper_expression' not in mmcif_dict:
+        return None
+    matrix_tags = ['_pdbx_struct_oper_list.matrix[{0}][{1}]'.format(i, j) for i in (1, 2, 3) for j in (1, 2, 3)]
+    vector_tags = ['_pdbx_struct_oper_list.vector[{0}]'.format(i) for i in (1, 2, 3)]
+    for tag in matrix_tags + vector_tags:
+        if tag not in mmcif_dict:
+            return None
+    values = mmcif_dict.columns(['_pdbx_struct_oper_list.id'] + matrix_tags + vector_tags)
+    oper_list = {}
+    for row in zip(*values):
+        numbers = np.array(row[1:], dtype=float)
+        oper_list[row[0]] = (numbers[:9].reshape(3, 3), numbers[9:])
+
+    assembly_ids, expressions, asym_id_lists = mmcif_dict.columns(['_pdbx_struct_assembly_gen.assembly_id',
+                                                                   '_pdbx_struct_assembly_gen.oper_expression',
+                                                                   '_pdbx_struct_assembly_gen.asym_id_list'])
+    assembly_operators = {}
+    expanded = set()
+    for assembly, expression, asym_id_list in zip(assembly_ids, expressions, asym_id_lists):
+        operators = []
+        for combination in parse_oper_expression(expression):
+            if any(oper_id not in oper_list for oper_id in combination):
+                message("Unknown operator in oper_expression " + expression + ": assemblies are not expanded",
+                        level=NORMAL)
+                return None
+            rotation, translation = np.identity(3), np.zeros(3)
+            # x -> R1 (R2 x + t2) + t1
+            for oper_id in reversed(combination):
+                oper_rotation, oper_translation = oper_list[oper_id]
+                rotation = oper_rotation @ rotation
+                translation = oper_rotation @ translation + oper_translation
+            if not is_identity_operator(rotation, translation):
+                expanded.add(assembly)
+            operators.append(('x'.join(combination), rotation, translation))
+        asym_ids = set(re.sub(' ', '', asym_id_list.strip()).split(','))
+        assembly_operators.setdefault(assembly, []).append((asym_ids, operators))
+    if not expanded:
+        return None
+    return dict((assembly, rows) for assembly, rows in assembly_operators.items() if assembly in expanded)
+
+def is_identity_operator(rotation, translation):
+    """
+    Returns True if a symmetry operator (rotation, translation) is the identity.
+    """
+    return np.allclose(rotation, np.identity(3), atol=1e-6) and np.allclose(translation, 0, atol=1e-6)
+
+def write_assembly_copies(newciffile, atom_site, assembly_rows, batch_size=1 << 20):
+    """
+    Writes the atoms of a biological assembly built with symmetry operators: for each row of
+    _pdbx_struct_assembly_gen, one copy of its chains per operator.
+
+    The coordinates of each row are transformed by all its operators at once (in batches of
+    about batch_size atoms), and the atoms are written one copy at a time. When the assembly
+    has more than one copy, the chain IDs (label_asym_id and auth_asym_id) of each copy are
+    followed by the name of its operator, such as A-1 or A-X0x12. Atoms are numbered again,
+    and the coordinates of the copies made by the identity are written unchanged.
+
+    Parameters:
+    -----------
+    newciffile : file object
+        The simplified CIF, after the header of the _atom_site loop.
+    atom_site : list of list of str
+        The 20 columns of _atom_site written by simplify_cif.
+    assembly_rows : list of tuple
+        (asym IDs, operators) of each row of the assembly (see read_assembly_operators).
+    batch_size : int, optional
+        Approximate number of transformed atoms kept in memory at once.
+
+    Returns:
+    --------
+    None
+    """
+    L1, L2, L3, L4, L5, L6, L7, L8, L9, L10, L11, L12, L13, L14, L15, L16, L17, L18, L19, L20 = atom_site
+    label_asym = np.array(L7)
+    all_coordinates = np.array([L11, L12, L13], dtype=float).T
+    add_suffix = sum(len(operators) for asym_ids, operators in assembly_rows) > 1
+    serial = 0
+    for asym_ids, operators in assembly_rows:
+        selected = np.nonzero(np.isin(label_asym, list(asym_ids)))[0]
+        if len(selected) == 0:
+            continue
+        # Fields that are the same in every copy
+        group = [L1[i] for i in selected]
+        middle1 = [L3[i] + ' "' + L4[i] + '" ' + L5[i] + " " + L6[i] for i in selected]
+        middle2 = [L8[i] + " " + L9[i] + " " + L10[i] for i in selected]
+        middle3 = [L14[i] + " " + L15[i] + " " + L16[i] + " " + L17[i] for i in selected]
+        end = ['"' + L19[i] + '" ' + L20[i] for i in selected]
+        label_chains = [L7[i] for i in selected]
+        auth_chains = [L18[i] for i in selected]
+        original_xyz = [L11[i] + " " + L12[i] + " " + L13[i] for i in selected]
+        coordinates = all_coordinates[selected]
+
+        copies_per_batch = max(1, batch_size // len(selected))
+        for first in range(0, len(operators), copies_per_batch):
+            batch = operators[first:first+copies_per_batch]
+            rotations = np.array([rotation for name, rotation, translation in batch])
+            translations = np.array([translation for name, rotation, translation in batch])
+            transformed = np.einsum('kij,nj->kni', rotations, coordinates) + translations[:, None, :]
+            for (name, rotation, translation), copy_coordinates in zip(batch, transformed):
+                if is_identity_operator(rotation, translation):
+                    xyz = original_xyz
+                else:
+                    xyz = ['{0:.3f} {1:.3f} {2:.3f}'.format(x, y, z) for x, y, z in copy_coordinates.tolist()]
+                suffix = '-' + name if add_suffix else ''
+                newciffile.write(''.join([group[j] + " " + str(serial+j+1) + " " + middle1[j] + " "
+                                          + label_chains[j] + suffix + " " + middle2[j] + " " + xyz[j] + " "
+                                          + middle3[j] + " " + auth_chains[j] + suffix + " " + end[j] + "\n"
+                                          for j in range(len(selected))]))
+                serial += len(selected)
 
 
 #
@@ -254,6 +621,54 @@ def clean_cif(oldfile, newfile):
     newfile : str
         The path where the cleaned CIF(s) will be written.
 
+    Returns:
+    -----------
+    None
+    """
+    with open_file(oldfile) as old_file, open_file(newfile, 'w') as new_file:
+        write_clean_cif(old_file, new_file)
+#
+def clean_and_simplify_cif(oldfile, newfile, pdbformat, filters=None):
+    """
+    Cleans a CIF and separates its biological assemblies in a single pass: the cleaned CIF is
+    kept in memory instead of being written to disk and read again. The files written are
+    identical to those of clean_cif followed by simplify_cif.
+
+    Parameters:
+    -----------
+    oldfile : str
+        Path to the original CIF(s) needed to be cleaned and simplified.
+    newfile: str
+        Path where the new, simplified CIF(s) will be saved (see simplify_cif).
+    pdbformat : str
+        The file format extension used when saving the new CIF.
+    filters : dict, optional
+        Atoms to remove (see ATOM_FILTERS). Default is None (every atom is kept).
+
+    Returns:
+    -----------
+    report : dict or None
+        If filters are given, the atoms removed by each filter (see simplify_cif).
+    """
+    cleaned = io.StringIO()
+    with open_file(oldfile) as old_file:
+        write_clean_cif(old_file, cleaned)
+    # Encoded as clean_cif would write it to disk
+    data = cleaned.getvalue().encode(locale.getpreferredencoding(False))
+    with MMCIFFile(oldfile, data=data) as mmcif_dict:
+        return simplify_cif(mmcif_dict, newfile, pdbformat, filters=filters)
+#
+def write_clean_cif(old_file, new_file):
+    """
+    Writes the cleaned content of a CIF (see clean_cif).
+
+    Parameters:
+    -----------
+    old_file : file object
+        The original CIF, opened for reading.
+    new_file : file object
+        Where the cleaned CIF is written.
+
     Returns:
     -----------
     None
@@ -263,6 +678,7 @@ def clean_cif(oldfile, newfile):
                   '_citation_author.name',
                   '_citation.title',
                   '_pdbx_struct_assembly_gen.assembly_id',
+                  '_pdbx_struct_oper_list.id',
                   '_entity.pdbx_description',
                   '_exptl.method',
                   '_em_3d_reconstruction.resolution',
@@ -273,28 +689,26 @@ def clean_cif(oldfile, newfile):
                        21,
                        15,
                        37,
+                       25,
                        24,
                        13,
                        32,
                        27,
                        22]
-    with open(oldfile) as old_file:
-        alllines = []
-        linecount = 0
-        poundline = 0
-        flag = 0
-        for line in old_file:
-            alllines.append(line)
-            if linecount == 0:
-                with open(newfile, 'a') as new_file:
-                    new_file.write(alllines[0])
-            for entry, keylength in zip(entry_list, keylength_list):
-                flag = check_and_write_entry(entry, line, alllines, line[0:keylength], flag, range(poundline, linecount), newfile)
-            if '#' in line[0]:
-                poundline = linecount
-            linecount += 1
-        with open(newfile, 'a') as new_file:
-            new_file.write('#\n')
+    alllines = []
+    linecount = 0
+    poundline = 0
+    flag = 0
+    for line in old_file:
+        alllines.append(line)
+        if linecount == 0:
+            new_file.write(alllines[0])
+        for entry, keylength in zip(entry_list, keylength_list):
+            flag = check_and_write_entry(entry, line, alllines, line[0:keylength], flag, range(poundline, linecount), new_file)
+        if '#' in line[0]:
+            poundline = linecount
+        linecount += 1
+    new_file.write('#\n')
 #
 def check_and_write_entry(entry, line, alllines, key, flag, linerange, newfile):
     """
@@ -314,8 +728,8 @@ def check_and_write_entry(entry, line, alllines, key, flag, linerange, newfile):
         A flag indicating whether the desired entry has been found (1 if found, 0 otherwise).
     linerange : range
         The range of lines from `alllines` to write to the new file if the entry is found.
-    newfile : str
-        The path to the new CIF where the relevant lines will be written.
+    newfile : str or file object
+        The path to the new CIF where the relevant lines will be written, or the new CIF opened for writing.
 
     Returns:
     -----------
@@ -325,8 +739,12 @@ def check_and_write_entry(entry, line, alllines, key, flag, linerange, newfile):
     if entry in key:
         flag = 1
     elif (flag==1) and '#' in line[0]:
-        with open(newfile, 'a') as new_file:
+        if hasattr(newfile, 'write'):
             for i in linerange:
-                new_file.write(alllines[i])
+                newfile.write(alllines[i])
+        else:
+            with open_file(newfile, 'a') as new_file:
+                for i in linerange:
+                    new_file.write(alllines[i])
         flag=0
     return flag
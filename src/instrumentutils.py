@@ -0,0 +1,311 @@
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import json
+import time
+import atexit
+import runpy
+import argparse
+import threading
+from contextlib import contextmanager
+
+# Environment variable with the path of the JSON lines file; when set, stats are recorded from the start
+STATS_ENVIRONMENT = 'PDBCLEAN_STATS'
+# Environment variable with the pid of the process owning the stats file; other processes append to it
+STATS_OWNER_ENVIRONMENT = 'PDBCLEAN_STATS_OWNER'
+# Phases timed by the library
+PHASES = ['parse', 'align', 'match', 'write']
+
+class Instrumentation(object):
+    """
+    Timers and counters around the phases of the curation (parse, align, match, write).
+
+    Recording is off until enable() is called, and timers then cost a few microseconds, so they
+    are only placed around whole files and alignments. Each timer records one line in the stats
+    file (phase, name, seconds and the counters incremented while it ran), and the totals of each
+    phase are written as a last line when the program ends.
+
+    Attributes:
+    -----------
+    enabled : bool
+        True if stats are recorded.
+    filename : str
+        Path of the JSON lines file, or None if only totals are kept.
+    owner : bool
+        True if this process truncated the stats file and writes the summary to it.
+
+    Methods:
+    --------
+    enable(filename, append):
+        Starts recording.
+
+    timer(phase, name):
+        Context manager timing a phase on one file (or alignment).
+
+    count(counter, n):
+        Increments a counter.
+
+    sleep(seconds):
+        Sleeps, counting the time spent waiting.
+
+    summary():
+        Returns the totals and rates of each phase.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.filename = None
+        self.owner = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started = time.perf_counter()
+        self.phases = {}
+        self.counters = {}
+        self._summary_written = False
+        self._atexit_registered = False
+
+    def enable(self, filename=None, append=False):
+        """
+        Starts recording. Unless append is True, this process owns the stats file: the file is
+        truncated, the summary is appended to it when the program ends, and its path is passed
+        through the environment to the worker processes, which append their timers to it.
+
+        Parameters:
+        -----------
+        filename : str, optional
+            Path of the JSON lines file. If None, only the totals are kept (see summary).
+        append : bool, optional
+            If True, the timers are appended to the file of the process owning it, which is
+            neither truncated nor given a summary by this process. Default is False.
+
+        Returns:
+        --------
+        None
+        """
+        with self._lock:
+            self.enabled = True
+            self.filename = filename
+            self._started = time.perf_counter()
+            self.phases = {}
+            self.counters = {}
+            self._summary_written = False
+            self.owner = filename is not None and not append
+            if self.owner:
+                open(filename, 'w').close()
+                os.environ[STATS_ENVIRONMENT] = filename
+                os.environ[STATS_OWNER_ENVIRONMENT] = str(os.getpid())
+                if not self._atexit_registered:
+                    atexit.register(self.write_summary)
+                    self._atexit_registered = True
+
+    def _write(self, record):
+        if self.filename is not None:
+            with open(self.filename, 'a') as statsfile:
+                statsfile.write(json.dumps(record)+'\n')
+
+    @contextmanager
+    def timer(self, phase, name=None):
+        """
+        Times a phase. The counters incremented while it runs (in the same thread) are added to
+        its record.
+
+        Parameters:
+        -----------
+        phase : str
+            One of PHASES.
+        name : str, optional
+            The file (or alignment) being processed.
+
+        Yields:
+        -------
+        record : dict
+            Counters of this timer, which can also be set directly.
+        """
+        if not self.enabled:
+            yield {}
+            return
+        record = {}
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            with self._lock:
+                totals = self.phases.setdefault(phase, {'calls': 0, 'seconds': 0.0})
+                totals['calls'] += 1
+                totals['seconds'] += seconds
+                for counter, n in record.items():
+                    totals[counter] = totals.get(counter, 0) + n
+                line = {'event': 'timer', 'phase': phase, 'name': name, 'seconds': round(seconds, 6)}
+                line.update(record)
+                self._write(line)
+
+    def count(self, counter, n=1):
+        """
+        Increments a counter, and the same counter of the timers running in this thread.
+
+        Parameters:
+        -----------
+        counter : str
+            Name of the counter, such as 'atoms' or 'alignments'.
+        n : int or float, optional
+            Increment. Default is 1.
+
+        Returns:
+        --------
+        None
+        """
+        if not self.enabled:
+            return
+        for record in getattr(self._local, 'stack', []):
+            record[counter] = record.get(counter, 0) + n
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def sleep(self, seconds):
+        """
+        Sleeps, and counts the time spent in 'sleep_seconds'. Used by the loops waiting for the
+        output of MUSCLE and of the files being written.
+        """
+        time.sleep(seconds)
+        self.count('sleep_seconds', seconds)
+
+    def summary(self):
+        """
+        Returns the totals of each phase and counter, with their rates per second of the phase
+        (files/s, atoms/s, alignments/s, ...).
+
+        Returns:
+        --------
+        summary : dict
+        """
+        with self._lock:
+            phases = {}
+            for phase, totals in self.phases.items():
+                phases[phase] = dict(totals)
+                if totals['seconds'] > 0:
+                    phases[phase]['calls_per_second'] = totals['calls'] / totals['seconds']
+                    for counter, n in totals.items():
+                        if counter not in ('calls', 'seconds', 'sleep_seconds'):
+                            phases[phase][counter+'_per_second'] = n / totals['seconds']
+            return {'event': 'summary',
+                    'wall_seconds': time.perf_counter() - self._started,
+                    'phases': phases,
+                    'counters': dict(self.counters)}
+
+    def write_summary(self):
+        """
+        Appends the summary to the stats file (once), if this process owns it.
+        """
+        if self.enabled and self.owner and not self._summary_written:
+            self._summary_written = True
+            summary = self.summary()
+            with self._lock:
+                self._write(summary)
+
+# One instance per process, used by the library through the module functions
+INSTRUMENTATION = Instrumentation()
+
+def enable(filename=None, append=False):
+    """
+    Starts recording stats (see Instrumentation.enable).
+    """
+    INSTRUMENTATION.enable(filename, append)
+
+def timer(phase, name=None):
+    """
+    Times a phase (see Instrumentation.timer).
+    """
+    return INSTRUMENTATION.timer(phase, name)
+
+def count(counter, n=1):
+    """
+    Increments a counter (see Instrumentation.count).
+    """
+    INSTRUMENTATION.count(counter, n)
+
+def sleep(seconds):
+    """
+    Sleeps, counting the time spent waiting (see Instrumentation.sleep).
+    """
+    INSTRUMENTATION.sleep(seconds)
+
+def summary():
+    """
+    Returns the totals and rates of each phase (see Instrumentation.summary).
+    """
+    return INSTRUMENTATION.summary()
+
+if os.environ.get(STATS_ENVIRONMENT) and __name__ != '__main__':
+    # Worker processes importing the module again (spawn, forkserver) append to the owner's file
+    owner_pid = os.environ.get(STATS_OWNER_ENVIRONMENT)
+    enable(os.environ[STATS_ENVIRONMENT], append=owner_pid not in (None, str(os.getpid())))
+
+def run_script(script, args, stats=None, cprofile=None, tracemalloc_top=None):
+    """
+    Runs an entry script (such as PDBClean_MolID_CIF.py) with stats, cProfile and/or tracemalloc.
+
+    Parameters:
+    -----------
+    script : str
+        Path of the script.
+    args : list of str
+        Arguments of the script.
+    stats : str, optional
+        Path of the JSON lines stats file.
+    cprofile : str, optional
+        Path of the cProfile output (read with pstats or snakeviz).
+    tracemalloc_top : int, optional
+        If given, the lines allocating the most memory are printed when the script ends.
+
+    Returns:
+    --------
+    None
+    """
+    if stats is not None:
+        enable(stats)
+    if tracemalloc_top is not None:
+        import tracemalloc
+        tracemalloc.start()
+    profiler = None
+    if cprofile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+    sys.argv = [script] + list(args)
+    try:
+        if profiler is not None:
+            profiler.enable()
+        runpy.run_path(script, run_name='__main__')
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(cprofile)
+            print('cProfile written to '+cprofile)
+        if tracemalloc_top is not None:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print('Peak memory: {0:.1f} MB'.format(peak/1e6))
+            for stat in snapshot.statistics('lineno')[:tracemalloc_top]:
+                print(stat)
+        INSTRUMENTATION.write_summary()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a PDBClean script with timers, cProfile or tracemalloc, e.g. '
+                                                 'python -m PDBClean.instrumentutils --stats stats.jsonl '
+                                                 'PDBClean_MolID_CIF.py simple_bank standard_MolID_bank')
+    parser.add_argument('--stats', help='JSON lines file with the time of each phase on each file, and the totals')
+    parser.add_argument('--cprofile', help='file where the cProfile stats are written')
+    parser.add_argument('--tracemalloc', type=int, metavar='N', dest='tracemalloc_top',
+                        help='trace memory allocations, and print the N lines allocating the most')
+    parser.add_argument('script', help='script to run')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='arguments of the script')
+    args = parser.parse_args()
+    # The library records to the instance of the imported module, not to this __main__ copy
+    from PDBClean import instrumentutils
+    instrumentutils.run_script(args.script, args.args, stats=args.stats, cprofile=args.cprofile, tracemalloc_top=args.tracemalloc_top)
@@ -0,0 +1,525 @@
+from __future__ import print_function
+from __future__ import division
+import mmap
+import re
+from itertools import groupby, repeat
+import numpy as np
+from PDBClean import instrumentutils, bcifutils
+from PDBClean.pdbclean_io import compression_of, read_bytes, BINARY_CIF_EXTENSION
+
+# Lines that can end the data of a loop (or open/close a text field), with their newline
+HEADER_LINE = re.compile(rb"\n(?:loop_|data_|_|;)", re.I)
+# Quoted values containing whitespace (or unclosed quotes), which str.split() does not
+# tokenize like MMCIF2Dict. The text searched must start with a newline.
+QUOTED_WHITESPACE = re.compile(r"(['\"])(?<=\s.)(?:(?!\1(?=\s|$))\S)*(?:\s|$)", re.M)
+COMMENT_LINE = re.compile(r"\n#[^\n]*")
+QUOTES = ("'", '"')
+
+class MMCIFFile(object):
+    """
+    Read-only, dictionary-like access to a CIF, giving the same values as Bio.PDB.MMCIF2Dict.
+
+    The file is memory-mapped rather than read (compressed files are decompressed in memory,
+    see pdbclean_io.open_file), or given as bytes already in memory. BinaryCIF files (.bcif)
+    are not tokenized at all: their columns are decoded from their binary encodings. Opening it only tokenizes the text outside of
+    loops and records where the data of each loop starts and ends. The columns of a loop (such
+    as _atom_site) are decoded the first time they are requested, one column at a time, so
+    a reader touches only the columns it uses.
+
+    Attributes:
+    -----------
+    filename : str
+        Path of the CIF.
+
+    Methods:
+    --------
+    columns(tags):
+        Returns the values of several columns of a loop, decoded in a single pass.
+
+    as_array(tag):
+        Returns the values of a tag as a NumPy array of strings.
+
+    close():
+        Unmaps the file.
+    """
+    def __init__(self, filename, data=None):
+        """
+        Initializes the MMCIFFile class by mapping and indexing a CIF.
+
+        Parameters:
+        -----------
+        filename : str or file object
+            Path of the CIF, or a file object opened on it.
+        data : bytes, optional
+            Content of the CIF, already in memory. If given, filename is only used as its name.
+        """
+        self.filename = getattr(filename, 'name', filename)
+        # Values of the tags outside of loops, and (loop, column) of the tags of loops
+        self._items = {}
+        self._loop_columns = {}
+        self._tags = []
+        if data is None and self.filename.endswith(BINARY_CIF_EXTENSION):
+            self._data = read_bytes(self.filename, decode_bcif=False)
+            self._index_bcif()
+            return
+        if data is not None:
+            self._data = data
+            if not self._data:
+                raise ValueError("Empty file.")
+        elif compression_of(self.filename) is not None:
+            self._data = read_bytes(self.filename)
+            if not self._data:
+                raise ValueError("Empty file.")
+        else:
+            try:
+                with open(self.filename, 'rb') as ciffile:
+                    try:
+                        self._data = mmap.mmap(ciffile.fileno(), 0, access=mmap.ACCESS_READ)
+                    except ValueError:
+                        raise ValueError("Empty file.")
+            except NotADirectoryError:
+                # A file of a packed bank (see packutils), read from the mapping of the bank
+                self._data = read_bytes(self.filename)
+                if not self._data:
+                    raise ValueError("Empty file.")
+        self._index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def __getitem__(self, tag):
+        if tag in self._items:
+            return self._items[tag]
+        return self.columns([tag])[0]
+
+    def __contains__(self, tag):
+        return tag in self._items or tag in self._loop_columns
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._items) + len(self._loop_columns)
+
+    def keys(self):
+        return list(self._items) + list(self._loop_columns)
+
+    def tags(self):
+        """
+        Returns the tags of the CIF in the order they appear (without 'data_').
+        """
+        return list(self._tags)
+
+    def get(self, tag, default=None):
+        if tag in self:
+            return self[tag]
+        return default
+
+    def as_array(self, tag):
+        """
+        Returns the values of a tag as a NumPy array of strings.
+
+        Parameters:
+        -----------
+        tag : str
+            CIF tag, such as '_atom_site.label_asym_id'.
+
+        Returns:
+        --------
+        values : np.ndarray
+        """
+        return np.array(self[tag])
+
+    def numeric_array(self, tag, dtype=float):
+        """
+        Returns the values of a tag as a NumPy array of numbers. The columns of BinaryCIF files are
+        decoded straight into the array, without going through strings.
+
+        Parameters:
+        -----------
+        tag : str
+            CIF tag, such as '_atom_site.Cartn_x'.
+        dtype : type, optional
+            Type of the array. Default is float.
+
+        Returns:
+        --------
+        values : np.ndarray
+        """
+        if tag in self._loop_columns:
+            loop, column = self._loop_columns[tag]
+            if 'bcif_columns' in loop and column not in loop['values']:
+                return bcifutils.decode_numbers(loop['bcif_columns'][column], dtype=dtype)
+        return np.array(self[tag], dtype=dtype)
+
+    def columns(self, tags):
+        """
+        Returns the values of several tags. Columns of the same loop that have not been read
+        yet are decoded together, in a single pass over the data of the loop.
+
+        Parameters:
+        -----------
+        tags : list of str
+            CIF tags, such as '_atom_site.label_asym_id'.
+
+        Returns:
+        --------
+        values : list of list of str
+            Values of each tag, in the order of tags.
+        """
+        for tag in tags:
+            if tag not in self:
+                raise KeyError(tag)
+        missing = {}
+        for tag in tags:
+            if tag in self._loop_columns:
+                loop, column = self._loop_columns[tag]
+                if column not in loop['values']:
+                    missing.setdefault(id(loop), (loop, set()))[1].add(column)
+        for loop, loop_columns in missing.values():
+            loop['values'].update(self._read_loop(loop, sorted(loop_columns)))
+        values = []
+        for tag in tags:
+            if tag in self._items:
+                values.append(self._items[tag])
+            else:
+                loop, column = self._loop_columns[tag]
+                values.append(loop['values'][column])
+        return values
+
+    def _index_bcif(self):
+        """
+        Records the columns of each category of a BinaryCIF file. They are decoded the first
+        time they are requested.
+        """
+        block = bcifutils.read_bcif(self._data)
+        self._items['data_'] = block['header']
+        for category in block['categories']:
+            loop = {'n_columns': len(category['columns']), 'values': {}, 'bcif_columns': category['columns']}
+            for column, bcif_column in enumerate(category['columns']):
+                tag = category['name'] + '.' + bcif_column['name']
+                self._loop_columns[tag] = (loop, column)
+                self._tags.append(tag)
+
+    def _index(self):
+        """
+        Tokenizes the text outside of loop data, as MMCIF2Dict does, and records the start and
+        end of the data of each loop.
+        """
+        data = self._data
+        pos = 0
+        first_token = True
+        key = None
+        loop_tags = None
+        while pos < len(data):
+            end = data.find(b"\n", pos)
+            if end < 0:
+                end = len(data)
+            line = data[pos:end].decode()
+            if line.startswith("#"):
+                pos = end + 1
+                continue
+            if loop_tags is not None and line.strip() and not line.lstrip().startswith("_"):
+                # All tags of the loop have been read: skip its data
+                data_end = self._loop_end(pos)
+                loop = {'start': pos, 'end': data_end, 'n_columns': len(loop_tags), 'values': {}}
+                for column in range(len(loop_tags)):
+                    self._loop_columns[loop_tags[column]] = (loop, column)
+                loop_tags = None
+                pos = data_end
+                continue
+            if line.startswith(";"):
+                tokens, end = self._text_field(pos)
+            else:
+                tokens = list(split_cif_line(line.strip()))
+            pos = end + 1
+            for token in tokens:
+                if first_token:
+                    if not token[0:5].startswith("data_"):
+                        raise ValueError("The input mmCIF file must begin with a 'data_' directive.")
+                    self._items[token[0:5]] = token[5:]
+                    first_token = False
+                elif token.lower() == "loop_":
+                    loop_tags = []
+                elif loop_tags is not None:
+                    loop_tags.append(token)
+                    self._tags.append(token)
+                elif key is None:
+                    key = token
+                else:
+                    self._items[key] = [token]
+                    self._tags.append(key)
+                    key = None
+        if loop_tags:
+            for tag in loop_tags:
+                self._items[tag] = []
+        if first_token:
+            raise ValueError("Empty file.")
+
+    def _text_field(self, pos):
+        """
+        Reads a text field (lines between two lines starting with a semicolon).
+
+        Parameters:
+        -----------
+        pos : int
+            Position of the opening semicolon.
+
+        Returns:
+        --------
+        tokens : list of str
+            The text field, followed by the tokens after the closing semicolon.
+        end : int
+            Position of the end of the line of the closing semicolon.
+        """
+        data = self._data
+        end = data.find(b"\n", pos)
+        end = len(data) if end < 0 else end
+        token_buffer = [data[pos + 1:end].decode().rstrip()]
+        while end < len(data):
+            pos = end + 1
+            end = data.find(b"\n", pos)
+            end = len(data) if end < 0 else end
+            line = data[pos:end].decode().rstrip()
+            if line.startswith(";"):
+                line = line[1:]
+                if line and line[0] not in (" ", "\t"):
+                    raise ValueError("Missing whitespace")
+                return ["\n".join(token_buffer)] + list(split_cif_line(line.strip())), end
+            token_buffer.append(line)
+        raise ValueError("Missing closing semicolon")
+
+    def _loop_end(self, pos):
+        """
+        Finds the end of the data of a loop: the next line starting a tag, loop or data block
+        that is not inside a text field.
+
+        Parameters:
+        -----------
+        pos : int
+            Position of the first line of data of the loop.
+
+        Returns:
+        --------
+        end : int
+        """
+        in_text_field = False
+        for match in HEADER_LINE.finditer(self._data, pos - 1):
+            if match.group() == b"\n;":
+                in_text_field = not in_text_field
+            elif not in_text_field:
+                return match.start() + 1
+        return len(self._data)
+
+    def _read_loop(self, loop, columns, chunk_size=1 << 22):
+        """
+        Decodes some columns of a loop.
+
+        Loop data is read in chunks of whole lines and split on whitespace. If a chunk holds
+        text fields, comments or quoted values containing whitespace, the loop is tokenized
+        like MMCIF2Dict instead.
+
+        Parameters:
+        -----------
+        loop : dict
+            The loop, as recorded by _index.
+        columns : list of int
+            Indices of the columns to decode.
+        chunk_size : int, optional
+            Approximate number of bytes split at once.
+
+        Returns:
+        --------
+        values : dict
+            The values of each column, by column index.
+        """
+        if 'bcif_columns' in loop:
+            return dict((column, bcifutils.decode_column(loop['bcif_columns'][column])) for column in columns)
+        data = self._data
+        n_columns = loop['n_columns']
+        values = dict((column, []) for column in columns)
+        n_tokens = 0
+        pos = loop['start']
+        while pos < loop['end']:
+            end = data.find(b"\n", min(pos + chunk_size, loop['end'] - 1))
+            end = loop['end'] if end < 0 or end >= loop['end'] else end + 1
+            text = "\n" + data[pos:end].decode()
+            if "\n#" in text:
+                text = COMMENT_LINE.sub("", text)
+            # Text fields, other comments and quoted values with whitespace need the full tokenizer
+            if ("\n;" in text or "#" in text and re.search(r"\s#", text)
+                    or ("'" in text or '"' in text) and QUOTED_WHITESPACE.search(text)):
+                return self._read_loop_slow(loop, columns)
+            tokens = text.split()
+            for column in columns:
+                column_tokens = tokens[(column - n_tokens) % n_columns::n_columns]
+                if "'" in text or '"' in text:
+                    column_tokens = [token[1:-1] if token[0] in QUOTES else token for token in column_tokens]
+                values[column].extend(column_tokens)
+            n_tokens += len(tokens)
+            pos = end
+        return values
+
+    def _read_loop_slow(self, loop, columns):
+        """
+        Decodes some columns of a loop, tokenizing its data like MMCIF2Dict.
+
+        Parameters:
+        -----------
+        loop : dict
+            The loop, as recorded by _index.
+        columns : list of int
+            Indices of the columns to decode.
+
+        Returns:
+        --------
+        values : dict
+            The values of each column, by column index.
+        """
+        data = self._data
+        tokens = []
+        pos = loop['start']
+        while pos < loop['end']:
+            end = data.find(b"\n", pos)
+            end = loop['end'] if end < 0 or end > loop['end'] else end
+            line = data[pos:end].decode()
+            if line.startswith(";"):
+                line_tokens, end = self._text_field(pos)
+                tokens.extend(line_tokens)
+            elif not line.startswith("#"):
+                tokens.extend(split_cif_line(line.strip()))
+            pos = end + 1
+        n_columns = loop['n_columns']
+        return dict((column, tokens[column::n_columns]) for column in columns)
+
+def split_cif_line(line):
+    """
+    Splits a line of a CIF into tokens, removing quotes and comments (as MMCIF2Dict does).
+
+    Parameters:
+    -----------
+    line : str
+        Line of the CIF, without its newline.
+
+    Returns:
+    --------
+    Generator of str
+    """
+    in_token = False
+    quote_open_char = None
+    start_i = 0
+    for i, c in enumerate(line):
+        if c in (" ", "\t"):
+            if in_token and not quote_open_char:
+                in_token = False
+                yield line[start_i:i]
+        elif c in QUOTES:
+            if not quote_open_char and not in_token:
+                quote_open_char = c
+                in_token = True
+                start_i = i + 1
+            elif c == quote_open_char and (i + 1 == len(line) or line[i + 1] in (" ", "\t")):
+                quote_open_char = None
+                in_token = False
+                yield line[start_i:i]
+        elif c == "#" and not in_token:
+            return
+        elif not in_token:
+            in_token = True
+            start_i = i
+    if in_token:
+        yield line[start_i:]
+    if quote_open_char:
+        raise ValueError("Line ended with quote open: " + line)
+
+def read_first_model_residues(filename, auth_chains=True, auth_residues=True):
+    """
+    Reads the chains and residues of the first model of a CIF, in the order in which
+    Bio.PDB.FastMMCIFParser builds them, without building atoms.
+
+    Only the columns of _atom_site naming residues are decoded, and consecutive atoms of the
+    same residue are handled once. Atoms without a residue number ('.') are skipped, chains that
+    are discontinuous are merged, and a residue redefined with another name (point mutation) is
+    moved to the end of its chain under its latest name, as FastMMCIFParser does.
+
+    Parameters:
+    -----------
+    filename : str
+        Path of the CIF.
+    auth_chains : bool, optional
+        If True, chain IDs are read from auth_asym_id, otherwise from label_asym_id. Default is True.
+    auth_residues : bool, optional
+        If True, residue numbers are read from auth_seq_id (when present), otherwise from
+        label_seq_id. Default is True.
+
+    Returns:
+    --------
+    chains : list of tuple
+        (chain ID, residues) for each chain, where residues is a list of (residue ID, residue name)
+        and residue ID is the Biopython residue ID (hetero flag, residue number, insertion code).
+    """
+    with MMCIFFile(filename) as mmcif_dict:
+        chain_tag = '_atom_site.auth_asym_id' if auth_chains else '_atom_site.label_asym_id'
+        if auth_residues and '_atom_site.auth_seq_id' in mmcif_dict:
+            seq_tag = '_atom_site.auth_seq_id'
+        else:
+            seq_tag = '_atom_site.label_seq_id'
+        tags = ['_atom_site.group_PDB', chain_tag, seq_tag, '_atom_site.pdbx_PDB_ins_code', '_atom_site.label_comp_id']
+        if '_atom_site.pdbx_PDB_model_num' in mmcif_dict:
+            tags.append('_atom_site.pdbx_PDB_model_num')
+        atom_site = mmcif_dict.columns(tags)
+    instrumentutils.count('atoms', len(atom_site[0]))
+    if len(atom_site) == 5:
+        atom_site.append(repeat(None))
+
+    chains = []
+    chain_residues = {}
+    first_model = None
+    current_chain_id = None
+    current_residue = None
+    # Consecutive atoms of a residue are identical in these columns
+    for (group, chain_id, resseq, icode, resname, model), atoms in groupby(zip(*atom_site)):
+        if resseq == '.':
+            continue
+        if model is not None:
+            if first_model is None:
+                first_model = int(model)
+            elif int(model) != first_model:
+                break
+        if chain_id != current_chain_id:
+            current_chain_id = chain_id
+            current_residue = None
+            if chain_id not in chain_residues:
+                chain_residues[chain_id] = ([], {})
+                chains.append((chain_id, chain_residues[chain_id][0]))
+            residues, residue_index = chain_residues[chain_id]
+        hetatm_flag = 'H' if group == 'HETATM' else ' '
+        if icode in ('.', '?'):
+            icode = ' '
+        residue = (hetatm_flag, int(resseq), icode, resname)
+        if residue == current_residue:
+            continue
+        current_residue = residue
+        field = 'H_' + resname if hetatm_flag == 'H' else ' '
+        res_id = (field, int(resseq), icode)
+        if res_id not in residue_index:
+            # [residue ID, residue name, names of a point mutation]
+            residue_index[res_id] = [res_id, resname, None]
+            residues.append(residue_index[res_id])
+        elif field == ' ':
+            entry = residue_index[res_id]
+            if entry[2] is None and resname != entry[1]:
+                entry[2] = set([entry[1]])
+                residues.remove(entry)
+                residues.append(entry)
+            if entry[2] is not None:
+                entry[2].add(resname)
+                entry[1] = resname
+    return [(chain_id, [(entry[0], entry[1]) for entry in residues]) for chain_id, residues in chains]
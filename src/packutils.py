@@ -0,0 +1,509 @@
+from __future__ import print_function
+import os
+import io
+import json
+import mmap
+import time
+import zlib
+import shutil
+import struct
+import threading
+from collections import namedtuple
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# A packed bank is a single file that takes the place of the directory of a bank, so the paths
+# of its files (such as my_project/simple_bank/1ABC+00.cif) stay the same. It starts with
+# PACK_MAGIC and PACK_VERSION, followed by records that are only ever appended:
+#   FILE   a file: its name and content
+#   DELE   a file removed from the bank: its name, no content
+#   INDX   the index of the files of the bank at that point (offset, size, modification time
+#          and CRC-32 of each), zlib-compressed JSON, followed by the trailer (INDEX_MAGIC and
+#          the offset of the INDX record)
+# Readers map the file and find the last index from the trailer. If the file does not end with
+# a trailer (a writer stopped before closing it), the records are scanned from the start.
+PACK_MAGIC = b'PDBCLEAN-PACK\r\n\x1a'
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct('>16sH')
+# Kind, length of the name, length of the content, modification time (ns) and CRC-32 of the content
+RECORD_HEADER = struct.Struct('>4sHQqI')
+TRAILER = struct.Struct('>4sQ')
+INDEX_MAGIC = b'PIDX'
+FILE_RECORD, DELETE_RECORD, INDEX_RECORD = b'FILE', b'DELE', b'INDX'
+# os.stat of a file of a packed bank
+EntryStat = namedtuple('EntryStat', ['st_size', 'st_mtime', 'st_mtime_ns'])
+
+#########
+# INDEX #
+#########
+
+def read_index(data, start=PACK_HEADER.size):
+    """
+    Reads the index of a packed bank: from the trailer at the end of data if there is one, or
+    else by scanning the records from start.
+
+    Parameters:
+    -----------
+    data : bytes-like
+        Content of the packed bank (usually a memory map).
+    start : int, optional
+        Offset of the first record. Default is just after the header.
+
+    Returns:
+    --------
+    entries : dict
+        Maps the name of each file to [offset, size, mtime_ns, crc32] of its content.
+    end : int
+        Offset of the end of the last complete record: anything after it was left by a writer
+        that stopped before finishing a record.
+    """
+    size = len(data)
+    if size >= start + TRAILER.size:
+        magic, offset = TRAILER.unpack_from(data, size - TRAILER.size)
+        if magic == INDEX_MAGIC and start <= offset <= size - TRAILER.size - RECORD_HEADER.size:
+            kind, name_length, data_length, mtime_ns, crc = RECORD_HEADER.unpack_from(data, offset)
+            index_start = offset + RECORD_HEADER.size + name_length
+            if kind == INDEX_RECORD and index_start + data_length + TRAILER.size == size:
+                index = bytes(data[index_start:index_start + data_length])
+                if zlib.crc32(index) == crc:
+                    return json.loads(zlib.decompress(index).decode()), size
+    entries = {}
+    pos = end = start
+    while pos + RECORD_HEADER.size <= size:
+        kind, name_length, data_length, mtime_ns, crc = RECORD_HEADER.unpack_from(data, pos)
+        data_start = pos + RECORD_HEADER.size + name_length
+        record_end = data_start + data_length + (TRAILER.size if kind == INDEX_RECORD else 0)
+        if kind not in (FILE_RECORD, DELETE_RECORD, INDEX_RECORD) or record_end > size:
+            break
+        name = bytes(data[pos + RECORD_HEADER.size:data_start]).decode()
+        if kind == FILE_RECORD:
+            entries[name] = [data_start, data_length, mtime_ns, crc]
+        elif kind == DELETE_RECORD:
+            entries.pop(name, None)
+        pos = end = record_end
+    return entries, end
+
+def is_pack(path):
+    """
+    Returns True if path is a packed bank.
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as packfile:
+        return packfile.read(len(PACK_MAGIC)) == PACK_MAGIC
+
+###########
+# READING #
+###########
+
+class PackFile(object):
+    """
+    Packed bank opened for reading. The file is memory-mapped, so each file of the bank is
+    read without reading the others.
+
+    Methods:
+    --------
+    names():
+        Returns the names of the files of the bank, sorted.
+
+    stat(name):
+        Returns the size and modification time of a file.
+
+    read(name):
+        Returns the content of a file.
+
+    open(name):
+        Returns a binary file object on the content of a file.
+
+    close():
+        Unmaps the file.
+    """
+    def __init__(self, path):
+        """
+        Initializes the PackFile class by mapping a packed bank and reading its index.
+
+        Parameters:
+        -----------
+        path : str
+            Path of the packed bank.
+        """
+        self.path = path
+        with open(path, 'rb') as packfile:
+            header = packfile.read(PACK_HEADER.size)
+            if len(header) < PACK_HEADER.size or header[:len(PACK_MAGIC)] != PACK_MAGIC:
+                raise ValueError('Not a packed bank: ' + path)
+            if PACK_HEADER.unpack(header)[1] != PACK_VERSION:
+                raise ValueError('Packed bank written by another version of PDBClean: ' + path)
+            self._data = mmap.mmap(packfile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.entries, self.end = read_index(self._data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def names(self):
+        return sorted(self.entries)
+
+    def _entry(self, name):
+        if name not in self.entries:
+            raise FileNotFoundError('No such file in packed bank {0}: {1}'.format(self.path, name))
+        return self.entries[name]
+
+    def stat(self, name):
+        offset, size, mtime_ns, crc = self._entry(name)
+        return EntryStat(size, mtime_ns / 1e9, mtime_ns)
+
+    def read(self, name):
+        offset, size, mtime_ns, crc = self._entry(name)
+        return self._data[offset:offset + size]
+
+    def open(self, name):
+        entry = io.BytesIO(self.read(name))
+        entry.name = self.path + '/' + name
+        return entry
+
+    def close(self):
+        self._data.close()
+
+# Packed banks opened by get_pack, with the size and modification time they had then
+_packs = {}
+_packs_lock = threading.Lock()
+
+def get_pack(path):
+    """
+    Returns the PackFile of a packed bank, opened once and kept open until the file changes.
+    """
+    stat = os.stat(path)
+    with _packs_lock:
+        cached = _packs.get(path)
+        if cached is None or cached[0] != (stat.st_size, stat.st_mtime_ns):
+            # A PackFile replaced here is not closed, as other threads may still be reading it
+            cached = ((stat.st_size, stat.st_mtime_ns), PackFile(path))
+            _packs[path] = cached
+        return cached[1]
+
+def close_packs():
+    """
+    Forgets the packed banks opened by get_pack, so they are mapped and indexed again when next read.
+    """
+    with _packs_lock:
+        _packs.clear()
+
+def split_pack_path(path):
+    """
+    Splits the path of a file of a packed bank into the path of the bank and the name of the
+    file in it, or returns None if no parent directory of path is a packed bank.
+    """
+    parent, name = os.path.split(path)
+    while parent and not os.path.isdir(parent):
+        if is_pack(parent):
+            return parent, name
+        parent, base = os.path.split(parent)
+        name = base + '/' + name
+    return None
+
+def _pack_entry(path):
+    split = split_pack_path(path)
+    if split is None:
+        raise FileNotFoundError('No such file or directory: ' + path)
+    return get_pack(split[0]), split[1]
+
+def read_entry(path):
+    """
+    Returns the content of a file of a packed bank, given its path (the path of the bank, followed
+    by its name).
+    """
+    pack, name = _pack_entry(path)
+    return pack.read(name)
+
+def open_entry(path):
+    """
+    Returns a binary file object on a file of a packed bank, given its path.
+    """
+    pack, name = _pack_entry(path)
+    return pack.open(name)
+
+def stat_entry(path):
+    """
+    Returns the size and modification time (see EntryStat) of a file of a packed bank, given its path.
+    """
+    pack, name = _pack_entry(path)
+    return pack.stat(name)
+
+###########
+# WRITING #
+###########
+
+class PackWriter(object):
+    """
+    Packed bank opened for appending files. The file is locked while it is open, so several
+    processes can append to the same bank one after the other. Files added or removed are
+    only visible to readers after close, which writes the index.
+
+    Methods:
+    --------
+    add(name, data, mtime_ns=None):
+        Appends a file (replacing the file of the same name, if any).
+
+    remove(name):
+        Removes a file.
+
+    close():
+        Writes the index and unlocks the file.
+    """
+    def __init__(self, path):
+        """
+        Initializes the PackWriter class, creating the packed bank if it does not exist.
+
+        Parameters:
+        -----------
+        path : str
+            Path of the packed bank.
+        """
+        self.path = path
+        self._file = open(path, 'a+b')
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() == 0:
+            self._file.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION))
+            self._file.flush()
+            self.entries, end = {}, PACK_HEADER.size
+        else:
+            with PackFile(path) as pack:
+                self.entries, end = pack.entries, pack.end
+        # Drop the incomplete record left by a writer that stopped before closing the bank
+        self._file.truncate(end)
+        self._changed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def _append(self, kind, name, data, mtime_ns):
+        encoded_name = name.encode()
+        crc = zlib.crc32(data)
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+        self._file.write(RECORD_HEADER.pack(kind, len(encoded_name), len(data), mtime_ns, crc) + encoded_name)
+        self._file.write(data)
+        self._changed = True
+        return [offset + RECORD_HEADER.size + len(encoded_name), len(data), mtime_ns, crc]
+
+    def add(self, name, data, mtime_ns=None):
+        """
+        Appends a file to the bank.
+
+        Parameters:
+        -----------
+        name : str
+            Name of the file in the bank, such as '1ABC+00.cif'.
+        data : bytes
+            Content of the file.
+        mtime_ns : int, optional
+            Modification time of the file, in nanoseconds. Default is the current time.
+
+        Returns:
+        --------
+        None
+        """
+        if mtime_ns is None:
+            mtime_ns = time.time_ns()
+        self.entries[name] = self._append(FILE_RECORD, name, data, mtime_ns)
+
+    def remove(self, name):
+        """
+        Removes a file from the bank (its content stays in the file until the bank is compacted).
+        """
+        if name in self.entries:
+            self._append(DELETE_RECORD, name, b'', time.time_ns())
+            del self.entries[name]
+
+    def close(self):
+        if self._file is None:
+            return
+        if self._changed:
+            index = zlib.compress(json.dumps(self.entries, separators=(',', ':')).encode(), 1)
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(RECORD_HEADER.pack(INDEX_RECORD, 0, len(index), time.time_ns(), zlib.crc32(index)) + index)
+            self._file.write(TRAILER.pack(INDEX_MAGIC, offset))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+#########
+# BANKS #
+#########
+
+def bank_files(directory):
+    """
+    Returns the files of a directory and its subdirectories, as (path, name) pairs, where name
+    is the path relative to the directory (with '/' separators), sorted by name.
+    """
+    files = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            files.append((path, os.path.relpath(path, directory).replace(os.sep, '/')))
+    return sorted(files, key=lambda file: file[1])
+
+def add_files(pack_path, filelist, names=None, verbose=True):
+    """
+    Appends files to a packed bank (creating it if needed), replacing the files of the same name.
+
+    Parameters:
+    -----------
+    pack_path : str
+        Path of the packed bank.
+    filelist : list of str
+        Paths of the files.
+    names : list of str, optional
+        Names of the files in the bank. Default is the base name of each path.
+    verbose : bool, optional
+        If True, the number of files and bytes added is printed. Default is True.
+
+    Returns:
+    --------
+    None
+    """
+    if names is None:
+        names = [os.path.basename(path) for path in filelist]
+    n_bytes = 0
+    with PackWriter(pack_path) as writer:
+        for path, name in zip(filelist, names):
+            with open(path, 'rb') as f:
+                data = f.read()
+            writer.add(name, data, mtime_ns=os.stat(path).st_mtime_ns)
+            n_bytes += len(data)
+    if verbose:
+        print('Added {0} files ({1:.1f} MB) to {2}'.format(len(filelist), n_bytes / 1e6, pack_path))
+
+def pack_bank(directory, verbose=True):
+    """
+    Replaces the directory of a bank by a packed bank, at the same path. Every file of the
+    directory (CIF(s), maps, journals, and the files of its subdirectories) is packed, and
+    read back and compared before the directory is removed.
+
+    Parameters:
+    -----------
+    directory : str
+        The directory of the bank, such as 'my_project/simple_bank'.
+    verbose : bool, optional
+        If True, the number of files and bytes packed is printed. Default is True.
+
+    Returns:
+    --------
+    None
+    """
+    directory = directory.rstrip('/')
+    if not os.path.isdir(directory):
+        raise IOError('Not a directory: ' + directory)
+    files = bank_files(directory)
+    parent, base = os.path.split(directory)
+    tmp_path = os.path.join(parent, '.' + base + '.pack-tmp-' + str(os.getpid()))
+    try:
+        add_files(tmp_path, [path for path, name in files], [name for path, name in files], verbose=False)
+        with PackFile(tmp_path) as pack:
+            for path, name in files:
+                with open(path, 'rb') as f:
+                    if pack.read(name) != f.read():
+                        raise IOError('{0} was not packed correctly'.format(path))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    shutil.rmtree(directory)
+    os.replace(tmp_path, directory)
+    if verbose:
+        print('Packed {0} files ({1:.1f} MB) into {2}'.format(len(files), os.path.getsize(directory) / 1e6,
+                                                             directory))
+
+def unpack_bank(pack_path, verbose=True):
+    """
+    Replaces a packed bank by a directory with its files, at the same path (the reverse of
+    pack_bank). The files keep their modification time.
+
+    Parameters:
+    -----------
+    pack_path : str
+        Path of the packed bank.
+    verbose : bool, optional
+        If True, the number of files unpacked is printed. Default is True.
+
+    Returns:
+    --------
+    None
+    """
+    pack_path = pack_path.rstrip('/')
+    parent, base = os.path.split(pack_path)
+    tmp_dir = os.path.join(parent, '.' + base + '.unpack-tmp-' + str(os.getpid()))
+    try:
+        with PackFile(pack_path) as pack:
+            for name in pack.names():
+                path = os.path.join(tmp_dir, *name.split('/'))
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'wb') as f:
+                    f.write(pack.read(name))
+                mtime_ns = pack.stat(name).st_mtime_ns
+                os.utime(path, ns=(mtime_ns, mtime_ns))
+            n_files = len(pack)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    if not os.path.isdir(tmp_dir):
+        os.mkdir(tmp_dir)
+    os.remove(pack_path)
+    os.replace(tmp_dir, pack_path)
+    if verbose:
+        print('Unpacked {0} files into {1}'.format(n_files, pack_path))
+
+def compact_pack(pack_path, verbose=True):
+    """
+    Rewrites a packed bank without the content of the files that were replaced or removed.
+
+    Parameters:
+    -----------
+    pack_path : str
+        Path of the packed bank.
+    verbose : bool, optional
+        If True, the bytes saved are printed. Default is True.
+
+    Returns:
+    --------
+    None
+    """
+    parent, base = os.path.split(pack_path.rstrip('/'))
+    tmp_path = os.path.join(parent, '.' + base + '.compact-tmp-' + str(os.getpid()))
+    size = os.path.getsize(pack_path)
+    try:
+        with PackFile(pack_path) as pack, PackWriter(tmp_path) as writer:
+            for name in pack.names():
+                writer.add(name, pack.read(name), mtime_ns=pack.stat(name).st_mtime_ns)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, pack_path)
+    if verbose:
+        print('Compacted {0}: {1:.1f} MB -> {2:.1f} MB'.format(pack_path, size / 1e6,
+                                                                os.path.getsize(pack_path) / 1e6))
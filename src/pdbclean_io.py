@@ -1,6 +1,24 @@
 import sys, os, shutil, datetime
+import hashlib
+import gzip
+import io
+import glob
+from fnmatch import fnmatch, fnmatchcase
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+from PDBClean import bcifutils, packutils
 #
 
+# Extensions of the CIF(s) read and written by PDBClean, plain, compressed or BinaryCIF
+CIF_EXTENSIONS = ('.cif', '.cif.gz', '.cif.zst', '.bcif')
+BINARY_CIF_EXTENSION = '.bcif'
+# Extension added to a file by each compression
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
 def check_project(projdir=None, level='top', action='create', verbose=True):
     """
     Manages the project directory by creating, cleaning, or deleting directories.
@@ -17,12 +35,15 @@ def check_project(projdir=None, level='top', action='create', verbose=True):
       - 'create': Create the directory if it doesn't already exist.
       - 'clean': Remove all files in the directory, leaving it empty.
       - 'delete': Deletes the directory and everything within it.
+      - 'catalog': Updates the project catalog (see catalogutils.ProjectCatalog) with the CIF(s) of
+        the banks (all of them if level is 'top'), and returns it.
     verbose : bool, optional
       If True, prints informative messages about the actions being performed. Default is True.
 
     Returns:
     --------
-    None
+    catalog : ProjectCatalog or None
+      The project catalog, if action is 'catalog'.
     """
 
     if projdir is None:
@@ -37,6 +58,18 @@ def check_project(projdir=None, level='top', action='create', verbose=True):
             clean_dir(dirname, verbose=verbose)
         elif(action=='delete'):
             delete_dir(dirname, verbose=verbose)
+        elif(action=='catalog'):
+            from PDBClean.catalogutils import ProjectCatalog, show_catalog_summary
+            catalog = ProjectCatalog(projdir)
+            if(level!='top'):
+                banks = [level]
+            else:
+                banks = sorted(name for name in os.listdir(projdir) if name.endswith('_bank'))
+            for bank in banks:
+                catalog.update_bank(bank, verbose=verbose)
+            if verbose:
+                show_catalog_summary(catalog)
+            return catalog
 
 def create_dir(dirpath, verbose=True):
     """
@@ -64,7 +97,7 @@ def create_dir(dirpath, verbose=True):
     else:
         if verbose:
             print('{0} already exists, with content:'.format(dirpath))
-            print(os.listdir(dirpath))
+            print(list_bank(dirpath))
             
 def clean_dir(dirpath, verbose=True):
     """
@@ -82,7 +115,13 @@ def clean_dir(dirpath, verbose=True):
     None
     """
 
-    if os.path.exists(dirpath):
+    if packutils.is_pack(dirpath):
+        # A packed bank (see packutils) is replaced by an empty directory
+        if verbose:
+            print('Cleaning {0}...'.format(dirpath))
+        os.remove(dirpath)
+        os.mkdir(dirpath)
+    elif os.path.exists(dirpath):
         listfile = (file for file in os.listdir(dirpath) if os.path.isfile(os.path.join(dirpath, file)))
         if verbose:
             print('Cleaning {0}...'.format(dirpath))
@@ -106,6 +145,273 @@ def delete_dir(dirpath, verbose=True):
     """
 
     if os.path.exists(dirpath):
-        shutil.rmtree(dirpath)
+        if os.path.isdir(dirpath):
+            shutil.rmtree(dirpath)
+        else:
+            os.remove(dirpath)
         if verbose:
             print('Deleting {0}...'.format(dirpath))
+
+def file_sha256(filepath, block_size=1 << 20):
+    """
+    Computes the SHA-256 checksum of a file.
+
+    Parameters:
+    -----------
+    filepath : str
+       The path of the file.
+    block_size : int, optional
+       Number of bytes read at a time. Default is 1 MiB.
+
+    Returns:
+    --------
+    checksum : str
+       Hexadecimal SHA-256 digest of the content of the file.
+    """
+
+    checksum = hashlib.sha256()
+    try:
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                checksum.update(block)
+    except NotADirectoryError:
+        checksum.update(packutils.read_entry(filepath))
+    return checksum.hexdigest()
+
+def stat_file(path):
+    """
+    Returns os.stat of a file, or the size and modification time of a file of a packed bank
+    (see packutils.EntryStat).
+    """
+    try:
+        return os.stat(path)
+    except NotADirectoryError:
+        return packutils.stat_entry(path)
+
+def compression_of(path):
+    """
+    Returns the compression of a file from its extension: 'gzip' (.gz), 'zstd' (.zst) or None.
+    """
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if path.endswith(extension):
+            return compression
+    return None
+
+def cif_extension(path):
+    """
+    Returns the CIF extension of a path ('.cif', '.cif.gz', '.cif.zst' or '.bcif'), or None if it is not a CIF.
+    """
+    for extension in CIF_EXTENSIONS:
+        if path.endswith(extension):
+            return extension
+    return None
+
+def cif_basename(path):
+    """
+    Returns the name of a CIF without its directory and CIF extension ('1abc' for 'raw_bank/1abc.cif.gz').
+    """
+    name = os.path.basename(path)
+    extension = cif_extension(name)
+    if extension is not None:
+        name = name[:-len(extension)]
+    return name
+
+def cif_file_extension(compression=None):
+    """
+    Returns the extension of the CIF(s) written with a compression (None, 'gzip' or 'zstd'), or
+    as BinaryCIF ('bcif').
+    """
+    if compression is None or compression == 'none':
+        return '.cif'
+    if compression == 'bcif':
+        return BINARY_CIF_EXTENSION
+    return '.cif' + COMPRESSION_EXTENSIONS[compression]
+
+def list_cif_files(dirname, pattern='*'):
+    """
+    Lists the CIF(s) of a directory, plain or compressed.
+
+    Parameters:
+    -----------
+    dirname : str
+        The directory, or a packed bank (see packutils).
+    pattern : str, optional
+        Shell pattern that the names (without CIF extension) must match. Default is '*'.
+
+    Returns:
+    --------
+    filelist : list of str
+        Paths of the CIF(s), sorted.
+    """
+    filelist = []
+    if os.path.isdir(dirname):
+        for entry in os.scandir(dirname):
+            if cif_extension(entry.name) is not None and not entry.name.startswith('.') \
+                    and fnmatchcase(cif_basename(entry.name), pattern) and entry.is_file():
+                filelist.append(dirname+'/'+entry.name)
+    elif packutils.is_pack(dirname):
+        for name in packutils.get_pack(dirname).names():
+            if cif_extension(name) is not None and not name.startswith('.') and '/' not in name \
+                    and fnmatchcase(cif_basename(name), pattern):
+                filelist.append(dirname+'/'+name)
+    return sorted(filelist)
+
+def list_bank(dirname):
+    """
+    Returns the names of the files of a directory, or of a packed bank (see packutils).
+    """
+    if packutils.is_pack(dirname):
+        return packutils.get_pack(dirname).names()
+    return os.listdir(dirname)
+
+def glob_bank(dirname, pattern):
+    """
+    Returns the paths of the files of a directory, or of a packed bank (see packutils), whose
+    names match a shell pattern (like glob.glob(dirname+'/'+pattern)).
+    """
+    if packutils.is_pack(dirname):
+        return [dirname+'/'+name for name in packutils.get_pack(dirname).names()
+                if '/' not in name and fnmatch(name, pattern) and (pattern.startswith('.') or not name.startswith('.'))]
+    return glob.glob(dirname+'/'+pattern)
+
+def require_zstandard():
+    if zstandard is None:
+        raise ImportError("Reading or writing .zst files requires the zstandard package (pip install zstandard)")
+
+class AtomicFile(object):
+    """
+    File written under a temporary name in the same directory, and renamed to its final name when
+    it is closed, so readers never see a partial file. If the writing fails inside a with block,
+    the temporary file is removed and the final file is left as it was.
+    """
+    def __init__(self, path, mode, open_function):
+        self.name = path
+        directory, basename = os.path.split(path)
+        self.tmp_path = os.path.join(directory, '.' + basename + '.tmp-' + str(os.getpid()))
+        self._file = open_function(self.tmp_path, mode)
+        self.closed = False
+
+    def __getattr__(self, attribute):
+        return getattr(self._file, attribute)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._file.close()
+            os.replace(self.tmp_path, self.name)
+
+    def discard(self):
+        if not self.closed:
+            self.closed = True
+            self._file.close()
+            os.remove(self.tmp_path)
+
+def _open_compressed(path, mode, compression):
+    try:
+        return _open_compressed_file(path, mode, compression)
+    except NotADirectoryError:
+        # Files of packed banks (see packutils) are read from the bank, which cannot be written to
+        split = packutils.split_pack_path(path)
+        if split is None:
+            raise
+        if 'r' not in mode:
+            raise IOError('{0} is a packed bank, which cannot be written to (unpack it first with '
+                          'PDBClean_Pack.py unpack)'.format(split[0]))
+        return _open_compressed_file(packutils.open_entry(path), mode, compression)
+
+def _open_compressed_file(path, mode, compression):
+    binary_mode = mode.replace('t', '')
+    if 'b' not in binary_mode:
+        binary_mode += 'b'
+    if compression == 'gzip':
+        if 'r' in mode:
+            raw = gzip.open(path, binary_mode)
+        else:
+            raw = gzip.open(path, binary_mode, compresslevel=GZIP_LEVEL)
+    elif compression == 'zstd':
+        require_zstandard()
+        if 'r' in mode:
+            raw = zstandard.open(path, binary_mode)
+        else:
+            raw = zstandard.open(path, binary_mode, cctx=zstandard.ZstdCompressor(level=ZSTD_LEVEL))
+    elif isinstance(path, str):
+        return open(path, mode)
+    else:
+        raw = path
+    if 'b' in mode:
+        return raw
+    return io.TextIOWrapper(raw)
+
+def open_file(path, mode='r', compression=None, atomic=None):
+    """
+    Opens a file, compressed or not. Compressed files are decompressed (or compressed) as they
+    are read (or written), without temporary files. Files of packed banks (see packutils) are
+    opened for reading like the files of a directory.
+
+    BinaryCIF files (.bcif) are read and written as the text of the CIF, in text or binary mode:
+    the file is decoded when it is opened for reading, and encoded when it is closed after writing
+    (see bcifutils). They cannot be opened for appending.
+
+    Parameters:
+    -----------
+    path : str
+        Path of the file.
+    mode : str, optional
+        'r', 'w' or 'a', in text (default) or binary ('b') mode. Default is 'r'.
+    compression : str, optional
+        'gzip', 'zstd' or 'none'. If None, the compression is given by the extension (see compression_of).
+    atomic : bool, optional
+        If True, the file is written under a temporary name and renamed when closed (see AtomicFile).
+        Default is True for mode 'w', and False otherwise.
+
+    Returns:
+    --------
+    file : file object
+    """
+    if path.endswith(BINARY_CIF_EXTENSION) and compression is None:
+        if 'r' in mode:
+            text = bcifutils.bcif_to_text(read_bytes(path, decode_bcif=False))
+            return io.BytesIO(text.encode()) if 'b' in mode else io.StringIO(text)
+        if 'a' in mode:
+            raise ValueError("BinaryCIF files cannot be opened for appending: " + path)
+        return bcifutils.BinaryCIFWriter(path, lambda bcif_path, bcif_mode: open_file(bcif_path, bcif_mode,
+                                                                                     compression='none',
+                                                                                     atomic=atomic))
+    if compression == 'none':
+        compression = None
+    elif compression is None:
+        compression = compression_of(path)
+    if atomic is None:
+        atomic = 'w' in mode
+    if atomic:
+        return AtomicFile(path, mode, lambda tmp_path, tmp_mode: _open_compressed(tmp_path, tmp_mode, compression))
+    return _open_compressed(path, mode, compression)
+
+def read_bytes(path, decode_bcif=True):
+    """
+    Returns the content of a file, decompressed if needed. BinaryCIF files are returned as
+    the text of the CIF, unless decode_bcif is False.
+    """
+    if decode_bcif and path.endswith(BINARY_CIF_EXTENSION):
+        return bcifutils.bcif_to_text(read_bytes(path, decode_bcif=False)).encode()
+    compression = compression_of(path)
+    if compression is None:
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except NotADirectoryError:
+            return packutils.read_entry(path)
+    with open_file(path, 'rb') as f:
+        return f.read()
@@ -6,9 +6,9 @@ import re
 import numpy as np
 import csv
 import os
+import glob
 import copy
 import time
-from Bio.PDB.MMCIFParser import FastMMCIFParser
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 from Bio.Align import MultipleSeqAlignment
@@ -16,7 +16,18 @@ from Bio import pairwise2
 from PDBClean.alignmentutils import *
 from PDBClean.listutils import *
 from matching.games import HospitalResident
+from PDBClean.pdbclean_io import file_sha256, open_file
+from PDBClean.mmcifutils import read_first_model_residues
+from PDBClean import instrumentutils
+from PDBClean import progressutils
+from PDBClean.progressutils import message
 import json
+import hashlib
+
+# Structures already standardized, one JSON record per line, in the target directory
+PROGRESS_JOURNAL = 'ChainStandardizationProgress.jsonl'
+# Journal of one shard or worker of a batch run, merged into PROGRESS_JOURNAL
+BATCH_JOURNAL = 'ChainStandardizationProgress.{0}.jsonl'
 
 ####################
 # INITIALIZE STEPS #
@@ -45,20 +56,21 @@ def pdb_to_structurelists(filelist):
     chid_list = []
     structid_list = []
     N = 0
-    for my_file in filelist:
+    for my_file in progressutils.progress(filelist, desc='Reading'):
         N += 1
-        print("Reading:" + ' ' + my_file + "  (" + str(N) + " of " + str(len(filelist)) + ")")
-        struct = FastMMCIFParser(QUIET=1).get_structure(str(my_file), my_file)
-        structid_list.append(struct.get_id())
+        message("Reading:" + ' ' + my_file + "  (" + str(N) + " of " + str(len(filelist)) + ")")
+        structid_list.append(str(my_file))
         chid_seq_map = {}
-        for chain in struct[0]:
-            seq = ""
-            for residue in chain:
-                seq += ResnConvert(residue.get_resname())
-            seq = re.sub('X', '', seq)
-            if (len(seq) > 4):
-                chid_seq_map[chain.get_id()] = seq
-                chid_list.append(chain.get_id())
+        # Residues of the first model, as FastMMCIFParser builds them, without building atoms
+        with instrumentutils.timer('parse', my_file):
+            for chid, residues in read_first_model_residues(my_file):
+                seq = ""
+                for residue_id, resname in residues:
+                    seq += ResnConvert(resname)
+                seq = re.sub('X', '', seq)
+                if (len(seq) > 4):
+                    chid_seq_map[chid] = seq
+                    chid_list.append(chid)
         Structure_Sequences.append(chid_seq_map)
     chid_set = set(chid_list)
     chid_list = sorted(list(chid_set))
@@ -232,6 +244,10 @@ def align_to_std_seq_and_save_to_disk(Structure_Sequences, Standard_Sequences, s
     Allows users to ignore specific chain IDs during alignment. It manages alignment results, renaming chains if
     necessary, and saving new files to disk.
 
+    Every structure written is recorded in a progress journal in target_dir (see record_structure_progress).
+    If the run is interrupted, running it again skips the structures whose input, output and standard
+    sequences have not changed since they were recorded.
+
     Parameters:
     -----------
     Structure_Sequences : list of dict
@@ -281,136 +297,537 @@ def align_to_std_seq_and_save_to_disk(Structure_Sequences, Standard_Sequences, s
         elif (input_submenu == "4"):
             counter=0
 
-            for chid_seq_map in Structure_Sequences:
+            # Structures standardized by a previous (interrupted) run are not done again
+            progress = read_progress_journal(target_dir)
+            standard_checksum = standard_sequences_sha256(Standard_Sequences, ignore_chid)
+            # Structures with the same chain sequences reuse the same alignment scores
+            score_cache = {}
+
+            for chid_seq_map in progressutils.progress(Structure_Sequences, desc='Standardizing chains',
+                                                       unit='structures'):
                 ChainReassignmentMapping_List = []
                 ChainReassignmentScores_List = []
 
                 filelist2=[]
                 filelist2.append(filelist[counter])
 
-                print('I am starting to work on:')
-                print(filelist2)
-                print("this is chid_seq_map and length")
-                print(chid_seq_map)
-                chid_seq_map_len = len(chid_seq_map)
-                print(chid_seq_map_len)
-                std_chid_list = []
-                test_list_list= {}
-                for std_chid in Standard_Sequences:
-                    if std_chid not in ignore_chid: # Standard_Sequences is the dictionary with the {chain IDs:sequences} from the reference structure
-                        print("Now I am working on this chain:")
-                        print(std_chid)
-                        std_chid_list.append(std_chid)
+                if structure_is_done(progress.get(os.path.basename(filelist[counter])), filelist[counter],
+                                     target_dir, standard_checksum):
+                    message('Already standardized, skipping:')
+                    message(filelist2)
+                    counter+=1
+                    continue
+
+                message('I am starting to work on:')
+                message(filelist2)
+                message("this is chid_seq_map and length")
+                message(chid_seq_map)
+                message(len(chid_seq_map))
+                output, output_scores = standardize_structure_chains(chid_seq_map, Standard_Sequences, ignore_chid,
+                                                                     score_cache)
+
+                message('Just finished with this structure:')
+                message(filelist2)
+                message('These are the results:')
+                message(output)
+                message(output_scores)
 
-                        structchid_score_map = {}
-                        if std_chid in chid_seq_map:
-                            aligned_seq = AlignSequences([Standard_Sequences[std_chid], chid_seq_map[std_chid]])
-                            score = ScoreSequenceAlignment(aligned_seq[0], aligned_seq[1])
-                            # If score is perfect, don't bother aligning all chains
-                            if (score >= 0.85):
-                                structchid_score_map[std_chid] = score
-                                for struct_chid in chid_seq_map:
-                                    if struct_chid not in ignore_chid:
-                                        if (struct_chid != std_chid):
-                                            structchid_score_map[struct_chid] = 0
-                        # If score is not perfect, align all chains
-                            else:
-                                for struct_chid in chid_seq_map:
-                                    if struct_chid not in ignore_chid:
-                                        aligned_seq = AlignSequences([Standard_Sequences[std_chid], chid_seq_map[struct_chid]])
-                                        score = ScoreSequenceAlignment(aligned_seq[0], aligned_seq[1])
-                                        structchid_score_map[struct_chid] = score
-                    # Chid of standard does not match any structure chid, so perform all alignments
-                        else:
-                            for struct_chid in chid_seq_map:
-                                if struct_chid not in ignore_chid:
-                                    aligned_seq = AlignSequences([Standard_Sequences[std_chid], chid_seq_map[struct_chid]])
-                                    score = ScoreSequenceAlignment(aligned_seq[0], aligned_seq[1])
-                                    structchid_score_map[struct_chid] = score
+                ChainReassignmentMapping_List.append(output) # FAPA NEW SCORES
+                ChainReassignmentScores_List.append(output_scores) # FAPA NEW SCORES
 
+                ##
+                # Here is where we start writing the new structures
+                ##
 
-                    #if std_chid not in ignore_chid: # we don't want to have any of the ignored chains 0_0
-                        test_list_list[std_chid] = structchid_score_map
+                reassignedmaps_to_pdb(filelist2, ChainReassignmentMapping_List, filelist2, target_dir=target_dir)
+                reassignedmaps_to_log(ChainReassignmentMapping_List, ChainReassignmentScores_List, filelist2, target_dir=target_dir)
 
-                        print("Chains already completed:")
-                        print(std_chid_list)
+                new_pdb_out=target_dir+"/"+(filelist2[0]).split('/')[-1]
+                message("new_pdb_out")
+                message(new_pdb_out)
 
-                ######
-                #  In this section we re-structure the data we collected in previous step. In previous step we filled in a
-                #  "matrix" of chainids and scores. In this section we first create the 'transpose', and then we sort both
-                # dictionaries of chainids by their scores.
-                # This step is necessary to later use the matching algorithm to assign the new chain ids.
-                #
-                ######
-                test_list_list_T = {}
-                for tll_key in test_list_list.keys():
-                    for tll_sub_key in test_list_list[tll_key].keys():
-                        if tll_sub_key not in test_list_list_T:
-                            test_list_list_T[tll_sub_key] = {}
-                        test_list_list_T[tll_sub_key][tll_key] = test_list_list[tll_key][tll_sub_key]
+                while not os.path.exists(new_pdb_out):
+                    instrumentutils.sleep(1) #FAPA, WAITING LESS TIME
+                    message("waiting...")
 
+                while not os.path.getsize(new_pdb_out) > 0:
+                    instrumentutils.sleep(1) #FAPA, WAITING LESS TIME
+                    message("waiting even more...")
 
-                test_list_list_sortkey2 = {}
-                for tll_key in test_list_list.keys():
-                    test_list_list_sortkey2[tll_key] = sorted(test_list_list[tll_key], key=lambda x:test_list_list[tll_key][x], reverse=True)
+                record_structure_progress(filelist[counter], output, output_scores, standard_checksum, target_dir)
 
+                counter+=1
 
-                test_list_list_T_sortkey = {}
-                for tll_key in test_list_list_T.keys():
-                    test_list_list_T_sortkey[tll_key] = sorted(test_list_list_T[tll_key], key=lambda x:test_list_list_T[tll_key][x], reverse=True)
+                input_submenu = "QUIT"
 
-                ########
-                # The following section uses the matching python library to assign the chain IDs. We use the HospitalResident algorithm
-                # We create a capacities variable, that assigns only one chain per hospital.
-                ########
+def standardize_structure_chains(chid_seq_map, Standard_Sequences, ignore_chid=None, score_cache=None):
+    """
+    Finds the new chain IDs of one structure: scores the alignment of each of its chains against
+    each standard sequence, and matches chains to standard chain IDs with the Hospital/Resident
+    algorithm (one chain per standard chain ID).
 
-                capacities={}
-                for h in list(test_list_list_sortkey2.keys()):
-                    capacities[h] = 1
+    Parameters:
+    -----------
+    chid_seq_map : dict
+        Maps the chain IDs of the structure to their sequences.
+    Standard_Sequences : dict
+        Dictionary where each key is a chain ID and each value is the sequence associated
+        with that chain ID.
+    ignore_chid : list of str, optional
+        Chain IDs that are not aligned to the standard sequences.
+    score_cache : dict, optional
+        Alignment scores already computed, by pair of sequences (see pairwise_alignment_score).
+        Sharing one cache between structures aligns each unique sequence only once.
 
-                game = HospitalResident.create_from_dictionaries(test_list_list_sortkey2, test_list_list_T_sortkey, capacities)
-                solved_game = game.solve()
+    Returns:
+    --------
+    output : dict
+        Maps the original chain IDs of the structure to their new chain IDs.
+    output_scores : dict
+        Maps the original chain IDs of the structure to the score of their new chain ID, as a string.
+    """
+    if ignore_chid is None:
+        ignore_chid = []
+    std_chid_list = []
+    test_list_list= {}
+    for std_chid in Standard_Sequences:
+        if std_chid not in ignore_chid: # Standard_Sequences is the dictionary with the {chain IDs:sequences} from the reference structure
+            message("Now I am working on this chain:")
+            message(std_chid)
+            std_chid_list.append(std_chid)
+
+            structchid_score_map = {}
+            if std_chid in chid_seq_map:
+                score = pairwise_alignment_score(Standard_Sequences[std_chid], chid_seq_map[std_chid], score_cache)
+                # If score is perfect, don't bother aligning all chains
+                if (score >= 0.85):
+                    structchid_score_map[std_chid] = score
+                    for struct_chid in chid_seq_map:
+                        if struct_chid not in ignore_chid:
+                            if (struct_chid != std_chid):
+                                structchid_score_map[struct_chid] = 0
+            # If score is not perfect, align all chains
+                else:
+                    for struct_chid in chid_seq_map:
+                        if struct_chid not in ignore_chid:
+                            score = pairwise_alignment_score(Standard_Sequences[std_chid], chid_seq_map[struct_chid], score_cache)
+                            structchid_score_map[struct_chid] = score
+        # Chid of standard does not match any structure chid, so perform all alignments
+            else:
+                for struct_chid in chid_seq_map:
+                    if struct_chid not in ignore_chid:
+                        score = pairwise_alignment_score(Standard_Sequences[std_chid], chid_seq_map[struct_chid], score_cache)
+                        structchid_score_map[struct_chid] = score
 
-                output = {}
-                for k in solved_game.keys():
-                    output[str(k)] = str(solved_game[k][0])
 
-                output_scores = {}
-                for k in output.keys():
-                    output_scores[str(k)] = str(test_list_list_T[k][output[k]])
+        #if std_chid not in ignore_chid: # we don't want to have any of the ignored chains 0_0
+            test_list_list[std_chid] = structchid_score_map
 
+            message("Chains already completed:")
+            message(std_chid_list)
 
-                print('Just finished with this structure:')
-                print(filelist2)
-                print('These are the results:')
-                print(output)
-                print(output_scores)
+    ######
+    #  In this section we re-structure the data we collected in previous step. In previous step we filled in a
+    #  "matrix" of chainids and scores. In this section we first create the 'transpose', and then we sort both
+    # dictionaries of chainids by their scores.
+    # This step is necessary to later use the matching algorithm to assign the new chain ids.
+    #
+    ######
+    test_list_list_T = {}
+    for tll_key in test_list_list.keys():
+        for tll_sub_key in test_list_list[tll_key].keys():
+            if tll_sub_key not in test_list_list_T:
+                test_list_list_T[tll_sub_key] = {}
+            test_list_list_T[tll_sub_key][tll_key] = test_list_list[tll_key][tll_sub_key]
 
-                ChainReassignmentMapping_List.append(output) # FAPA NEW SCORES
-                ChainReassignmentScores_List.append(output_scores) # FAPA NEW SCORES
 
-                ##
-                # Here is where we start writing the new structures
-                ##
+    test_list_list_sortkey2 = {}
+    for tll_key in test_list_list.keys():
+        test_list_list_sortkey2[tll_key] = sorted(test_list_list[tll_key], key=lambda x:test_list_list[tll_key][x], reverse=True)
 
-                reassignedmaps_to_pdb(filelist2, ChainReassignmentMapping_List, filelist2, target_dir=target_dir)
-                reassignedmaps_to_log(ChainReassignmentMapping_List, ChainReassignmentScores_List, filelist2, target_dir=target_dir)
 
-                new_pdb_out=target_dir+"/"+(filelist2[0]).split('/')[-1]
-                print("new_pdb_out")
-                print(new_pdb_out)
+    test_list_list_T_sortkey = {}
+    for tll_key in test_list_list_T.keys():
+        test_list_list_T_sortkey[tll_key] = sorted(test_list_list_T[tll_key], key=lambda x:test_list_list_T[tll_key][x], reverse=True)
 
-                while not os.path.exists(new_pdb_out):
-                    time.sleep(1) #FAPA, WAITING LESS TIME
-                    print("waiting...")
+    ########
+    # The following section uses the matching python library to assign the chain IDs. We use the HospitalResident algorithm
+    # We create a capacities variable, that assigns only one chain per hospital.
+    ########
 
-                while not os.path.getsize(new_pdb_out) > 0:
-                    time.sleep(1) #FAPA, WAITING LESS TIME
-                    print("waiting even more...")
+    capacities={}
+    for h in list(test_list_list_sortkey2.keys()):
+        capacities[h] = 1
 
-                counter+=1
+    with instrumentutils.timer('match'):
+        game = HospitalResident.create_from_dictionaries(test_list_list_sortkey2, test_list_list_T_sortkey, capacities)
+        solved_game = game.solve()
 
-                input_submenu = "QUIT"
+    output = {}
+    for k in solved_game.keys():
+        output[str(k)] = str(solved_game[k][0])
+
+    output_scores = {}
+    for k in output.keys():
+        output_scores[str(k)] = str(test_list_list_T[k][output[k]])
+
+    return output, output_scores
+
+def read_progress_journal(target_dir, journal=PROGRESS_JOURNAL):
+    """
+    Reads the progress journal of the chain ID standardization.
+
+    Parameters:
+    -----------
+    target_dir : str
+        Directory where the new files are saved.
+    journal : str, optional
+        File name of the journal. Default is PROGRESS_JOURNAL.
+
+    Returns:
+    --------
+    progress : dict
+        Maps the file name of each structure to its latest record.
+    """
+    progress = {}
+    journalfilename = target_dir+'/'+journal
+    if os.path.isfile(journalfilename):
+        with open(journalfilename) as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last line of a run that was killed while writing it
+                    continue
+                progress[record['structure']] = record
+    return progress
+
+def standard_sequences_sha256(Standard_Sequences, ignore_chid):
+    """
+    Computes a checksum of the standard sequences and of the chain IDs to ignore, which
+    determine the chain reassignment of every structure.
+
+    Parameters:
+    -----------
+    Standard_Sequences : dict
+        Dictionary where each key is a chain ID and each value is the sequence associated
+        with that chain ID.
+    ignore_chid : list of str
+        Chain IDs that are not aligned to the standard sequences.
+
+    Returns:
+    --------
+    checksum : str
+    """
+    text = json.dumps([Standard_Sequences, sorted(ignore_chid)], sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def structure_is_done(record, ciffile, target_dir, standard_checksum):
+    """
+    Checks that a structure recorded in the progress journal does not need to be standardized again:
+    its input file and the standard sequences are those of the record, and its output file is intact.
+
+    Parameters:
+    -----------
+    record : dict or None
+        Record of the structure in the progress journal.
+    ciffile : str
+        Path of the input CIF.
+    target_dir : str
+        Directory where the new files are saved.
+    standard_checksum : str
+        Checksum of the current standard sequences (see standard_sequences_sha256).
+
+    Returns:
+    --------
+    done : bool
+    """
+    if record is None or record['standard_sha256'] != standard_checksum:
+        return False
+    new_pdb_out = target_dir+'/'+os.path.basename(ciffile)
+    if not os.path.isfile(new_pdb_out):
+        return False
+    return record['input_sha256'] == file_sha256(ciffile) and record['output_sha256'] == file_sha256(new_pdb_out)
+
+def record_structure_progress(ciffile, output, output_scores, standard_checksum, target_dir, journal=PROGRESS_JOURNAL):
+    """
+    Appends a structure that was standardized to the progress journal, with the checksums of its
+    input and output files and its chain reassignment. The record is on disk when this returns.
+
+    Parameters:
+    -----------
+    ciffile : str
+        Path of the input CIF.
+    output : dict
+        Maps the original chain IDs of the structure to their new chain IDs.
+    output_scores : dict
+        Maps the original chain IDs of the structure to the score of their new chain ID.
+    standard_checksum : str
+        Checksum of the standard sequences (see standard_sequences_sha256).
+    target_dir : str
+        Directory where the new files are saved.
+    journal : str, optional
+        File name of the journal. Default is PROGRESS_JOURNAL.
+
+    Returns:
+    --------
+    None
+    """
+    record = {'structure': os.path.basename(ciffile),
+              'input': ciffile,
+              'input_sha256': file_sha256(ciffile),
+              'output_sha256': file_sha256(target_dir+'/'+os.path.basename(ciffile)),
+              'standard_sha256': standard_checksum,
+              'reassignment': output,
+              'scores': output_scores}
+    with open(target_dir+'/'+journal, 'a') as journalfile:
+        journalfile.write(json.dumps(record, sort_keys=True)+'\n')
+        journalfile.flush()
+        os.fsync(journalfile.fileno())
+
+#########################
+# BATCH STANDARDIZATION #
+#########################
+
+def parse_shard(shard):
+    """
+    Reads a shard given as 'i/N': the i-th of N slices of the list of files, counting from 0.
+
+    Parameters:
+    -----------
+    shard : str
+        Shard, such as '0/4'.
+
+    Returns:
+    --------
+    shard_index : int
+    n_shards : int
+    """
+    try:
+        shard_index, n_shards = [int(number) for number in shard.split('/')]
+    except ValueError:
+        raise ValueError("Shard must be given as i/N, for example 0/4, not {0}".format(shard))
+    if not 0 <= shard_index < n_shards:
+        raise ValueError("Shard index must be between 0 and N-1, not {0}".format(shard))
+    return shard_index, n_shards
+
+def shard_filelist(filelist, shard_index, n_shards):
+    """
+    Returns the files of one shard. Files are sorted first, so every node computes the same slices.
+
+    Parameters:
+    -----------
+    filelist : list of str
+    	list of file paths for all '.cif' files in specified directory
+    shard_index : int
+    n_shards : int
+
+    Returns:
+    --------
+    shard_files : list of str
+    """
+    return sorted(filelist)[shard_index::n_shards]
+
+def claim_structures(filelist, claims_dir, worker):
+    """
+    Work queue shared by several nodes through a directory: a structure is claimed by creating
+    its claim file, which succeeds for only one worker (O_CREAT | O_EXCL). Structures claimed by
+    this worker in a previous run are returned again, so a worker that was stopped can be restarted.
+
+    Parameters:
+    -----------
+    filelist : list of str
+    	list of file paths for all '.cif' files in specified directory
+    claims_dir : str
+        Directory of the claim files, shared by all the workers.
+    worker : str
+        Name of this worker, unique among the workers.
+
+    Returns:
+    --------
+    Generator of str
+        Paths of the files claimed by this worker.
+    """
+    if not os.path.isdir(claims_dir):
+        os.makedirs(claims_dir, exist_ok=True)
+    for ciffile in sorted(filelist):
+        claimfilename = claims_dir+'/'+os.path.basename(ciffile)+'.claim'
+        try:
+            fd = os.open(claimfilename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            with open(claimfilename) as claimfile:
+                owner = claimfile.read().strip()
+            if owner != worker:
+                continue
+        else:
+            with os.fdopen(fd, 'w') as claimfile:
+                claimfile.write(worker+'\n')
+        yield ciffile
+
+def standardize_batch(filelist, Standard_Sequences, target_dir, journal, ignore_chid=None, claims_dir=None,
+                      worker=None):
+    """
+    Standardizes the chain IDs of a batch of structures against frozen standard sequences, without
+    user interaction. Structures are read one at a time, and recorded in the batch journal, so an
+    interrupted batch is resumed by running it again.
+
+    Parameters:
+    -----------
+    filelist : list of str
+    	list of file paths of the structures of the batch (or of all structures, with claims_dir)
+    Standard_Sequences : dict
+        Dictionary where each key is a chain ID and each value is the sequence associated
+        with that chain ID.
+    target_dir : str
+        Directory where the new files will be saved
+    journal : str
+        File name of the journal of this batch (see BATCH_JOURNAL).
+    ignore_chid : list of str, optional
+        Chain IDs that are not aligned to the standard sequences.
+    claims_dir : str, optional
+        If given, structures are taken from the work queue in this directory (see claim_structures).
+    worker : str, optional
+        Name of this worker in the work queue.
+
+    Returns:
+    --------
+    n_standardized : int
+        Number of structures standardized (not counting those done before).
+    """
+    if ignore_chid is None:
+        ignore_chid = []
+    progress = read_progress_journal(target_dir, journal)
+    standard_checksum = standard_sequences_sha256(Standard_Sequences, ignore_chid)
+    if claims_dir is not None:
+        filelist = claim_structures(filelist, claims_dir, worker)
+    n_standardized = 0
+    score_cache = {}
+    for ciffile in filelist:
+        if structure_is_done(progress.get(os.path.basename(ciffile)), ciffile, target_dir, standard_checksum):
+            continue
+        chid_seq_map = pdb_to_structurelists([ciffile])[0][0]
+        output, output_scores = standardize_structure_chains(chid_seq_map, Standard_Sequences, ignore_chid,
+                                                             score_cache)
+        reassignedmaps_to_pdb([ciffile], [output], [ciffile], target_dir=target_dir)
+        record_structure_progress(ciffile, output, output_scores, standard_checksum, target_dir, journal=journal)
+        n_standardized += 1
+    return n_standardized
+
+def standardize_structures(Structure_Sequences, Standard_Sequences, filelist, target_dir, ignore_chid=None,
+                           verbose=True):
+    """
+    Standardizes the chain IDs of structures whose sequences are already in memory, without user
+    interaction. Each structure is recorded in the progress journal as soon as it is written, so
+    running it again only standardizes the structures that were not recorded.
+
+    Parameters:
+    -----------
+    Structure_Sequences : list of dict
+        Maps chain IDs to sequences, for each structure (see pdb_to_structurelists).
+    Standard_Sequences : dict
+        Dictionary where each key is a chain ID and each value is the sequence associated
+        with that chain ID.
+    filelist : list of str
+        Paths of the structures, in the order of Structure_Sequences.
+    target_dir : str
+        Directory where the new files will be saved
+    ignore_chid : list of str, optional
+        Chain IDs that are not aligned to the standard sequences.
+    verbose : bool, optional
+        If True, each structure is printed as it is standardized. Default is True.
+
+    Returns:
+    --------
+    n_standardized : int
+        Number of structures standardized (not counting those done before).
+    """
+    if ignore_chid is None:
+        ignore_chid = []
+    progress = read_progress_journal(target_dir)
+    standard_checksum = standard_sequences_sha256(Standard_Sequences, ignore_chid)
+    done = [structure_is_done(progress.get(os.path.basename(path)), path, target_dir, standard_checksum)
+            for path in filelist]
+    logfilename = target_dir+'/ChainStandardizationRecord.txt'
+    if os.path.isfile(logfilename) and not any(done):
+        # Starting over: do not append to the record of a previous run
+        os.remove(logfilename)
+    n_standardized = 0
+    score_cache = {}
+    for I in range(len(filelist)):
+        if done[I]:
+            continue
+        if verbose:
+            print('[chainid] [{0}/{1}]: {2}'.format(I+1, len(filelist), os.path.basename(filelist[I])))
+        output, output_scores = standardize_structure_chains(Structure_Sequences[I], Standard_Sequences,
+                                                             ignore_chid, score_cache)
+        reassignedmaps_to_pdb([filelist[I]], [output], [filelist[I]], target_dir=target_dir)
+        reassignedmaps_to_log([output], [output_scores], [filelist[I]], target_dir=target_dir)
+        record_structure_progress(filelist[I], output, output_scores, standard_checksum, target_dir)
+        n_standardized += 1
+    return n_standardized
+
+def merge_batch_records(filelist, target_dir, verbose=True):
+    """
+    Merges the journals of all the shards or workers of a batch run, and checks that every structure
+    was standardized once, with the same standard sequences, and that its output file is intact.
+    If so, writes the progress journal and ChainStandardizationRecord.txt of the whole run.
+
+    Parameters:
+    -----------
+    filelist : list of str
+    	list of file paths for all '.cif' files in specified directory
+    target_dir : str
+        Directory where the new files were saved
+    verbose : bool, optional
+        If True, prints the chain reassignments. Default is True.
+
+    Returns:
+    --------
+    complete : bool
+        True if all structures were standardized, and the records were written.
+    """
+    records = {}
+    for journalfilename in sorted(glob.glob(target_dir+'/'+BATCH_JOURNAL.format('*'))):
+        for name, record in read_progress_journal(target_dir, os.path.basename(journalfilename)).items():
+            records.setdefault(name, []).append(record)
+    missing = []
+    invalid = []
+    merged = []
+    for ciffile in sorted(filelist):
+        name = os.path.basename(ciffile)
+        valid = [record for record in records.get(name, [])
+                 if structure_is_done(record, ciffile, target_dir, record['standard_sha256'])]
+        if name not in records:
+            missing.append(name)
+        elif not valid:
+            invalid.append(name)
+        else:
+            merged.append((ciffile, valid[-1]))
+    standard_checksums = set(record['standard_sha256'] for ciffile, record in merged)
+    if missing:
+        print("{0} structures were not standardized by any shard:".format(len(missing)))
+        for name in missing:
+            print(name)
+    if invalid:
+        print("{0} structures changed since they were standardized (input or output file):".format(len(invalid)))
+        for name in invalid:
+            print(name)
+    if len(standard_checksums) > 1:
+        print("Shards were run with different standard sequences or ignored chain IDs.")
+    if missing or invalid or len(standard_checksums) > 1:
+        return False
+
+    with open(target_dir+'/'+PROGRESS_JOURNAL, 'w') as journalfile:
+        for ciffile, record in merged:
+            journalfile.write(json.dumps(record, sort_keys=True)+'\n')
+    logfilename = target_dir+'/ChainStandardizationRecord.txt'
+    if os.path.isfile(logfilename):
+        os.remove(logfilename)
+    reassignedmaps_to_log([record['reassignment'] for ciffile, record in merged],
+                          [record['scores'] for ciffile, record in merged],
+                          [ciffile for ciffile, record in merged], target_dir=target_dir, verbose=verbose)
+    print("All {0} structures were standardized.".format(len(merged)))
+    return True
 
  # Not called anywhere
 def align_to_standard_seq(Structure_Sequences, Standard_Sequences, structid_list):
@@ -1050,17 +1467,17 @@ def reassignedmaps_to_pdb(filelist, ChainReassignmentMapping_List, structid_list
     --------
     None
     """
-    print("structid_list")
-    print(structid_list)
+    message("structid_list")
+    message(structid_list)
 
     for my_files in filelist:
         newciffilename=target_dir+'/'+my_files.split('/')[-1]
-        with open(my_files) as myfile:
-            print("my file name")
-            print(myfile.name)
-            with open(newciffilename, 'w') as newciffile:
+        with instrumentutils.timer('write', newciffilename), open_file(my_files) as myfile:
+            message("my file name")
+            message(my_files)
+            with open_file(newciffilename, 'w') as newciffile:
                 # Now figure out which file is which template
-                I = structid_list.index(myfile.name)
+                I = structid_list.index(my_files)
                 for line in myfile:
                     if (line[0:4] == "ATOM"):
                             # Chains outside map should not exist but just in case
@@ -5,7 +5,11 @@ import numpy as np
 import csv
 import os
 import copy
-from Bio.PDB.MMCIF2Dict import MMCIF2Dict
+from PDBClean.mmcifutils import MMCIFFile
+from PDBClean.pdbclean_io import open_file
+from PDBClean import instrumentutils
+from PDBClean import progressutils
+from PDBClean.progressutils import message
 
 
 ####################
@@ -23,16 +27,16 @@ def pdb_to_masterlist(filelist):
 
     Returns:
     -----------
-    master_molID_class_list : list
+    master_molID_class_list : MolIDMasterList
     A list containing molID class objects for each CIF processed.
     """
-    master_molID_class_list = []
+    master_molID_class_list = MolIDMasterList()
     N=0
-    for my_files in filelist:
+    for my_files in progressutils.progress(filelist, desc='Reading'):
         N += 1
-        print("Reading:"+' '+my_files+"  ("+str(N)+" of "+str(len(filelist))+")")
-        with open(my_files) as myfile:
-            this_molID_class = make_MolID_cif(myfile)
+        message("Reading:"+' '+my_files+"  ("+str(N)+" of "+str(len(filelist))+")")
+        with instrumentutils.timer('parse', my_files):
+            this_molID_class = make_MolID_cif(my_files)
             master_molID_class_list.append(this_molID_class)
     return master_molID_class_list
 
@@ -47,10 +51,10 @@ def uniquelist_to_conversionlist(unique_map):
 
     Returns:
     --------
-    molIDConversion_list : list
+    molIDConversion_list : MolIDConversionList
         A list of initialized `MolIDConversion` objects created from the unique mapping.
     """
-    molIDConversion_list = []
+    molIDConversion_list = MolIDConversionList()
     for key in unique_map:
         molIDConversion_list.append(initial_MolIDConversion(key, unique_map[key]))
     return molIDConversion_list
@@ -91,6 +95,122 @@ def update_masterlist(master_molID_class_list, molIDConversion_list):
         molID_class.check_for_concatenations()
     return master_molID_class_list
 
+class CompletenessTrackedList(list):
+    """
+    A list that keeps count of the incomplete parts of its items (chains whose concatenation was
+    not accepted, entity names without enough chain IDs), so the menus can check the status of
+    the curation without going over every item.
+
+    Each item has a `tracker` attribute, set to the list it belongs to, and reports to it every
+    change of its number of incomplete parts. Copies and pickles of an item are not tracked
+    until they are added to a list.
+
+    Attributes:
+    -----------
+    num_incomplete : int
+        The number of incomplete parts of all the items.
+    incomplete : dict
+        Maps the items with incomplete parts to their number of incomplete parts.
+
+    Methods:
+    --------
+    count_incomplete(item):
+        Counts the incomplete parts of an item (defined by each subclass).
+
+    completeness_changed(item, delta):
+        Called by an item when its number of incomplete parts changes by delta.
+    """
+    def __init__(self, items=()):
+        list.__init__(self)
+        self.num_incomplete = 0
+        self.incomplete = {}
+        self.extend(items)
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def count_incomplete(self, item):
+        raise NotImplementedError
+
+    def completeness_changed(self, item, delta):
+        self.num_incomplete += delta
+        count = self.incomplete.get(item, 0) + delta
+        if count:
+            self.incomplete[item] = count
+        else:
+            self.incomplete.pop(item, None)
+
+    def _attach(self, item):
+        item.tracker = self
+        self.completeness_changed(item, self.count_incomplete(item))
+
+    def _detach(self, item):
+        if item.tracker is self:
+            item.tracker = None
+        self.completeness_changed(item, -self.count_incomplete(item))
+
+    def append(self, item):
+        self._attach(item)
+        list.append(self, item)
+
+    def insert(self, index, item):
+        self._attach(item)
+        list.insert(self, index, item)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def remove(self, item):
+        list.remove(self, item)
+        self._detach(item)
+
+    def pop(self, index=-1):
+        item = list.pop(self, index)
+        self._detach(item)
+        return item
+
+    def clear(self):
+        for item in self:
+            self._detach(item)
+        list.clear(self)
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            old_items = self[index]
+            value = list(value)
+        else:
+            old_items = [self[index]]
+        for item in old_items:
+            self._detach(item)
+        for item in (value if isinstance(index, slice) else [value]):
+            self._attach(item)
+        list.__setitem__(self, index, value)
+
+    def __delitem__(self, index):
+        old_items = self[index] if isinstance(index, slice) else [self[index]]
+        list.__delitem__(self, index)
+        for item in old_items:
+            self._detach(item)
+
+    def incomplete_items(self):
+        """
+        Returns the items with incomplete parts, in the order of the list.
+        """
+        return [item for item in self if item in self.incomplete]
+
+class MolIDMasterList(CompletenessTrackedList):
+    """
+    List of MolID objects (one per CIF) that keeps count of the chains whose concatenation
+    was not accepted (complete_order[chID] is False). See CompletenessTrackedList.
+    """
+    def count_incomplete(self, molID_class):
+        return sum(1 for complete in molID_class.complete_order.values() if complete is False)
+
 # The class containing all the information about each file necessary to build
 # a conversion template
 class MolID(object):
@@ -127,6 +247,9 @@ class MolID(object):
         Updates the concatenation order for a given chain ID, ensuring consistency with
         other chain IDs that share the same new chain ID.
     """
+    # MolIDMasterList the object belongs to, told of every change of complete_order
+    tracker = None
+
     def __init__(self, file_name, chID_newchID_map, molID_chID,
                  concat_order, complete_order):
         """
@@ -151,6 +274,21 @@ class MolID(object):
         self.concat_order = concat_order
         self.complete_order = complete_order
 
+    def __getstate__(self):
+        # Copies (see search_chains) and pickles are not tracked by the list of the original
+        state = dict(self.__dict__)
+        state.pop('tracker', None)
+        return state
+
+    def set_complete_order(self, chID, complete):
+        """
+        Sets complete_order[chID], and updates the count of the MolIDMasterList it belongs to.
+        """
+        was_incomplete = self.complete_order.get(chID) is False
+        self.complete_order[chID] = complete
+        if self.tracker is not None and was_incomplete != (complete is False):
+            self.tracker.completeness_changed(self, 1 if complete is False else -1)
+
     def add_chID_newchID_map(self, molID, newchID_list):
         """
         Maps original chain IDs to new chain IDs for a given entity name.
@@ -196,9 +334,9 @@ class MolID(object):
         # Update complete_order
         for chID in self.chID_newchID_map:
             if chID in self.concat_order:
-                self.complete_order[chID] = False
+                self.set_complete_order(chID, False)
             else:
-                self.complete_order[chID] = True
+                self.set_complete_order(chID, True)
 
 
     # This will force the complete_order[chID] to the input "complete" which is either True or False
@@ -213,7 +351,7 @@ class MolID(object):
         complete : bool
             The completion status to be set for the chain ID (True or False).
         """
-        self.complete_order[chID] = complete
+        self.set_complete_order(chID, complete)
 
     def update_concat_order(self, chID, neworder):
         """
@@ -322,8 +460,8 @@ def make_MolID_cif(myfile):
 
     Parameters:
     -----------
-    myfile : file object
-        A file object representing a CIF to be processed.
+    myfile : str or file object
+        Path of the CIF to be processed, or a file object opened on it.
 
     Returns:
     --------
@@ -331,31 +469,30 @@ def make_MolID_cif(myfile):
         An instance of the MolID class containing the extracted entity name's (MolIDs)
         with their chain IDs, and initialized but empty concatenation and completion order map.
     """
-    file_name = myfile.name
+    file_name = getattr(myfile, 'name', myfile)
     chID_newchID_map = {}
     molID_chID = {}
     concat_order = {}
     complete_order = {}
 
-    mmcif_dict = MMCIF2Dict(myfile)
-
-    # Link molID and chID using entity_id, creating a mapping between entity_id and auth_asym_id.
-    # Store this mapping in entity_chIDlist_map
+    with MMCIFFile(myfile) as mmcif_dict:
+        # Link molID and chID using entity_id, creating a mapping between entity_id and auth_asym_id.
+        # Store this mapping in entity_chIDlist_map
 
-    entity_list = mmcif_dict['_atom_site.label_entity_id']
-    chID_list = mmcif_dict['_atom_site.label_asym_id']
-    entity_chIDlist_map = {}
+        entity_list, chID_list = mmcif_dict.columns(['_atom_site.label_entity_id', '_atom_site.label_asym_id'])
+        instrumentutils.count('atoms', len(entity_list))
+        entity_chIDlist_map = {}
 
-    for i in range(len(entity_list)):
-        if entity_list[i] not in entity_chIDlist_map:
-            entity_chIDlist_map[entity_list[i]] = [chID_list[i]]
-        else:
-            if chID_list[i] not in entity_chIDlist_map[entity_list[i]]:
-                entity_chIDlist_map[entity_list[i]].append(chID_list[i])
+        for i in range(len(entity_list)):
+            if entity_list[i] not in entity_chIDlist_map:
+                entity_chIDlist_map[entity_list[i]] = [chID_list[i]]
+            else:
+                if chID_list[i] not in entity_chIDlist_map[entity_list[i]]:
+                    entity_chIDlist_map[entity_list[i]].append(chID_list[i])
 
-    entity_list = mmcif_dict['_entity.id']
-    molID_list = mmcif_dict['_entity.pdbx_description']
-    molID_list = [i.upper() for i in molID_list]
+        entity_list = mmcif_dict['_entity.id']
+        molID_list = mmcif_dict['_entity.pdbx_description']
+        molID_list = [i.upper() for i in molID_list]
 
     for i in range(len(entity_list)):
         if entity_list[i] in entity_chIDlist_map:
@@ -411,6 +548,8 @@ class MolIDConversion(object):
     chID_list = []
     occur = 0
     complete = bool
+    # MolIDConversionList the object belongs to, told of every change of complete
+    tracker = None
 
     def __init__(self, molID, chID_list, occur, complete):
         """
@@ -432,6 +571,11 @@ class MolIDConversion(object):
         self.occur = occur
         self.complete = complete
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('tracker', None)
+        return state
+
     def check_for_completeness(self):
         """
         Checks if the number of chain IDs in the list matches or goes over the expected
@@ -439,12 +583,15 @@ class MolIDConversion(object):
 
         If the number of chain IDs in `chID_list` is greater than or equal to `occur` (occurrences of the entity
         in the cif), `complete` (all chain IDs have been assigned with a chain ID assignment) is set to True. Otherwise
-        , it is set to False.
+        , it is set to False. The count of the MolIDConversionList it belongs to is updated.
         """
+        was_incomplete = self.complete is False
         if (len(self.chID_list) >= self.occur):
             self.complete = True
         else:
             self.complete = False
+        if self.tracker is not None and was_incomplete != (self.complete is False):
+            self.tracker.completeness_changed(self, 1 if self.complete is False else -1)
 
     def add_chID(self, chID): # NEVER CALLED
         """
@@ -456,6 +603,7 @@ class MolIDConversion(object):
             The chain ID to be added to the list.
         """
         self.chID_list.append(chID)
+        self.check_for_completeness()
 
     def add_chID_list(self, chID_list):
         """
@@ -468,6 +616,7 @@ class MolIDConversion(object):
         """
         for chID in chID_list:
             self.chID_list.append(chID)
+        self.check_for_completeness()
 
     def remove_chID_list(self, chID_list):
         """
@@ -481,6 +630,16 @@ class MolIDConversion(object):
         for chID in chID_list:
             if chID in self.chID_list:
                 self.chID_list.remove(chID)
+        self.check_for_completeness()
+
+
+class MolIDConversionList(CompletenessTrackedList):
+    """
+    List of MolIDConversion objects that keeps count of the entity names without enough
+    chain IDs (complete is False). See CompletenessTrackedList.
+    """
+    def count_incomplete(self, molIDConversion):
+        return 1 if molIDConversion.complete is False else 0
 
 
 def initial_MolIDConversion(molID, occur):
@@ -525,6 +684,7 @@ def add_chID_list(MolIDConversion, chID_list):
     for chID in chID_list:
         if chID not in MolIDConversion.chID_list:
             MolIDConversion.chID_list.append(chID)
+    MolIDConversion.check_for_completeness()
     return MolIDConversion
 #
 
@@ -909,6 +1069,15 @@ def show_full_conversion(current_list, step='conversion'):
                               molID_class.chID_newchID_map[chID] + ":" +
                               str(0))
 
+def unaccepted_molID_classes(master_molID_class_list):
+    """
+    Returns the MolID objects with concatenations not accepted yet (all of them, if the list is not
+    a MolIDMasterList), in the order of the list.
+    """
+    if isinstance(master_molID_class_list, MolIDMasterList):
+        return master_molID_class_list.incomplete_items()
+    return master_molID_class_list
+
 def show_unassigned_conversion(current_list, step='conversion'):
     """
     Displays unassigned entity name conversions or concatenations.
@@ -940,7 +1109,7 @@ def show_unassigned_conversion(current_list, step='conversion'):
 
     elif(step=='concatenation'):
         counter=0
-        for molID_class in current_list:
+        for molID_class in unaccepted_molID_classes(current_list):
             for molID in molID_class.molID_chID:
                 for chID in molID_class.molID_chID[molID]:
                     if molID_class.complete_order[chID] is False:
@@ -989,7 +1158,7 @@ def return_unassigned_conversion(current_list, step='conversion'):
                 molIDCon_chID_list_forPrint = re.sub('\[|\]| |\'', '', str(molIDConversion.chID))#FAPA
                 print(str(molIDConversion.occur)+":"+str(molIDConversion.molID)+":"+molIDCon_chID_list_forPrint)
     elif(step=='concatenation'):
-        for molID_class in current_list:
+        for molID_class in unaccepted_molID_classes(current_list):
             for molID in molID_class.molID_chID:
                 for chID in molID_class.molID_chID[molID]:
                     if molID_class.complete_order[chID] is False:
@@ -999,7 +1168,7 @@ def return_unassigned_conversion(current_list, step='conversion'):
                               + str(molID_class.concat_order[chID]))
     return unassigned
 
-def add_user_conversion(molIDConversion_list):
+def add_user_conversion(molIDConversion_list, input_cnv_file=None):
     """
     Updates a list of MolIDConversion objects with chain IDs from a user-provided input file
     and checks each for completeness.
@@ -1013,13 +1182,16 @@ def add_user_conversion(molIDConversion_list):
     -----------
     molIDConversion_list : list
         molIDConversion objects where each object contains an entity name and their chain IDs
+    input_cnv_file : str, optional
+        Path of the conversion file. If None, the user is asked for it.
 
     Returns:
     -----------
     molIDConversion_list : list
         Updated list of molIDConversion objects after adding the chain IDs from the users input file
     """
-    input_cnv_file = input('Conversion File: ')
+    if input_cnv_file is None:
+        input_cnv_file = input('Conversion File: ')
     user_molID_chID_map =  read_input_file(input_cnv_file)
     for molIDConversion in molIDConversion_list:
         # This is currently strict inclusion but perhaps should be except out
@@ -1251,10 +1423,13 @@ def check_complete(molIDConversion_list):
         - "0" if there are any incomplete assignments.
         - "1" if all assignments are complete.
     """
-    num_unassigned = 0
-    for molIDConversion in molIDConversion_list:
-        if molIDConversion.complete is False:
-            num_unassigned += 1
+    if isinstance(molIDConversion_list, MolIDConversionList):
+        num_unassigned = molIDConversion_list.num_incomplete
+    else:
+        num_unassigned = 0
+        for molIDConversion in molIDConversion_list:
+            if molIDConversion.complete is False:
+                num_unassigned += 1
     if (num_unassigned > 0):
         input_menu_complete = "0"
     else:
@@ -1283,6 +1458,8 @@ def problem_counter(master_molID_class_list):
     count_problems : int
         The number of incomplete chain ID entries (marked as `False`) across all molID class objects in the list.
     """
+    if isinstance(master_molID_class_list, MolIDMasterList):
+        return master_molID_class_list.num_incomplete
     count_problems = 0
     for molID_class in master_molID_class_list:
         for chID in molID_class.complete_order:
@@ -1529,6 +1706,46 @@ def list_accept_concatenations_auto(master_molID_class_list, search_term, new_or
     return master_molID_class_list, new_order
 
 
+def accept_all_concatenations(master_molID_class_list, summary_file=None):
+    """
+    Accepts every planned concatenation in one pass over the master list.
+
+    The MolID class objects are updated in place, without the search, copy and replacement
+    done for each concatenation by list_accept_concatenations_auto, so the time grows
+    linearly with the number of chains.
+
+    Parameters:
+    -----------
+    master_molID_class_list : list
+        A list of `MolID` class instances, each containing entity name and chain ID information.
+    summary_file : str, optional
+        If given, the concatenations accepted are written to this file, one per line in the
+        format 'File:MolID:OldChain:NewChain:ConcatOrder', followed by their number.
+
+    Returns:
+    --------
+    master_molID_class_list : list
+        The same list, with all concatenations accepted.
+    accepted : list of str
+        The concatenations accepted, in the format 'File:MolID:OldChain:NewChain:ConcatOrder'.
+    """
+    accepted = []
+    for molID_class in unaccepted_molID_classes(master_molID_class_list):
+        for molID in molID_class.molID_chID:
+            for chID in molID_class.molID_chID[molID]:
+                if molID_class.complete_order[chID] is False:
+                    molID_class.force_complete_order(chID, True)
+                    accepted.append(molID_class.file_name + ":" + molID + ":"
+                                    + chID + ":" +
+                                    molID_class.chID_newchID_map[chID] + ":"
+                                    + str(molID_class.concat_order[chID]))
+    if summary_file is not None:
+        with open(summary_file, 'w') as summary:
+            summary.write(''.join(line + "\n" for line in accepted))
+            summary.write("Accepted %s concatenations\n" % len(accepted))
+    return master_molID_class_list, accepted
+
+
 def get_search_term(value):
     """
     Prompts the user to input a search term in a specific format until the input is valid or the user chooses to quit.
@@ -1798,10 +2015,10 @@ def masterlist_to_pdb(filelist, masterlist, target_dir=None):
     """
     for my_files in filelist:
         newciffilename=target_dir+'/'+my_files.split('/')[-1]
-        with open(my_files) as myfile:
-            with open(newciffilename, 'w') as newciffile:
+        with instrumentutils.timer('write', newciffilename), open_file(my_files) as myfile:
+            with open_file(newciffilename, 'w') as newciffile:
                 for molID_class in masterlist:
-                    if (molID_class.file_name == myfile.name):
+                    if (molID_class.file_name == my_files):
                         for line in myfile:
                             if (line[0:4] == "ATOM") or (line[0:6]=="HETATM"):
                                 # Chains outside map should not exist but just in case
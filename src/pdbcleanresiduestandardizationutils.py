@@ -1,10 +1,22 @@
 from __future__ import print_function
 from __future__ import division
-from Bio.PDB.MMCIFParser import FastMMCIFParser
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PDBClean.mmcifutils import read_first_model_residues
+from PDBClean.pdbclean_io import open_file, read_bytes
+from PDBClean import instrumentutils
+from PDBClean import progressutils
+from PDBClean.progressutils import message
 from PDBClean.alignmentutils import *
 from PDBClean.listutils import *
 #
 
+# Letters given to residues in insertion columns of the alignment (columns where
+# at least GAP_CUTOFF percent of the sequences have a gap)
+GAP_LETTERS = ['A','B','C','D','E','F','G','H','I','J','K','L','M','N','O','P','Q','R','S','T','U','V','W','X','Y','Z',
+               'a','b','c','d','e','f','g','h','i','j','k','l','m','n','o','p','q','r','s','t','u','v','w','x','y','z']
+GAP_CUTOFF = 30
+
 ####################
 # INITIALIZE STEPS #
 ####################
@@ -38,32 +50,27 @@ def pdb_to_structurelists(filelist):
     structid_list = []
 
     N = 0
-    for my_file in filelist:
+    for my_file in progressutils.progress(filelist, desc='Reading'):
         N += 1
-        print("Reading:" + ' ' + my_file + "  (" + str(N) + " of " + str(len(filelist)) + ")")
-        struct = FastMMCIFParser(auth_residues=False,QUIET=1).get_structure(str(my_file), my_file)
-        structid_list.append(struct.get_id())
+        message("Reading:" + ' ' + my_file + "  (" + str(N) + " of " + str(len(filelist)) + ")")
+        structid_list.append(str(my_file))
         chid_seq_map = {}
         chid_resinum_map = {}
         # Only written for structures with only one model in them
-        for chain in struct[0]:
-            if (chain.get_id() not in chid_resinum_map): #FAPA: HERE WE NEED TO ADD IF TO CHECK IF pdbx_PDB_ins_code != '?'
-                chid_resinum_map[chain.get_id()] = []
-            key = str(struct.get_id()) + "_" + str(chain.get_id())
-            resinum_list = []
-            seq = ""
-            for residue in chain:
-                #print("printing residue ids: "+ str(residue.get_id()[2]))
-                resinum_list.append(residue.get_id()[1])
-                #chid_resinum_map[chain.get_id()].append(residue.get_id()[1])
-                # For each residue we extract both the residue number and the associated "letter" (pdbx_PDB_ins_code)
-                chid_resinum_map[chain.get_id()].append(str(residue.get_id()[1])+str(residue.get_id()[2])) #FAPA 17 oct 2024
-                #resinum_list.append(residue.id()[1])
-                #chid_resinum_map[chain.get_id()].append(residue.id()[1])
-                seq += ResnConvert(residue.get_resname())
-            Structure_Sequences[key] = seq
-            # chid_list is a master list of all chainIDs used
-            chid_list.append(chain.get_id())
+        # Residues of the first model, as FastMMCIFParser(auth_residues=False) builds them, without building atoms
+        with instrumentutils.timer('parse', my_file):
+            for chid, residues in read_first_model_residues(my_file, auth_residues=False):
+                if (chid not in chid_resinum_map): #FAPA: HERE WE NEED TO ADD IF TO CHECK IF pdbx_PDB_ins_code != '?'
+                    chid_resinum_map[chid] = []
+                key = str(my_file) + "_" + str(chid)
+                seq = ""
+                for residue_id, resname in residues:
+                    # For each residue we extract both the residue number and the associated "letter" (pdbx_PDB_ins_code)
+                    chid_resinum_map[chid].append(str(residue_id[1])+str(residue_id[2])) #FAPA 17 oct 2024
+                    seq += ResnConvert(resname)
+                Structure_Sequences[key] = seq
+                # chid_list is a master list of all chainIDs used
+                chid_list.append(chid)
         ChID_ResiNum_Vector.append(chid_resinum_map)
     chid_set = set(chid_list)
     chid_list = sorted(list(chid_set))
@@ -74,7 +81,7 @@ def pdb_to_structurelists(filelist):
 # INTERACTIVE STANDARDIZATION FUNCTIONS #
 #########################################
 
-def perform_multiple_alignment(Structure_Sequences, ChID_ResiNum_Vector, structid_list, chid_list, check):
+def perform_multiple_alignment(Structure_Sequences, ChID_ResiNum_Vector, structid_list, chid_list, check, max_workers=None):
     """
     Interactive user interface for performing multiple alignments
 
@@ -90,6 +97,8 @@ def perform_multiple_alignment(Structure_Sequences, ChID_ResiNum_Vector, structi
     	A list containing all the chain IDs from CIF(s)
     check : str
         Option chosen by user which opens the submenu
+    max_workers : int, optional
+        Number of chain alignments running at the same time. If None, one per CPU core.
 
     Returns:
     --------
@@ -97,8 +106,8 @@ def perform_multiple_alignment(Structure_Sequences, ChID_ResiNum_Vector, structi
         A dictionary where each key is a combination of structure identifier and chain ID,
         and the value is the aligned sequence for that chain.
     Structure_ConversionTemplate : dict
-        A dictionary mapping each structure identifier to a conversion template,
-        which contains mappings of residue numbers from the original sequence to the aligned sequence.
+        A dictionary mapping each structure identifier to a conversion template, which maps
+        each chain ID to a ResidueConversion (standardized residue numbers of the chain).
     chid_list : list of str
         Updated list of chain IDs where some may have been removed based on the user's options
     check : str
@@ -123,145 +132,252 @@ def perform_multiple_alignment(Structure_Sequences, ChID_ResiNum_Vector, structi
         elif (input_submenu == "3"):
             chid_list = remove_file_defined_chain_from_list(chid_list)
         elif (input_submenu == "4"):
-            for chid in chid_list:
-                this_chainsseq_list = []
-                this_chainsseq_list_ids = [] #FAPA
-                this_chainsseq_aligned_list = []
-                for I in range(len(structid_list)):
-                    key = str(structid_list[I]) + "_" + chid
-                    if key in Structure_Sequences:
-                        this_chainsseq_list.append(Structure_Sequences[key])
-                        this_chainsseq_list_ids.append(structid_list[I]) # FAPA
-                #this_chainsseq_aligned_list_map = AlignSequences_v2(this_chainsseq_list, chid,this_chainsseq_list_ids )
-                #this_chainsseq_aligned_list_map = AlignSequences_v3(this_chainsseq_list, chid, this_chainsseq_list_ids) #FAPA MAY2024
-                this_chainsseq_aligned_list_map, this_chainseq_gap_percentages = AlignSequences_v4(this_chainsseq_list, chid,
-                                                                    this_chainsseq_list_ids)  # FAPA JULY2024
-                i = 0
-                for I in range(len(structid_list)):
-                    key = str(structid_list[I]) + "_" + chid
-                    if key in Structure_Sequences:
-                        #Structure_Sequences_Aligned[key] = this_chainsseq_aligned_list[i]
-                        Structure_Sequences_Aligned[key] = this_chainsseq_aligned_list_map[str(structid_list[I])]
-                        Structure_Sequences_GAPS[key] = this_chainseq_gap_percentages #FAPA
-                        i += 1
-
-            #THIS IS THE VERSION THAT WORKS, COMMENTED SO WE TRY SOMETHING NEW
-            #for I in range(len(structid_list)):
-            #    conversion_template = {}
-            #    for chain in ChID_ResiNum_Vector[I]:
-            #        resinum_aligned_list = []
-            #        key = str(structid_list[I]) + "_" + str(chain)
-            #        if key in Structure_Sequences_Aligned:
-            #            seq = Structure_Sequences_Aligned[key]
-            #            i = 0
-            #            for resn in seq:
-            #                i += 1
-            #                if (resn != "-"):
-            #                    resinum_aligned_list.append(i)
-            #            i = 0
-            #            for residue in ChID_ResiNum_Vector[I][chain]:
-            #                key2 = chain + "_" + str(residue)
-            #                conversion_template[key2] = resinum_aligned_list[i]
-            #                i += 1
-            #    Structure_ConversionTemplate[structid_list[I]] = conversion_template
-
-            # MY TEST STARTS HERE, WITH VARIATIONS OF THE CODE ABOVE
-
-            for I in range(len(structid_list)):
-                conversion_template = {}
-                for chain in ChID_ResiNum_Vector[I]:
-                    #print(ChID_ResiNum_Vector[I])
-                    #residue_numbers_users = [residue.get_id()[1] for residue in chain.get_residues()]
-                    #print(residue_numbers_users)
-                    resinum_aligned_list = []
-                    key = str(structid_list[I]) + "_" + str(chain)
-                    if key in Structure_Sequences_Aligned:
-                        seq = Structure_Sequences_Aligned[key]
-                        gaps = Structure_Sequences_GAPS[key]
-                        i = 0
-                        counter=1
-                        new_res_num=[]
-                        freq_tracker=1
-                        gap_tracker=0
-                        gap_letter=['A','B','C','D','E','F','G','H','I','J','K','L','M','N','O','P','Q','R','S','T','U','V','W','X','Y','Z','a','b','c','d','e','f','g','h','i','j','k','l','m','n','o','p','q','r','s','t','u','v','w','x','y','z']
-                        for freq in gaps:
-                            #freq_tracker = 1
-                            #gap_tracker = 0
-                            #print(freq)
-                            if freq < 30:
-                                new_res_num.append(counter)
-                                counter += 1
-                                freq_tracker=freq
-                                gap_tracker=0
-                                #print("hello")
-                            else:
-                                #print(gap_tracker)
-                                #new_res_num.append(str(counter)+"_"+str(gap_tracker))
-                                new_res_num.append(str(counter-1) +" "+str(gap_letter[gap_tracker]))
-                                gap_tracker+=1
-                                freq_tracker=freq
-
-                        #print(new_res_num)
-                        #print(len(new_res_num))
-                        #print(len(seq))
-
-
-                        for resn in seq:
-                            #print(new_res_num[i])
-                            if (resn != "-"):
-                                resinum_aligned_list.append(new_res_num[i])
-                            i += 1
-
-                        #print("resinum_aligned_list")
-                        #print(len(resinum_aligned_list))
-                        #print(resinum_aligned_list)
-
-                        #i = 0
-
-                        #print("THIS IS THE CHAIN NUMBER TEST")
-                        #print(ChID_ResiNum_Vector[I][chain]) #FAPA
-
-                        for residue in range(len(resinum_aligned_list)):
-                            #i +=1
-                            #print("this is the value of i:", i)
-                            #print("this is resimnum_aligned_list[i]:", resinum_aligned_list[residue] )
-                            #print("this is the value of residue:", residue)
-                            #print("this is what is in the structure:",ChID_ResiNum_Vector[I][chain][residue])
-
-                            key2 = chain + "_" + str(ChID_ResiNum_Vector[I][chain][residue])
-                            #print("key 2 is:",key2)
-                                #print(key2) #FAPA
-                                #print(resinum_aligned_list[i]) #FAPA
-                            conversion_template[key2] = resinum_aligned_list[residue]
-                            i += 1
-                        #print(conversion_template)
-
-
-
-                        #for residue in ChID_ResiNum_Vector[I][chain]:
-                        #    #i +=1
-                        #    print("this is the value of i:", i)
-                        #    print("this is resimnum_aligned_list[i]:", resinum_aligned_list[i] )
-                        #    print("this is the value of residue:", residue)
-                        #    if i == len(resinum_aligned_list)-1:
-                        #        break
-                        #    elif resinum_aligned_list[i] in ChID_ResiNum_Vector[I][chain]:
-                        #        key2 = chain + "_" + str(residue)
-                        #        #print(key2) #FAPA
-                        #        #print(resinum_aligned_list[i]) #FAPA
-                        #        conversion_template[key2] = resinum_aligned_list[i]
-                        #    i += 1
-                        #print(conversion_template)
-
-                Structure_ConversionTemplate[structid_list[I]] = conversion_template
-
-
+            Structure_Sequences_Aligned, Structure_Sequences_GAPS = align_chains(Structure_Sequences, structid_list,
+                                                                                 chid_list, max_workers=max_workers)
 
+            Structure_ConversionTemplate = build_conversion_templates(Structure_Sequences_Aligned,
+                                                                      Structure_Sequences_GAPS,
+                                                                      ChID_ResiNum_Vector,
+                                                                      structid_list)
 
             check = "1"
             input_submenu = "QUIT"
     return Structure_Sequences_Aligned, Structure_ConversionTemplate, chid_list, check
 
+def align_chains(Structure_Sequences, structid_list, chid_list, max_workers=None):
+    """
+    Performs one multiple alignment per chain ID. The alignments are independent from each
+    other, so they are run in parallel.
+
+    Parameters:
+    -----------
+    Structure_Sequences : dict
+        Contains dictionary where chain ID is mapped to their sequence for each structure.
+    structid_list : list of str
+    	List of unique structure identifiers for each CIF. Format is 'input directory / CIF'
+    chid_list : list of str
+    	A list containing the chain IDs to be aligned
+    max_workers : int, optional
+        Number of chain alignments running at the same time. If None, one per CPU core.
+
+    Returns:
+    --------
+    Structure_Sequences_Aligned : dict
+        A dictionary where each key is a combination of structure identifier and chain ID,
+        and the value is the aligned sequence for that chain.
+    Structure_Sequences_GAPS : dict
+        A dictionary where each key is a combination of structure identifier and chain ID,
+        and the value is the gap percentage per position of the alignment of that chain.
+    """
+    Structure_Sequences_Aligned = {}
+    Structure_Sequences_GAPS = {}
+    alignment_jobs = {}
+    for chid in chid_list:
+        this_chainsseq_list = []
+        this_chainsseq_list_ids = [] #FAPA
+        for I in range(len(structid_list)):
+            key = str(structid_list[I]) + "_" + chid
+            if key in Structure_Sequences:
+                this_chainsseq_list.append(Structure_Sequences[key])
+                this_chainsseq_list_ids.append(structid_list[I]) # FAPA
+        alignment_jobs[chid] = (this_chainsseq_list, this_chainsseq_list_ids)
+
+    alignment_results = AlignSequences_v4_parallel(alignment_jobs, max_workers=max_workers)
+
+    for chid in chid_list:
+        this_chainsseq_aligned_list_map, this_chainseq_gap_percentages = alignment_results[chid]
+        for I in range(len(structid_list)):
+            key = str(structid_list[I]) + "_" + chid
+            if key in Structure_Sequences:
+                Structure_Sequences_Aligned[key] = this_chainsseq_aligned_list_map[str(structid_list[I])]
+                Structure_Sequences_GAPS[key] = this_chainseq_gap_percentages #FAPA
+    return Structure_Sequences_Aligned, Structure_Sequences_GAPS
+
+def alignment_to_numbering(gap_percentages, gap_cutoff=GAP_CUTOFF):
+    """
+    Assigns a standardized residue number to every column of a multiple alignment.
+
+    Columns where less than `gap_cutoff` percent of the sequences have a gap are numbered
+    consecutively (1, 2, 3, ...). The other columns are insertions: they take the number of
+    the previous numbered column and a letter (A, B, C, ...) counting the insertion columns
+    since that column.
+
+    Parameters:
+    -----------
+    gap_percentages : np.ndarray
+        An array where each element represents the percentage of gaps at that position
+        across all sequences.
+    gap_cutoff : float, optional
+        Columns with this percentage of gaps or more are insertion columns. Default is 30.
+
+    Returns:
+    --------
+    column_resnum : np.ndarray
+        Standardized residue number of each column.
+    column_inscode : np.ndarray
+        Index in GAP_LETTERS of the insertion letter of each column, -1 for numbered columns.
+    """
+    numbered = np.asarray(gap_percentages) < gap_cutoff
+    column = np.arange(len(numbered))
+    column_resnum = np.cumsum(numbered).astype(np.int32)
+    last_numbered = np.maximum.accumulate(np.where(numbered, column, -1))
+    column_inscode = np.where(numbered, -1, column - last_numbered - 1).astype(np.int16)
+    return column_resnum, column_inscode
+
+class ResidueConversion(object):
+    """
+    Conversion template of one chain in one structure: the standardized residue number
+    (and insertion letter) of each of its residues, stored as integer arrays.
+
+    Attributes:
+    -----------
+    old_resid : list of str
+        Original residue IDs of the chain (residue number followed by insertion code),
+        as stored in ChID_ResiNum_Vector.
+    new_resnum : np.ndarray
+        Standardized residue number of each residue.
+    new_inscode : np.ndarray
+        Index in GAP_LETTERS of the insertion letter of each residue, -1 if there is none.
+
+    Methods:
+    --------
+    new_resid(i):
+        Returns the standardized residue ID of residue i, as written in the conversion template.
+
+    items(chid):
+        Iterates over (chain ID_original residue ID, standardized residue ID) pairs.
+    """
+    def __init__(self, old_resid, new_resnum, new_inscode):
+        """
+        Initializes the ResidueConversion class with the provided parameters.
+
+        Parameters:
+        -----------
+        old_resid : list of str
+            Original residue IDs of the chain.
+        new_resnum : np.ndarray
+            Standardized residue number of each residue.
+        new_inscode : np.ndarray
+            Index in GAP_LETTERS of the insertion letter of each residue, -1 if there is none.
+        """
+        self.old_resid = old_resid
+        self.new_resnum = new_resnum
+        self.new_inscode = new_inscode
+
+    def __len__(self):
+        return len(self.new_resnum)
+
+    def new_resid(self, i):
+        """
+        Returns the standardized residue ID of residue i: the residue number, or the residue
+        number and the insertion letter separated by a space.
+
+        Parameters:
+        -----------
+        i : int
+            Index of the residue in the chain.
+
+        Returns:
+        --------
+        new_resid : int or str
+        """
+        if self.new_inscode[i] < 0:
+            return int(self.new_resnum[i])
+        return str(self.new_resnum[i]) + " " + GAP_LETTERS[self.new_inscode[i]]
+
+    def items(self, chid):
+        """
+        Iterates over the conversion of each residue.
+
+        Parameters:
+        -----------
+        chid : str
+            Chain ID of the chain.
+
+        Returns:
+        --------
+        Generator of (key, new_resid) tuples, where key is 'chain ID_original residue ID'.
+        """
+        for i in range(len(self)):
+            yield chid + "_" + str(self.old_resid[i]), self.new_resid(i)
+
+def build_conversion_templates(Structure_Sequences_Aligned, Structure_Sequences_GAPS, ChID_ResiNum_Vector,
+                               structid_list, gap_cutoff=GAP_CUTOFF):
+    """
+    Builds the conversion template of every structure from the multiple alignments.
+
+    The numbering of the columns of each alignment is computed once per chain ID
+    (see alignment_to_numbering). The standardized number of each residue is then
+    read from the columns that are not gaps in its aligned sequence. A chain that does not
+    have as many residues as its aligned sequence raises a ValueError.
+
+    Parameters:
+    -----------
+    Structure_Sequences_Aligned : dict
+        A dictionary where each key is a combination of structure identifier and chain ID,
+        and the value is the aligned sequence for that chain.
+    Structure_Sequences_GAPS : dict
+        A dictionary where each key is a combination of structure identifier and chain ID,
+        and the value is the gap percentage per position of the alignment of that chain.
+    ChID_ResiNum_Vector : list of dict
+        Each dictionary maps the chain ID to their residue numbers for a structure
+    structid_list : list of str
+    	List of unique structure identifiers for each CIF. Format is 'input directory / CIF'
+    gap_cutoff : float, optional
+        Columns with this percentage of gaps or more are insertion columns. Default is 30.
+
+    Returns:
+    --------
+    Structure_ConversionTemplate : dict
+        A dictionary mapping each structure identifier to its conversion template, a
+        dictionary mapping each chain ID to a ResidueConversion.
+    """
+    Structure_ConversionTemplate = {}
+    chain_numbering = {}
+    for I in range(len(structid_list)):
+        conversion_template = {}
+        for chain in ChID_ResiNum_Vector[I]:
+            key = str(structid_list[I]) + "_" + str(chain)
+            if key in Structure_Sequences_Aligned:
+                # All structures share the alignment (and its numbering) of a chain ID
+                if chain not in chain_numbering:
+                    chain_numbering[chain] = alignment_to_numbering(Structure_Sequences_GAPS[key], gap_cutoff)
+                column_resnum, column_inscode = chain_numbering[chain]
+                seq = np.frombuffer(Structure_Sequences_Aligned[key].encode(), dtype=np.uint8)
+                residue_column = np.flatnonzero(seq != ord('-'))
+                old_resid = ChID_ResiNum_Vector[I][chain]
+                if len(old_resid) != len(residue_column):
+                    # Truncating either one would shift the numbering of every residue after the mismatch
+                    raise ValueError('Chain {0} of {1} has {2} residues, but {3} in its aligned sequence (was '
+                                     'the alignment {4}.fasta made from other sequences?)'.format(
+                                         chain, structid_list[I], len(old_resid), len(residue_column), chain))
+                conversion_template[chain] = ResidueConversion(old_resid,
+                                                               column_resnum[residue_column],
+                                                               column_inscode[residue_column])
+        Structure_ConversionTemplate[structid_list[I]] = conversion_template
+    return Structure_ConversionTemplate
+
+def conversiontemplate_to_dict(conversion_template):
+    """
+    Expands the conversion template of one structure into a dictionary.
+
+    Parameters:
+    -----------
+    conversion_template : dict
+        A dictionary mapping each chain ID to a ResidueConversion.
+
+    Returns:
+    --------
+    conversion_map : dict
+        A dictionary where each key is 'chain ID_original residue ID' and the value is the
+        standardized residue ID.
+    """
+    conversion_map = {}
+    for chain in conversion_template:
+        for key, new_resid in conversion_template[chain].items(chain):
+            conversion_map[key] = new_resid
+    return conversion_map
+
 def show_conversiontemplate(Structure_ConversionTemplate):
     """
     Prints the conversion template to screen
@@ -279,8 +395,9 @@ def show_conversiontemplate(Structure_ConversionTemplate):
 
     for structid in Structure_ConversionTemplate:
         print(structid)
-        for key in Structure_ConversionTemplate[structid]:
-            print(key + ":" + str(Structure_ConversionTemplate[structid][key]))
+        for chain in Structure_ConversionTemplate[structid]:
+            for key, new_resid in Structure_ConversionTemplate[structid][chain].items(chain):
+                print(key + ":" + str(new_resid))
 
 ## FAPA
 def write_and_show_conversiontemplate(Structure_ConversionTemplate, target_dir, write_csv=True):
@@ -307,17 +424,11 @@ def write_and_show_conversiontemplate(Structure_ConversionTemplate, target_dir,
     if write_csv:
         with open(f'{target_dir}/OldResID_NewResID_Map.csv', 'w') as fout:
             fout.write('OldResID:NewResId:File\n')
-
-
-    for structid in Structure_ConversionTemplate:
-        #print(structid)
-        for key in Structure_ConversionTemplate[structid]:
-            #print(key + ":" + str(Structure_ConversionTemplate[structid][key]))
-            #structid_for_print=[x.split("/")[-1] for x in structid]
-            structid_for_print = structid.split("/")[-1]
-            if write_csv:
-                with open(f'{target_dir}/OldResID_NewResID_Map.csv', 'a') as fout:
-                    fout.write(f'{key}:{str(Structure_ConversionTemplate[structid][key])}:{structid_for_print}\n')
+            for structid in Structure_ConversionTemplate:
+                structid_for_print = structid.split("/")[-1]
+                for chain in Structure_ConversionTemplate[structid]:
+                    for key, new_resid in Structure_ConversionTemplate[structid][chain].items(chain):
+                        fout.write(f'{key}:{str(new_resid)}:{structid_for_print}\n')
 
 # FAPA
 
@@ -345,10 +456,10 @@ def conversiontemplate_to_pdb(filelist, Structure_ConversionTemplate, target_dir
     """
     for my_files in filelist:
         newciffilename=target_dir+'/'+my_files.split('/')[-1]
-        with open(my_files) as myfile:
-            with open(newciffilename, 'w') as newciffile:
+        with open_file(my_files) as myfile:
+            with open_file(newciffilename, 'w') as newciffile:
                 # Now figure out which file is which template
-                conversion_template = Structure_ConversionTemplate[myfile.name]
+                conversion_template = conversiontemplate_to_dict(Structure_ConversionTemplate[my_files])
                 for line in myfile:
                     if (line[0:4] == "ATOM") or (line[0:6] == "HETATM"):
                         # Chains outside map should not exist but just in case
@@ -365,10 +476,11 @@ def conversiontemplate_to_pdb(filelist, Structure_ConversionTemplate, target_dir
 
 # FAPA MAY 2024 TEST STARTS
 
-def conversiontemplate_to_pdb_FAPA(filelist, Structure_ConversionTemplate, target_dir=None):
+def conversiontemplate_to_pdb_FAPA(filelist, Structure_ConversionTemplate, target_dir=None, max_workers=None):
     """
     Saves the conversion template into re-written CIF(s) which are placed into the target directory.
     This function considers cases where a residue number also includes a letter.
+    Files are independent from each other, so they are renumbered in parallel.
 
     Parameters:
     -----------
@@ -379,108 +491,287 @@ def conversiontemplate_to_pdb_FAPA(filelist, Structure_ConversionTemplate, targe
         which contains mappings of residue numbers from the original sequence to the aligned sequence.
     target_dir : str, optional
         Directory where the new files will be saved. If none, no files will be saved.
+    max_workers : int, optional
+        Number of files renumbered at the same time. If None, one per CPU core.
 
     Returns:
     --------
     None
     """
-    for my_files in filelist:
-        newciffilename=target_dir+'/'+my_files.split('/')[-1]
-        with open(my_files) as myfile:
-            with open(newciffilename, 'w') as newciffile:
-                # Now figure out which file is which template
-                conversion_template = Structure_ConversionTemplate[myfile.name]
-                #print(conversion_template)
-
+    jobs = [(my_files, target_dir+'/'+my_files.split('/')[-1], Structure_ConversionTemplate[my_files])
+            for my_files in filelist]
+    if max_workers == 1 or len(jobs) < 2:
+        for job in jobs:
+            with instrumentutils.timer('write', job[1]):
+                renumber_cif(*job)
+        return
+    # Files written by the worker processes are timed together
+    with instrumentutils.timer('write', target_dir) as record:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(renumber_cif, *job) for job in jobs]
+            for future in as_completed(futures):
+                future.result()
+        record['files'] = len(jobs)
+
+def residue_lookup(conversion):
+    """
+    Builds the lookup tables that give the index of a residue in a ResidueConversion.
 
-                for line in myfile:
-                    resnum=1
-                    #old_line_resnum=0
-                    if (line[0:4] == "ATOM") or (line[0:6] == "HETATM"):
-                        # Chains outside map should not exist but just in case
-                        #line_split = line.strip()
-                        line_split = line.split()
-                        #print(line_split[8])
-                        #new_line_resnum=int(line_split[8])
+    Parameters:
+    -----------
+    conversion : ResidueConversion
+        Conversion template of one chain.
 
-                        #if new_line_resnum == start_line_resnum:
+    Returns:
+    --------
+    lut_start : int
+        Residue number stored in the first element of lut.
+    lut : np.ndarray
+        Index of each residue without insertion code, by residue number - lut_start. -1 if the
+        residue number is not in the chain.
+    resid_index : dict
+        Index of each residue, by original residue ID (used for residues with insertion codes).
+    """
+    resid_index = dict(zip(map(str, conversion.old_resid), range(len(conversion))))
+    numbered = {int(resid): i for resid, i in resid_index.items()
+                if resid[-1] == " " and resid[:-1].isascii() and resid[:-1].isdigit() and (len(resid) == 2 or resid[0] != "0")}
+    if not numbered:
+        return 0, np.full(0, -1, dtype=np.int64), resid_index
+    lut_start = min(numbered)
+    lut = np.full(max(numbered) - lut_start + 1, -1, dtype=np.int64)
+    lut[np.fromiter(numbered.keys(), dtype=np.int64) - lut_start] = np.fromiter(numbered.values(), dtype=np.int64)
+    return lut_start, lut, resid_index
+
+def token_bytes(buffer, starts, lengths, width):
+    """
+    Copies tokens of a byte buffer into the rows of a fixed width matrix, padded with zeros.
 
-                        # We need to consider the value of pdbx_PDB_ins_code, in column 9
-                        # This is considered in the key
-                        # and original value will be overwritten with '?'
-                        # in next version, we will add the letter value to column 9
+    Parameters:
+    -----------
+    buffer : np.ndarray
+        Bytes (uint8) the tokens are read from.
+    starts : np.ndarray
+        Position of the first byte of each token.
+    lengths : np.ndarray
+        Length of each token. Tokens longer than width are truncated.
+    width : int
+        Number of columns of the matrix.
 
-                        if str(line_split[9]) == '?':
-                            key = line_split[6] + "_" + str(line_split[8]) + " "  # FAPA: WE WANT CHAINID_RESID TO BE THE KEY
-                        else:
-                            key = line_split[6] + "_" + str(line_split[8]) + str(line_split[9])
+    Returns:
+    --------
+    matrix : np.ndarray
+        uint8 matrix with one token per row.
+    """
+    column = np.arange(width)
+    index = np.minimum(starts[:, None] + column, len(buffer) - 1)
+    return np.where(column < lengths[:, None], buffer[index], 0).astype(np.uint8)
 
+def gather_segments(buffer, starts, lengths):
+    """
+    Concatenates segments of a byte buffer.
 
-                        #key = line_split[6] + "_" + str(line_split[8]) #FAPA: WE WANT CHAINID_RESID TO BE THE KEY
-                        #key = line_split[6] + "_" + str(resnum)  # FAPA: WE WANT CHAINID_RESID TO BE THE KEY
+    Parameters:
+    -----------
+    buffer : np.ndarray
+        Bytes (uint8) the segments are read from.
+    starts : np.ndarray
+        Position of the first byte of each segment.
+    lengths : np.ndarray
+        Length of each segment.
 
-                        #print(len(line_split))
+    Returns:
+    --------
+    bytes
+    """
+    starts, lengths = starts[lengths > 0], lengths[lengths > 0]
+    if not len(lengths):
+        return b""
+    # Positions to read advance by one, except at the start of each segment where they jump
+    step = np.ones(lengths.sum(), dtype=np.int64)
+    step[0] = starts[0]
+    step[np.cumsum(lengths[:-1])] = starts[1:] - (starts[:-1] + lengths[:-1]) + 1
+    return buffer[np.cumsum(step)].tobytes()
+
+def renumber_cif(ciffilename, newciffilename, conversion_template, lines_per_chunk=100000):
+    """
+    Rewrites the label_seq_id, pdbx_PDB_ins_code and auth_seq_id columns of the atoms of a CIF
+    with the standardized residue numbers of its conversion template.
 
+    The file is tokenized as a NumPy byte array, the residue of each atom is looked up with one
+    lookup table per chain, and rewritten lines are assembled from byte segments, so that no
+    Python code runs per atom. Rewritten lines have their tokens separated by single spaces,
+    as in conversiontemplate_to_pdb.
 
+    Parameters:
+    -----------
+    ciffilename : str
+        Path of the CIF to renumber.
+    newciffilename : str
+        Path where the renumbered CIF is saved.
+    conversion_template : dict
+        Conversion template of the structure, mapping each chain ID to a ResidueConversion.
+    lines_per_chunk : int, optional
+        Number of rewritten lines assembled at once, which bounds the memory used.
 
-                        if key in conversion_template:
-                            #print(key, conversion_template[key])
-                            if len(line_split) == 18:
-                                if len(str(conversion_template[key]).split()) < 2:
-                                    #print(conversion_template[key])
-                                    newline = line_split[0] + " " + line_split[1] + " " + line_split[2] + " " + line_split[3] + " " + line_split[4] + " " + line_split[5] + " " + line_split[6] + " " + \
-                                              line_split[7] + " " + str(conversion_template[key]) + " " + "?" + " " + line_split[10] + " " + line_split[11] + " " + line_split[12] + " " + line_split[13] + \
-                                              " " + line_split[14] + " " + str(conversion_template[key]) + " " + line_split[16] + " " + line_split[17] + " " + "\n"
-                                    newciffile.write(newline)
-                                else:
-                                    # the key already contains two columns (this is a test)
-                                    #print("i am here: "+ str(conversion_template[key].split()[1]))
-                                    newline = line_split[0] + " " + line_split[1] + " " + line_split[2] + " " + \
-                                              line_split[3] + " " + line_split[4] + " " + line_split[5] + " " + \
-                                              line_split[6] + " " + \
-                                              line_split[7] + " " + str(conversion_template[key].split()[0]) + " " + \
-                                              str(conversion_template[key].split()[1])+ " " + \
-                                              line_split[10] + " " + line_split[11] + " " + line_split[12] + " " + \
-                                              line_split[13] + \
-                                              " " + line_split[14] + " " + str(conversion_template[key].split()[0]) + " " + \
-                                              line_split[16] + " " + line_split[17] + " " + "\n"
-                                    newciffile.write(newline)
-                            else:
-                                if len(str(conversion_template[key]).split()) < 2:
-                                    #print(conversion_template[key])
-                                    newline = line_split[0] + " " + line_split[1] + " " + line_split[2] + " " + line_split[3] + " " + line_split[4] + " " + line_split[5] + " " + line_split[6] + " " + \
-                                              line_split[7] + " " + str(conversion_template[key]) + " " + "?" + " " + line_split[10] + " " + line_split[11] + " " + line_split[12] + " " + line_split[13] + \
-                                              " " + line_split[14] + " " + str(conversion_template[key]) + " " + line_split[16] + " " + line_split[17] + " " + line_split[18] + " " + line_split[19] + "\n"
-                                    newciffile.write(newline)
-                                else:
-                                    newline = line_split[0] + " " + line_split[1] + " " + line_split[2] + " " + \
-                                              line_split[3] + " " + line_split[4] + " " + line_split[5] + " " + \
-                                              line_split[6] + " " + \
-                                              line_split[7] + " " + str(conversion_template[key].split()[0]) + " " + \
-                                              str(conversion_template[key].split()[1]) + " " + \
-                                              line_split[10] + " " + line_split[11] + " " + line_split[12] + " " + \
-                                              line_split[13] + \
-                                              " " + line_split[14] + " " + str(conversion_template[key].split()[0]) + " " + \
-                                              line_split[16] + " " + line_split[17] + " " + line_split[18] + " " + line_split[19] + "\n"
-                                    newciffile.write(newline)
-                        else:
-                            if len(line_split) == 18:
-                                newciffile.write(line)
-                            else:
-                                if line_split[8] == ".":
-                                    newline = line_split[0] + " " + line_split[1] + " " + line_split[2] + " " + \
-                                              line_split[3] + " " + line_split[4] + " " + line_split[5] + " " + \
-                                              line_split[6] + " " + \
-                                              line_split[7] + " " + line_split[15] + " " + \
-                                              line_split[9] + " " + \
-                                              line_split[10] + " " + line_split[11] + " " + line_split[12] + " " + \
-                                              line_split[13] + \
-                                              " " + line_split[14] + " " + line_split[15] + " " + \
-                                              line_split[16] + " " + line_split[17] + " " + line_split[18] + " "+ line_split[19] +"\n"
-                                    newciffile.write(newline)
-                                else:
-                                    newciffile.write(line)
-                    else:
-                        newciffile.write(line)
+    Returns:
+    --------
+    None
+    """
+    text = read_bytes(ciffilename)
+    if b"\r" in text:
+        # Same newlines as reading the file in text mode
+        text = text.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+    buffer = np.frombuffer(text, dtype=np.uint8)
+    newline = np.flatnonzero(buffer == ord('\n'))
+    line_start = np.concatenate(([0], newline + 1))
+    line_end = np.concatenate((newline, [len(buffer)]))
+    line_start, line_end = line_start[line_start < len(buffer)], line_end[line_start < len(buffer)]
+    prefix = token_bytes(np.append(buffer, np.uint8(0)), line_start, line_end - line_start, 6)
+    atom = np.all(prefix[:, :4] == np.frombuffer(b"ATOM", dtype=np.uint8), axis=1) \
+           | np.all(prefix == np.frombuffer(b"HETATM", dtype=np.uint8), axis=1)
+    line_start, line_end = line_start[atom], line_end[atom]
+
+    # CIF files have no control characters, so whitespace is any byte up to the space
+    in_token = np.zeros(len(buffer) + 2, dtype=np.int8)
+    in_token[1:-1] = buffer > 32
+    token_edge = np.diff(in_token)
+    token_start = np.flatnonzero(token_edge == 1)
+    token_end = np.flatnonzero(token_edge == -1)
+    first_token = np.searchsorted(token_start, line_start)
+    token_counts = np.searchsorted(token_start, line_end) - first_token
+    # Lines are rebuilt from their first 20 tokens (18 in files without auth_atom_id and model)
+    keep = (token_counts == 18) | (token_counts >= 20)
+    line_start, line_end = line_start[keep], line_end[keep]
+    first_token, token_counts = first_token[keep], token_counts[keep]
+    if not len(line_start):
+        with open_file(newciffilename, 'wb') as newciffile:
+            newciffile.write(text)
+        return
+
+    def column(k):
+        starts = token_start[first_token + k]
+        return starts, token_end[first_token + k] - starts
+
+    chain_start, chain_length = column(6)
+    label_start, label_length = column(8)
+    ins_start, ins_length = column(9)
+    chain_width = max(int(chain_length.max(initial=0)), 1)
+    chains = token_bytes(buffer, chain_start, chain_length, chain_width)
+    # Chain IDs are decoded once per run of consecutive atoms of the same chain
+    chain_run = np.flatnonzero(np.concatenate(([True], np.any(chains[1:] != chains[:-1], axis=1))))
+    chain_ids = [chains[row].tobytes().rstrip(b"\0").decode() for row in chain_run]
+    chain_code = np.repeat([sorted(set(chain_ids)).index(chid) for chid in chain_ids],
+                           np.diff(np.concatenate((chain_run, [len(chains)]))))
+    no_ins_code = (ins_length == 1) & (buffer[ins_start] == ord('?'))
+    no_label = (label_length == 1) & (buffer[label_start] == ord('.'))
+    # label_seq_id as an integer, when it is written as one (no sign, no leading zeros)
+    digits = token_bytes(buffer, label_start, label_length, 9) - np.uint8(ord('0'))
+    in_label = np.arange(9) < label_length[:, None]
+    numbered = no_ins_code & (label_length <= 9) & np.all((digits < 10) | ~in_label, axis=1) \
+               & ((label_length == 1) | (digits[:, 0] != 0))
+    label_seq = np.zeros(len(line_start), dtype=np.int64)
+    for k in range(9):
+        label_seq = np.where(in_label[:, k], label_seq * 10 + digits[:, k], label_seq)
+
+    # Index of the residue of each atom in the conversion of its chain, -1 if not converted
+    residue_index = np.full(len(line_start), -1, dtype=np.int64)
+    new_resnum = np.zeros(len(line_start), dtype=np.int64)
+    new_inscode = np.full(len(line_start), -1, dtype=np.int64)
+    for code, chain in enumerate(sorted(set(chain_ids))):
+        if chain not in conversion_template:
+            continue
+        conversion = conversion_template[chain]
+        lut_start, lut, resid_index = residue_lookup(conversion)
+        in_chain = chain_code == code
+        # Plain residue numbers are looked up in the table, anything else in the dictionary
+        rows = np.flatnonzero(in_chain & numbered)
+        position = label_seq[rows] - lut_start
+        inside = (position >= 0) & (position < len(lut))
+        residue_index[rows[inside]] = lut[position[inside]]
+        for row in np.flatnonzero(in_chain & ~numbered):
+            resid = text[label_start[row]:label_start[row] + label_length[row]].decode()
+            if no_ins_code[row]:
+                resid += " "
+            else:
+                resid += text[ins_start[row]:ins_start[row] + ins_length[row]].decode()
+            residue_index[row] = resid_index.get(resid, -1)
+        converted = in_chain & (residue_index >= 0)
+        new_resnum[converted] = conversion.new_resnum[residue_index[converted]]
+        new_inscode[converted] = conversion.new_inscode[residue_index[converted]]
+    converted = residue_index >= 0
+    # Residues without a conversion and without label_seq_id take their auth_seq_id
+    unconverted = ~converted & no_label & (token_counts != 18)
+    rewritten = np.flatnonzero(converted | unconverted)
+
+    # Segments are read from the file, followed by the new residue numbers, insertion codes and separators
+    resnum_min = int(new_resnum.min(initial=0))
+    resnum_text = [str(resnum).encode() for resnum in range(resnum_min, int(new_resnum.max(initial=0)) + 1)]
+    resnum_bytes = np.frombuffer(b"".join(resnum_text), dtype=np.uint8)
+    resnum_length = np.array([len(resnum) for resnum in resnum_text], dtype=np.int64)
+    resnum_start = len(buffer) + np.cumsum(resnum_length) - resnum_length
+    inscode_start = len(buffer) + len(resnum_bytes)
+    separator_start = inscode_start + 1 + len(GAP_LETTERS)
+    segment_buffer = np.concatenate((buffer, resnum_bytes,
+                                     np.frombuffer(("?" + "".join(GAP_LETTERS) + " \n").encode(), dtype=np.uint8)))
+
+    # New label_seq_id, pdbx_PDB_ins_code and auth_seq_id of the rewritten lines
+    first_token, token_counts = first_token[rewritten], token_counts[rewritten]
+    line_start, line_end = line_start[rewritten], line_end[rewritten]
+    is_converted = converted[rewritten]
+    resnum = new_resnum[rewritten][is_converted] - resnum_min
+    new_start = {k: token_start[first_token + k] for k in (8, 9, 15)}
+    new_length = {k: token_end[first_token + k] - new_start[k] for k in (8, 9, 15)}
+    for k in (8, 15):
+        new_start[k][is_converted] = resnum_start[resnum]
+        new_length[k][is_converted] = resnum_length[resnum]
+    new_start[9][is_converted] = inscode_start + 1 + new_inscode[rewritten][is_converted]
+    new_length[9][is_converted] = 1
+    new_start[8][~is_converted] = new_start[15][~is_converted]
+    new_length[8][~is_converted] = new_length[15][~is_converted]
+    short = token_counts == 18
+    previous_end = np.concatenate(([0], np.minimum(line_end + 1, len(buffer))))
+
+    token_length = np.concatenate(([0], np.cumsum(token_end - token_start)))
+    single_spaced = (token_start[first_token] == line_start) & (token_end[first_token + token_counts - 1] == line_end) \
+                    & (token_length[first_token + token_counts] - token_length[first_token]
+                       == line_end - line_start - token_counts + 1)
+    if np.all(single_spaced & ((token_counts == 18) | (token_counts == 20))):
+        # Lines already written with single spaces (as by all PDBClean steps) are copied in
+        # pieces around the three rewritten columns: the unchanged text since the previous line,
+        # columns 8, 9 and 15 with the spaces between them, the end of the line and the newline
+        segments = [(previous_end[:-1], token_start[first_token + 8] - previous_end[:-1]),
+                    (new_start[8], new_length[8]),
+                    (token_end[first_token + 8], token_start[first_token + 9] - token_end[first_token + 8]),
+                    (new_start[9], new_length[9]),
+                    (token_end[first_token + 9], token_start[first_token + 15] - token_end[first_token + 9]),
+                    (new_start[15], new_length[15]),
+                    (token_end[first_token + 15], line_end - token_end[first_token + 15]),
+                    (separator_start + 1 - short, 1 + short)]
+        starts = np.stack([segment[0] for segment in segments], axis=1)
+        lengths = np.stack([segment[1] for segment in segments], axis=1)
+    else:
+        # Otherwise lines are rebuilt from the unchanged text since the previous line and 20
+        # (token, separator) pairs; lines of 18 tokens leave the last two pairs empty
+        token_index = np.minimum(first_token[:, None] + np.arange(20), len(token_start) - 1)
+        starts = np.zeros((len(rewritten), 41), dtype=np.int64)
+        lengths = np.zeros((len(rewritten), 41), dtype=np.int64)
+        starts[:, 0] = previous_end[:-1]
+        lengths[:, 0] = line_start - previous_end[:-1]
+        starts[:, 1::2] = token_start[token_index]
+        lengths[:, 1::2] = token_end[token_index] - token_start[token_index]
+        for k in (8, 9, 15):
+            starts[:, 2 * k + 1] = new_start[k]
+            lengths[:, 2 * k + 1] = new_length[k]
+        starts[:, 2::2] = separator_start
+        lengths[:, 2::2] = 1
+        starts[:, 40] = separator_start + 1
+        lengths[short, 36] = 2
+        lengths[short, 37:] = 0
+
+    with open_file(newciffilename, 'wb') as newciffile:
+        for chunk in range(0, len(rewritten), lines_per_chunk):
+            newciffile.write(gather_segments(segment_buffer, starts[chunk:chunk + lines_per_chunk].ravel(),
+                                             lengths[chunk:chunk + lines_per_chunk].ravel()))
+        newciffile.write(text[previous_end[-1]:])
 
 # FAPA MAY 2024 TEST ENDS
\ No newline at end of file
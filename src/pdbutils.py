@@ -5,8 +5,11 @@ import re
 import numpy as np
 from urllib.request import urlopen
 from contextlib import closing, suppress
+from PDBClean.pdbclean_io import AtomicFile
 #
-def download_pdb_from_metadata(metadata, projdir=None):
+PDB_DOWNLOAD_URL = 'https://files.rcsb.org/download/'
+#
+def download_pdb_from_metadata(metadata, projdir=None, store=None):
     """
     Downloads PDB files based on metadata, in this case the description lines of the fasta files,
     and saves them in the specified project directory.
@@ -17,6 +20,9 @@ def download_pdb_from_metadata(metadata, projdir=None):
         A list of metadata strings, from which PDB IDs will be extracted.
     projdir : str, optional
         The path to the project directory where the PDB files will be saved. If None, a message will display.
+    store : storeutils.Store, optional
+        Shared store of PDB entries (see storeutils). If given, the entries already in the store are
+        linked into the project instead of being downloaded again. Default is None.
 
     Returns:
     --------
@@ -30,9 +36,9 @@ def download_pdb_from_metadata(metadata, projdir=None):
             os.mkdir(download_dir)
         idset = get_idset_from_metadata(metadata)
         for pdbid in idset:
-            download_pdb_from_id(pdbid, download_dir=download_dir)
+            download_pdb_from_id(pdbid, download_dir=download_dir, store=store)
 
-def download_pdb_from_id(pdbid, pdbformat='.cif', download_dir=None):
+def download_pdb_from_id(pdbid, pdbformat='.cif', download_dir=None, store=None):
     """
     Downloads a specific PDB file using its ID and saves it in the specified directory.
 
@@ -44,18 +50,23 @@ def download_pdb_from_id(pdbid, pdbformat='.cif', download_dir=None):
         The format of the PDB file to be downloaded. Default is '.cif'.
      download_dir : str, optional
         The directory where the downloaded file will be saved. If None, a message will display.
+    store : storeutils.Store, optional
+        Shared store of PDB entries. If given, the latest revision of the entry in the store is
+        linked to the file, and the entry is only downloaded if the store does not have it. Default is None.
 
     Returns:
     --------
     None
     """
-    download_url='https://files.rcsb.org/download/'
     if download_dir is None:
         print("Please provide a directory where to store downloaded files...")
     else:
         target = download_dir+'/'+pdbid+pdbformat
-        source = download_url+pdbid.upper()+pdbformat
-        download_from_url(source, target)
+        if store is not None:
+            store.fetch(pdbid, pdbformat, target)
+        else:
+            source = PDB_DOWNLOAD_URL+pdbid.upper()+pdbformat
+            download_from_url(source, target)
 
 def get_idset_from_metadata(metadata):
     """
@@ -159,8 +170,9 @@ def download_from_url(source, target):
     --------
     None
     """
+    # The file is replaced rather than rewritten, as it may be linked to a shared store
     with closing(urlopen(source)) as r:
-        with open(target, 'wb') as f:
+        with AtomicFile(target, 'wb', open) as f:
             shutil.copyfileobj(r,f)
     print('wrote {0} from {1}'.format(target, source))
 
@@ -0,0 +1,638 @@
+from __future__ import print_function
+from __future__ import division
+import os, glob
+import json
+import time
+import threading
+from queue import Queue
+from PDBClean import pdbclean_io, pdbutils, cleanutils, bcifutils
+from PDBClean.storeutils import Store, derived_key
+from PDBClean.catalogutils import ProjectCatalog
+from PDBClean import pdbcleanmolidcifutils as molidutils
+from PDBClean import pdbcleanchainstandardizationutils as chainstd
+from PDBClean import pdbcleanresiduestandardizationutils as resstd
+
+# Stages run on each structure on its own, and stages that need all the structures at once
+FILE_STAGES = ['download', 'clean', 'simplify']
+BARRIER_STAGES = ['molid', 'chainid', 'residueid']
+STAGES = FILE_STAGES + BARRIER_STAGES
+STAGE_BANKS = {'download': 'raw_bank',
+               'clean': 'clean_bank',
+               'simplify': 'simple_bank',
+               'molid': 'standard_MolID_bank',
+               'chainid': 'standard_ChainID_bank',
+               'residueid': 'standard_ResidueID_bank'}
+CHECKPOINT_FILE = 'pipeline_checkpoint.txt'
+STANDARD_SEQUENCES_FILE = 'pipeline_standard_sequences.json'
+# Name under which a barrier stage is recorded in the checkpoint
+ALL_STRUCTURES = '*'
+
+class PipelineCheckpoint(object):
+    """
+    Journal of the stages completed by the pipeline, kept in the project directory so that a
+    pipeline that was interrupted can be run again and start where it stopped.
+
+    Each line of the journal is a stage and a structure name (ALL_STRUCTURES for barrier stages).
+    Lines are appended and synced to disk as soon as a stage is completed.
+
+    Attributes:
+    -----------
+    filename : str
+        Path of the journal.
+
+    Methods:
+    --------
+    is_done(stage, name):
+        Returns True if the stage was completed for this structure.
+
+    mark_done(stage, name):
+        Records that the stage was completed for this structure.
+
+    forget(stages):
+        Removes all records of some stages, so they are run again.
+    """
+    def __init__(self, projdir):
+        """
+        Initializes the PipelineCheckpoint class, reading the journal if it exists.
+
+        Parameters:
+        -----------
+        projdir : str
+            The project directory.
+        """
+        self.filename = projdir+'/'+CHECKPOINT_FILE
+        self._lock = threading.Lock()
+        self._done = self._read()
+
+    def _read(self):
+        done = set()
+        if os.path.isfile(self.filename):
+            with open(self.filename) as journal:
+                for line in journal:
+                    fields = line.split()
+                    if len(fields) == 2:
+                        done.add(tuple(fields))
+        return done
+
+    def is_done(self, stage, name=ALL_STRUCTURES):
+        with self._lock:
+            return (stage, name) in self._done
+
+    def mark_done(self, stage, name=ALL_STRUCTURES):
+        with self._lock:
+            with open(self.filename, 'a') as journal:
+                journal.write('{0} {1}\n'.format(stage, name))
+                journal.flush()
+                os.fsync(journal.fileno())
+            self._done.add((stage, name))
+
+    def forget(self, stages):
+        with self._lock:
+            # Other instances may have recorded stages since this one read the journal
+            self._done = set(record for record in self._read() if record[0] not in stages)
+            with open(self.filename, 'w') as journal:
+                for stage, name in sorted(self._done):
+                    journal.write('{0} {1}\n'.format(stage, name))
+
+def stage_outputs(projdir, stage, name):
+    """
+    Lists the files written by a per-structure stage.
+
+    Parameters:
+    -----------
+    projdir : str
+        The project directory.
+    stage : str
+        One of FILE_STAGES.
+    name : str
+        Name of the structure (PDB ID).
+
+    Returns:
+    --------
+    outputs : list of str
+    """
+    target_dir = projdir+'/'+STAGE_BANKS[stage]
+    if stage == 'simplify':
+        # One file per biological assembly, named <name>+<assembly>.cif (or .cif.gz, .cif.zst)
+        return pdbclean_io.list_cif_files(target_dir, glob.escape(name)+'+*')
+    return pdbclean_io.list_cif_files(target_dir, glob.escape(name))
+
+def structure_name(path):
+    """
+    Returns the name of the structure (PDB ID) of a CIF of a bank, without its assembly
+    ('1abc' for 'simple_bank/1abc+01.cif').
+    """
+    return pdbclean_io.cif_basename(path).split('+')[0]
+
+def list_structure_files(bank_dir, names=None):
+    """
+    Lists the CIF(s) of a bank that belong to some structures.
+
+    Parameters:
+    -----------
+    bank_dir : str
+        The bank (directory or packed bank).
+    names : list of str, optional
+        Names of the structures (PDB IDs). If None, every CIF of the bank is listed.
+
+    Returns:
+    --------
+    filelist : list of str
+    """
+    filelist = pdbclean_io.list_cif_files(bank_dir)
+    if names is None:
+        return filelist
+    names = set(names)
+    return [path for path in filelist if structure_name(path) in names]
+
+def remove_barrier_outputs(projdir, name):
+    """
+    Removes the CIF(s) of a structure from the banks of the barrier stages, so that a structure
+    that failed does not keep the outputs of an earlier run.
+    """
+    for stage in BARRIER_STAGES:
+        for path in pdbclean_io.list_cif_files(projdir+'/'+STAGE_BANKS[stage], glob.escape(name)+'*'):
+            if os.path.isfile(path) and structure_name(path) == name:
+                os.remove(path)
+
+def output_extension(input_cif, compression=None):
+    """
+    Returns the extension of the CIF written from input_cif: the extension given by the
+    compression, or the extension of the input if compression is None.
+    """
+    if compression is None:
+        return pdbclean_io.cif_extension(input_cif)
+    return pdbclean_io.cif_file_extension(compression)
+
+def stage_is_done(projdir, stage, name, checkpoint, compression=None):
+    """
+    Returns True if a per-structure stage was completed for a structure, its outputs are on disk,
+    and (unless compression is None) they were written with the compression asked for.
+    """
+    if not checkpoint.is_done(stage, name):
+        return False
+    outputs = stage_outputs(projdir, stage, name)
+    if not outputs:
+        return False
+    if compression is None or stage == 'download':
+        return True
+    return all(output.endswith(pdbclean_io.cif_file_extension(compression)) for output in outputs)
+
+def run_file_stage(projdir, stage, name, compression=None, store=None):
+    """
+    Runs a per-structure stage on one structure.
+
+    Parameters:
+    -----------
+    projdir : str
+        The project directory.
+    stage : str
+        One of FILE_STAGES.
+    name : str
+        Name of the structure (PDB ID).
+    compression : str, optional
+        Compression of the CIF(s) written: 'gzip', 'zstd', 'none' or 'bcif'. If None, the CIF(s) are
+        written with the compression of their input.
+    store : storeutils.Store, optional
+        Shared store of PDB entries and derived CIF(s). If given, the download and the outputs of
+        clean and simplify are linked from the store when it has them, and added to it otherwise.
+
+    Returns:
+    --------
+    None
+    """
+    target_dir = projdir+'/'+STAGE_BANKS[stage]
+    if stage == 'download':
+        # The RCSB PDB also serves gzipped CIF(s), which are then never decompressed on disk
+        pdbformat = '.cif.gz' if compression == 'gzip' else '.cif'
+        pdbutils.download_pdb_from_id(name, pdbformat=pdbformat, download_dir=target_dir, store=store)
+    else:
+        previous_stage = FILE_STAGES[FILE_STAGES.index(stage)-1]
+        input_cif = stage_outputs(projdir, previous_stage, name)[0]
+        extension = output_extension(input_cif, compression)
+        output_cif = target_dir+'/'+name+extension
+        # Remove the files written by a previous run, which may have another compression
+        for old_cif in stage_outputs(projdir, stage, name):
+            os.remove(old_cif)
+        if store is not None:
+            params = {'extension': extension}
+            if stage == 'simplify':
+                # simplify_cif names the data block of each output after its path
+                params['block'] = target_dir+'/'+name
+            input_sha256 = pdbclean_io.file_sha256(input_cif)
+            key = derived_key(stage, params, input_sha256)
+            if store.link_derived(key, target_dir+'/'+name):
+                return
+        if stage == 'clean':
+            cleanutils.clean_cif(input_cif, output_cif)
+        elif stage == 'simplify':
+            cleanutils.simplify_cif(input_cif, output_cif, extension)
+        if store is not None and stage_outputs(projdir, stage, name):
+            store.put_derived(key, stage, params, input_sha256, target_dir+'/'+name,
+                              stage_outputs(projdir, stage, name))
+    if not stage_outputs(projdir, stage, name):
+        raise IOError('{0} did not write any file for {1}'.format(stage, name))
+
+def stage_worker(projdir, stage, inbox, outbox, checkpoint, failed, catalog=None, verbose=True, compression=None,
+                 store=None):
+    """
+    Runs a per-structure stage on the structures it receives from the previous stage, and
+    passes each structure to the next stage as soon as it is done. A structure that fails is
+    reported, its outputs are removed, and it is not passed on. The worker stops when it receives None.
+
+    Parameters:
+    -----------
+    projdir : str
+        The project directory.
+    stage : str
+        One of FILE_STAGES.
+    inbox : Queue
+        Names of the structures to process.
+    outbox : Queue or None
+        Queue of the next stage.
+    checkpoint : PipelineCheckpoint
+    failed : dict
+        Maps the names of the structures that failed to the stage and error.
+    catalog : ProjectCatalog, optional
+        If given, the status and duration of the stage on each structure are recorded in it.
+    verbose : bool, optional
+        If True, progress is printed to the console. Default is true.
+    compression : str, optional
+        Compression of the CIF(s) written (see run_file_stage).
+    store : storeutils.Store, optional
+        Shared store of PDB entries and derived CIF(s) (see run_file_stage).
+
+    Returns:
+    --------
+    None
+    """
+    while True:
+        name = inbox.get()
+        if name is None:
+            break
+        try:
+            if stage_is_done(projdir, stage, name, checkpoint, compression):
+                if verbose:
+                    print('[{0}] {1}: already done'.format(stage, name))
+            else:
+                start = time.time()
+                run_file_stage(projdir, stage, name, compression=compression, store=store)
+                checkpoint.mark_done(stage, name)
+                if catalog is not None:
+                    catalog.record_step(stage, name, 'done', time.time()-start)
+                if verbose:
+                    print('[{0}] {1}'.format(stage, name))
+        except Exception as error:
+            # Partial outputs must not reach the barrier stages
+            for output in stage_outputs(projdir, stage, name):
+                os.remove(output)
+            failed[name] = (stage, error)
+            if catalog is not None:
+                catalog.record_step(stage, name, 'failed')
+            print('[{0}] {1}: FAILED ({2})'.format(stage, name, error))
+            continue
+        if outbox is not None:
+            outbox.put(name)
+    if outbox is not None:
+        outbox.put(None)
+
+def run_file_stages(projdir, names, stages=FILE_STAGES, queue_size=4, catalog=None, verbose=True, compression=None,
+                    store=None):
+    """
+    Runs the per-structure stages, each in its own thread. Stages are connected by bounded
+    queues, so a structure is cleaned while the next one is downloaded, and a fast stage
+    cannot get more than queue_size structures ahead of a slow one.
+
+    Parameters:
+    -----------
+    projdir : str
+        The project directory.
+    names : list of str
+        Names of the structures (PDB IDs).
+    stages : list of str, optional
+        The per-structure stages to run, in order. Default is all of FILE_STAGES.
+    queue_size : int, optional
+        Maximum number of structures waiting between two stages. Default is 4.
+    catalog : ProjectCatalog, optional
+        If given, the status and duration of each stage on each structure are recorded in it.
+    verbose : bool, optional
+        If True, progress is printed to the console. Default is true.
+    compression : str, optional
+        Compression of the CIF(s) written (see run_file_stage).
+    store : storeutils.Store, optional
+        Shared store of PDB entries and derived CIF(s) (see run_file_stage).
+
+    Returns:
+    --------
+    completed : list of str
+        Names of the structures that went through all the stages.
+    failed : dict
+        Maps the names of the structures that failed to the stage and error.
+    """
+    checkpoint = PipelineCheckpoint(projdir)
+    for stage in stages:
+        pdbclean_io.check_project(projdir=projdir, level=STAGE_BANKS[stage], verbose=False)
+    queues = [Queue(maxsize=queue_size) for stage in stages] + [Queue()]
+    failed = {}
+    workers = []
+    for i, stage in enumerate(stages):
+        worker = threading.Thread(target=stage_worker,
+                                  args=(projdir, stage, queues[i], queues[i+1], checkpoint, failed, catalog, verbose,
+                                        compression, store))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+    for name in names:
+        queues[0].put(name)
+    queues[0].put(None)
+    completed = []
+    while True:
+        name = queues[-1].get()
+        if name is None:
+            break
+        completed.append(name)
+    for worker in workers:
+        worker.join()
+    return completed, failed
+
+def run_molid_stage(projdir, conversion_file=None, accept_concatenations=False, names=None, verbose=True):
+    """
+    Assigns the chain IDs of every entity (MolID step), without user interaction.
+
+    Parameters:
+    -----------
+    projdir : str
+        The project directory.
+    conversion_file : str, optional
+        File with the chain IDs of each entity, as read by the MolID step (option 3).
+    accept_concatenations : bool, optional
+        If True, all concatenations of entities into one chain are accepted. If False and
+        there are concatenations, the stage stops so they can be reviewed. Default is False.
+    names : list of str, optional
+        Names of the structures to curate. If None, every CIF of the source bank is curated.
+    verbose : bool, optional
+        If True, progress is printed to the console. Default is true.
+
+    Returns:
+    --------
+    complete : bool
+        True if the new files were written.
+    """
+    source_dir = projdir+'/'+STAGE_BANKS['simplify']
+    target_dir = projdir+'/'+STAGE_BANKS['molid']
+    pdbclean_io.check_project(projdir=projdir, level=STAGE_BANKS['molid'], verbose=False)
+    filelist = list_structure_files(source_dir, names)
+    master_molID_class_list = molidutils.pdb_to_masterlist(filelist)
+    unique_molID_occur_map = molidutils.CreateMasterUniqueMolIDMap(master_molID_class_list)
+    molIDConversion_list = molidutils.uniquelist_to_conversionlist(unique_molID_occur_map)
+    if conversion_file is not None:
+        molIDConversion_list = molidutils.add_user_conversion(molIDConversion_list, conversion_file)
+    if molidutils.check_complete(molIDConversion_list) != "1":
+        print("Some entities do not have enough chain IDs in the conversion file:")
+        molidutils.show_unassigned_conversion(molIDConversion_list)
+        return False
+    master_molID_class_list = molidutils.update_masterlist(master_molID_class_list, molIDConversion_list)
+    if molidutils.problem_counter(master_molID_class_list) != 0:
+        if not accept_concatenations:
+            molidutils.show_unassigned_conversion(master_molID_class_list, step='concatenation')
+            print("Review the concatenations with PDBClean_MolID_CIF.py, or accept all of them with --accept-concatenations")
+            return False
+        summary_file = target_dir+'/AcceptedConcatenations.txt'
+        master_molID_class_list, accepted = molidutils.accept_all_concatenations(master_molID_class_list,
+                                                                                 summary_file=summary_file)
+        if verbose:
+            print("Accepted {0} concatenations, listed in {1}".format(len(accepted), summary_file))
+    if verbose:
+        print("Finalizing Curation ...")
+    molidutils.masterlist_to_pdb(filelist, master_molID_class_list, target_dir=target_dir)
+    return True
+
+def run_chainid_stage(projdir, standard_sequences_file=None, ignore_chid=None, catalog=None, names=None,
+                      verbose=True):
+    """
+    Standardizes the chain IDs of every structure (ChainID step), without user interaction.
+
+    The standard sequences are the consensus of all the structures, unless a file with the
+    standard sequences is given. They are saved in the project directory, and structures
+    are then renamed one at a time and recorded in the progress journal of the ChainID step,
+    so an interrupted stage only renames the structures that were not recorded.
+
+    Parameters:
+    -----------
+    projdir : str
+        The project directory.
+    standard_sequences_file : str, optional
+        JSON file with the dictionary of the standard sequences.
+    ignore_chid : list of str, optional
+        Chain IDs that are not aligned to the standard sequences.
+    catalog : ProjectCatalog, optional
+        If given, the sequences are read from the catalog, and only the CIF(s) that changed since
+        they were catalogued are parsed.
+    names : list of str, optional
+        Names of the structures to curate. If None, every CIF of the source bank is curated.
+    verbose : bool, optional
+        If True, progress is printed to the console. Default is true.
+
+    Returns:
+    --------
+    complete : bool
+        True if the new files were written.
+    """
+    source_dir = projdir+'/'+STAGE_BANKS['molid']
+    target_dir = projdir+'/'+STAGE_BANKS['chainid']
+    pdbclean_io.check_project(projdir=projdir, level=STAGE_BANKS['chainid'], verbose=False)
+    checkpoint = PipelineCheckpoint(projdir)
+    if catalog is not None:
+        catalog.update_bank(STAGE_BANKS['molid'], verbose=verbose)
+        Structure_Sequences, filelist, chid_list = catalog.structure_sequences(STAGE_BANKS['molid'])
+        if names is not None:
+            names = set(names)
+            Structure_Sequences = [sequences for sequences, path in zip(Structure_Sequences, filelist)
+                                   if structure_name(path) in names]
+            filelist = [path for path in filelist if structure_name(path) in names]
+            chid_list = sorted(set(chid for sequences in Structure_Sequences for chid in sequences))
+    else:
+        filelist = list_structure_files(source_dir, names)
+        Structure_Sequences, structid_list, chid_list = chainstd.pdb_to_structurelists(filelist)
+
+    saved_standard = projdir+'/'+STANDARD_SEQUENCES_FILE
+    if standard_sequences_file is None and checkpoint.is_done('standard_sequences'):
+        standard_sequences_file = saved_standard
+    if standard_sequences_file is not None:
+        with open(standard_sequences_file) as f:
+            Standard_Sequences = json.loads(f.read())
+    else:
+        Standard_Sequences = {}
+        for chid in chid_list:
+            Standard_Sequences = chainstd.assign_standard_from_consensus(Structure_Sequences, Standard_Sequences, chid)
+    if standard_sequences_file != saved_standard:
+        with open(saved_standard, 'w') as f:
+            json.dump(Standard_Sequences, f)
+        checkpoint.mark_done('standard_sequences')
+
+    chainstd.standardize_structures(Structure_Sequences, Standard_Sequences, filelist, target_dir,
+                                    ignore_chid=ignore_chid, verbose=verbose)
+    return True
+
+def run_residueid_stage(projdir, ignore_chid=None, max_workers=None, names=None, verbose=True):
+    """
+    Standardizes the residue numbers of every chain (ResidueID step), without user interaction.
+
+    Parameters:
+    -----------
+    projdir : str
+        The project directory.
+    ignore_chid : list of str, optional
+        Chain IDs whose residues are not renumbered.
+    max_workers : int, optional
+        Number of alignments and files processed at the same time. If None, one per CPU core.
+    names : list of str, optional
+        Names of the structures to curate. If None, every CIF of the source bank is curated.
+    verbose : bool, optional
+        If True, progress is printed to the console. Default is true.
+
+    Returns:
+    --------
+    complete : bool
+        True if the new files were written.
+    """
+    source_dir = projdir+'/'+STAGE_BANKS['chainid']
+    target_dir = projdir+'/'+STAGE_BANKS['residueid']
+    pdbclean_io.check_project(projdir=projdir, level=STAGE_BANKS['residueid'], verbose=False)
+    filelist = list_structure_files(source_dir, names)
+    Structure_Sequences, ChID_ResiNum_Vector, structid_list, chid_list = resstd.pdb_to_structurelists(filelist)
+    if ignore_chid is not None:
+        chid_list = [chid for chid in chid_list if chid not in ignore_chid]
+    if verbose:
+        print('[residueid] aligning {0} chains of {1} structures'.format(len(chid_list), len(filelist)))
+    Structure_Sequences_Aligned, Structure_Sequences_GAPS = resstd.align_chains(Structure_Sequences, structid_list,
+                                                                                chid_list, max_workers=max_workers)
+    Structure_ConversionTemplate = resstd.build_conversion_templates(Structure_Sequences_Aligned,
+                                                                     Structure_Sequences_GAPS,
+                                                                     ChID_ResiNum_Vector,
+                                                                     structid_list)
+    resstd.conversiontemplate_to_pdb_FAPA(filelist, Structure_ConversionTemplate, target_dir=target_dir,
+                                          max_workers=max_workers)
+    return True
+
+def run_pipeline(projdir, pdbids=None, stop_after='residueid', conversion_file=None, accept_concatenations=False,
+                 standard_sequences_file=None, ignore_chid=None, queue_size=4, max_workers=None, verbose=True,
+                 compression=None, store=None):
+    """
+    Runs the curation from download to residue standardization.
+
+    Each structure flows through the per-structure stages (download, clean, simplify) on its
+    own. Only the stages that need every structure (MolID entity census, consensus standard
+    sequences, multiple alignments of each chain) wait for all of them. Completed stages are
+    recorded in the project directory, and skipped when the pipeline is run again. The status
+    and duration of each stage are recorded in the project catalog (see catalogutils).
+
+    Parameters:
+    -----------
+    projdir : str
+        The project directory.
+    pdbids : list of str, optional
+        PDB IDs to download. If None, the CIF(s) already in raw_bank are used.
+    stop_after : str, optional
+        Last stage to run. Default is 'residueid'.
+    conversion_file : str, optional
+        File with the chain IDs of each entity, for the MolID step.
+    accept_concatenations : bool, optional
+        If True, all concatenations proposed by the MolID step are accepted. Default is False.
+    standard_sequences_file : str, optional
+        JSON file with the standard sequences of the ChainID step. If None, the consensus is used.
+    ignore_chid : list of str, optional
+        Chain IDs that are not standardized in the ChainID and ResidueID steps.
+    queue_size : int, optional
+        Maximum number of structures waiting between two per-structure stages. Default is 4.
+    max_workers : int, optional
+        Number of alignments and files processed at the same time in the ResidueID step.
+    verbose : bool, optional
+        If True, progress is printed to the console. Default is true.
+    compression : str, optional
+        Compression of the CIF(s) written by the per-structure stages: 'gzip', 'zstd', 'none' or
+        'bcif' (BinaryCIF).
+        The later stages keep the compression of their input. If None, each CIF keeps the
+        compression of the downloaded file.
+    store : str or storeutils.Store, optional
+        Shared store (or its directory) of PDB entries and derived CIF(s), used by several projects
+        (see storeutils). If given, the entries and the outputs of clean and simplify that are in
+        the store are linked into the project instead of being downloaded or computed again.
+
+    Returns:
+    --------
+    failed : dict
+        Maps the names of the structures that failed to the stage and error.
+    """
+    if compression == 'zstd':
+        pdbclean_io.require_zstandard()
+    elif compression == 'bcif':
+        bcifutils.require_msgpack()
+    # A store opened from its directory is closed at the end, a Store given is left open
+    own_store = store is not None and not isinstance(store, Store)
+    if own_store:
+        store = Store(store)
+    catalog = None
+    try:
+        pdbclean_io.check_project(projdir=projdir, verbose=False)
+        checkpoint = PipelineCheckpoint(projdir)
+        catalog = ProjectCatalog(projdir)
+        last = STAGES.index(stop_after)
+        if pdbids is None:
+            stages = FILE_STAGES[1:last+1]
+            names = sorted(set(pdbclean_io.cif_basename(path)
+                               for path in pdbclean_io.list_cif_files(projdir+'/'+STAGE_BANKS['download'])))
+        else:
+            stages = FILE_STAGES[:last+1]
+            names = list(pdbids)
+        failed = {}
+        # Structures curated by the barrier stages: those that went through the per-structure stages
+        completed = None
+        if stages:
+            done_before = set(name for name in names
+                              if all(stage_is_done(projdir, stage, name, checkpoint, compression) for stage in stages))
+            completed, failed = run_file_stages(projdir, names, stages=stages, queue_size=queue_size, catalog=catalog,
+                                                verbose=verbose, compression=compression, store=store)
+            if set(completed) != done_before:
+                # The set of structures changed: the barrier stages must be run again
+                checkpoint.forget(BARRIER_STAGES + ['standard_sequences'])
+        if failed:
+            print('{0} structures failed, they are left out of the next stages:'.format(len(failed)))
+            for name in sorted(failed):
+                print('    {0} ({1}): {2}'.format(name, failed[name][0], failed[name][1]))
+                remove_barrier_outputs(projdir, name)
+
+        for stage in BARRIER_STAGES[:max(0, last-len(FILE_STAGES)+1)]:
+            if checkpoint.is_done(stage):
+                if verbose:
+                    print('[{0}] already done'.format(stage))
+                continue
+            start = time.time()
+            if stage == 'molid':
+                complete = run_molid_stage(projdir, conversion_file=conversion_file,
+                                           accept_concatenations=accept_concatenations, names=completed,
+                                           verbose=verbose)
+            elif stage == 'chainid':
+                complete = run_chainid_stage(projdir, standard_sequences_file=standard_sequences_file,
+                                             ignore_chid=ignore_chid, catalog=catalog, names=completed,
+                                             verbose=verbose)
+            elif stage == 'residueid':
+                complete = run_residueid_stage(projdir, ignore_chid=ignore_chid, max_workers=max_workers,
+                                               names=completed, verbose=verbose)
+            if not complete:
+                catalog.record_step(stage, ALL_STRUCTURES, 'stopped', time.time()-start)
+                print('Pipeline stopped at {0}.'.format(stage))
+                break
+            checkpoint.mark_done(stage)
+            catalog.record_step(stage, ALL_STRUCTURES, 'done', time.time()-start)
+            # A barrier stage that ran makes the stages after it stale
+            stale = BARRIER_STAGES[BARRIER_STAGES.index(stage)+1:]
+            if stage == 'molid':
+                stale = stale + ['standard_sequences']
+            checkpoint.forget(stale)
+        return failed
+    finally:
+        if catalog is not None:
+            catalog.close()
+        if own_store:
+            store.close()
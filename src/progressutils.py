@@ -0,0 +1,234 @@
+from __future__ import print_function
+from __future__ import division
+import os
+import sys
+import time
+
+# Verbosity levels: QUIET prints only menus, questions and errors, NORMAL adds one progress bar
+# per loop over files or alignments, and VERBOSE adds the details of each file and alignment.
+QUIET = 0
+NORMAL = 1
+VERBOSE = 2
+VERBOSITY_NAMES = {'quiet': QUIET, 'normal': NORMAL, 'verbose': VERBOSE}
+# Environment variable with the verbosity level (a name or a number)
+VERBOSITY_ENVIRONMENT = 'PDBCLEAN_VERBOSITY'
+
+def verbosity_from_environment(default=NORMAL):
+    """
+    Reads the verbosity level from the environment (VERBOSITY_ENVIRONMENT).
+
+    Parameters:
+    -----------
+    default : int, optional
+        Level used if the variable is not set or not valid. Default is NORMAL.
+
+    Returns:
+    --------
+    level : int
+    """
+    value = os.environ.get(VERBOSITY_ENVIRONMENT, '').strip().lower()
+    if value in VERBOSITY_NAMES:
+        return VERBOSITY_NAMES[value]
+    if value.isdigit():
+        return int(value)
+    return default
+
+_verbosity = verbosity_from_environment()
+
+def get_verbosity():
+    """
+    Returns the verbosity level of the library.
+    """
+    return _verbosity
+
+def set_verbosity(level):
+    """
+    Sets the verbosity level of the library.
+
+    Parameters:
+    -----------
+    level : int or str
+        QUIET, NORMAL or VERBOSE, or one of their names ('quiet', 'normal', 'verbose').
+
+    Returns:
+    --------
+    None
+    """
+    global _verbosity
+    if isinstance(level, str):
+        level = VERBOSITY_NAMES[level.lower()]
+    _verbosity = level
+
+def message(*args, **kwargs):
+    """
+    Prints a message if the verbosity level is at least `level` (keyword argument, default VERBOSE).
+    Other keyword arguments are passed to print.
+    """
+    level = kwargs.pop('level', VERBOSE)
+    if _verbosity >= level:
+        print(*args, **kwargs)
+
+def format_seconds(seconds):
+    """
+    Formats a duration as H:MM:SS, or M:SS under an hour.
+    """
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return '{0}:{1:02d}:{2:02d}'.format(hours, minutes, seconds)
+    return '{0}:{1:02d}'.format(minutes, seconds)
+
+class ProgressBar(object):
+    """
+    Single-line progress bar, with the throughput and estimated time left.
+
+    The line is redrawn at most every `min_interval` seconds, so loops over thousands of files
+    spend no time printing. When the output is not a terminal (a log file, or a notebook),
+    a new line is written at most every `log_interval` seconds instead.
+
+    Attributes:
+    -----------
+    total : int
+        Number of items, or None if unknown.
+    desc : str
+        Label shown before the bar.
+    unit : str
+        Name of the items, such as 'files'.
+    n : int
+        Number of items done.
+
+    Methods:
+    --------
+    update(n):
+        Adds n items done.
+
+    close():
+        Draws the final state of the bar.
+    """
+    def __init__(self, total=None, desc='', unit='files', min_interval=0.2, log_interval=10.0, stream=None,
+                 level=NORMAL):
+        """
+        Initializes the ProgressBar class.
+
+        Parameters:
+        -----------
+        total : int, optional
+            Number of items, or None if unknown.
+        desc : str, optional
+            Label shown before the bar.
+        unit : str, optional
+            Name of the items. Default is 'files'.
+        min_interval : float, optional
+            Minimum seconds between two redraws on a terminal. Default is 0.2.
+        log_interval : float, optional
+            Minimum seconds between two lines when the output is not a terminal. Default is 10.
+        stream : file object, optional
+            Where the bar is written. Default is sys.stderr.
+        level : int, optional
+            Minimum verbosity level for the bar to be shown. Default is NORMAL.
+        """
+        self.total = total
+        self.desc = desc
+        self.unit = unit
+        self.n = 0
+        self.stream = stream if stream is not None else sys.stderr
+        self.enabled = _verbosity >= level
+        self.interactive = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.interval = min_interval if self.interactive else log_interval
+        self.start = time.perf_counter()
+        self.last_draw = None
+        self.closed = False
+        self.width = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def line(self, now):
+        elapsed = now - self.start
+        rate = self.n / elapsed if elapsed > 0 else 0.0
+        text = self.desc + ': ' if self.desc else ''
+        if self.total:
+            fraction = min(self.n / self.total, 1.0)
+            filled = int(fraction * 25)
+            text += '[{0}{1}] {2}/{3} ({4:.0%})'.format('#' * filled, '.' * (25 - filled), self.n, self.total,
+                                                        fraction)
+        else:
+            text += '{0}'.format(self.n)
+        text += ' {0:.1f} {1}/s'.format(rate, self.unit)
+        if self.total and 0 < self.n < self.total and rate > 0:
+            text += ' ETA ' + format_seconds((self.total - self.n) / rate)
+        else:
+            text += ' ' + format_seconds(elapsed)
+        return text
+
+    def draw(self, now, final=False):
+        text = self.line(now)
+        if self.interactive:
+            padding = ' ' * max(0, self.width - len(text))
+            self.stream.write('\r' + text + padding + ('\n' if final else ''))
+            self.width = len(text)
+        else:
+            self.stream.write(text + '\n')
+        self.stream.flush()
+        self.last_draw = now
+
+    def update(self, n=1):
+        """
+        Adds n items done, and redraws the bar if it was not redrawn recently.
+        """
+        self.n += n
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        last = self.last_draw
+        if last is None and not self.interactive:
+            # Short loops written to a log only get the final line
+            last = self.start
+        if last is None or now - last >= self.interval:
+            self.draw(now)
+
+    def close(self):
+        """
+        Draws the final state of the bar (once).
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.enabled:
+            self.draw(time.perf_counter(), final=True)
+
+def progress(iterable, total=None, desc='', unit='files', level=NORMAL):
+    """
+    Iterates over `iterable`, showing a progress bar (see ProgressBar).
+
+    Parameters:
+    -----------
+    iterable : iterable
+        Items of the loop.
+    total : int, optional
+        Number of items. Default is len(iterable), if it has one.
+    desc : str, optional
+        Label shown before the bar.
+    unit : str, optional
+        Name of the items. Default is 'files'.
+    level : int, optional
+        Minimum verbosity level for the bar to be shown. Default is NORMAL.
+
+    Yields:
+    -------
+    item
+        Each item of `iterable`.
+    """
+    if total is None and hasattr(iterable, '__len__'):
+        total = len(iterable)
+    bar = ProgressBar(total=total, desc=desc, unit=unit, level=level)
+    try:
+        for item in iterable:
+            yield item
+            bar.update()
+    finally:
+        bar.close()
@@ -0,0 +1,563 @@
+from __future__ import print_function
+import io
+import os
+import json
+import hmac
+import socket
+import secrets
+import asyncio
+import http.client
+import traceback
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from PDBClean import pdbclean_io, sessionutils
+from PDBClean import pdbcleanmolidcifutils as molidutils
+from PDBClean import pdbcleanchainstandardizationutils as chainstd
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_SOCKET = 'curation.sock'
+# Largest request body accepted, in bytes
+MAX_REQUEST_SIZE = 64 << 20
+
+class CurationError(Exception):
+    """
+    Error of a call to the curation server (bad parameters, or a step called too early).
+    """
+    pass
+
+def default_token_file(socket_path=None, port=DEFAULT_PORT):
+    """
+    Returns the file where a curation server writes its token: <socket_path>.token for a Unix
+    socket, and ~/.pdbclean/curation-<port>.token for a TCP port.
+    """
+    if socket_path is not None:
+        return socket_path+'.token'
+    return os.path.join(os.path.expanduser('~'), '.pdbclean', 'curation-{0}.token'.format(port))
+
+def write_token_file(token_file):
+    """
+    Creates a random token, and writes it to a file that only its owner can read.
+    """
+    token = secrets.token_urlsafe(32)
+    directory = os.path.dirname(token_file)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o700)
+    fd = os.open(token_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        # The file may have existed with other permissions
+        os.fchmod(f.fileno(), 0o600)
+        f.write(token+'\n')
+    return token
+
+def read_token_file(token_file):
+    with open(token_file) as f:
+        return f.read().strip()
+
+class CurationState(object):
+    """
+    The objects of the MolID and ChainID steps, kept in memory by the curation server, and the
+    calls that query and edit them. Each public method is a call of the JSON API; its keyword
+    arguments are the parameters of the call, and it returns a JSON-serializable result.
+
+    Banks are read once when they are opened (or loaded from their session snapshot, see
+    sessionutils), and every later call works on the objects in memory.
+
+    Attributes:
+    -----------
+    molid : dict or None
+        source_dir, target_dir, filelist, master_molID_class_list and molIDConversion_list of
+        the MolID step, once opened.
+    chainid : dict or None
+        source_dir, target_dir, filelist, Structure_Sequences, chid_list and Standard_Sequences
+        of the ChainID step, once opened.
+    """
+    def __init__(self):
+        self.molid = None
+        self.chainid = None
+
+    def _require(self, step):
+        state = getattr(self, step)
+        if state is None:
+            raise CurationError('Call open_{0} first'.format(step))
+        return state
+
+    def status(self):
+        """
+        Returns the progress of the steps that were opened.
+        """
+        status = {'molid': None, 'chainid': None}
+        if self.molid is not None:
+            status['molid'] = {'source_dir': self.molid['source_dir'],
+                               'target_dir': self.molid['target_dir'],
+                               'files': len(self.molid['filelist']),
+                               'entities': len(self.molid['molIDConversion_list']),
+                               'conversions_complete': molidutils.check_complete(
+                                   self.molid['molIDConversion_list']) == "1",
+                               'conversions_applied': self.molid['conversions_applied'],
+                               'unaccepted_concatenations': molidutils.problem_counter(
+                                   self.molid['master_molID_class_list'])}
+        if self.chainid is not None:
+            status['chainid'] = {'source_dir': self.chainid['source_dir'],
+                                 'target_dir': self.chainid['target_dir'],
+                                 'files': len(self.chainid['filelist']),
+                                 'chain_ids': len(self.chainid['chid_list']),
+                                 'standard_sequences': len(self.chainid['Standard_Sequences'])}
+        return status
+
+    ##############
+    # MolID step #
+    ##############
+
+    def open_molid(self, source_dir, target_dir):
+        """
+        Reads the source bank of the MolID step (or its session snapshot).
+        """
+        filelist = pdbclean_io.list_cif_files(source_dir)
+        if not filelist:
+            raise CurationError('No CIF(s) in '+source_dir)
+        session = sessionutils.Session(target_dir, 'molid', filelist)
+        state = session.load_state()
+        if state is None:
+            master_molID_class_list = molidutils.pdb_to_masterlist(filelist)
+            unique_molID_occur_map = molidutils.CreateMasterUniqueMolIDMap(master_molID_class_list)
+            molIDConversion_list = molidutils.uniquelist_to_conversionlist(unique_molID_occur_map)
+            state = {'master_molID_class_list': master_molID_class_list,
+                     'molIDConversion_list': molIDConversion_list}
+            session.save_state(state)
+        self.molid = {'source_dir': source_dir, 'target_dir': target_dir, 'filelist': filelist,
+                      'master_molID_class_list': state['master_molID_class_list'],
+                      'molIDConversion_list': state['molIDConversion_list'],
+                      'conversions_applied': False}
+        return self.status()['molid']
+
+    def _conversion_record(self, molIDConversion):
+        return {'molID': molIDConversion.molID, 'chains': list(molIDConversion.chID_list),
+                'occur': molIDConversion.occur, 'complete': molIDConversion.complete is True}
+
+    def conversions(self, search='', unassigned_only=False):
+        """
+        Returns the entities (MolIDConversion objects) whose name contains `search`.
+        """
+        molid = self._require('molid')
+        return [self._conversion_record(molIDConversion) for molIDConversion in molid['molIDConversion_list']
+                if search in molIDConversion.molID and not (unassigned_only and molIDConversion.complete is True)]
+
+    def load_conversion_file(self, path):
+        """
+        Adds the chain IDs of a conversion file (as option 3 of the MolID menu).
+        """
+        molid = self._require('molid')
+        if not os.path.isfile(path):
+            raise CurationError('No such file: '+path)
+        molid['molIDConversion_list'] = molidutils.add_user_conversion(molid['molIDConversion_list'], path)
+        return self.status()['molid']
+
+    def edit_conversion(self, molID, chains, action='add'):
+        """
+        Adds (or removes, with action='remove') chain IDs to the entity named molID.
+        """
+        molid = self._require('molid')
+        for molIDConversion in molid['molIDConversion_list']:
+            if molIDConversion.molID == molID:
+                break
+        else:
+            raise CurationError('No entity named '+molID)
+        if action == 'add':
+            molIDConversion.add_chID_list(chains)
+        elif action == 'remove':
+            molIDConversion.remove_chID_list(chains)
+        else:
+            raise CurationError("action must be 'add' or 'remove'")
+        return self._conversion_record(molIDConversion)
+
+    def apply_conversions(self):
+        """
+        Assigns the new chain IDs to every CIF (as option 7 of the MolID menu), and returns the
+        number of concatenations to accept.
+        """
+        molid = self._require('molid')
+        if molidutils.check_complete(molid['molIDConversion_list']) != "1":
+            raise CurationError('Some entities do not have enough chain IDs')
+        molidutils.update_masterlist(molid['master_molID_class_list'], molid['molIDConversion_list'])
+        molid['conversions_applied'] = True
+        return molidutils.problem_counter(molid['master_molID_class_list'])
+
+    def _concatenation_records(self, molID_class_list, unaccepted_only=True, limit=None):
+        records = []
+        for molID_class in molID_class_list:
+            for molID in molID_class.molID_chID:
+                for chID in molID_class.molID_chID[molID]:
+                    if unaccepted_only and molID_class.complete_order[chID] is not False:
+                        continue
+                    records.append({'file': molID_class.file_name, 'molID': molID, 'chain': chID,
+                                    'new_chain': molID_class.chID_newchID_map[chID],
+                                    'order': molID_class.concat_order.get(chID, 0),
+                                    'accepted': molID_class.complete_order[chID] is not False})
+                    if limit is not None and len(records) >= limit:
+                        return records
+        return records
+
+    def concatenations(self, unaccepted_only=True, limit=None):
+        """
+        Returns the chains of the CIF(s) with their new chain ID and concatenation order (only
+        those not accepted yet, unless unaccepted_only is False), up to limit records.
+        """
+        molid = self._require('molid')
+        master_molID_class_list = molid['master_molID_class_list']
+        if unaccepted_only:
+            master_molID_class_list = molidutils.unaccepted_molID_classes(master_molID_class_list)
+        return self._concatenation_records(master_molID_class_list, unaccepted_only, limit)
+
+    def edit_concatenations(self, action, file='', molID='', chain='', new_chain='', order='', value=None,
+                            preview=False):
+        """
+        Searches the chains (as option 3 and 4 of the concatenation menu; empty fields match
+        everything) and applies an action to them: 'try' a new chain ID (value), 'update' the
+        concatenation order (value) or 'accept' the planned concatenation. With preview, the
+        chains that would have a conflict are returned, and nothing is changed.
+        """
+        molid = self._require('molid')
+        if action not in ('try', 'update', 'accept'):
+            raise CurationError("action must be 'try', 'update' or 'accept'")
+        if action != 'accept' and value is None:
+            raise CurationError("action '{0}' needs a value".format(action))
+        search_term = [file, molID, chain, new_chain, str(order)]
+        found_map = molidutils.search_chains(molid['master_molID_class_list'], search_term)[0]
+        found_map = molidutils.edit_chain_order(found_map, value, action=action)
+        matched = sum(len(chIDs) for chIDs in found_map.values())
+        if preview:
+            return {'matched': matched, 'conflicts': self._concatenation_records(found_map)}
+        molidutils.accept_newchain(molid['master_molID_class_list'], found_map)
+        return {'matched': matched,
+                'unaccepted_concatenations': molidutils.problem_counter(molid['master_molID_class_list'])}
+
+    def accept_all_concatenations(self):
+        """
+        Accepts every planned concatenation (as option 5 of the concatenation menu).
+        """
+        molid = self._require('molid')
+        summary_file = molid['target_dir']+'/AcceptedConcatenations.txt'
+        accepted = molidutils.accept_all_concatenations(molid['master_molID_class_list'], summary_file=summary_file)[1]
+        return {'accepted': len(accepted), 'summary_file': summary_file}
+
+    def finalize_molid(self):
+        """
+        Writes the new CIF(s) to the target directory (as option 6 of the concatenation menu).
+        """
+        molid = self._require('molid')
+        if not molid['conversions_applied']:
+            raise CurationError('Call apply_conversions first')
+        if molidutils.problem_counter(molid['master_molID_class_list']) != 0:
+            raise CurationError('Some concatenations were not accepted')
+        if not os.path.isdir(molid['target_dir']):
+            os.makedirs(molid['target_dir'])
+        molidutils.masterlist_to_pdb(molid['filelist'], molid['master_molID_class_list'],
+                                     target_dir=molid['target_dir'])
+        return {'files': len(molid['filelist']), 'target_dir': molid['target_dir']}
+
+    ################
+    # ChainID step #
+    ################
+
+    def open_chainid(self, source_dir, target_dir):
+        """
+        Reads the sequences of the source bank of the ChainID step (or its session snapshot).
+        """
+        filelist = pdbclean_io.list_cif_files(source_dir)
+        if not filelist:
+            raise CurationError('No CIF(s) in '+source_dir)
+        session = sessionutils.Session(target_dir, 'chainid', filelist)
+        state = session.load_state()
+        if state is None:
+            Structure_Sequences, structid_list, chid_list = chainstd.pdb_to_structurelists(filelist)
+            state = {'Structure_Sequences': Structure_Sequences, 'structid_list': structid_list,
+                     'chid_list': chid_list}
+            session.save_state(state)
+        self.chainid = {'source_dir': source_dir, 'target_dir': target_dir, 'filelist': filelist,
+                        'Structure_Sequences': state['Structure_Sequences'], 'chid_list': state['chid_list'],
+                        'Standard_Sequences': {}}
+        return self.status()['chainid']
+
+    def chain_ids(self):
+        """
+        Returns the chain IDs found in the structures.
+        """
+        return list(self._require('chainid')['chid_list'])
+
+    def standard_sequences(self):
+        """
+        Returns the standard sequences.
+        """
+        return dict(self._require('chainid')['Standard_Sequences'])
+
+    def set_standard_sequences(self, sequences):
+        """
+        Replaces the standard sequences (a dictionary of chain ID to sequence).
+        """
+        chainid = self._require('chainid')
+        chainid['Standard_Sequences'] = dict(sequences)
+        return len(chainid['Standard_Sequences'])
+
+    def consensus_standard_sequences(self, chain_ids=None):
+        """
+        Sets the standard sequence of each chain ID (all of them by default) to the consensus of
+        the structures (as option 2 of the ChainID menu).
+        """
+        chainid = self._require('chainid')
+        if chain_ids is None:
+            chain_ids = chainid['chid_list']
+        for chid in chain_ids:
+            chainid['Standard_Sequences'] = chainstd.assign_standard_from_consensus(chainid['Structure_Sequences'],
+                                                                                  chainid['Standard_Sequences'], chid)
+        return dict(chainid['Standard_Sequences'])
+
+    def standardize_chains(self, ignore_chid=None):
+        """
+        Renames the chains of every structure to those of the standard sequences, and writes the
+        new CIF(s) to the target directory (as option 4 of the ChainID menu).
+        """
+        chainid = self._require('chainid')
+        if not chainid['Standard_Sequences']:
+            raise CurationError('Set the standard sequences first')
+        if not os.path.isdir(chainid['target_dir']):
+            os.makedirs(chainid['target_dir'])
+        n_standardized = chainstd.standardize_structures(chainid['Structure_Sequences'], chainid['Standard_Sequences'],
+                                                         chainid['filelist'], chainid['target_dir'],
+                                                         ignore_chid=ignore_chid)
+        return {'standardized': n_standardized, 'target_dir': chainid['target_dir']}
+
+# Calls of the API: the public methods of CurationState, and 'shutdown'
+API_METHODS = sorted(name for name in dir(CurationState) if not name.startswith('_'))
+
+class CurationServer(object):
+    """
+    Local server of the JSON API of a CurationState, over HTTP on a Unix socket or on localhost.
+
+    Each call is a POST to /<method>, with a JSON object of parameters as body. The response is a
+    JSON object with 'result' and 'output' (what the call printed), or 'error'. Calls run one at a
+    time in a worker thread, in the order they arrive, so the event loop keeps accepting
+    connections while a long call (such as finalize_molid) runs. Connections are kept alive, so a
+    client can make many small calls cheaply.
+
+    Calls can open banks anywhere and read their session snapshots (which are pickled), so they
+    must only come from the user who started the server. The server creates a random token when
+    it starts, and writes it to token_file, which only its owner can read; every request must send
+    it in an 'Authorization: Bearer <token>' header. Requests must also be POSTs with a JSON
+    Content-Type and no Origin header, so web pages cannot make calls from a browser.
+    """
+    def __init__(self, state=None, socket_path=None, host=DEFAULT_HOST, port=DEFAULT_PORT, token_file=None):
+        self.state = state if state is not None else CurationState()
+        self.socket_path = socket_path
+        self.host = host
+        self.port = port
+        self.token_file = token_file if token_file is not None else default_token_file(socket_path, port)
+        self._token = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._stopped = None
+        self._connections = set()
+
+    def _call(self, method, params):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            result = getattr(self.state, method)(**params)
+        return result, output.getvalue()
+
+    def check_request(self, verb, headers):
+        """
+        Returns the HTTP status and JSON response of a request that is refused (see the class
+        documentation), or None if the request may be dispatched.
+        """
+        if 'origin' in headers:
+            return 403, {'error': 'Requests from web pages are not accepted'}
+        authorization = headers.get('authorization', '')
+        if not (authorization.startswith('Bearer ') and self._token is not None and
+                hmac.compare_digest(authorization[len('Bearer '):].strip().encode(), self._token.encode())):
+            return 401, {'error': 'Missing or wrong token (see '+self.token_file+')'}
+        if verb != 'POST':
+            return 405, {'error': 'Use POST'}
+        if headers.get('content-type', '').split(';')[0].strip().lower() != 'application/json':
+            return 415, {'error': 'The Content-Type must be application/json'}
+        return None
+
+    async def dispatch(self, verb, path, body):
+        """
+        Runs a call (already checked, see check_request), and returns the HTTP status and the
+        JSON response.
+        """
+        method = path.split('?')[0].strip('/')
+        if method == 'shutdown':
+            return 200, {'result': True}
+        if method not in API_METHODS:
+            return 404, {'error': 'Unknown method: '+method, 'methods': API_METHODS + ['shutdown']}
+        try:
+            params = json.loads(body.decode('utf-8')) if body.strip() else {}
+            if not isinstance(params, dict):
+                raise CurationError('The parameters must be a JSON object')
+            loop = asyncio.get_running_loop()
+            result, output = await loop.run_in_executor(self._executor, self._call, method, params)
+            return 200, {'result': result, 'output': output}
+        except (CurationError, TypeError, ValueError) as error:
+            return 400, {'error': str(error)}
+        except Exception as error:
+            return 500, {'error': '{0}: {1}'.format(type(error).__name__, error),
+                         'traceback': traceback.format_exc()}
+
+    async def handle_connection(self, reader, writer):
+        self._connections.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                verb, path, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                refused = self.check_request(verb, headers)
+                if refused is not None:
+                    # The body is not read, so the connection cannot be used again
+                    status, response = refused
+                    keep_alive = False
+                elif length > MAX_REQUEST_SIZE:
+                    status, response = 413, {'error': 'Request too large'}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, response = await self.dispatch(verb, path, body)
+                    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                shutdown = status == 200 and path.split('?')[0].strip('/') == 'shutdown'
+                if shutdown:
+                    keep_alive = False
+                data = json.dumps(response).encode('utf-8')
+                writer.write('HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n'
+                             'Connection: {3}\r\n\r\n'.format(status, http.client.responses.get(status, ''),
+                                                              len(data), 'keep-alive' if keep_alive else 'close')
+                             .encode('latin-1') + data)
+                await writer.drain()
+                if shutdown:
+                    # Stop once the response was sent
+                    self._stopped.set()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(asyncio.current_task())
+            writer.close()
+
+    async def serve(self):
+        """
+        Serves calls until the 'shutdown' call.
+        """
+        self._stopped = asyncio.Event()
+        self._connections = set()
+        self._token = write_token_file(self.token_file)
+        if self.socket_path is not None:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            server = await asyncio.start_unix_server(self.handle_connection, path=self.socket_path)
+            os.chmod(self.socket_path, 0o600)
+            print('PDBClean curation server listening on '+self.socket_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host=self.host, port=self.port)
+            print('PDBClean curation server listening on http://{0}:{1}'.format(self.host, self.port))
+        print('Token written to '+self.token_file)
+        async with server:
+            await self._stopped.wait()
+            # Close the connections kept alive by clients
+            for connection in list(self._connections):
+                connection.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+        if self.socket_path is not None and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        if os.path.exists(self.token_file):
+            os.remove(self.token_file)
+        self._executor.shutdown()
+
+def serve(state=None, socket_path=None, host=DEFAULT_HOST, port=DEFAULT_PORT, token_file=None):
+    """
+    Runs a curation server until it receives the 'shutdown' call.
+
+    Parameters:
+    -----------
+    state : CurationState, optional
+        Objects served, such as a state where banks were already opened. Default is a new CurationState.
+    socket_path : str, optional
+        Path of the Unix socket. If None, the server listens on host and port.
+    host : str, optional
+        Default is DEFAULT_HOST (localhost only).
+    port : int, optional
+        Default is DEFAULT_PORT.
+    token_file : str, optional
+        File where the token of the server is written. Default is given by default_token_file.
+
+    Returns:
+    --------
+    None
+    """
+    asyncio.run(CurationServer(state, socket_path=socket_path, host=host, port=port, token_file=token_file).serve())
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a Unix socket.
+    """
+    def __init__(self, socket_path, timeout=None):
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class CurationClient(object):
+    """
+    Client of the curation server, for notebooks. Calls are methods of the client:
+
+        client = CurationClient(socket_path='curation.sock')
+        client.open_molid(source_dir='simple_bank', target_dir='standard_MolID_bank')
+        client.conversions(unassigned_only=True)
+
+    What the server printed during a call is printed again by the client, unless print_output is False.
+    The connection is kept open between calls. The token of the server is read from its token file
+    (see default_token_file), unless it is given.
+    """
+    def __init__(self, socket_path=None, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=None, print_output=True,
+                 token=None, token_file=None):
+        if socket_path is not None:
+            self.connection = UnixHTTPConnection(socket_path, timeout=timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        if token is None:
+            token = read_token_file(token_file if token_file is not None else default_token_file(socket_path, port))
+        self.token = token
+        self.print_output = print_output
+
+    def call(self, method, **params):
+        """
+        Makes a call, and returns its result. Raises CurationError if the call failed.
+        """
+        body = json.dumps(params).encode('utf-8')
+        self.connection.request('POST', '/'+method, body=body,
+                                headers={'Content-Type': 'application/json', 'Authorization': 'Bearer '+self.token})
+        response = json.loads(self.connection.getresponse().read().decode('utf-8'))
+        if 'error' in response:
+            raise CurationError(response['error'])
+        if self.print_output and response.get('output'):
+            print(response['output'], end='')
+        return response['result']
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return lambda **params: self.call(method, **params)
+
+    def close(self):
+        self.connection.close()
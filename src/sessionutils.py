@@ -0,0 +1,301 @@
+from __future__ import print_function
+import os
+import json
+import time
+import zlib
+import struct
+import pickle
+import hashlib
+import builtins
+from PDBClean.pdbclean_io import file_sha256, open_file, stat_file
+from PDBClean.progressutils import message, NORMAL
+
+# Snapshot files start with SNAPSHOT_MAGIC and SNAPSHOT_VERSION (2 bytes), followed by the
+# zlib-compressed pickle of the session. SNAPSHOT_VERSION must be increased whenever the
+# classes stored in snapshots change, so older snapshots are ignored instead of misread.
+SNAPSHOT_MAGIC = b'PDBCLEAN-SESSION'
+SNAPSHOT_VERSION = 1
+JOURNAL_VERSION = 1
+
+def bank_fingerprint(filelist, known_files=None):
+    """
+    Computes the content hash of a bank: the SHA-256 of the names and contents of its CIF(s).
+
+    Parameters:
+    -----------
+    filelist : list of str
+        Paths of the CIF(s) of the bank.
+    known_files : dict, optional
+        Maps paths to [size, mtime_ns, sha256] of a previous call. Files whose size and
+        modification time did not change are not read again.
+
+    Returns:
+    --------
+    bank_hash : str
+        Hexadecimal SHA-256 of the bank.
+    files : dict
+        Maps each path to [size, mtime_ns, sha256], for the next call.
+    """
+    if known_files is None:
+        known_files = {}
+    checksum = hashlib.sha256()
+    files = {}
+    for path in sorted(filelist):
+        stat = stat_file(path)
+        known = known_files.get(path)
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            sha256 = known[2]
+        else:
+            sha256 = file_sha256(path)
+        files[path] = [stat.st_size, stat.st_mtime_ns, sha256]
+        checksum.update(os.path.basename(path).encode() + b'\0' + sha256.encode() + b'\n')
+    return checksum.hexdigest(), files
+
+def write_snapshot(filename, bank_hash, files, state):
+    """
+    Writes a session snapshot.
+
+    Parameters:
+    -----------
+    filename : str
+        Path of the snapshot.
+    bank_hash : str
+        Content hash of the bank the state was read from (see bank_fingerprint).
+    files : dict
+        Size, modification time and SHA-256 of each CIF (see bank_fingerprint).
+    state : dict
+        Objects of the session, such as master_molID_class_list or Structure_Sequences.
+
+    Returns:
+    --------
+    None
+    """
+    payload = pickle.dumps({'bank': bank_hash, 'files': files, 'state': state}, protocol=pickle.HIGHEST_PROTOCOL)
+    with open_file(filename, 'wb') as snapshot:
+        snapshot.write(SNAPSHOT_MAGIC + struct.pack('>H', SNAPSHOT_VERSION))
+        snapshot.write(zlib.compress(payload, 1))
+
+def read_snapshot(filename):
+    """
+    Reads a session snapshot.
+
+    Parameters:
+    -----------
+    filename : str
+        Path of the snapshot.
+
+    Returns:
+    --------
+    snapshot : dict or None
+        Keys 'bank', 'files' and 'state' (see write_snapshot), or None if there is no snapshot,
+        or it was written by another version of PDBClean.
+    """
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'rb') as snapshot:
+        data = snapshot.read()
+    header = len(SNAPSHOT_MAGIC) + 2
+    if data[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC or len(data) < header:
+        return None
+    if struct.unpack('>H', data[len(SNAPSHOT_MAGIC):header])[0] != SNAPSHOT_VERSION:
+        return None
+    try:
+        return pickle.loads(zlib.decompress(data[header:]))
+    except Exception:
+        return None
+
+class Session(object):
+    """
+    Snapshot and journal of an interactive curation (MolID or ChainID menus).
+
+    The objects read from the source bank are saved in a snapshot, keyed by the content hash of
+    the bank, so the next run on the same bank loads them instead of parsing every CIF again.
+    Every answer typed in the menus (and the result of the slow steps run from them, see call)
+    is appended to a journal. When the session ends normally the journal is removed; after a
+    crash, running the script with --resume replays the journal and continues from there.
+
+    Attributes:
+    -----------
+    snapshot_file : str
+        Path of the snapshot.
+    journal_file : str
+        Path of the journal.
+    bank_hash : str
+        Content hash of the source bank.
+
+    Methods:
+    --------
+    load_state():
+        Returns the objects of the snapshot, or None if the bank changed.
+
+    save_state(state):
+        Writes the snapshot.
+
+    start(resume):
+        Starts journaling the answers (and replaying the journal if resume is True).
+
+    input(prompt):
+        Journaled replacement of input().
+
+    call(name, function, *args):
+        Runs a step, or returns its result from the journal.
+
+    close():
+        Ends the session, removing the journal.
+    """
+    def __init__(self, directory, name, filelist):
+        """
+        Initializes the Session class.
+
+        Parameters:
+        -----------
+        directory : str
+            Directory where the snapshot and journal are kept (the target directory of the step).
+        name : str
+            Name of the step, such as 'molid' or 'chainid'.
+        filelist : list of str
+            Paths of the CIF(s) of the source bank.
+        """
+        self.directory = directory
+        self.snapshot_file = directory+'/.'+name+'_session.snapshot'
+        self.journal_file = directory+'/.'+name+'_session.journal'
+        self.filelist = filelist
+        self.bank_hash = None
+        self.files = {}
+        self.replay = []
+        self._journal = None
+        self._input = None
+
+    def load_state(self):
+        """
+        Returns the objects saved in the snapshot if it was written from the same bank (and the same
+        paths), or None.
+        The content hash of the bank is computed, reading only the CIF(s) that changed since the
+        snapshot was written.
+        """
+        start = time.perf_counter()
+        snapshot = read_snapshot(self.snapshot_file)
+        known_files = snapshot['files'] if snapshot is not None else None
+        self.bank_hash, self.files = bank_fingerprint(self.filelist, known_files)
+        # The objects hold the paths of the CIF(s), which must be the same as well
+        if snapshot is None or snapshot['bank'] != self.bank_hash or set(snapshot['files']) != set(self.filelist):
+            return None
+        message("Loaded session snapshot of {0} CIF(s) in {1:.2f} s".format(len(self.filelist),
+                                                                          time.perf_counter() - start), level=NORMAL)
+        return snapshot['state']
+
+    def save_state(self, state):
+        """
+        Writes the snapshot of the objects read from the bank.
+
+        Parameters:
+        -----------
+        state : dict
+            Objects of the session, such as master_molID_class_list or Structure_Sequences.
+
+        Returns:
+        --------
+        None
+        """
+        if self.bank_hash is None:
+            self.bank_hash, self.files = bank_fingerprint(self.filelist)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        write_snapshot(self.snapshot_file, self.bank_hash, self.files, state)
+
+    def start(self, resume=False):
+        """
+        Starts journaling the answers typed in the menus. input() is replaced by Session.input
+        until the session is closed.
+
+        Parameters:
+        -----------
+        resume : bool, optional
+            If True, and the journal of a session on the same bank exists, its answers are
+            replayed before asking for new ones. Default is False.
+
+        Returns:
+        --------
+        None
+        """
+        records = []
+        if resume and os.path.isfile(self.journal_file):
+            with open(self.journal_file) as journal:
+                lines = [json.loads(line) for line in journal if line.strip()]
+            if lines and lines[0].get('bank') == self.bank_hash and lines[0].get('version') == JOURNAL_VERSION:
+                records = lines[1:]
+                print("Resuming session: replaying {0} answers".format(sum(1 for r in records if 'input' in r)))
+            else:
+                print("The journal of the previous session does not match this bank, starting a new session")
+        self.replay = records
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self._journal = open(self.journal_file, 'w')
+        self._write({'bank': self.bank_hash, 'version': JOURNAL_VERSION})
+        for record in records:
+            self._write(record)
+        self._input = builtins.input
+        builtins.input = self.input
+
+    def _write(self, record):
+        self._journal.write(json.dumps(record)+'\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def input(self, prompt=''):
+        """
+        Returns the next answer of the journal being replayed, or asks for a new one and
+        appends it to the journal.
+        """
+        if self.replay:
+            if 'input' in self.replay[0]:
+                answer = self.replay.pop(0)['input']
+                print(prompt + answer)
+                return answer
+            # The menus did not ask for what the journal recorded: stop replaying
+            print("The journal does not match the menus anymore, continuing from here")
+            self.replay = []
+        answer = self._input(prompt)
+        self._write({'input': answer})
+        return answer
+
+    def call(self, name, function, *args):
+        """
+        Runs a step of the menus, and journals its result, so it is not run again when the
+        session is resumed. The answers the step asks for are journaled as well.
+
+        Parameters:
+        -----------
+        name : str
+            Name of the step in the journal.
+        function : callable
+            The step. Its result must be serializable as JSON.
+        *args
+            Arguments of the step.
+
+        Returns:
+        --------
+        result
+            The result of the step (lists instead of tuples, when it is read from the journal).
+        """
+        for i, record in enumerate(self.replay):
+            if 'input' not in record:
+                if record.get('result') == name:
+                    del self.replay[:i+1]
+                    return record['value']
+                break
+        result = function(*args)
+        self._write({'result': name, 'value': result})
+        return result
+
+    def close(self):
+        """
+        Ends the session: input() is restored and the journal is removed.
+        """
+        if self._input is not None:
+            builtins.input = self._input
+            self._input = None
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+            os.remove(self.journal_file)
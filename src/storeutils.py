@@ -0,0 +1,528 @@
+from __future__ import print_function
+import os
+import json
+import time
+import errno
+import shutil
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from PDBClean import pdbutils
+from PDBClean.pdbclean_io import file_sha256
+
+# A store keeps the files downloaded from the PDB, and the files derived from them by the
+# per-structure steps, once for all the projects of a machine (or group). Files are kept under
+# the SHA-256 of their content (objects/ab/abcdef...), and linked into the banks of the projects
+# (hard links, or copies when the store is on another file system). The database of the store
+# records the revisions of each PDB entry, the outputs of each step for a given input and
+# parameters, and the files of the projects that reference each object, so the objects that are
+# no longer used by any project can be removed (see Store.collect_garbage).
+STORE_ENVIRONMENT = 'PDBCLEAN_STORE'
+STORE_DATABASE = 'store.db'
+STORE_LOCK = 'store.lock'
+# Must be increased whenever the output of a cached step changes, so older outputs are not reused
+DERIVED_VERSION = 1
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS revisions (
+    pdbid TEXT NOT NULL,
+    format TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    fetched REAL,
+    PRIMARY KEY (pdbid, format, sha256)
+);
+CREATE TABLE IF NOT EXISTS derived (
+    key TEXT PRIMARY KEY,
+    step TEXT,
+    params TEXT,
+    input_sha256 TEXT,
+    outputs TEXT,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    path TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    mode TEXT,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS revisions_fetched ON revisions (pdbid, format, fetched);
+CREATE INDEX IF NOT EXISTS refs_sha256 ON refs (sha256);
+"""
+
+def derived_key(step, params, input_sha256):
+    """
+    Returns the key of the outputs of a step in the store: the SHA-256 of the step, its
+    parameters, the SHA-256 of its input and DERIVED_VERSION.
+
+    Parameters:
+    -----------
+    step : str
+        Name of the step, such as 'clean' or 'simplify'.
+    params : dict
+        Parameters of the step that change its outputs (serializable as JSON).
+    input_sha256 : str
+        SHA-256 of the input file.
+
+    Returns:
+    --------
+    key : str
+    """
+    description = json.dumps([DERIVED_VERSION, step, params, input_sha256], sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+class Store(object):
+    """
+    Content-addressed store of PDB entries and of the files derived from them, shared by
+    several projects.
+
+    The database is kept in the store directory, in WAL mode. Every change to the objects is
+    made under a shared lock of the store, and garbage collection under an exclusive lock, so
+    several projects can use the store at the same time.
+
+    Attributes:
+    -----------
+    root : str
+        The store directory.
+
+    Methods:
+    --------
+    fetch(pdbid, pdbformat, target, refresh):
+        Links the latest revision of a PDB entry to a file, downloading it if needed.
+
+    add_revision(pdbid, pdbformat, path):
+        Adds a file as a revision of a PDB entry, and links it back in its place.
+
+    put_file(path):
+        Adds a file to the store, and links it back in its place.
+
+    link_object(sha256, target):
+        Links an object of the store to a file.
+
+    find_derived(key):
+        Returns the outputs of a step stored under a key, if any.
+
+    link_derived(key, target_prefix):
+        Links the outputs of a step stored under a key.
+
+    put_derived(key, step, params, input_sha256, target_prefix, outputs):
+        Adds the outputs of a step to the store.
+
+    references(sha256):
+        Returns the number of project files that reference an object.
+
+    collect_garbage(dry_run):
+        Removes the objects that no project file references anymore.
+
+    status():
+        Returns the number and size of the objects, revisions, derived files and references.
+
+    close():
+        Closes the database.
+    """
+    def __init__(self, root):
+        """
+        Initializes the Store class, creating the store directory and database if needed.
+
+        Parameters:
+        -----------
+        root : str
+            The store directory.
+        """
+        self.root = os.path.abspath(root)
+        if not os.path.isdir(self.root+'/objects'):
+            os.makedirs(self.root+'/objects')
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.root+'/'+STORE_DATABASE, timeout=60, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        with self._db:
+            self._db.executescript(STORE_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        """
+        Holds the lock of the store (shared by the processes adding or linking objects, and
+        exclusive for garbage collection).
+        """
+        with open(self.root+'/'+STORE_LOCK, 'a') as lockfile:
+            if fcntl is not None:
+                fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+
+    def _execute(self, query, args=()):
+        with self._lock, self._db:
+            return self._db.execute(query, args).fetchall()
+
+    def object_path(self, sha256):
+        return self.root+'/objects/'+sha256[:2]+'/'+sha256
+
+    def _temporary_path(self, name):
+        return self.root+'/objects/.'+name+'.tmp-'+str(os.getpid())+'-'+str(threading.get_ident())
+
+    ###########
+    # OBJECTS #
+    ###########
+
+    def _add_object(self, path, sha256, move=False):
+        """
+        Makes path (a file on the file system of the store) the object of its content, unless
+        the object already exists. The object is made read-only, so it cannot be changed through
+        the files linked to it. Returns False if the object already existed (for example, added
+        by another process since it was looked for), in which case path is not linked to it.
+        """
+        object_path = self.object_path(sha256)
+        if not os.path.isdir(os.path.dirname(object_path)):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        try:
+            # os.link, unlike os.replace, never replaces an object that projects are linked to
+            os.link(path, object_path)
+            os.chmod(object_path, 0o444)
+            added = True
+        except FileExistsError:
+            added = False
+        if move:
+            os.remove(path)
+        self._execute('INSERT OR IGNORE INTO objects (sha256, size, created) VALUES (?, ?, ?)',
+                      (sha256, os.path.getsize(object_path), time.time()))
+        return added
+
+    def _record_reference(self, path, sha256, mode):
+        stat = os.stat(path)
+        self._execute('INSERT OR REPLACE INTO refs (path, sha256, mode, size, mtime_ns) VALUES (?, ?, ?, ?, ?)',
+                      (os.path.abspath(path), sha256, mode, stat.st_size, stat.st_mtime_ns))
+
+    def link_object(self, sha256, target):
+        """
+        Links an object of the store to a file (replacing it, if it exists). The file is a hard
+        link to the object, or a copy if the store is on another file system.
+
+        Parameters:
+        -----------
+        sha256 : str
+            SHA-256 of the object.
+        target : str
+            Path of the file.
+
+        Returns:
+        --------
+        None
+        """
+        with self._locked():
+            self._link_object(sha256, target)
+
+    def _link_object(self, sha256, target):
+        directory, basename = os.path.split(target)
+        tmp_path = os.path.join(directory, '.'+basename+'.tmp-'+str(os.getpid())+'-'+str(threading.get_ident()))
+        try:
+            os.link(self.object_path(sha256), tmp_path)
+            mode = 'hardlink'
+        except OSError as error:
+            if error.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            shutil.copyfile(self.object_path(sha256), tmp_path)
+            mode = 'copy'
+        os.replace(tmp_path, target)
+        self._record_reference(target, sha256, mode)
+
+    def put_file(self, path):
+        """
+        Adds a file to the store, and makes it a reference to the object: a hard link if the
+        file is on the file system of the store (or else, the file is copied to the store).
+
+        Parameters:
+        -----------
+        path : str
+            Path of the file.
+
+        Returns:
+        --------
+        sha256 : str
+            SHA-256 of the file.
+        """
+        sha256 = file_sha256(path)
+        with self._locked():
+            self._put_file(path, sha256)
+        return sha256
+
+    def _put_file(self, path, sha256):
+        if os.path.isfile(self.object_path(sha256)):
+            self._link_object(sha256, path)
+            return
+        try:
+            if self._add_object(path, sha256):
+                self._record_reference(path, sha256, 'hardlink')
+            else:
+                self._link_object(sha256, path)
+        except OSError as error:
+            if error.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            tmp_path = self._temporary_path(sha256)
+            shutil.copyfile(path, tmp_path)
+            self._add_object(tmp_path, sha256, move=True)
+            self._record_reference(path, sha256, 'copy')
+
+    #############
+    # REVISIONS #
+    #############
+
+    def latest_revision(self, pdbid, pdbformat='.cif'):
+        """
+        Returns the SHA-256 of the latest revision of a PDB entry in the store, or None.
+        """
+        rows = self._execute('SELECT sha256 FROM revisions WHERE pdbid = ? AND format = ? '
+                             'ORDER BY fetched DESC LIMIT 1', (pdbid.upper(), pdbformat))
+        if rows and os.path.isfile(self.object_path(rows[0][0])):
+            return rows[0][0]
+        return None
+
+    def add_revision(self, pdbid, pdbformat, path):
+        """
+        Adds a file as the latest revision of a PDB entry (if its content is new), and links it
+        back in its place.
+
+        Parameters:
+        -----------
+        pdbid : str
+            PDB ID of the entry.
+        pdbformat : str
+            Format of the file, such as '.cif' or '.cif.gz'.
+        path : str
+            Path of the file.
+
+        Returns:
+        --------
+        sha256 : str
+            SHA-256 of the file (the revision hash).
+        """
+        sha256 = file_sha256(path)
+        with self._locked():
+            self._put_file(path, sha256)
+            self._execute('INSERT OR IGNORE INTO revisions (pdbid, format, sha256, fetched) VALUES (?, ?, ?, ?)',
+                          (pdbid.upper(), pdbformat, sha256, time.time()))
+        return sha256
+
+    def fetch(self, pdbid, pdbformat='.cif', target=None, refresh=False):
+        """
+        Links the latest revision of a PDB entry to a file, downloading it from the RCSB PDB if
+        the store does not have it yet.
+
+        Parameters:
+        -----------
+        pdbid : str
+            PDB ID of the entry.
+        pdbformat : str, optional
+            Format of the file, such as '.cif' or '.cif.gz'. Default is '.cif'.
+        target : str, optional
+            Path of the file linked to the entry. If None, the entry is only added to the store.
+        refresh : bool, optional
+            If True, the entry is downloaded again, and kept as a new revision if it changed.
+            Default is False.
+
+        Returns:
+        --------
+        sha256 : str
+            SHA-256 of the revision.
+        """
+        with self._locked():
+            # Looked up under the lock, so garbage collection cannot remove the object before it is linked
+            sha256 = None if refresh else self.latest_revision(pdbid, pdbformat)
+            if sha256 is None:
+                tmp_path = self._temporary_path(pdbid)
+                pdbutils.download_from_url(pdbutils.PDB_DOWNLOAD_URL+pdbid.upper()+pdbformat, tmp_path)
+                sha256 = file_sha256(tmp_path)
+                self._add_object(tmp_path, sha256, move=True)
+                # A revision downloaded again becomes the latest one
+                self._execute('INSERT OR REPLACE INTO revisions (pdbid, format, sha256, fetched) VALUES (?, ?, ?, ?)',
+                              (pdbid.upper(), pdbformat, sha256, time.time()))
+            if target is not None:
+                self._link_object(sha256, target)
+        return sha256
+
+    ###########
+    # DERIVED #
+    ###########
+
+    def find_derived(self, key):
+        """
+        Returns the outputs of a step stored under a key (see derived_key), as a list of
+        [suffix, sha256] (the suffix follows the name of the structure in the name of each
+        output), or None if they are not all in the store.
+        """
+        rows = self._execute('SELECT outputs FROM derived WHERE key = ?', (key,))
+        if not rows:
+            return None
+        outputs = json.loads(rows[0][0])
+        if not all(os.path.isfile(self.object_path(sha256)) for suffix, sha256 in outputs):
+            return None
+        return outputs
+
+    def link_derived(self, key, target_prefix):
+        """
+        Links the outputs of a step stored under a key (see derived_key).
+
+        Parameters:
+        -----------
+        key : str
+            Key of the outputs.
+        target_prefix : str
+            Path of the outputs without their suffix, such as 'my_project/simple_bank/1ABC'.
+
+        Returns:
+        --------
+        linked : bool
+            False if the store does not have the outputs.
+        """
+        with self._locked():
+            outputs = self.find_derived(key)
+            if outputs is None:
+                return False
+            for suffix, sha256 in outputs:
+                self._link_object(sha256, target_prefix+suffix)
+        return True
+
+    def put_derived(self, key, step, params, input_sha256, target_prefix, outputs):
+        """
+        Adds the outputs of a step to the store, under a key (see derived_key), and links them
+        back in their place.
+
+        Parameters:
+        -----------
+        key : str
+            Key of the outputs.
+        step : str
+            Name of the step.
+        params : dict
+            Parameters of the step.
+        input_sha256 : str
+            SHA-256 of the input of the step.
+        target_prefix : str
+            Path of the outputs without their suffix.
+        outputs : list of str
+            Paths of the outputs.
+
+        Returns:
+        --------
+        None
+        """
+        name = os.path.basename(target_prefix)
+        stored = []
+        for path in outputs:
+            stored.append([os.path.basename(path)[len(name):], self.put_file(path)])
+        self._execute('INSERT OR REPLACE INTO derived (key, step, params, input_sha256, outputs, created) '
+                      'VALUES (?, ?, ?, ?, ?, ?)',
+                      (key, step, json.dumps(params, sort_keys=True), input_sha256, json.dumps(stored), time.time()))
+
+    ######################
+    # GARBAGE COLLECTION #
+    ######################
+
+    def _is_reference(self, path, sha256, mode, size, mtime_ns):
+        """
+        Returns True if a file still references an object: it is a hard link to the object, or
+        a copy of it that did not change.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if mode == 'hardlink':
+            try:
+                object_stat = os.stat(self.object_path(sha256))
+            except OSError:
+                return False
+            return (stat.st_dev, stat.st_ino) == (object_stat.st_dev, object_stat.st_ino)
+        return (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns)
+
+    def references(self, sha256):
+        """
+        Returns the number of project files that reference an object (as last recorded; see
+        collect_garbage).
+        """
+        return self._execute('SELECT COUNT(*) FROM refs WHERE sha256 = ?', (sha256,))[0][0]
+
+    def collect_garbage(self, dry_run=False, verbose=True):
+        """
+        Removes the objects that no project file references anymore. The references of files
+        that were removed, replaced or modified since they were linked are dropped first; then
+        the objects without references are removed, with their revisions and the outputs of
+        the steps that used them.
+
+        Parameters:
+        -----------
+        dry_run : bool, optional
+            If True, nothing is removed, and the objects that would be are counted. Default is False.
+        verbose : bool, optional
+            If True, the objects and bytes removed are printed. Default is True.
+
+        Returns:
+        --------
+        n_objects : int
+            Number of objects removed.
+        n_bytes : int
+            Bytes freed.
+        """
+        with self._locked(exclusive=True):
+            stale = set()
+            referenced = set()
+            for row in self._execute('SELECT path, sha256, mode, size, mtime_ns FROM refs'):
+                if self._is_reference(*row):
+                    referenced.add(row[1])
+                else:
+                    stale.add(row[0])
+            if not dry_run:
+                for path in stale:
+                    self._execute('DELETE FROM refs WHERE path = ?', (path,))
+            garbage = [(sha256, size) for sha256, size in self._execute('SELECT sha256, size FROM objects')
+                       if sha256 not in referenced]
+            if not dry_run:
+                removed = set()
+                for sha256, size in garbage:
+                    if os.path.isfile(self.object_path(sha256)):
+                        os.remove(self.object_path(sha256))
+                    self._execute('DELETE FROM objects WHERE sha256 = ?', (sha256,))
+                    self._execute('DELETE FROM revisions WHERE sha256 = ?', (sha256,))
+                    removed.add(sha256)
+                for key, outputs in self._execute('SELECT key, outputs FROM derived'):
+                    if any(sha256 in removed for suffix, sha256 in json.loads(outputs)):
+                        self._execute('DELETE FROM derived WHERE key = ?', (key,))
+        n_bytes = sum(size for sha256, size in garbage)
+        if verbose:
+            print('{0} {1} unreferenced objects ({2:.1f} MB), dropped {3} stale references'.format(
+                'Would remove' if dry_run else 'Removed', len(garbage), n_bytes / 1e6, len(stale)))
+        return len(garbage), n_bytes
+
+    def status(self):
+        """
+        Returns the number (and size) of the objects, PDB entries, revisions, outputs of steps
+        and references of the store.
+        """
+        n_objects, n_bytes = self._execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM objects')[0]
+        return {'objects': n_objects,
+                'bytes': n_bytes,
+                'entries': self._execute('SELECT COUNT(DISTINCT pdbid) FROM revisions')[0][0],
+                'revisions': self._execute('SELECT COUNT(*) FROM revisions')[0][0],
+                'derived': self._execute('SELECT COUNT(*) FROM derived')[0][0],
+                'references': self._execute('SELECT COUNT(*) FROM refs')[0][0]}